@@ -69,6 +69,7 @@ data_preprocess_folder = [
     'cal_metrics_in_af_range',
     'concat_files',
     'cnv_germline_tagging',
+    'select_cascade_candidates',
 ]
 
 
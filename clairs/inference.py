@@ -0,0 +1,184 @@
+# BSD 3-Clause License
+#
+# Copyright 2023 The University of Hong Kong, Department of Computer Science
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import copy
+import inspect
+import logging
+import tempfile
+import numpy as np
+import torch
+
+from torch import nn
+from shared.utils import log_warning
+
+inference_backend_list = ['torch', 'torch_int8', 'onnxruntime']
+
+
+def fuse_conv_bn(model):
+    """
+    Fold every BatchNorm2d that directly follows a Conv2d in a nn.Sequential into the convolution weights, the
+    BatchNorm2d is replaced by an identity. Only valid for models in eval mode.
+    """
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+    for module in model.modules():
+        if not isinstance(module, nn.Sequential):
+            continue
+        for idx in range(len(module) - 1):
+            if isinstance(module[idx], nn.Conv2d) and isinstance(module[idx + 1], nn.BatchNorm2d):
+                module[idx] = fuse_conv_bn_eval(module[idx], module[idx + 1])
+                module[idx + 1] = nn.Identity()
+    return model
+
+
+def quantize_model(model):
+    """
+    Fuse conv+BN and apply dynamic int8 quantization to the Linear and GRU layers.
+    """
+    model = fuse_conv_bn(copy.deepcopy(model).eval())
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear, nn.GRU}, dtype=torch.qint8)
+
+
+def onnx_model_path_from(chkpnt_fn, input_dtype):
+    # cache the exported graph next to the checkpoint, fall back to the temp folder if not writable
+    onnx_fn = '{}.{}_input.int8.onnx'.format(chkpnt_fn, str(input_dtype).replace('torch.', ''))
+    if os.access(os.path.dirname(os.path.abspath(chkpnt_fn)), os.W_OK):
+        return onnx_fn
+    return os.path.join(tempfile.gettempdir(), os.path.basename(onnx_fn))
+
+
+def export_onnx_model(model, input_matrix, onnx_fn):
+    """
+    Export the conv+BN fused model to ONNX with a dynamic batch axis, then quantize the MatMul/Gemm weights to int8.
+    The export is written to a temporary file first and moved in place, so that concurrent predict processes sharing
+    the same checkpoint never read a partial graph.
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model = fuse_conv_bn(copy.deepcopy(model).eval())
+    export_kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    tmp_prefix = '{}.{}'.format(onnx_fn, os.getpid())
+    with torch.no_grad():
+        torch.onnx.export(model,
+                          (input_matrix,),
+                          tmp_prefix + '.fp32',
+                          input_names=['input'],
+                          output_names=['output'],
+                          dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+                          do_constant_folding=True,
+                          **export_kwargs)
+    quantize_dynamic(tmp_prefix + '.fp32', tmp_prefix + '.int8', op_types_to_quantize=['MatMul', 'Gemm'],
+                     weight_type=QuantType.QInt8)
+    os.replace(tmp_prefix + '.int8', onnx_fn)
+    os.remove(tmp_prefix + '.fp32')
+
+
+class InferenceModel(object):
+    """
+    Wrap a fp32 model with a CPU optimized inference backend, calling the wrapper returns the raw model output as
+    the fp32 model does.
+
+    torch: the original fp32 model.
+    torch_int8: conv+BN fused, dynamic int8 quantized Linear and GRU layers.
+    onnxruntime: conv+BN fused ONNX graph with int8 quantized MatMul/Gemm weights, exported once on the first batch
+    and cached next to the checkpoint.
+    """
+
+    def __init__(self, model, chkpnt_fn, backend='torch', threads=1):
+        self.model = model
+        self.chkpnt_fn = chkpnt_fn
+        self.backend = backend
+        self.threads = threads
+        self.session = None
+
+        if self.backend == 'onnxruntime':
+            try:
+                import onnxruntime
+            except ImportError:
+                logging.info(log_warning("[WARNING] onnxruntime is not installed, use torch_int8 backend instead"))
+                self.backend = 'torch_int8'
+
+        if self.backend == 'torch_int8':
+            self.model = quantize_model(model)
+
+    def _load_session(self, input_matrix):
+        import onnxruntime
+
+        onnx_fn = onnx_model_path_from(self.chkpnt_fn, input_matrix.dtype)
+        is_cached = os.path.exists(onnx_fn) and os.path.getmtime(onnx_fn) >= os.path.getmtime(self.chkpnt_fn)
+        if not is_cached:
+            logging.info("[INFO] Export ONNX model to {}".format(onnx_fn))
+            export_onnx_model(self.model, input_matrix, onnx_fn)
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = self.threads
+        session_options.inter_op_num_threads = 1
+        session_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_fn, sess_options=session_options,
+                                                    providers=['CPUExecutionProvider'])
+
+    def __call__(self, input_matrix):
+        if self.backend != 'onnxruntime':
+            return self.model(input_matrix)
+
+        if self.session is None:
+            self._load_session(input_matrix)
+        input_matrix = np.ascontiguousarray(input_matrix.cpu().numpy())
+        output = self.session.run(None, {'input': input_matrix})[0]
+        return torch.from_numpy(output)
+
+
+class InferenceValidator(object):
+    """
+    Compare the probabilities of an inference backend against the fp32 model, record the maximum probability delta
+    and the candidates with a changed call.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.max_prob_delta = 0.0
+        self.changed_call_list = []
+
+    def update(self, probabilities, fp32_probabilities, position_list):
+        self.total += len(probabilities)
+        if len(probabilities) == 0:
+            return
+        self.max_prob_delta = max(self.max_prob_delta, float(np.abs(probabilities - fp32_probabilities).max()))
+        changed_idx = np.where(np.argmax(probabilities, axis=1) != np.argmax(fp32_probabilities, axis=1))[0]
+        for idx in changed_idx:
+            self.changed_call_list.append(position_list[idx])
+
+    def print_summary(self, backend):
+        logging.info("[INFO] Inference backend {} validation: total {}, max probability delta {:.6f}, changed calls {}"
+                     .format(backend, self.total, self.max_prob_delta, len(self.changed_call_list)))
+        for position in self.changed_call_list:
+            logging.info("[INFO] Changed call: {}".format(position))
@@ -29,6 +29,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import numpy as np
+import torch
 from torch import nn
 
 import shared.param as param
@@ -185,7 +186,17 @@ class ResNet(nn.Module):
 
         return nn.Sequential(*layers)
 
+    def normalize_input(self, x):
+        # raw integer tensors in (batch, depth, width, channel) layout are sliced to the model input channels, permuted
+        # to (batch, channel, depth, width) without a copy and scaled by 1/100 in a single float32 pass, the model
+        # attributes are unchanged so that saved checkpoints keep loading
+        in_channels = self.conv1.conv[0].in_channels
+        x = x[..., :in_channels].permute(0, 3, 1, 2)
+        return x.float().div_(100.0)
+
     def forward(self, x):
+        if not torch.is_floating_point(x):
+            x = self.normalize_input(x)
         output = self.conv1(x)
         output = self.conv1_x(output)
         output = self.conv2(output)
@@ -42,8 +42,9 @@ from sys import stderr
 from subprocess import PIPE, run, Popen
 
 from clairs.call_variants import output_vcf_from_probability, OutputConfig
+from clairs.inference import InferenceModel, InferenceValidator, inference_backend_list
 from shared.utils import IUPAC_base_to_ACGT_base_dict as BASE2ACGT, BASIC_BASES, str2bool, file_path_from, log_error, \
-    log_warning, subprocess_popen, TensorStdout
+    log_warning, subprocess_popen, TensorStdout, str_none
 import shared.param as param
 
 
@@ -71,6 +72,9 @@ def print_output_message(
         extra_infomation_string=""
 ):
     global call_fn
+    if probabilities_file is not None:
+        probabilities_file.write("{}\t{}\t{}\n".format(
+            chromosome, position, ' '.join(["{:0.6f}".format(x) for x in probabilities])))
     if call_fn is not None:
         output_vcf_from_probability(
             chromosome,
@@ -96,7 +100,8 @@ def print_output_message(
 
 def tensor_generator_from(tensor_file_path, batch_size, pileup=False, min_rescale_cov=None, phase_tumor=False,
                           platform='ont'):
-    float_type = 'float32'
+    # full-alignment tensors are kept in int8, the model slices, permutes and scales them
+    float_type = 'float32' if pileup or param.use_tf else 'int8'
 
     if tensor_file_path != "PIPE":
         f = subprocess_popen(shlex.split("{} -fdc {}".format(param.zstd, tensor_file_path)))
@@ -360,6 +365,7 @@ def DataGenerator(dataset, num_epoch, batch_size, chunk_start_pos, chunk_end_pos
 def predict(args):
     global output_config
     global call_fn
+    global probabilities_file
 
     output_config = OutputConfig(
         is_show_reference=args.show_ref,
@@ -384,12 +390,16 @@ def predict(args):
     chkpnt_fn = args.chkpnt_fn
     tensor_fn = args.tensor_fn
     platform = args.platform
-    torch.set_num_threads(1)
+    inference_backend = args.inference_backend
+    torch.set_num_threads(args.inference_threads)
     torch.manual_seed(0)
     np.random.seed(0)
     if use_gpu and not torch.cuda.is_available():
         print("[WARNING] --use_gpu is enabled, but cuda is not found")
         use_gpu = False
+    if use_gpu and inference_backend != 'torch':
+        print("[WARNING] --inference_backend {} is CPU only, use torch backend with --use_gpu".format(inference_backend))
+        inference_backend = 'torch'
     if use_gpu:
         device = 'cuda'
     else:
@@ -418,6 +428,13 @@ def predict(args):
         predict_fn_fp = TensorStdout(sys.stdout)
         output_file = predict_fn_fp.stdin
 
+    probabilities_file = None
+    if args.probabilities_fn is not None:
+        probabilities_dir = os.path.dirname(args.probabilities_fn)
+        if probabilities_dir != '' and not os.path.exists(probabilities_dir):
+            output = run("mkdir -p {}".format(probabilities_dir), shell=True)
+        probabilities_file = open(args.probabilities_fn, 'w')
+
     global test_pos
     test_pos = None
 
@@ -431,8 +448,23 @@ def predict(args):
 
         model.eval()
 
+    fp32_model = model
+    validator = None
+    if not param.use_tf and inference_backend != 'torch':
+        model = InferenceModel(model, chkpnt_fn, backend=inference_backend, threads=args.inference_threads)
+        inference_backend = model.backend
+        validator = InferenceValidator() if args.validate_inference_backend else None
+
     total = 0
     softmax = torch.nn.Softmax(dim=1)
+
+    def model_prediction(input_matrix, position):
+        with torch.no_grad():
+            prediction = softmax(model(input_matrix)).cpu().numpy()
+            if validator is not None:
+                validator.update(prediction, softmax(fp32_model(input_matrix)).cpu().numpy(), position)
+        return prediction
+
     if not args.is_from_tables:
         is_finish_loaded_all_mini_batches = False
         mini_batches_loaded = []
@@ -460,17 +492,8 @@ def predict(args):
                 if param.use_tf:
                     prediction = model.predict_on_batch(input_tensor)[0]
                 else:
-                    if args.pileup:
-                        input_matrix = torch.from_numpy(input_tensor).to(device)
-                    else:
-                        input_matrix = torch.from_numpy(np.transpose(input_tensor, (0, 3, 1, 2)) / 100.0).float().to(
-                            device)
-                        if input_matrix.shape[1] != param.channel_size:
-                            input_matrix = input_matrix[:, :param.channel_size, :, :]
-                    with torch.no_grad():
-                        prediction = model(input_matrix)
-                    prediction = softmax(prediction)
-                    prediction = prediction.cpu().numpy()
+                    input_matrix = torch.from_numpy(input_tensor).to(device)
+                    prediction = model_prediction(input_matrix, position)
 
                 total += len(input_tensor)
                 thread_pool.append(Thread(
@@ -517,14 +540,18 @@ def predict(args):
         dataset_iter = iter(data_generator)
         for idx in range(num_epoch):
             input_tensor, position, normal_alt_info_list, tumor_alt_info_list = next(dataset_iter)
-            input_matrix = torch.from_numpy(np.transpose(input_tensor, (0, 3, 1, 2)) / 100.0).float().to(device)
-            with torch.no_grad():
-                prediction = model(input_matrix)
-            prediction = softmax(prediction)
-            prediction = prediction.cpu().numpy()
+            # bin files store full-alignment tensors as float32, keep the raw int8 contract of the model
+            input_matrix = torch.from_numpy(input_tensor.astype(np.int8, copy=False)).to(device)
+            prediction = model_prediction(input_matrix, position)
             batch_output(output_file, position, normal_alt_info_list, tumor_alt_info_list, prediction)
             total += len(input_tensor)
 
+    if validator is not None:
+        validator.print_summary(inference_backend)
+
+    if probabilities_file is not None:
+        probabilities_file.close()
+
     run_time = "%.1fs" % (time() - variant_call_start_time)
     logging.info("[INFO] {} total processed positions: {}, time elapsed: {}".format(args.ctg_name, total, run_time))
 
@@ -585,6 +612,9 @@ def main():
     parser.add_argument('--enable_indel_calling', type=str2bool, default=0,
                         help="EXPERIMENTAL: Call Indel variants, default: disabled")
 
+    parser.add_argument('--probabilities_fn', type=str_none, default=None,
+                        help="EXPERIMENTAL: Output the probabilities of all candidates for cascade calling")
+
     # options for debug purpose
     parser.add_argument('--predict_fn', type=str, default="PIPE",
                         help="DEBUG: Output network output probabilities for further analysis")
@@ -601,6 +631,15 @@ def main():
                         help=SUPPRESS)
 
     ## If set, variants with >=QUAL will be marked 'PASS', or 'LowQual'
+    parser.add_argument('--inference_backend', type=str, default='torch', choices=inference_backend_list,
+                        help="CPU inference backend, torch: fp32 PyTorch, torch_int8: dynamic int8 quantized PyTorch, onnxruntime: int8 quantized ONNX graph cached next to the checkpoint, default: %(default)s")
+
+    parser.add_argument('--inference_threads', type=int, default=1,
+                        help="Number of threads used by each inference process, default: %(default)s")
+
+    parser.add_argument('--validate_inference_backend', type=str2bool, default=False,
+                        help="Also run the fp32 model and report the maximum probability delta and changed calls of the inference backend")
+
     parser.add_argument('--qual', type=int, default=0,
                         help=SUPPRESS)
 
@@ -73,7 +73,7 @@ torch.backends.cudnn.deterministic = True
 
 
 class BinFileDataset(Dataset):
-    def __init__(self, file_list, file_path, chunk_size, batch_size, debug_mode=False, discard_germline = False, add_af_in_label = False, smoothing = None, pileup=True):
+    def __init__(self, file_list, file_path, chunk_size, batch_size, debug_mode=False, discard_germline = False, add_af_in_label = False, smoothing = None, pileup=True, ring_buffer_size=0):
         ### Configurations
         self.debug_mode = debug_mode
         self.discard_germline = discard_germline
@@ -86,59 +86,116 @@ class BinFileDataset(Dataset):
         self.train_flag = True
 
         ### Dataset Initialization
-        self.table_dataset_list, self.chunk_offset = self._populate_dataset_table(file_list, file_path)
+        # bin files are only inspected here, each DataLoader worker reopens its own handles lazily
+        self.table_dataset_list = None
+        self.table_dataset_pid = None
+        self.chunk_offset, self.num_rows_list, self.chunk_rows_list = self._populate_dataset_table(file_list, file_path)
         self.cum_sum = np.cumsum(self.chunk_offset)
         self.total_chunks = sum(self.chunk_offset)
         self.pileup = pileup
         ### Smoothing
         self.positive = 1 - smoothing if smoothing is not None else 1
         self.negative = smoothing if smoothing is not None else 0
+        if self.discard_germline:
+            self.label_lookup = np.array([[self.positive, self.negative],
+                                          [self.positive, self.negative],
+                                          [self.negative, self.positive]], dtype=np.float32)
+        else:
+            self.label_lookup = np.where(np.eye(3, dtype=bool), self.positive, self.negative).astype(np.float32)
+
+        ### Reusable read buffers, a ring larger than the DataLoader batch is safe as collate copies each sample
+        self.ring_buffer_size = ring_buffer_size
+        self.ring_buffer_list = None
+        self.ring_buffer_idx = 0
 
     def _populate_dataset_table(self, file_list, file_path):
         chunk_offset = np.zeros(len(file_list), dtype=int)
-        table_dataset_list = []
+        num_rows_list = np.zeros(len(file_list), dtype=int)
+        chunk_rows_list = np.ones(len(file_list), dtype=int)
         for bin_idx, bin_file in enumerate(file_list):
-            table_dataset = tables.open_file(os.path.join(file_path, bin_file), 'r')
-            table_dataset_list.append(table_dataset)
-            chunk_num = (len(table_dataset.root.label) - self.batch_size) // self.chunk_size
-            chunk_offset[bin_idx] = chunk_num
-        return table_dataset_list, chunk_offset
+            with tables.open_file(os.path.join(file_path, bin_file), 'r') as table_dataset:
+                chunk_num = (len(table_dataset.root.label) - self.batch_size) // self.chunk_size
+                chunk_offset[bin_idx] = chunk_num
+                num_rows_list[bin_idx] = len(table_dataset.root.input_matrix)
+                chunkshape = table_dataset.root.input_matrix.chunkshape
+                chunk_rows_list[bin_idx] = chunkshape[0] if chunkshape is not None else 1
+        return chunk_offset, num_rows_list, chunk_rows_list
+
+    def _get_table_dataset(self, bin_idx):
+        # handles shared across forked DataLoader workers would contend on the same HDF5 file state
+        pid = os.getpid()
+        if self.table_dataset_list is None or self.table_dataset_pid != pid:
+            self.table_dataset_list = [None] * len(self.file_list)
+            self.table_dataset_pid = pid
+            self.ring_buffer_list = None
+        if self.table_dataset_list[bin_idx] is None:
+            self.table_dataset_list[bin_idx] = tables.open_file(os.path.join(self.file_path, self.file_list[bin_idx]), 'r')
+        return self.table_dataset_list[bin_idx]
+
+    def _read_input_matrix(self, table_dataset, start_idx, end_idx):
+        input_matrix = table_dataset.root.input_matrix
+        if self.ring_buffer_size <= 0 or end_idx - start_idx != self.chunk_size:
+            return input_matrix.read(start_idx, end_idx)
+        if self.ring_buffer_list is None:
+            self.ring_buffer_list = [np.empty([self.chunk_size] + list(input_matrix.shape[1:]), dtype=input_matrix.dtype)
+                                     for _ in range(self.ring_buffer_size)]
+        buffer = self.ring_buffer_list[self.ring_buffer_idx]
+        if buffer.shape[1:] != input_matrix.shape[1:] or buffer.dtype != input_matrix.dtype:
+            return input_matrix.read(start_idx, end_idx)
+        self.ring_buffer_idx = (self.ring_buffer_idx + 1) % self.ring_buffer_size
+        return input_matrix.read(start_idx, end_idx, out=buffer)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['table_dataset_list'] = None
+        state['table_dataset_pid'] = None
+        state['ring_buffer_list'] = None
+        return state
 
     def __len__(self):
         return self.total_chunks
 
-    def __getitem__(self, idx):
+    def _get_chunk_range(self, idx):
         bin_idx, chunk_idx = self._get_file_and_chunk_index(idx)
         start_idx = chunk_idx * self.chunk_size
-        start_idx += self.random_start_position if self.random_start_position is not None and self.train_flag else 0
+        if self.random_start_position is not None and self.train_flag:
+            # align the random shift to the HDF5 chunkshape so each slab decompresses whole chunks only, a chunkshape
+            # not smaller than the slab would round every shift to 0, keep the unaligned shift then
+            chunk_rows = self.chunk_rows_list[bin_idx]
+            if chunk_rows < self.chunk_size:
+                start_idx += self.random_start_position - self.random_start_position % chunk_rows
+            else:
+                start_idx += self.random_start_position
         end_idx = start_idx + self.chunk_size
-        num_rows = len(self.table_dataset_list[bin_idx].root.input_matrix)
+        num_rows = self.num_rows_list[bin_idx]
         if end_idx > num_rows:
             end_idx = num_rows
         if start_idx >= num_rows:
             start_idx = num_rows - 1
         assert end_idx <= num_rows, f"Index out of range: {end_idx} > {num_rows}"
-        current_tensor = self.table_dataset_list[bin_idx].root.input_matrix[start_idx:end_idx]
-        current_label = self.table_dataset_list[bin_idx].root.label[start_idx:end_idx]
+        return bin_idx, start_idx, end_idx
+
+    def __getitem__(self, idx):
+        bin_idx, start_idx, end_idx = self._get_chunk_range(idx)
+        table_dataset = self._get_table_dataset(bin_idx)
+        current_tensor = self._read_input_matrix(table_dataset, start_idx, end_idx)
+        return self._format_chunk(table_dataset, current_tensor, start_idx, end_idx)
+
+    def _format_chunk(self, table_dataset, current_tensor, start_idx, end_idx):
+        current_label = table_dataset.root.label.read(start_idx, end_idx)
         if self.add_af_in_label:
-            af_info = [item[3] for item in current_label]
-            af_info = [[item, item, 1 / float(max(item, 0.05)) / 20.0] for item in af_info]
-            af_tensor = np.array(af_info)
+            af_info = current_label[:, 3].astype(np.float64)
+            af_tensor = np.stack([af_info, af_info, 1 / np.maximum(af_info, 0.05) / 20.0], axis=1)
 
-        if self.discard_germline:
-            current_label = [[self.negative, self.positive] if np.argmax(item[:3]) == 2 else [self.positive, self.negative]for item in current_label]
-        else:
-            current_label = [[self.negative, self.negative, self.positive] if np.argmax(item[:3]) == 2 else \
-                [self.negative, self.positive, self.negative] if np.argmax(item[:3]) == 1 else \
-                    [self.positive, self.negative, self.negative]for item in current_label]
+        current_label = self.label_lookup[np.argmax(current_label[:, :3], axis=1)]
 
+        # full-alignment tensors stay in raw int8 (depth, width, channel) layout, the model permutes and scales them
         if not self.pileup:
-            current_tensor = np.transpose(current_tensor, (0, 3, 1, 2))
-        current_label = np.array(current_label,dtype=np.float32)
+            current_tensor = current_tensor.astype(np.int8, copy=False)
         if self.debug_mode:
-            position_info = self.table_dataset_list[bin_idx].root.position[start_idx:end_idx]
-            normal_info = self.table_dataset_list[bin_idx].root.normal_alt_info[start_idx:end_idx]
-            tumor_info = self.table_dataset_list[bin_idx].root.tumor_alt_info[start_idx:end_idx]
+            position_info = table_dataset.root.position[start_idx:end_idx]
+            normal_info = table_dataset.root.normal_alt_info[start_idx:end_idx]
+            tumor_info = table_dataset.root.tumor_alt_info[start_idx:end_idx]
             return current_tensor, current_label, position_info, normal_info, tumor_info
         if self.add_af_in_label:
             return current_tensor, current_label, af_tensor
@@ -153,8 +210,121 @@ class BinFileDataset(Dataset):
         return file_idx, chunk_idx
 
     def close(self):
+        if self.table_dataset_list is None:
+            return
         for dataset in self.table_dataset_list:
-            dataset.close()
+            if dataset is not None:
+                dataset.close()
+        self.table_dataset_list = None
+
+class PurityMixingDataset(BinFileDataset):
+    """
+    Full-alignment Dataset over bins created with create_bin.py --store_read_rows, an in-silico tumor of a random purity
+    and depth is mixed from the stored normal and tumor read rows of each candidate when a chunk is loaded, instead of
+    materializing a bin set per tumor proportion.
+
+    For purity p, the synthetic coverage d follows check_max_sampled_coverage in mix_chunk_bam: d = min(tumor_depth / p,
+    normal_depth / (1 + gamma - p)), capped by the tumor tensor depth and scaled down by a random ratio in
+    [min_depth_ratio, 1]. The synthetic tumor takes round(p * d) tumor reads and fills the rest of d with normal reads, the
+    normal side takes gamma * d of the remaining normal reads, so no normal read appears on both sides. Sampled
+    rows keep their stored order and the tumor and contaminating rows are interleaved randomly.
+    """
+
+    def __init__(self, file_list, file_path, chunk_size, batch_size, tensor_shape, min_purity=0.2, max_purity=1.0,
+                 min_depth_ratio=1.0, pair_gamma=0.5, max_normal_depth=None, max_tumor_depth=None, **kwargs):
+        self.tensor_shape = tensor_shape
+        self.min_purity = min_purity
+        self.max_purity = max_purity
+        self.min_depth_ratio = min_depth_ratio
+        self.pair_gamma = pair_gamma
+        self.max_normal_depth = max_normal_depth
+        self.max_tumor_depth = max_tumor_depth
+        self.read_start_list = None
+        self.rng = None
+        self.rng_pid = None
+        super(PurityMixingDataset, self).__init__(file_list, file_path, chunk_size, batch_size, pileup=False, **kwargs)
+
+    def _populate_dataset_table(self, file_list, file_path):
+        chunk_offset = np.zeros(len(file_list), dtype=int)
+        num_rows_list = np.zeros(len(file_list), dtype=int)
+        chunk_rows_list = np.ones(len(file_list), dtype=int)
+        self.read_start_list = []
+        for bin_idx, bin_file in enumerate(file_list):
+            with tables.open_file(os.path.join(file_path, bin_file), 'r') as table_dataset:
+                if 'read_depth' not in table_dataset.root:
+                    raise ValueError("[ERROR] {} has no read rows, create it with --store_read_rows".format(bin_file))
+                chunk_offset[bin_idx] = (len(table_dataset.root.label) - self.batch_size) // self.chunk_size
+                num_rows_list[bin_idx] = len(table_dataset.root.label)
+                chunkshape = table_dataset.root.label.chunkshape
+                chunk_rows_list[bin_idx] = chunkshape[0] if chunkshape is not None else 1
+                # row offset of each candidate in read_matrix, normal rows followed by tumor rows
+                read_depth = table_dataset.root.read_depth.read()
+                read_start = np.zeros((len(read_depth), 3), dtype=np.int64)
+                read_start[:, 1] = read_depth[:, 0]
+                read_start[:, 2] = read_depth.sum(axis=1)
+                read_start += np.concatenate([[0], np.cumsum(read_start[:-1, 2])])[:, None]
+                self.read_start_list.append(read_start)
+        return chunk_offset, num_rows_list, chunk_rows_list
+
+    def _get_rng(self, idx):
+        if not self.train_flag:
+            # validation chunks are mixed the same way in every epoch
+            return np.random.default_rng([seed, idx])
+        # torch seeds each DataLoader worker differently in every epoch
+        if self.rng is None or self.rng_pid != os.getpid():
+            self.rng = np.random.default_rng(torch.initial_seed())
+            self.rng_pid = os.getpid()
+        return self.rng
+
+    def _mix_reads(self, rng, normal_rows, tumor_rows, output_matrix):
+        normal_depth, tumor_depth = len(normal_rows), len(tumor_rows)
+        purity = rng.uniform(self.min_purity, self.max_purity)
+        coverage = min(tumor_depth / purity, normal_depth / (1 + self.pair_gamma - purity))
+        if self.max_tumor_depth is not None:
+            coverage = min(coverage, self.max_tumor_depth)
+        if self.max_normal_depth is not None:
+            coverage = min(coverage, self.max_normal_depth / self.pair_gamma)
+        coverage *= rng.uniform(self.min_depth_ratio, 1.0)
+
+        mixed_tumor_depth = int(coverage)
+        tumor_read_num = min(tumor_depth, int(round(purity * mixed_tumor_depth)))
+        contaminated_read_num = min(normal_depth, mixed_tumor_depth - tumor_read_num)
+        normal_read_num = min(normal_depth - contaminated_read_num, int(self.pair_gamma * coverage))
+
+        tumor_idx = np.sort(rng.choice(tumor_depth, tumor_read_num, replace=False))
+        normal_permutation = rng.permutation(normal_depth)
+        contaminated_idx = np.sort(normal_permutation[:contaminated_read_num])
+        normal_idx = np.sort(normal_permutation[contaminated_read_num:contaminated_read_num + normal_read_num])
+
+        # order preserving random interleave of the tumor and contaminating rows
+        mixed_tumor_depth = tumor_read_num + contaminated_read_num
+        is_tumor_row = np.zeros(mixed_tumor_depth, dtype=bool)
+        is_tumor_row[rng.choice(mixed_tumor_depth, tumor_read_num, replace=False)] = True
+
+        center_padding_depth = param.center_padding_depth
+        prefix_padding_depth = (len(output_matrix) - normal_read_num - mixed_tumor_depth - center_padding_depth) // 2
+        tumor_start = prefix_padding_depth + normal_read_num + center_padding_depth
+        output_matrix[prefix_padding_depth:prefix_padding_depth + normal_read_num] = normal_rows[normal_idx]
+        mixed_tumor_matrix = output_matrix[tumor_start:tumor_start + mixed_tumor_depth]
+        mixed_tumor_matrix[is_tumor_row] = tumor_rows[tumor_idx]
+        mixed_tumor_matrix[~is_tumor_row] = normal_rows[contaminated_idx]
+
+    def __getitem__(self, idx):
+        bin_idx, start_idx, end_idx = self._get_chunk_range(idx)
+        table_dataset = self._get_table_dataset(bin_idx)
+        rng = self._get_rng(idx)
+        read_start = self.read_start_list[bin_idx][start_idx:end_idx]
+        read_offset = read_start[0, 0]
+        read_matrix = table_dataset.root.read_matrix.read(read_offset, read_start[-1, 2])
+
+        current_tensor = np.zeros([end_idx - start_idx] + self.tensor_shape, dtype=np.int8)
+        for row_idx, (normal_start, tumor_start, tumor_end) in enumerate(read_start - read_offset):
+            self._mix_reads(rng,
+                            normal_rows=read_matrix[normal_start:tumor_start],
+                            tumor_rows=read_matrix[tumor_start:tumor_end],
+                            output_matrix=current_tensor[row_idx])
+        return self._format_chunk(table_dataset, current_tensor, start_idx, end_idx)
+
 
 class GPU_Monitor(threading.Thread):
     def __init__(self, gpu_id, interval=5, duration=60, csv_file='gpu_usage.csv'):
@@ -224,6 +394,19 @@ def cal_metrics(tp, fp, fn):
     return round(precision, 6), round(recall, 6), round(f1_score, 6)
 
 
+def count_tp_fp_fn(y_truth, y_pred, arg_index):
+    """
+    Count the true positive, false positive and false negative calls of class arg_index with tensor ops on the
+    device of the inputs.
+    """
+    is_truth = y_truth == arg_index
+    is_pred = y_pred == arg_index
+    tp = (is_truth & is_pred).sum()
+    fp = (~is_truth & is_pred).sum()
+    fn = (is_truth & ~is_pred).sum()
+    return tp, fp, fn
+
+
 def get_label_task(label, label_shape_cum, task):
     if task == 0:
         return label[:label_shape_cum[task]]
@@ -334,6 +517,15 @@ def train_model_torch_dataset(args):
 
     output = model(input)
 
+    use_bf16 = args.cpu_bf16 and device == 'cpu'
+    if device == 'cpu':
+        if args.cpu_threads > 0:
+            torch.set_num_threads(args.cpu_threads)
+        if not args.pileup:
+            # the permuted (batch, depth, width, channel) input is already channels_last, keep the conv weights alike
+            model = model.to(memory_format=torch.channels_last)
+        print("[INFO] CPU training threads: {}, bf16 autocast: {}".format(torch.get_num_threads(), use_bf16))
+
     batch_size, chunk_size = param.trainBatchSize, param.chunk_size
     assert batch_size % chunk_size == 0
     chunks_per_batch = batch_size // chunk_size
@@ -360,20 +552,35 @@ def train_model_torch_dataset(args):
 
     logging.info("[INFO] total {} training bin files: {}".format(len(bin_list), ','.join(bin_list)))
 
+    # the ring must outlive one DataLoader batch before a read buffer is reused
+    ring_buffer_size = max(args.torch_dataset_ring_buffer_size, chunks_per_batch + 1) if args.torch_dataset_ring_buffer_size > 0 else 0
+    dataset_class, dataset_kwargs = BinFileDataset, dict(pileup=args.pileup, ring_buffer_size=ring_buffer_size)
+    if args.purity_mixing:
+        if args.pileup or not 0 < args.min_purity <= args.max_purity <= 1:
+            print("[ERROR] --purity_mixing requires full-alignment bins and 0 < --min_purity <= --max_purity <= 1")
+            return
+        dataset_class = PurityMixingDataset
+        dataset_kwargs = dict(tensor_shape=tensor_shape,
+                              min_purity=args.min_purity,
+                              max_purity=args.max_purity,
+                              min_depth_ratio=args.min_depth_ratio,
+                              max_normal_depth=param.normal_matrix_depth_dict[platform],
+                              max_tumor_depth=param.tumor_matrix_depth_dict[platform])
+        print("[INFO] Mix tumor purity in training: {}-{}".format(args.min_purity, args.max_purity))
     if validation_fn:
         val_list = os.listdir(validation_fn)
         logging.info("[INFO] total {} validation bin files: {}".format(len(val_list), ','.join(val_list)))
-        train_dataset = BinFileDataset(bin_list, args.bin_fn, chunk_size, batch_size, debug_mode=False, discard_germline = discard_germline, \
-                                       add_af_in_label = param.add_af_in_label, smoothing=smoothing, pileup=args.pileup)
+        train_dataset = dataset_class(bin_list, args.bin_fn, chunk_size, batch_size, debug_mode=False, discard_germline = discard_germline, \
+                                      add_af_in_label = param.add_af_in_label, smoothing=smoothing, **dataset_kwargs)
         train_chunk_num = len(train_dataset)
 
-        val_dataset = BinFileDataset(val_list, validation_fn, chunk_size, batch_size, debug_mode=debug_mode, discard_germline=discard_germline, \
-                                     add_af_in_label=False, smoothing=smoothing, pileup=args.pileup)
+        val_dataset = dataset_class(val_list, validation_fn, chunk_size, batch_size, debug_mode=debug_mode, discard_germline=discard_germline, \
+                                    add_af_in_label=False, smoothing=smoothing, **dataset_kwargs)
         validate_chunk_num = len(val_dataset)
         total_chunks = train_chunk_num + validate_chunk_num
     else:
-        total_dataset = BinFileDataset(bin_list, args.bin_fn, chunk_size, batch_size, debug_mode=debug_mode, discard_germline=discard_germline, \
-                                       add_af_in_label = param.add_af_in_label, smoothing=smoothing, pileup=args.pileup)
+        total_dataset = dataset_class(bin_list, args.bin_fn, chunk_size, batch_size, debug_mode=debug_mode, discard_germline=discard_germline, \
+                                      add_af_in_label = param.add_af_in_label, smoothing=smoothing, **dataset_kwargs)
         total_chunks = len(total_dataset)
         training_dataset_percentage = param.trainingDatasetPercentage if add_validation_dataset else None
         if add_validation_dataset:
@@ -418,17 +625,19 @@ def train_model_torch_dataset(args):
             pass
 
     if add_validation_dataset:
-        train_dataloader = DataLoader(train_dataset, batch_size=chunks_per_batch, shuffle=True, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=True)
-        validate_dataloader = DataLoader(val_dataset, batch_size=chunks_per_batch, shuffle=False, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=True)
+        train_dataloader = DataLoader(train_dataset, batch_size=chunks_per_batch, shuffle=True, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=device == 'cuda')
+        validate_dataloader = DataLoader(val_dataset, batch_size=chunks_per_batch, shuffle=False, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=device == 'cuda')
     else:
-        train_dataloader = DataLoader(train_dataset, batch_size=chunks_per_batch, shuffle=True, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=True)
+        train_dataloader = DataLoader(train_dataset, batch_size=chunks_per_batch, shuffle=True, num_workers=args.torch_dataset_num_workers, prefetch_factor=args.torch_dataset_prefetch_factor, pin_memory=device == 'cuda')
     criterion = FocalLoss() if apply_focal_loss else nn.CrossEntropyLoss()
     criterion = criterion.to(device)
     if param.add_af_in_label:
         af_loss = AFLoss().to(device)
 
-    # optimizer
-    optimizer = optim.Adam(model.parameters(), lr=learning_rate, weight_decay=param.weight_decay)
+    # optimizer, the gradient of the 0.5 * lambda * ||w||^2 L2 loss over all parameters is lambda * w, which is what
+    # the coupled Adam weight decay adds, so the L2 term is folded into the weight decay instead of summed every step
+    weight_decay = param.weight_decay + (l2_regularization_lambda if add_l2_regulation_loss else 0.0)
+    optimizer = optim.Adam(model.parameters(), lr=learning_rate, weight_decay=weight_decay)
     # learning rate scheduler
     lr_scheduler = torch.optim.lr_scheduler.ExponentialLR(optimizer, gamma=0.9)
 
@@ -451,6 +660,7 @@ def train_model_torch_dataset(args):
     if args.gpu_csv_fn is not None and check_gpu_status:
         monitor = GPU_Monitor(gpu_id=0, interval=1, duration=120, csv_file = args.gpu_csv_fn)  # Monitor for 5 minutes
         monitor.start()
+    arg_index = 1 if discard_germline else 2
     for epoch in range(1, max_epoch + 1):
         epoch_loss = 0
         fp, tp, fn = 0, 0, 0
@@ -471,23 +681,20 @@ def train_model_torch_dataset(args):
                 data, label = batch_tuple
             t.set_description('EPOCH {}'.format(epoch))
             if not args.pileup:
-                    data = data.reshape(-1, param.channel_size, param.matrix_depth_dict[platform], param.no_of_positions)
-                    data = data.to(device) / 100.0
+                    data = data.reshape(-1, param.matrix_depth_dict[platform], param.no_of_positions, data.shape[-1])
+                    data = data.to(device)
             else:
                     data = data.reshape(-1, param.no_of_positions, param.pileup_channel_size*2)
                     data = data.to(device)
             label = label.reshape(-1, 3).to(device)
             label = label.to(device)
-            output_logit = model(data).contiguous()
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=use_bf16):
+                output_logit = model(data).contiguous()
+            output_logit = output_logit.float()
             y_truth = torch.argmax(label, axis=1)
             optimizer.zero_grad()
             loss = criterion(input=output_logit, target=label) if apply_focal_loss else criterion(output_logit, y_truth)
 
-            l2_regularization_loss = sum([l2_regularization_lambda * 0.5 * params.norm(2) ** 2 for params in
-                                          model.parameters()]) if add_l2_regulation_loss else 0.0
-
-            loss += l2_regularization_loss
-
             if param.add_af_in_label:
                 af_list = af_list.reshape(-1, 3).to(device)
                 loss += af_loss(input=output_logit, target=af_list)
@@ -500,19 +707,15 @@ def train_model_torch_dataset(args):
                 if training_step % echo_each_step == echo_each_step - 1:
                     writer.add_scalar('training loss', training_loss / echo_each_step, training_step)
                 training_loss = 0.0
-            y_truth = y_truth.cpu().numpy()
-            y_pred = output_logit.argmax(dim=1).cpu().numpy()
-            arg_index = 1 if discard_germline else 2
-            fp += sum([True if x != arg_index and y == arg_index else False for x, y in zip(y_truth, y_pred)])
-            fn += sum([True if x == arg_index and y != arg_index else False for x, y in zip(y_truth, y_pred)])
-            tp += sum([True if x == y and x == arg_index else False for x, y in zip(y_truth, y_pred)])
+            batch_tp, batch_fp, batch_fn = count_tp_fp_fn(y_truth, output_logit.argmax(dim=1), arg_index)
+            tp, fp, fn = tp + batch_tp, fp + batch_fp, fn + batch_fn
 
             if batch_idx + 1 == train_steps:
                 break
 
             epoch_loss += loss
             el = epoch_loss.detach().cpu().numpy()
-            t.set_postfix({'loss': el, 'tp': tp, 'fp': fp, 'fn': fn})
+            t.set_postfix({'loss': el, 'tp': int(tp), 'fp': int(fp), 'fn': int(fn)})
             t.update(1)
 
         # validation
@@ -529,15 +732,16 @@ def train_model_torch_dataset(args):
             else:
                 data, label, position_info, normal_info, tumor_info = batch_tuple
             if not args.pileup:
-                    data = data.reshape(-1, param.channel_size, param.matrix_depth_dict[platform], param.no_of_positions)
-                    data = data.to(device) / 100.0
+                    data = data.reshape(-1, param.matrix_depth_dict[platform], param.no_of_positions, data.shape[-1])
+                    data = data.to(device)
             else:
                     data = data.reshape(-1, param.no_of_positions, param.pileup_channel_size*2)
                     data = data.to(device)
             label = label.reshape(-1, 3).to(device)
             label = label.to(device)
-            with torch.no_grad():
+            with torch.no_grad(), torch.autocast('cpu', dtype=torch.bfloat16, enabled=use_bf16):
                 output_logit = model(data)
+            output_logit = output_logit.float()
 
             y_truth = torch.argmax(label, axis=1)
             optimizer.zero_grad()
@@ -548,11 +752,13 @@ def train_model_torch_dataset(args):
                 if validation_step % echo_each_step == echo_each_step - 1:
                     writer.add_scalar('validation loss', validation_loss / echo_each_step, validation_step)
                 validation_loss = 0.0
-            y_truth = y_truth.cpu().numpy()
             output_pro = torch.softmax(output_logit, dim=1)
-            y_pred = output_pro.argmax(dim=1).cpu().numpy()
-            arg_index = 1 if discard_germline else 2
+            y_pred = output_pro.argmax(dim=1)
+            batch_tp, batch_fp, batch_fn = count_tp_fp_fn(y_truth, y_pred, arg_index)
+            val_tp, val_fp, val_fn = val_tp + batch_tp, val_fp + batch_fp, val_fn + batch_fn
             if debug_mode:
+                y_truth = y_truth.cpu().numpy()
+                y_pred = y_pred.cpu().numpy()
                 if device == 'cuda':
                     data_numpy = data.cpu().numpy()
                 else:
@@ -564,9 +770,6 @@ def train_model_torch_dataset(args):
                     if x != arg_index and y == arg_index:
                         print(idx, 'FP', x, y, cpu_logit[idx], position_info[idx], normal_info[idx], tumor_info[idx])
 
-            val_fp += sum([True if x != arg_index and y == arg_index else False for x, y in zip(y_truth, y_pred)])
-            val_fn += sum([True if x == arg_index and y != arg_index else False for x, y in zip(y_truth, y_pred)])
-            val_tp += sum([True if x == y and x == arg_index else False for x, y in zip(y_truth, y_pred)])
 
             if batch_idx + 1 == validate_steps:
                 break
@@ -575,7 +778,7 @@ def train_model_torch_dataset(args):
             el = val_epoch_loss.detach().cpu().numpy()
             if not debug_mode:
                 v.set_postfix(
-                    {'validation_loss': el, 'val_tp': val_tp, 'val_fp': val_fp, 'val_fn': val_fn})
+                    {'validation_loss': el, 'val_tp': int(val_tp), 'val_fp': int(val_fp), 'val_fn': int(val_fn)})
 
                 v.update(1)
 
@@ -776,7 +979,8 @@ def train_model(args):
                     af_tensor = torch.from_numpy(np.array(af_list)).to(device)
 
                 if not args.pileup:#in collate
-                    input_tensor = torch.from_numpy(np.transpose(input_matrix, (0, 3, 1, 2)) / 100.0).to(device)
+                    # raw int8 (depth, width, channel) layout, the model permutes and scales it as in predict
+                    input_tensor = torch.from_numpy(input_matrix.astype(np.int8, copy=False)).to(device)
                 else:
                     input_tensor = torch.from_numpy(input_matrix).to(device)
                 label_tensor = torch.from_numpy(label_for_tumor).to(device)
@@ -985,6 +1189,27 @@ def main():
     parser.add_argument('--torch_dataset_prefetch_factor', type=int, default=12,
                         help="Prefetch factor for torch dataset to preload datasets")
 
+    parser.add_argument('--torch_dataset_ring_buffer_size', type=int, default=0,
+                        help="Number of reusable read buffers kept by each torch dataset worker, 0 to disable, default: %(default)s")
+
+    parser.add_argument('--cpu_threads', type=int, default=0,
+                        help="Intra-op threads of CPU model training, 0 to use the torch default, default: %(default)s")
+
+    parser.add_argument('--cpu_bf16', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Run the forward pass of CPU model training under bfloat16 autocast, default: %(default)s")
+
+    parser.add_argument('--purity_mixing', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Mix the tumor purity and depth of each candidate at training time, requires bins created with --store_read_rows, default: %(default)s")
+
+    parser.add_argument('--min_purity', type=float, default=0.2,
+                        help="Minimum tumor purity sampled with --purity_mixing, default: %(default)s")
+
+    parser.add_argument('--max_purity', type=float, default=1.0,
+                        help="Maximum tumor purity sampled with --purity_mixing, default: %(default)s")
+
+    parser.add_argument('--min_depth_ratio', type=float, default=1.0,
+                        help="Scale the mixed coverage by a random ratio between --min_depth_ratio and 1 with --purity_mixing, default: %(default)s")
+
     # mutually-incompatible validation options
     vgrp = parser.add_mutually_exclusive_group()
     vgrp.add_argument('--random_validation', action='store_true',
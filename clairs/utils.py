@@ -35,7 +35,9 @@ import shlex
 import tables
 import numpy as np
 import heapq
-from random import random
+import concurrent.futures
+from random import random, seed as random_seed
+from functools import partial
 from collections import defaultdict
 from itertools import product
 
@@ -44,6 +46,7 @@ from shared.utils import subprocess_popen, IUPAC_base_to_num_dict as BASE2NUM
 
 FILTERS = tables.Filters(complib='blosc:lz4hc', complevel=5)
 shuffle_bin_size = 3000
+write_batch_size = 500
 PREFIX_CHAR_STR = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
 
 
@@ -176,12 +179,15 @@ def write_table_dict(table_dict, normal_matrix, tumor_matrix, label, pos, total,
     center_padding_depth = param.center_padding_depth
     padding_depth = tensor_shape[0] - tensor_depth - center_padding_depth
     prefix_padding_depth = int(padding_depth / 2)
-    suffix_padding_depth = padding_depth - int(padding_depth / 2)
-    prefix_zero_padding = ['0'] * prefix_padding_depth * tensor_shape[1] * tensor_shape[2]
-    center_zero_padding = ['0'] * center_padding_depth * tensor_shape[1] * tensor_shape[2]
-    suffix_zero_padding = ['0'] * suffix_padding_depth * tensor_shape[1] * tensor_shape[2]
-    table_dict['input_matrix'].append(
-        prefix_zero_padding + normal_matrix + center_zero_padding + tumor_matrix + suffix_zero_padding)
+    row_size = tensor_shape[1] * tensor_shape[2]
+
+    # pad in place: only the normal and tumor rows are written into the zeroed preallocated slot
+    input_matrix = table_dict['input_matrix'][len(table_dict['position'])].reshape(-1)
+    input_matrix[:] = 0
+    normal_start = prefix_padding_depth * row_size
+    tumor_start = normal_start + (normal_depth + center_padding_depth) * row_size
+    input_matrix[normal_start:normal_start + len(normal_matrix)] = np.asarray(normal_matrix, dtype=np.int8)
+    input_matrix[tumor_start:tumor_start + len(tumor_matrix)] = np.asarray(tumor_matrix, dtype=np.int8)
     table_dict['position'].append(pos)
     table_dict['label'].append(label)
     table_dict['normal_alt_info'].append(normal_alt_info)
@@ -191,9 +197,36 @@ def write_table_dict(table_dict, normal_matrix, tumor_matrix, label, pos, total,
     return total + 1
 
 
-def update_table_dict():
+def write_read_rows(table_dict, normal_matrix, tumor_matrix, label, pos, total, normal_alt_info, tumor_alt_info,
+                    tensor_shape, proportion=None):
+    """
+    Keep the unpadded normal and tumor read rows of a candidate instead of the padded tensor, the normal and tumor
+    depth are recorded in read_depth so that the training Dataset could resample the read mix of each candidate.
+    """
+    row_size = tensor_shape[1] * tensor_shape[2]
+    normal_depth = len(normal_matrix) // row_size
+    tumor_depth = len(tumor_matrix) // row_size
+
+    table_dict['read_matrix'].append(np.asarray(normal_matrix, dtype=np.int8).reshape([-1] + tensor_shape[1:]))
+    table_dict['read_matrix'].append(np.asarray(tumor_matrix, dtype=np.int8).reshape([-1] + tensor_shape[1:]))
+    table_dict['read_depth'].append((normal_depth, tumor_depth))
+    table_dict['position'].append(pos)
+    table_dict['label'].append(label)
+    table_dict['normal_alt_info'].append(normal_alt_info)
+    table_dict['tumor_alt_info'].append(tumor_alt_info)
+    table_dict['proportion'].append(proportion)
+
+    return total + 1
+
+
+def update_table_dict(tensor_shape=None, float_type='float32', store_read_rows=False):
     table_dict = {}
-    table_dict['input_matrix'] = []
+    if store_read_rows:
+        table_dict['read_matrix'] = []
+        table_dict['read_depth'] = []
+    else:
+        table_dict['input_matrix'] = np.zeros([write_batch_size] + tensor_shape, dtype=np.dtype(float_type)) \
+            if tensor_shape is not None else []
     table_dict['normal_alt_info'] = []
     table_dict['tumor_alt_info'] = []
     table_dict['position'] = []
@@ -214,18 +247,37 @@ def write_table_file(table_file, table_dict, tensor_shape, label_size, float_typ
     time, especially in ont data, here we usually use 1:1 or 1:2 for variant candidate: non variant candidate.
     """
 
-    try:
-        input_matrix = np.array(table_dict['input_matrix'], np.dtype(float_type)).reshape([-1] + tensor_shape)
-    except:
-            return table_dict
-    table_file.root.input_matrix.append(input_matrix)
+    row_num = len(table_dict['position'])
+    if row_num == 0:
+        return table_dict
+    if 'read_depth' in table_dict:
+        table_file.root.read_matrix.append(np.concatenate(table_dict['read_matrix']))
+        table_file.root.read_depth.append(np.array(table_dict['read_depth'], np.dtype('int32')).reshape(-1, 2))
+        table_dict['read_matrix'] = []
+        table_dict['read_depth'] = []
+    else:
+        input_matrix = table_dict['input_matrix']
+        if isinstance(input_matrix, np.ndarray):
+            input_matrix = input_matrix[:row_num]
+        else:
+            try:
+                input_matrix = np.array(input_matrix, np.dtype(float_type)).reshape([-1] + tensor_shape)
+            except:
+                return table_dict
+        table_file.root.input_matrix.append(input_matrix)
 
     table_file.root.normal_alt_info.append(np.array(table_dict['normal_alt_info']).reshape(-1, 1))
     table_file.root.tumor_alt_info.append(np.array(table_dict['tumor_alt_info']).reshape(-1, 1))
     table_file.root.position.append(np.array(table_dict['position']).reshape(-1, 1))
     table_file.root.label.append(np.array(table_dict['label'], np.dtype(float_type)).reshape(-1, label_size))
     table_file.root.proportion.append(np.array(table_dict['proportion'], np.dtype('float32')).reshape(-1, 1))
-    table_dict = update_table_dict()
+
+    # reuse the preallocated tensor buffer for the next batch
+    table_dict['normal_alt_info'] = []
+    table_dict['tumor_alt_info'] = []
+    table_dict['position'] = []
+    table_dict['label'] = []
+    table_dict['proportion'] = []
 
     return table_dict
 
@@ -398,79 +450,76 @@ def heapq_merge_generator_from(normal_bin_reader_generator, tumor_bin_reader_gen
         yield X, batch_count
 
 
-def get_training_array(args,
-                       normal_tensor_fn,
-                       tumor_tensor_fn,
-                       var_fn,
-                       bed_fn,
-                       bin_fn,
-                       shuffle=True,
-                       is_allow_duplicate_chr_pos=True,
-                       chunk_id=None,
-                       chunk_num=None,
-                       platform='ont',
-                       pileup=False,
-                       maximum_non_variant_ratio=None,
-                       phase_tumor=False,
-                       candidate_details_fn_prefix=None,
-                       merge_bins=False):
-    tree = bed_tree_from(bed_file_path=bed_fn)
-    is_tree_empty = len(tree.keys()) == 0
-    Y, miss_variant_set = variant_map_from(var_fn, tree, is_tree_empty)
+def create_table_file(bin_fn, tensor_shape, label_size, filters=FILTERS, chunk_rows=None, store_read_rows=False):
+    """
+    Create the bin file arrays. With store_read_rows, the padded input_matrix is replaced by read_matrix, the
+    unpadded normal then tumor read rows of every candidate, and read_depth, the (normal, tumor) row count of every
+    candidate.
+    """
+    float_atom = tables.Atom.from_dtype(np.dtype('float32'))
+    string_atom = tables.StringAtom(itemsize=param.no_of_positions + 50)
+    long_string_atom = tables.StringAtom(itemsize=30000)  # max alt_info length
 
-    global param
-    float_type = 'int32'
-    if pileup:
-        import shared.param as param
+    def chunkshape_from(shape):
+        return None if chunk_rows is None else tuple([chunk_rows] + list(shape[1:]))
+
+    table_file = tables.open_file(bin_fn, mode='w', filters=filters)
+    if store_read_rows:
+        earray_list = [('read_matrix', tables.Atom.from_dtype(np.dtype('int8')), [0] + tensor_shape[1:]),
+                       ('read_depth', tables.Atom.from_dtype(np.dtype('int32')), [0, 2])]
     else:
-        import shared.param as param
-        float_type = 'int8'
+        earray_list = [('input_matrix', float_atom, [0] + tensor_shape)]
+    earray_list += [('position', string_atom, [0, 1]),
+                   ('label', float_atom, [0, label_size]),
+                   ('normal_alt_info', long_string_atom, [0, 1]),
+                   ('tumor_alt_info', long_string_atom, [0, 1]),
+                   ('proportion', float_atom, [0, 1])]
+    for name, atom, shape in earray_list:
+        table_file.create_earray(where='/', name=name, atom=atom, shape=shape, filters=filters,
+                                 chunkshape=chunkshape_from(shape))
+    return table_file
+
+
+def merge_bin_files(bin_fn_list, output_bin_fn, tensor_shape, label_size, filters=FILTERS, chunk_rows=None,
+                    store_read_rows=False):
+    """
+    Concatenate bin files written by parallel shards into a single bin file, copying each array in slabs.
+    """
+    table_file = create_table_file(output_bin_fn, tensor_shape, label_size, filters, chunk_rows, store_read_rows)
+    slab_size = write_batch_size * 10
+    for bin_fn in bin_fn_list:
+        with tables.open_file(bin_fn, 'r') as input_table_file:
+            for node in table_file.root:
+                input_array = getattr(input_table_file.root, node.name)
+                for start in range(0, len(input_array), slab_size):
+                    node.append(input_array.read(start, min(start + slab_size, len(input_array))))
+    table_file.close()
+    for bin_fn in bin_fn_list:
+        os.remove(bin_fn)
+
 
+def write_bin_file(tensor_pair_list, bin_fn, args, Y, miss_variant_set, tree, is_tree_empty, platform='ont',
+                   filters=FILTERS, chunk_rows=None, is_allow_duplicate_chr_pos=True, non_variant_subsample_ratio=1.0,
+                   store_read_rows=False, seed=None):
+    """
+    Write all normal/tumor tensor file pairs of one shard into a bin file. All inputs are passed explicitly so that a
+    shard runs the same under any multiprocessing start method, seed: reseed the shuffle and subsampling of a shard.
+    """
+    global param
+    import shared.param as param
+    if seed is not None:
+        np.random.seed(seed)
+        random_seed(seed)
     tensor_shape = param.input_shape_dict[platform]
     max_normal_depth = param.normal_matrix_depth_dict[platform]
     max_tumor_depth = param.tumor_matrix_depth_dict[platform]
+    float_type = 'int8'
 
-    non_variant_subsample_ratio = maximum_non_variant_ratio if maximum_non_variant_ratio is not None else 1.0
-
-    normal_tensor_list = []
-    tumor_tensor_list = []
-    if os.path.exists(tumor_tensor_fn) or os.path.exists(normal_tensor_fn):
-        if not (os.path.exists(tumor_tensor_fn) and os.path.exists(normal_tensor_fn)):
-            return 0
-        normal_tensor_list.append(normal_tensor_fn)
-        tumor_tensor_list.append(tumor_tensor_fn)
-    else:
-        tumor_tensor_info = tumor_tensor_fn.split('/')
-        tumor_directry, file_prefix = '/'.join(tumor_tensor_info[:-1]), tumor_tensor_info[-1]
-
-        normal_tensor_info = normal_tensor_fn.split('/')
-        normal_directry, file_prefix = '/'.join(normal_tensor_info[:-1]), normal_tensor_info[-1]
-
-        for file_name in os.listdir(tumor_directry):
-            if file_name.startswith(file_prefix + '_') or file_name.startswith(
-                    file_prefix + '.'):  # add '_.' to avoid add other prefix chr
-                if os.path.exists(os.path.join(normal_directry, file_name)):
-                    normal_tensor_list.append(os.path.join(normal_directry, file_name))
-                    tumor_tensor_list.append(os.path.join(tumor_directry, file_name))
-
-    tables.set_blosc_max_threads(64)
-    int_atom = tables.Atom.from_dtype(np.dtype(float_type))
-    float_atom = tables.Atom.from_dtype(np.dtype('float32'))
-    string_atom = tables.StringAtom(itemsize=param.no_of_positions + 50)
-    long_string_atom = tables.StringAtom(itemsize=30000)  # max alt_info length
-    table_file = tables.open_file(bin_fn, mode='w', filters=FILTERS)
-    table_file.create_earray(where='/', name='input_matrix', atom=float_atom, shape=[0] + tensor_shape,
-                             filters=FILTERS)
-    table_file.create_earray(where='/', name='position', atom=string_atom, shape=(0, 1), filters=FILTERS)
-    table_file.create_earray(where='/', name='label', atom=float_atom, shape=(0, param.label_size), filters=FILTERS)
-    table_file.create_earray(where='/', name='normal_alt_info', atom=long_string_atom, shape=(0, 1), filters=FILTERS)
-    table_file.create_earray(where='/', name='tumor_alt_info', atom=long_string_atom, shape=(0, 1), filters=FILTERS)
-    table_file.create_earray(where='/', name='proportion', atom=float_atom, shape=(0, 1), filters=FILTERS)
-
-    table_dict = update_table_dict()
+    table_file = create_table_file(bin_fn, tensor_shape, param.label_size, filters, chunk_rows, store_read_rows)
+    table_dict = update_table_dict(tensor_shape, float_type, store_read_rows)
     total_compressed = 0
     total = 0
-    for normal_tensor_fn, tumor_tensor_fn in zip(normal_tensor_list, tumor_tensor_list):
+    for normal_tensor_fn, tumor_tensor_fn in tensor_pair_list:
 
         normal_subprocess_process = subprocess_popen(shlex.split("{} -fdc {}".format(param.zstd, normal_tensor_fn)))
         tumor_subprocess_process = subprocess_popen(shlex.split("{} -fdc {}".format(param.zstd, tumor_tensor_fn)))
@@ -496,8 +545,6 @@ def get_training_array(args,
                                                                non_variant_subsample_ratio=non_variant_subsample_ratio,
                                                                is_tumor=True)
 
-        total_compressed = 0
-        total = 0
         for X, batch_total in heapq_merge_generator_from(normal_bin_reader_generator, tumor_bin_reader_generator):
             total += batch_total
             all_pos_list = get_key_list(X)
@@ -523,26 +570,129 @@ def get_training_array(args,
                 if args.use_reference_candidates_only and label[0] != 1:
                     continue
 
-                total_compressed = write_table_dict(table_dict=table_dict,
-                                                    normal_matrix=normal_tensor,
-                                                    tumor_matrix=tumor_tensor,
-                                                    label=label,
-                                                    pos=pos_infos,
-                                                    total=total_compressed,
-                                                    normal_alt_info=nomral_alt_info,
-                                                    tumor_alt_info=tumor_alt_info,
-                                                    tensor_shape=tensor_shape,
-                                                    pileup=pileup,
-                                                    proportion=proportion,
-                                                    max_normal_depth=max_normal_depth,
-                                                    max_tumor_depth=max_tumor_depth
-                                                    )
-
-                if total_compressed % 500 == 0 and total_compressed > 0:
+                if store_read_rows:
+                    # depth is capped when the read mix is sampled in training, keep all rows here
+                    total_compressed = write_read_rows(table_dict=table_dict,
+                                                       normal_matrix=normal_tensor,
+                                                       tumor_matrix=tumor_tensor,
+                                                       label=label,
+                                                       pos=pos_infos,
+                                                       total=total_compressed,
+                                                       normal_alt_info=nomral_alt_info,
+                                                       tumor_alt_info=tumor_alt_info,
+                                                       tensor_shape=tensor_shape,
+                                                       proportion=proportion)
+                else:
+                    total_compressed = write_table_dict(table_dict=table_dict,
+                                                        normal_matrix=normal_tensor,
+                                                        tumor_matrix=tumor_tensor,
+                                                        label=label,
+                                                        pos=pos_infos,
+                                                        total=total_compressed,
+                                                        normal_alt_info=nomral_alt_info,
+                                                        tumor_alt_info=tumor_alt_info,
+                                                        tensor_shape=tensor_shape,
+                                                        pileup=False,
+                                                        proportion=proportion,
+                                                        max_normal_depth=max_normal_depth,
+                                                        max_tumor_depth=max_tumor_depth
+                                                        )
+
+                if len(table_dict['position']) == write_batch_size:
                     table_dict = write_table_file(table_file, table_dict, tensor_shape, param.label_size, float_type)
 
-        if total_compressed % 500 != 0 and total_compressed > 0:
-            table_dict = write_table_file(table_file, table_dict, tensor_shape, param.label_size, float_type)
+        table_dict = write_table_file(table_file, table_dict, tensor_shape, param.label_size, float_type)
 
     table_file.close()
+    return total_compressed, total
+
+
+def get_training_array(args,
+                       normal_tensor_fn,
+                       tumor_tensor_fn,
+                       var_fn,
+                       bed_fn,
+                       bin_fn,
+                       shuffle=True,
+                       is_allow_duplicate_chr_pos=True,
+                       chunk_id=None,
+                       chunk_num=None,
+                       platform='ont',
+                       pileup=False,
+                       maximum_non_variant_ratio=None,
+                       phase_tumor=False,
+                       candidate_details_fn_prefix=None,
+                       merge_bins=False,
+                       threads=1,
+                       complib='blosc:lz4hc',
+                       complevel=5,
+                       chunk_rows=None,
+                       store_read_rows=False):
+    global param
+    import shared.param as param
+
+    tree = bed_tree_from(bed_file_path=bed_fn)
+    is_tree_empty = len(tree.keys()) == 0
+    Y, miss_variant_set = variant_map_from(var_fn, tree, is_tree_empty)
+
+    tensor_shape = param.input_shape_dict[platform]
+    non_variant_subsample_ratio = maximum_non_variant_ratio if maximum_non_variant_ratio is not None else 1.0
+
+    normal_tensor_list = []
+    tumor_tensor_list = []
+    if os.path.exists(tumor_tensor_fn) or os.path.exists(normal_tensor_fn):
+        if not (os.path.exists(tumor_tensor_fn) and os.path.exists(normal_tensor_fn)):
+            return 0
+        normal_tensor_list.append(normal_tensor_fn)
+        tumor_tensor_list.append(tumor_tensor_fn)
+    else:
+        tumor_tensor_info = tumor_tensor_fn.split('/')
+        tumor_directry, file_prefix = '/'.join(tumor_tensor_info[:-1]), tumor_tensor_info[-1]
+
+        normal_tensor_info = normal_tensor_fn.split('/')
+        normal_directry, file_prefix = '/'.join(normal_tensor_info[:-1]), normal_tensor_info[-1]
+
+        for file_name in os.listdir(tumor_directry):
+            if file_name.startswith(file_prefix + '_') or file_name.startswith(
+                    file_prefix + '.'):  # add '_.' to avoid add other prefix chr
+                if os.path.exists(os.path.join(normal_directry, file_name)):
+                    normal_tensor_list.append(os.path.join(normal_directry, file_name))
+                    tumor_tensor_list.append(os.path.join(tumor_directry, file_name))
+
+    tables.set_blosc_max_threads(64)
+    filters = tables.Filters(complib=complib, complevel=complevel)
+    write_shard_bin_file = partial(write_bin_file,
+                                   args=args,
+                                   Y=Y,
+                                   miss_variant_set=miss_variant_set,
+                                   tree=tree,
+                                   is_tree_empty=is_tree_empty,
+                                   platform=platform,
+                                   filters=filters,
+                                   chunk_rows=chunk_rows,
+                                   is_allow_duplicate_chr_pos=is_allow_duplicate_chr_pos,
+                                   non_variant_subsample_ratio=non_variant_subsample_ratio,
+                                   store_read_rows=store_read_rows)
+
+    tensor_pair_list = list(zip(normal_tensor_list, tumor_tensor_list))
+    shard_num = max(1, min(threads, len(tensor_pair_list)))
+    if shard_num == 1:
+        total_compressed, total = write_shard_bin_file(tensor_pair_list, bin_fn)
+    else:
+        # each shard writes its own bin with its own random seed, the shard bins are always merged into bin_fn
+        shard_bin_fn_list = ["{}_{}".format(bin_fn, shard_idx) for shard_idx in range(shard_num)]
+        shard_tensor_pair_list = [tensor_pair_list[shard_idx::shard_num] for shard_idx in range(shard_num)]
+        shard_seed_list = np.random.randint(0, 2 ** 31 - 1, size=shard_num).tolist()
+        total_compressed, total = 0, 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=shard_num) as executor:
+            future_list = [executor.submit(write_shard_bin_file, shard_tensor_pair, shard_bin_fn, seed=shard_seed)
+                           for shard_tensor_pair, shard_bin_fn, shard_seed in
+                           zip(shard_tensor_pair_list, shard_bin_fn_list, shard_seed_list)]
+            for future in future_list:
+                shard_compressed, shard_total = future.result()
+                total_compressed += shard_compressed
+                total += shard_total
+        merge_bin_files(shard_bin_fn_list, bin_fn, tensor_shape, param.label_size, filters, chunk_rows,
+                        store_read_rows)
+
     print("[INFO] Compressed %d/%d tensor" % (total_compressed, total), file=sys.stderr)
@@ -0,0 +1,293 @@
+import os
+import zlib
+import struct
+
+from collections import defaultdict, deque
+
+from shared.utils import log_warning
+
+# maximum uncompressed size of a BGZF block, same as htslib
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00"
+
+# tabix binning scheme
+TABIX_MIN_SHIFT = 14
+TABIX_PSEUDO_BIN = 37450
+TABIX_FORMAT_VCF = 2
+
+
+def bgzf_block_from(data, compress_level=6):
+    """
+    Compress data (<= BGZF_BLOCK_SIZE bytes) into a single BGZF block.
+    """
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15)
+    compressed_data = compressor.compress(data) + compressor.flush()
+    block_size = len(compressed_data) + 26
+    header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00" + struct.pack('<H', block_size - 1)
+    return header + compressed_data + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+class BgzfWriter(object):
+    """
+    Write a BGZF (blocked gzip) file readable by gzip, bgzip and tabix. With threads > 1, the blocks are deflated in a
+    thread pool and written in order.
+
+    As the compressed size of a block is only known after it is deflated, tell() returns a block offset,
+    (block index << 16) | offset in the uncompressed block, which is converted into the tabix virtual offset,
+    (compressed block address << 16) | offset in the uncompressed block, by virtual_offset_from() after close.
+    """
+
+    def __init__(self, fn, compress_level=6, threads=1):
+        self.fn = fn
+        self.compress_level = compress_level
+        self.file = open(fn, 'wb')
+        self.buffer = bytearray()
+        self.block_count = 0
+        self.block_address_list = [0]
+        self.executor = None
+        self.pending_block_list = deque()
+        self.max_pending_blocks = 0
+        if threads > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+            self.max_pending_blocks = threads * 4
+
+    def tell(self):
+        return (self.block_count << 16) | len(self.buffer)
+
+    def virtual_offset_from(self, block_offset):
+        return (self.block_address_list[block_offset >> 16] << 16) | (block_offset & 0xffff)
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode()
+        self.buffer += data
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def _write_block(self, data):
+        self.block_count += 1
+        if self.executor is None:
+            self._output_block(bgzf_block_from(data, self.compress_level))
+            return
+        self.pending_block_list.append(self.executor.submit(bgzf_block_from, data, self.compress_level))
+        while len(self.pending_block_list) >= self.max_pending_blocks:
+            self._output_block(self.pending_block_list.popleft().result())
+
+    def _output_block(self, block):
+        self.file.write(block)
+        self.block_address_list.append(self.block_address_list[-1] + len(block))
+
+    def flush(self):
+        if len(self.buffer):
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending_block_list):
+            self._output_block(self.pending_block_list.popleft().result())
+
+    def close(self):
+        self.flush()
+        self.file.write(BGZF_EOF)
+        self.file.close()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def reg2bin(beg, end):
+    end -= 1
+    if beg >> 14 == end >> 14:
+        return 4681 + (beg >> 14)
+    if beg >> 17 == end >> 17:
+        return 585 + (beg >> 17)
+    if beg >> 20 == end >> 20:
+        return 73 + (beg >> 20)
+    if beg >> 23 == end >> 23:
+        return 9 + (beg >> 23)
+    if beg >> 26 == end >> 26:
+        return 1 + (beg >> 26)
+    return 0
+
+
+def vcf_interval_from(columns):
+    """
+    0-based [start, end) interval of a VCF record as tabix computes it: the REF span, or the INFO END if provided.
+    """
+    start = int(columns[1]) - 1
+    end = start + max(len(columns[3]), 1) if len(columns) > 3 else start + 1
+    if len(columns) > 7 and 'END=' in columns[7]:
+        for info in columns[7].split(';'):
+            if info.startswith('END='):
+                try:
+                    end = max(end, int(info[4:]))
+                except ValueError:
+                    pass
+                break
+    return start, end
+
+
+class TabixIndexer(object):
+    """
+    Build a tabix (.tbi) index of a position sorted VCF while it is written, records of a contig need to be added
+    consecutively and in position order.
+    """
+
+    def __init__(self):
+        self.contig_list = []
+        self.bin_dict = {}
+        self.linear_index_dict = {}
+        self.stats_dict = {}
+        self.last_record = None
+        self.is_sorted = True
+        self.unsorted_record = None
+
+    def add(self, ctg_name, start, end, voffset_start, voffset_end):
+        if self.last_record is not None:
+            last_ctg_name, last_start = self.last_record
+            if (ctg_name == last_ctg_name and start < last_start) or (
+                    ctg_name != last_ctg_name and ctg_name in self.bin_dict):
+                self.is_sorted = False
+                self.unsorted_record = (ctg_name, start + 1)
+        self.last_record = (ctg_name, start)
+        if not self.is_sorted:
+            return
+
+        if ctg_name not in self.bin_dict:
+            self.contig_list.append(ctg_name)
+            self.bin_dict[ctg_name] = defaultdict(list)
+            self.linear_index_dict[ctg_name] = []
+            self.stats_dict[ctg_name] = [voffset_start, voffset_end, 0]
+
+        end = max(end, start + 1)
+        chunk_list = self.bin_dict[ctg_name][reg2bin(start, end)]
+        if len(chunk_list) and chunk_list[-1][1] == voffset_start:
+            chunk_list[-1][1] = voffset_end
+        else:
+            chunk_list.append([voffset_start, voffset_end])
+
+        linear_index = self.linear_index_dict[ctg_name]
+        window_end = (end - 1) >> TABIX_MIN_SHIFT
+        if len(linear_index) <= window_end:
+            linear_index += [None] * (window_end + 1 - len(linear_index))
+        for window in range(start >> TABIX_MIN_SHIFT, window_end + 1):
+            if linear_index[window] is None:
+                linear_index[window] = voffset_start
+
+        stats = self.stats_dict[ctg_name]
+        stats[1] = voffset_end
+        stats[2] += 1
+
+    def add_vcf_row(self, row, voffset_start, voffset_end):
+        columns = row.split('\t', 8)
+        start, end = vcf_interval_from(columns)
+        self.add(columns[0], start, end, voffset_start, voffset_end)
+
+    def write(self, index_fn, virtual_offset_from=None):
+        """
+        Write the index, virtual_offset_from converts the offsets added into tabix virtual offsets if provided.
+        """
+        voffset = virtual_offset_from if virtual_offset_from is not None else (lambda x: x)
+        names = b''.join([ctg_name.encode() + b'\x00' for ctg_name in self.contig_list])
+        data = [b'TBI\x01', struct.pack('<i', len(self.contig_list))]
+        # VCF preset: format, col_seq, col_beg, col_end, meta char, skip lines
+        data.append(struct.pack('<iiiiii', TABIX_FORMAT_VCF, 1, 2, 0, ord('#'), 0))
+        data.append(struct.pack('<i', len(names)) + names)
+        for ctg_name in self.contig_list:
+            bin_dict = self.bin_dict[ctg_name]
+            off_beg, off_end, mapped_count = self.stats_dict[ctg_name]
+            data.append(struct.pack('<i', len(bin_dict) + 1))
+            for bin in sorted(bin_dict.keys()):
+                chunk_list = bin_dict[bin]
+                data.append(struct.pack('<Ii', bin, len(chunk_list)))
+                data.append(b''.join([struct.pack('<QQ', voffset(chunk_beg), voffset(chunk_end)) for chunk_beg, chunk_end
+                                      in chunk_list]))
+            data.append(struct.pack('<IiQQQQ', TABIX_PSEUDO_BIN, 2, voffset(off_beg), voffset(off_end), mapped_count, 0))
+
+            # windows without records take the offset of the previous window
+            linear_index = self.linear_index_dict[ctg_name]
+            previous_offset = 0
+            for window, offset in enumerate(linear_index):
+                if offset is None:
+                    linear_index[window] = previous_offset
+                else:
+                    previous_offset = offset
+            data.append(struct.pack('<i', len(linear_index)))
+            data.append(b''.join([struct.pack('<Q', voffset(offset)) for offset in linear_index]))
+        data.append(struct.pack('<Q', 0))
+
+        index_writer = BgzfWriter(index_fn)
+        index_writer.write(b''.join(data))
+        index_writer.close()
+
+
+class BgzfVcfWriter(object):
+    """
+    File-like writer of a BGZF compressed VCF, the tabix index is built on the fly and written on close if the records
+    were written in sorted order. Written text can hold any number of rows, a row can also be split across writes.
+    """
+
+    def __init__(self, vcf_fn, compress_level=6, threads=1):
+        self.vcf_fn = vcf_fn
+        self.writer = BgzfWriter(vcf_fn, compress_level=compress_level, threads=threads)
+        self.indexer = TabixIndexer()
+        self.partial_row = ''
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, data):
+        if self.partial_row != '':
+            data = self.partial_row + data
+            self.partial_row = ''
+        start = 0
+        end = data.find('\n')
+        while end != -1:
+            self.write_row(data[start:end + 1])
+            start = end + 1
+            end = data.find('\n', start)
+        self.partial_row = data[start:]
+
+    def write_row(self, row):
+        if row == '':
+            return
+        if row[0] == '#':
+            self.writer.write(row)
+            return
+        voffset_start = self.writer.tell()
+        self.writer.write(row)
+        self.indexer.add_vcf_row(row, voffset_start, self.writer.tell())
+
+    def close(self):
+        if self.closed:
+            return self.indexer.is_sorted
+        self.closed = True
+        self.write_row(self.partial_row)
+        self.partial_row = ''
+        self.writer.close()
+        index_fn = self.vcf_fn + '.tbi'
+        if self.indexer.is_sorted:
+            self.indexer.write(index_fn, virtual_offset_from=self.writer.virtual_offset_from)
+            return True
+        if os.path.exists(index_fn):
+            os.remove(index_fn)
+        print(log_warning("[WARNING] VCF {} is not sorted at {}:{}, skip tabix indexing".format(
+            self.vcf_fn, *self.indexer.unsorted_record)))
+        return False
+
+
+def compress_index_vcf(input_vcf, threads=1):
+    """
+    Compress a VCF into input_vcf.gz and index it, the uncompressed VCF is removed as bgzip does.
+    """
+    if not os.path.exists(input_vcf):
+        return
+    vcf_writer = BgzfVcfWriter(input_vcf + '.gz', threads=threads)
+    with open(input_vcf) as f:
+        for row in f:
+            vcf_writer.write_row(row)
+    vcf_writer.close()
+    os.remove(input_vcf)
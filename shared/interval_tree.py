@@ -1,9 +1,171 @@
+import os
 import shlex
 import sys
-from shared.intervaltree.intervaltree import IntervalTree
+import json
+import hashlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    # pypy scripts only use the scalar queries
+    np = None
 
 from shared.utils import subprocess_popen
 
+INTERVAL_INDEX_CACHE_VERSION = 2
+
+
+class IntervalIndex(object):
+    """
+    0-based [start, end) interval index of a contig. Overlapping and adjacent intervals are merged into sorted start
+    and end arrays, so a point or range query is a single bisect and never allocates. Intervals can be added with
+    addi() as to an IntervalTree, the index is rebuilt on the next query.
+    """
+
+    def __init__(self, starts=None, ends=None):
+        self.starts = array('q', starts if starts is not None else [])
+        self.ends = array('q', ends if ends is not None else [])
+        self.pending_interval_list = []
+        self.np_starts = None
+        self.np_ends = None
+
+    def addi(self, begin, end):
+        self.pending_interval_list.append((begin, end))
+
+    def _build(self):
+        interval_list = sorted(list(zip(self.starts, self.ends)) + self.pending_interval_list)
+        self.pending_interval_list = []
+        starts, ends = [], []
+        for begin, end in interval_list:
+            if end <= begin:
+                continue
+            if len(ends) and begin <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+                continue
+            starts.append(begin)
+            ends.append(end)
+        self.starts = array('q', starts)
+        self.ends = array('q', ends)
+        self.np_starts = None
+        self.np_ends = None
+
+    def __len__(self):
+        if self.pending_interval_list:
+            self._build()
+        return len(self.starts)
+
+    def __iter__(self):
+        if self.pending_interval_list:
+            self._build()
+        return iter(zip(self.starts, self.ends))
+
+    def __getstate__(self):
+        if self.pending_interval_list:
+            self._build()
+        return {'starts': self.starts, 'ends': self.ends}
+
+    def __setstate__(self, state):
+        self.__init__(state['starts'], state['ends'])
+
+    def at(self, point):
+        """
+        Whether any interval contains the point.
+        """
+        if self.pending_interval_list:
+            self._build()
+        idx = bisect_right(self.starts, point) - 1
+        return idx >= 0 and point < self.ends[idx]
+
+    def overlaps(self, begin, end):
+        """
+        Whether any interval overlaps [begin, end), an empty range overlaps nothing as in IntervalTree.overlap().
+        """
+        if begin >= end:
+            return False
+        if self.pending_interval_list:
+            self._build()
+        idx = bisect_left(self.starts, end) - 1
+        return idx >= 0 and self.ends[idx] > begin
+
+    def contains(self, positions):
+        """
+        Batched point query, return a boolean array (NumPy) or list of whether each position is in any interval.
+        """
+        if self.pending_interval_list:
+            self._build()
+        if np is None:
+            return [self.at(pos) for pos in positions]
+        if self.np_starts is None:
+            self.np_starts = np.frombuffer(self.starts, dtype=np.int64) if len(self.starts) else np.zeros(0, np.int64)
+            self.np_ends = np.frombuffer(self.ends, dtype=np.int64) if len(self.ends) else np.zeros(0, np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        idx = np.searchsorted(self.np_starts, positions, side='right') - 1
+        if len(self.np_ends) == 0:
+            return np.zeros(positions.shape, dtype=bool)
+        return (idx >= 0) & (positions < self.np_ends[np.maximum(idx, 0)])
+
+
+def interval_index_cache_path_from(bed_file_path, cache_dir):
+    # one cache file per BED path in the cache folder of the run, nothing is written next to the input BED
+    bed_key = hashlib.md5(os.path.abspath(bed_file_path).encode()).hexdigest()
+    return os.path.join(cache_dir, bed_key + '.interval_index')
+
+
+def bed_signature_from(bed_file_path):
+    stat = os.stat(bed_file_path)
+    return [INTERVAL_INDEX_CACHE_VERSION, os.path.abspath(bed_file_path), stat.st_size, int(stat.st_mtime)]
+
+
+def load_interval_index_cache(bed_file_path, cache_dir):
+    """
+    Return (tree, bed region dict) cached for the BED, None if there is no cache or the BED has changed since. The
+    cache is a JSON header line followed by the raw int64 start and end arrays of each contig, nothing is unpickled.
+    """
+    cache_fn = interval_index_cache_path_from(bed_file_path, cache_dir)
+    if not os.path.exists(cache_fn):
+        return None
+    try:
+        with open(cache_fn, 'rb') as f:
+            header = json.loads(f.readline().decode())
+            if header['signature'] != bed_signature_from(bed_file_path):
+                return None
+            tree, bed_region_dict = {}, {}
+            for ctg_name, interval_num, bed_region in header['contigs']:
+                starts, ends = array('q'), array('q')
+                starts.fromfile(f, interval_num)
+                ends.fromfile(f, interval_num)
+                tree[ctg_name] = IntervalIndex(starts, ends)
+                if bed_region is not None:
+                    bed_region_dict[ctg_name] = tuple(bed_region)
+    except (IOError, OSError, ValueError, KeyError, TypeError, EOFError):
+        return None
+    return tree, bed_region_dict
+
+
+def save_interval_index_cache(bed_file_path, tree, bed_region_dict, cache_dir):
+    cache_fn = interval_index_cache_path_from(bed_file_path, cache_dir)
+    tmp_cache_fn = '{}.{}'.format(cache_fn, os.getpid())
+    contig_list = []
+    for ctg_name, interval_index in tree.items():
+        bed_region = bed_region_dict.get(ctg_name)
+        contig_list.append([ctg_name, len(interval_index), list(bed_region) if bed_region is not None else None])
+    header = {'signature': bed_signature_from(bed_file_path), 'contigs': contig_list}
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_cache_fn, 'wb') as f:
+            f.write((json.dumps(header) + '\n').encode())
+            for ctg_name in tree:
+                tree[ctg_name].starts.tofile(f)
+                tree[ctg_name].ends.tofile(f)
+        # chunks of the same BED can run in parallel, never expose a partial cache
+        os.replace(tmp_cache_fn, cache_fn)
+    except (IOError, OSError):
+        if os.path.exists(tmp_cache_fn):
+            os.remove(tmp_cache_fn)
+
 
 def bed_tree_from(bed_file_path,
                   expand_region=None,
@@ -12,9 +174,12 @@ def bed_tree_from(bed_file_path,
                   bed_ctg_end=None,
                   return_bed_region=False,
                   padding=None,
-                  region=None):
+                  region=None,
+                  cache_dir=None):
     """
-    0-based interval tree [start, end)
+    0-based interval index [start, end), a dictionary (contig name: IntervalIndex).
+    cache_dir: load the index of all contigs from a cache in this folder, the cache is built on the first call. Only
+    used without bed_ctg_start/bed_ctg_end and padding, disabled by default.
     """
 
     tree = {}
@@ -28,7 +193,7 @@ def bed_tree_from(bed_file_path,
             sys.exit("[ERROR] Invalid region input: {}".format(region))
 
         if ctg_name not in tree:
-            tree[ctg_name] = IntervalTree()
+            tree[ctg_name] = IntervalIndex()
         tree[ctg_name].addi(ctg_start, ctg_end)
         if return_bed_region:
             return tree, None, None
@@ -39,40 +204,55 @@ def bed_tree_from(bed_file_path,
             return tree, None, None
         return tree
 
-    bed_start, bed_end = float('inf'), 0
-    unzip_process = subprocess_popen(shlex.split("gzip -fdc %s" % (bed_file_path)))
-    for row_id, row in enumerate(unzip_process.stdout):
-        if row[0] == '#':
-            continue
-        columns = row.strip().split()
+    use_cache = cache_dir is not None and not (bed_ctg_start and bed_ctg_end) and not padding and os.path.exists(bed_file_path)
+    cached = load_interval_index_cache(bed_file_path, cache_dir) if use_cache else None
+    if cached is None:
+        # bed region of each contig, before zero-length intervals are extended
+        bed_region_dict = {}
+        unzip_process = subprocess_popen(shlex.split("gzip -fdc %s" % (bed_file_path)))
+        for row_id, row in enumerate(unzip_process.stdout):
+            if row[0] == '#':
+                continue
+            columns = row.strip().split()
 
-        ctg_name = columns[0]
-        if contig_name != None and ctg_name != contig_name:
-            continue
-        if ctg_name not in tree:
-            tree[ctg_name] = IntervalTree()
+            ctg_name = columns[0]
+            if not use_cache and contig_name != None and ctg_name != contig_name:
+                continue
+            if ctg_name not in tree:
+                tree[ctg_name] = IntervalIndex()
 
-        ctg_start, ctg_end = int(columns[1]), int(columns[2])
+            ctg_start, ctg_end = int(columns[1]), int(columns[2])
 
-        if ctg_end < ctg_start or ctg_start < 0 or ctg_end < 0:
-            sys.exit("[ERROR] Invalid bed input in {}-th row {} {} {}".format(row_id+1, ctg_name, ctg_start, ctg_end))
+            if ctg_end < ctg_start or ctg_start < 0 or ctg_end < 0:
+                sys.exit("[ERROR] Invalid bed input in {}-th row {} {} {}".format(row_id+1, ctg_name, ctg_start, ctg_end))
 
-        if bed_ctg_start and bed_ctg_end:
-            if ctg_end < bed_ctg_start or ctg_start > bed_ctg_end:
-                continue
-        if padding:
-            ctg_start += padding
-            ctg_end -= padding
-        bed_start = min(ctg_start, bed_start)
-        bed_end = max(ctg_end, bed_end)
-        if ctg_start == ctg_end:
-            ctg_end += 1
+            if bed_ctg_start and bed_ctg_end:
+                if ctg_end < bed_ctg_start or ctg_start > bed_ctg_end:
+                    continue
+            if padding:
+                ctg_start += padding
+                ctg_end -= padding
+            bed_start, bed_end = bed_region_dict.get(ctg_name, (float('inf'), 0))
+            bed_region_dict[ctg_name] = (min(ctg_start, bed_start), max(ctg_end, bed_end))
+            if ctg_start == ctg_end:
+                ctg_end += 1
 
-        tree[ctg_name].addi(ctg_start, ctg_end)
+            tree[ctg_name].addi(ctg_start, ctg_end)
+
+        unzip_process.stdout.close()
+        unzip_process.wait()
+        if use_cache:
+            save_interval_index_cache(bed_file_path, tree, bed_region_dict, cache_dir)
+    else:
+        tree, bed_region_dict = cached
+
+    if contig_name is not None:
+        tree = dict([(k, v) for k, v in tree.items() if k == contig_name])
+        bed_region_dict = dict([(k, v) for k, v in bed_region_dict.items() if k == contig_name])
 
-    unzip_process.stdout.close()
-    unzip_process.wait()
     if return_bed_region:
+        bed_start = min([v[0] for v in bed_region_dict.values()] + [float('inf')])
+        bed_end = max([v[1] for v in bed_region_dict.values()] + [0])
         return tree, bed_start, bed_end
     return tree
 
@@ -81,9 +261,5 @@ def is_region_in(tree, contig_name, region_start=None, region_end=None):
     if not tree or (contig_name is None) or (contig_name not in tree):
         return False
 
-    interval_tree = tree[contig_name]
-    return len(
-        interval_tree.at(region_start)
-        if region_end is None else
-        interval_tree.overlap(begin=region_start, end=region_end)
-    ) > 0
+    interval_index = tree[contig_name]
+    return interval_index.at(region_start) if region_end is None else interval_index.overlaps(region_start, region_end)
@@ -41,6 +41,8 @@ center_padding_depth = 2
 min_rescale_cov = 50
 SAMTOOLS_VIEW_FILTER_FLAG = 2316
 extend_bp = 100
+# known sites closer than the gap share one BAM fetch window in the genotyping fast path
+genotyping_max_fetch_gap = 10000
 alternative_base_num = min_tumor_support_read_num = 3
 max_depth = tensor_max_depth + center_padding_depth
 normal_tumor_ratio = 1
@@ -60,6 +62,8 @@ ont_max_tumor_depth = ont_tensor_max_depth - ont_max_normal_depth
 matrix_depth_dict = {'ont': ont_max_depth, 'ilmn': max_depth, 'hifi': 130}
 normal_matrix_depth_dict = {'ont': ont_max_normal_depth, 'ilmn': max_normal_depth, 'hifi': 64}
 tumor_matrix_depth_dict = {'ont': ont_max_tumor_depth, 'ilmn': max_tumor_depth, 'hifi': 64}
+# streaming read downsampling keeps up to headroom x matrix depth reads at a position for allele frequency estimation
+downsample_depth_headroom = 4
 phase_normal = {'ont': False, 'ilmn': False, 'hifi': False}
 phase_tumor = {'ont': True, 'ilmn': False, 'hifi': True}
 qual_dict = {'ont': 0.8, 'ilmn': 0.95, 'hifi': 0.8}
@@ -0,0 +1,120 @@
+"""
+Decoding of the mpileup base column shared by candidate extraction, tensor creation and the filters. Pure Python as
+most callers run with pypy, the decoding skips whole runs of plain bases with regular expressions instead of walking
+the column char by char.
+"""
+
+import re
+
+from collections import Counter
+
+PILEUP_BASES = "ACGTNacgtn#*"
+FORWARD_BASES = "ACGTN*"
+# read start marker with its mapping quality char, or read end marker
+READ_MARKER_PATTERN = re.compile(r'\^.|\$', re.S)
+INDEL_PATTERN = re.compile(r'[+-](\d+)')
+NON_BASE_PATTERN = re.compile(r'[^ACGTNacgtn#*]')
+
+
+def base_list_from(pileup_bases, upper=False, read_idx_list=None):
+    """
+    Decode a mpileup base column into a list of [base, indel] per read, indel is '' or the '+'/'-' prefixed inserted or
+    deleted bases following the base. Reference skips and other chars not in PILEUP_BASES are dropped.
+    upper: upper case the base and indel, the strand is lost.
+    read_idx_list: only return the reads of the sorted indices, the other reads are not decoded if the column has no
+    indel. An empty list is returned if the column has fewer reads.
+    """
+    if '^' in pileup_bases or '$' in pileup_bases:
+        pileup_bases = READ_MARKER_PATTERN.sub('', pileup_bases)
+    if upper:
+        pileup_bases = pileup_bases.upper()
+
+    if '+' not in pileup_bases and '-' not in pileup_bases:
+        bases = bases_from(pileup_bases)
+        if read_idx_list is None:
+            return [[base, ""] for base in bases]
+        if len(read_idx_list) and read_idx_list[-1] >= len(bases):
+            return []
+        return [[bases[idx], ""] for idx in read_idx_list]
+
+    base_list = []
+    start = 0
+    indel_match = INDEL_PATTERN.search(pileup_bases, start)
+    while indel_match is not None:
+        base_list += [[base, ""] for base in bases_from(pileup_bases[start:indel_match.start()])]
+        indel_start, indel_end = indel_match.end(), indel_match.end() + int(indel_match.group(1))
+        base_list[-1][1] = pileup_bases[indel_match.start()] + pileup_bases[indel_start:indel_end]  # add indel seq
+        start = indel_end
+        indel_match = INDEL_PATTERN.search(pileup_bases, start)
+    base_list += [[base, ""] for base in bases_from(pileup_bases[start:])]
+    if read_idx_list is None:
+        return base_list
+    if len(read_idx_list) and read_idx_list[-1] >= len(base_list):
+        return []
+    return [base_list[idx] for idx in read_idx_list]
+
+
+def bases_from(pileup_bases):
+    # a regex search is much faster than checking each char, most columns only have bases
+    if NON_BASE_PATTERN.search(pileup_bases) is None:
+        return pileup_bases
+    return NON_BASE_PATTERN.sub('', pileup_bases)
+
+
+def base_list_with_read_ends_from(pileup_bases, upper=False):
+    """
+    Same as base_list_from(), also return the indices in the base list of the read starts and read ends.
+    """
+    base_idx = 0
+    base_list = []
+    read_end_set = set()
+    read_start_set = set()
+    while base_idx < len(pileup_bases):
+        base = pileup_bases[base_idx].upper() if upper else pileup_bases[base_idx]
+        if base == '+' or base == '-':
+            indel_match = INDEL_PATTERN.match(pileup_bases, base_idx)
+            indel_start, indel_end = indel_match.end(), indel_match.end() + int(indel_match.group(1))
+            indel = pileup_bases[indel_start:indel_end]
+            base_list[-1][1] = base + (indel.upper() if upper else indel)  # add indel seq
+            base_idx = indel_end
+            continue
+        elif base in PILEUP_BASES:
+            base_list.append([base, ""])
+        elif base == '^':  # start of read, next base is mq
+            base_idx += 1
+            read_start_set.add(len(base_list) - 1)
+        elif base == '$':
+            read_end_set.add(len(base_list) - 1)
+        base_idx += 1
+    return base_list, read_start_set, read_end_set
+
+
+def allele_counter_from(base_list, quality_list=None, min_quality=0, strand=False):
+    """
+    Upper case allele ('A', 'A+CT', 'A-2NN', '*', ...) counts, only the bases with quality >= min_quality are counted if
+    quality_list is provided.
+    strand: also return the forward and reverse strand counts of each allele, the bases of the reverse strand reads are
+    lower case or '#'.
+    """
+    if quality_list is not None and min_quality > 0:
+        base_list = [item for item, quality in zip(base_list, quality_list) if quality >= min_quality]
+    allele_counter = Counter([(base + indel).upper() for base, indel in base_list])
+    if not strand:
+        return allele_counter
+    forward_counter = Counter([(base + indel).upper() for base, indel in base_list if base in FORWARD_BASES])
+    return allele_counter, forward_counter, allele_counter - forward_counter
+
+
+def hap_counts_from(base_list, phasing_info, allele):
+    """
+    Counts of the reads supporting the upper case allele and of all reads in each haplotype, [HP0, HP1, HP2] lists,
+    HP0 is the unphased reads.
+    """
+    hap_list = [0, 0, 0]
+    all_hap_list = [0, 0, 0]
+    for (base, indel), hap in zip(base_list, phasing_info):
+        hap = int(hap) if hap in ('1', '2') else 0
+        all_hap_list[hap] += 1
+        if (base + indel).upper() == allele:
+            hap_list[hap] += 1
+    return hap_list, all_hap_list
@@ -1,6 +1,8 @@
 import os
+import zlib
 
 from collections import defaultdict, namedtuple
+from itertools import repeat
 from os.path import abspath
 from sys import exit, stderr
 from subprocess import check_output, PIPE, Popen
@@ -240,6 +242,102 @@ def samtools_view_process_from(
         shlex.split("%s view -F 2318 %s %s" % (samtools, bam_file_path, region_str))
     )
 
+
+def is_cram_file(file_name):
+    return isinstance(file_name, str) and file_name.lower().endswith('.cram')
+
+
+def samtools_input_option_from(bam_fn, ref_fn=None, decode_threads=0):
+    """
+    samtools options to read an alignment file, the reference to decode a CRAM and the htslib decode threads.
+    """
+    input_option = ""
+    if is_cram_file(bam_fn) and ref_fn is not None:
+        input_option += " --reference {}".format(ref_fn)
+    if decode_threads is not None and decode_threads > 0:
+        input_option += " --input-fmt-option nthreads={}".format(decode_threads)
+    return input_option
+
+
+def ref_cache_from(ref_fn, cache_dir, contig_list=None):
+    """
+    Populate a htslib REF_CACHE folder (cache_dir/xx/yy/md5 of each contig sequence) with the contigs of contig_list, all
+    contigs if None, and return the REF_CACHE path template. Only the contigs not cached before from the same FASTA are
+    read, with the .fai offsets if the FASTA is not compressed. The contig files are written to a temporary file first
+    so that concurrent runs never read a partial one.
+    """
+    import gzip
+    import hashlib
+
+    ref_cache = os.path.join(cache_dir, '%2s', '%2s', '%s')
+    stat = os.stat(ref_fn)
+    done_prefix = os.path.join(cache_dir, '{}.{}.{}'.format(os.path.basename(ref_fn), stat.st_size, int(stat.st_mtime)))
+    contig_offset_dict = {}
+    fai_fn = ref_fn + '.fai'
+    if os.path.exists(fai_fn):
+        with open(fai_fn) as f:
+            for row in f:
+                columns = row.split('\t')
+                contig_offset_dict[columns[0]] = int(columns[2])
+
+    def is_required(ctg_name):
+        return (contig_list is None or ctg_name in contig_list) and not os.path.exists(
+            done_prefix + '.' + ctg_name + '.done')
+
+    contig_set = set([ctg_name for ctg_name in (contig_offset_dict if contig_list is None else contig_list) if
+                      is_required(ctg_name)])
+    if len(contig_set) == 0 and (contig_list is not None or len(contig_offset_dict)):
+        return ref_cache
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    tmp_fn = os.path.join(cache_dir, 'contig.{}.tmp'.format(os.getpid()))
+
+    def save_contig(ctg_name, rows):
+        md5 = hashlib.md5()
+        with open(tmp_fn, 'wb') as contig_fp:
+            for row in rows:
+                # same as the M5 tag, upper case sequence without whitespace
+                sequence = b''.join(row.split()).upper()
+                contig_fp.write(sequence)
+                md5.update(sequence)
+        md5_str = md5.hexdigest()
+        contig_dir = os.path.join(cache_dir, md5_str[:2], md5_str[2:4])
+        if not os.path.exists(contig_dir):
+            os.makedirs(contig_dir, exist_ok=True)
+        os.replace(tmp_fn, os.path.join(contig_dir, md5_str[4:]))
+        open(done_prefix + '.' + ctg_name + '.done', 'w').close()
+
+    next_header = [None]
+
+    def sequence_rows_from(ref_fp):
+        # sequence rows to the next contig header
+        for row in ref_fp:
+            if row[:1] == b'>':
+                next_header[0] = row
+                return
+            yield row
+        next_header[0] = None
+
+    ref_fp = gzip.open(ref_fn, 'rb') if ref_fn.endswith('.gz') else open(ref_fn, 'rb')
+    if not ref_fn.endswith('.gz') and all(ctg_name in contig_offset_dict for ctg_name in contig_set):
+        for ctg_name in sorted(contig_set, key=lambda x: contig_offset_dict[x]):
+            ref_fp.seek(contig_offset_dict[ctg_name])
+            save_contig(ctg_name, sequence_rows_from(ref_fp))
+    else:
+        # scan the whole FASTA, the contigs not required are skipped
+        next_header[0] = ref_fp.readline()
+        while next_header[0]:
+            ctg_name = next_header[0][1:].split()[0].decode()
+            sequence_rows = sequence_rows_from(ref_fp)
+            if is_required(ctg_name):
+                save_contig(ctg_name, sequence_rows)
+            else:
+                for _ in sequence_rows:
+                    pass
+    ref_fp.close()
+    return ref_cache
+
 class Position(object):
     def __init__(self, ctg_name=None,
                  genotype1=None,
@@ -352,4 +450,80 @@ class TensorStdout(object):
         self.stdin = handle
 
     def __del__(self):
-        self.stdin.close()
\ No newline at end of file
+        self.stdin.close()
+
+class ReadDownsampler(object):
+    """
+    Deterministic streaming read downsampling of a pileup, applied position by position while the pileup is read.
+    A read is kept or dropped when it first appears and keeps the decision for all the positions it covers, so a
+    kept read stays complete across a tensor window. At each position, the new reads fill at most the free slots below
+    max_depth left by the kept reads, those with the lowest hash of the read name first, which is reproducible across
+    runs, so the kept depth never exceeds max_depth while each read is seen at all the positions it covers. The decision
+    of a read is only forgotten once the read has not been seen for prune_interval positions, so a read missing at some
+    positions (e.g. a filtered base) is not decided again.
+    """
+
+    def __init__(self, max_depth, prune_interval=1000):
+        self.max_depth = max_depth
+        self.prune_interval = prune_interval
+        self.decision_dict = {}
+        self.last_seen_dict = {}
+        self.position_count = 0
+        self.downsampled_position_count = 0
+        self.total_depth = 0
+        self.kept_depth = 0
+        self.max_kept_depth = 0
+
+    def kept_indices_from(self, read_name_list):
+        """
+        Return the indices of the kept reads in read_name_list, None if all reads are kept.
+        """
+        decision_dict = self.decision_dict
+        new_read_idx_list = []
+        kept_idx_list = []
+        for idx, read_name in enumerate(read_name_list):
+            is_kept = decision_dict.get(read_name)
+            if is_kept is None:
+                new_read_idx_list.append(idx)
+            elif is_kept:
+                kept_idx_list.append(idx)
+
+        free_slots = max(self.max_depth - len(kept_idx_list), 0)
+        if len(new_read_idx_list) <= free_slots:
+            for idx in new_read_idx_list:
+                decision_dict[read_name_list[idx]] = True
+            kept_idx_list = sorted(kept_idx_list + new_read_idx_list)
+        else:
+            new_read_name_list = sorted(set([read_name_list[idx] for idx in new_read_idx_list]),
+                                        key=lambda read_name: (zlib.crc32(read_name.encode()) & 0xffffffff, read_name))
+            kept_read_name_set = set(new_read_name_list[:free_slots])
+            for idx in new_read_idx_list:
+                read_name = read_name_list[idx]
+                is_kept = read_name in kept_read_name_set
+                decision_dict[read_name] = is_kept
+                if is_kept:
+                    kept_idx_list.append(idx)
+            kept_idx_list.sort()
+
+        self.position_count += 1
+        self.total_depth += len(read_name_list)
+        self.kept_depth += len(kept_idx_list)
+        self.max_kept_depth = max(self.max_kept_depth, len(kept_idx_list))
+        self.last_seen_dict.update(zip(read_name_list, repeat(self.position_count)))
+        if self.position_count % self.prune_interval == 0:
+            # the reads not seen in the last prune interval have ended
+            min_position_count = self.position_count - self.prune_interval
+            self.last_seen_dict = dict((read_name, position_count) for read_name, position_count in
+                                       self.last_seen_dict.items() if position_count > min_position_count)
+            self.decision_dict = dict((read_name, decision_dict[read_name]) for read_name in self.last_seen_dict)
+
+        if len(kept_idx_list) == len(read_name_list):
+            return None
+        self.downsampled_position_count += 1
+        return kept_idx_list
+
+    def summary(self):
+        mean_depth = float(self.total_depth) / self.position_count if self.position_count else 0.0
+        mean_kept_depth = float(self.kept_depth) / self.position_count if self.position_count else 0.0
+        return "mean depth {:.1f}, effective mean depth {:.1f}, effective max depth {}, downsampled positions {}/{}".format(
+            mean_depth, mean_kept_depth, self.max_kept_depth, self.downsampled_position_count, self.position_count)
@@ -1,11 +1,20 @@
 import shlex
 import os
+import sys
 
 from textwrap import dedent
 from subprocess import run
+from shutil import which
 from collections import defaultdict
 
-from shared.utils import subprocess_popen, Position as Position, file_path_from
+try:
+    import numpy as np
+except ImportError:
+    # the pypy3 interpreter running most pipeline scripts may not ship numpy, only the columnar reader needs it
+    np = None
+
+from shared.utils import subprocess_popen, Position as Position, file_path_from, log_error
+from shared.bgzf import BgzfVcfWriter
 import shared.param as param
 
 caller_name = param.caller_name
@@ -48,6 +57,56 @@ vcf_header = dedent("""\
                     )
 
 
+def vcf_index_path_from(vcf_fn):
+    """
+    Return the tabix (.tbi) or CSI (.csi) index of a bgzipped VCF, None if the VCF is not indexed or the index is older
+    than the VCF.
+    """
+    if vcf_fn is None or not vcf_fn.endswith('.gz') or not os.path.exists(vcf_fn):
+        return None
+    for suffix in ('.tbi', '.csi'):
+        index_fn = vcf_fn + suffix
+        if os.path.exists(index_fn) and os.path.getmtime(index_fn) >= os.path.getmtime(vcf_fn):
+            return index_fn
+    return None
+
+
+def vcf_region_from(ctg_name, ctg_start=None, ctg_end=None):
+    if ctg_start is None or ctg_end is None:
+        return ctg_name
+    return "{}:{}-{}".format(ctg_name, max(1, int(ctg_start)), max(1, int(ctg_end)))
+
+
+def open_vcf_stream(vcf_fn, ctg_name=None, ctg_start=None, ctg_end=None, direct_open=False, include_header=True):
+    """
+    Open a VCF for reading and return (handle, stream), the handle needs to be closed (file) or waited (process) by
+    the caller. If a contig is provided and the VCF is indexed, only the contig or region is decompressed with a tabix
+    query, otherwise the whole VCF is decompressed. Rows outside the contig or region may still be returned, callers
+    are expected to keep their own contig and position checks.
+    """
+    if direct_open:
+        vcf_fp = open(vcf_fn)
+        return vcf_fp, vcf_fp
+
+    if ctg_name is not None and which('tabix') is not None and vcf_index_path_from(vcf_fn) is not None:
+        region = vcf_region_from(ctg_name, ctg_start, ctg_end)
+        tabix_option = "-h " if include_header else ""
+        if vcf_index_path_from(vcf_fn).endswith('.csi'):
+            tabix_option += "-C "
+        vcf_fp = subprocess_popen(shlex.split("tabix {}{} {}".format(tabix_option, vcf_fn, region)))
+    else:
+        vcf_fp = subprocess_popen(shlex.split("gzip -fdc %s" % (vcf_fn)))
+    return vcf_fp, vcf_fp.stdout
+
+
+def close_vcf_stream(vcf_fp):
+    if hasattr(vcf_fp, 'wait'):
+        vcf_fp.stdout.close()
+        vcf_fp.wait()
+    else:
+        vcf_fp.close()
+
+
 class TruthStdout(object):
     def __init__(self, handle):
         self.stdin = handle
@@ -65,7 +124,9 @@ class VcfWriter(object):
                  write_header=True,
                  header=None,
                  cmdline=None,
-                 show_ref_calls=False):
+                 show_ref_calls=False,
+                 compress_vcf=False,
+                 threads=1):
         self.vcf_fn = vcf_fn
         self.show_ref_calls = show_ref_calls
         # make directory if not exist
@@ -74,7 +135,11 @@ class VcfWriter(object):
             print("[INFO] Output VCF folder {} not found, create it".format(vcf_folder))
             return_code = run("mkdir -p {}".format(vcf_folder), shell=True)
 
-        self.vcf_writer = open(self.vcf_fn, 'w')
+        if compress_vcf:
+            # write BGZF blocks and build the tabix index in one pass, vcf_fn is expected to end with .gz
+            self.vcf_writer = BgzfVcfWriter(self.vcf_fn, threads=threads)
+        else:
+            self.vcf_writer = open(self.vcf_fn, 'w')
         self.ref_fn = ref_fn
         self.ctg_name = ctg_name
         if ctg_name is not None:
@@ -193,6 +258,70 @@ class VcfWriter(object):
         self.vcf_writer.write(vcf_format)
 
 
+class VcfRecordStore(object):
+    """
+    Columnar storage of the VCF records read with VcfReader(columnar=True). Contig, position, FILTER and AF are kept in
+    NumPy arrays and the raw rows are concatenated in a single buffer indexed by row offsets, so millions of records do
+    not need one Position object each.
+    """
+
+    def __init__(self):
+        self.contig_list = []
+        self.filter_list = []
+        self._contig_code_dict = {}
+        self._filter_code_dict = {}
+        self._columns = defaultdict(list)
+        self._row_list = []
+        self.row_buffer = ""
+        self.size = 0
+
+    def _code_from(self, value, code_dict, value_list):
+        if value not in code_dict:
+            code_dict[value] = len(value_list)
+            value_list.append(value)
+        return code_dict[value]
+
+    def append(self, ctg_name, pos, filter, af, row):
+        columns = self._columns
+        columns['contig_code'].append(self._code_from(ctg_name, self._contig_code_dict, self.contig_list))
+        columns['filter_code'].append(self._code_from(filter, self._filter_code_dict, self.filter_list))
+        columns['pos'].append(pos)
+        columns['af'].append(af)
+        columns['row_length'].append(len(row))
+        self._row_list.append(row)
+
+    def finalize(self):
+        columns = self._columns
+        self.contig_code = np.array(columns['contig_code'], dtype=np.int32)
+        self.filter_code = np.array(columns['filter_code'], dtype=np.int32)
+        self.pos = np.array(columns['pos'], dtype=np.int64)
+        self.af = np.array(columns['af'], dtype=np.float64)
+        self.row_end = np.cumsum(np.array(columns['row_length'], dtype=np.int64))
+        self.row_start = self.row_end - np.array(columns['row_length'], dtype=np.int64)
+        self.row_buffer = "".join(self._row_list)
+        self.size = len(self.pos)
+        self._columns = None
+        self._row_list = None
+        return self
+
+    def __len__(self):
+        return self.size
+
+    def row_str(self, idx):
+        return self.row_buffer[self.row_start[idx]:self.row_end[idx]]
+
+    def key_index(self, with_contig_key=True):
+        """
+        Record index of each (contig, position) key, or position key if with_contig_key is False, in the key order of
+        VcfReader.variant_dict. As in the dict, a later record of a duplicated key replaces the earlier one.
+        """
+        if with_contig_key:
+            keys = zip([self.contig_list[code] for code in self.contig_code.tolist()], self.pos.tolist())
+        else:
+            keys = self.pos.tolist()
+        return dict((key, idx) for idx, key in enumerate(keys))
+
+
 class VcfReader(object):
     def __init__(self, vcf_fn,
                  ctg_name=None,
@@ -213,7 +342,9 @@ class VcfReader(object):
                  max_qual=None,
                  discard_indel=False,
                  discard_multi=False,
-                 keep_af=False):
+                 keep_af=False,
+                 split_by_contig=False,
+                 columnar=False):
         self.vcf_fn = vcf_fn
         self.ctg_name = ctg_name
         self.ctg_start = ctg_start
@@ -236,6 +367,23 @@ class VcfReader(object):
         self.min_qual = min_qual
         self.max_qual = max_qual
         self.keep_af = keep_af
+        # single pass mode for callers processing all contigs, variants are split into one position keyed dict per
+        # contig, each of them is the same as the variant_dict of a reader with the contig as ctg_name
+        self.split_by_contig = split_by_contig and ctg_name is None
+        self.contig_variant_dict = defaultdict(lambda: defaultdict(Position))
+        # keep the records in a VcfRecordStore for callers reading the rows, FILTER and AF of a whole VCF, variant_dict
+        # is not filled and no record filter is applied in this mode
+        self.columnar = columnar and np is not None
+        self.record_store = None
+        if self.columnar and (self.split_by_contig or naf_filter is not None or taf_filter is not None or
+                              filter_tag is not None or min_qual is not None or max_qual is not None or discard_indel
+                              or discard_multi or (not show_ref and not skip_genotype)):
+            sys.exit(log_error("[ERROR] VcfReader(columnar=True) does not support record filters or split_by_contig"))
+
+    def contig_variants(self, ctg_name):
+        if self.split_by_contig:
+            return self.contig_variant_dict[ctg_name] if ctg_name in self.contig_variant_dict else defaultdict(Position)
+        return self.variant_dict
 
     def read_vcf(self):
         is_ctg_region_provided = self.ctg_start is not None and self.ctg_end is not None
@@ -243,13 +391,16 @@ class VcfReader(object):
         if self.vcf_fn is None or not os.path.exists(self.vcf_fn):
             return
 
+        if self.columnar:
+            self.read_vcf_columnar()
+            return
+
         header_last_column = []
-        if self.direct_open:
-            vcf_fp = open(self.vcf_fn)
-            vcf_fo = vcf_fp
-        else:
-            vcf_fp = subprocess_popen(shlex.split("gzip -fdc %s" % (self.vcf_fn)))
-            vcf_fo = vcf_fp.stdout
+        vcf_fp, vcf_fo = open_vcf_stream(self.vcf_fn,
+                                         ctg_name=self.ctg_name,
+                                         ctg_start=self.ctg_start if is_ctg_region_provided else None,
+                                         ctg_end=self.ctg_end if is_ctg_region_provided else None,
+                                         direct_open=self.direct_open)
         for row in vcf_fo:
             columns = row.strip().split()
             if columns[0][0] == "#":
@@ -348,19 +499,77 @@ class VcfReader(object):
                 continue
             extra_infos = columns[-1].split(':')[-1] if have_extra_infos else ''
             row_str = row if self.keep_row_str else False
-            key = (chromosome, position) if self.ctg_name is None else position
-
-            self.variant_dict[key] = Position(ctg_name=chromosome,
-                                              pos=position,
-                                              ref_base=reference,
-                                              alt_base=alternate,
-                                              genotype1=int(genotype_1),
-                                              genotype2=int(genotype_2),
-                                              qual=qual,
-                                              row_str=row_str,
-                                              af=taf,
-                                              filter=FILTER,
-                                              extra_infos=extra_infos)
+            if self.split_by_contig:
+                variant_dict, key = self.contig_variant_dict[chromosome], position
+            else:
+                variant_dict = self.variant_dict
+                key = (chromosome, position) if self.ctg_name is None else position
+
+            variant_dict[key] = Position(ctg_name=chromosome,
+                                         pos=position,
+                                         ref_base=reference,
+                                         alt_base=alternate,
+                                         genotype1=int(genotype_1),
+                                         genotype2=int(genotype_2),
+                                         qual=qual,
+                                         row_str=row_str,
+                                         af=taf,
+                                         filter=FILTER,
+                                         extra_infos=extra_infos)
+
+        close_vcf_stream(vcf_fp)
+
+    def read_vcf_columnar(self):
+        """
+        Read the contig, position, FILTER, AF and raw row of each VCF record into a VcfRecordStore.
+        """
+        is_ctg_region_provided = self.ctg_start is not None and self.ctg_end is not None
+        store = VcfRecordStore()
+        vcf_fp, vcf_fo = open_vcf_stream(self.vcf_fn,
+                                         ctg_name=self.ctg_name,
+                                         ctg_start=self.ctg_start if is_ctg_region_provided else None,
+                                         ctg_end=self.ctg_end if is_ctg_region_provided else None,
+                                         direct_open=self.direct_open)
+        for row in vcf_fo:
+            columns = row.strip().split()
+            if columns[0][0] == "#":
+                if self.save_header:
+                    self.header += row
+                continue
+
+            chromosome, position = columns[0], int(columns[1])
+            if self.ctg_name is not None and chromosome != self.ctg_name:
+                continue
+            if is_ctg_region_provided and not (self.ctg_start <= position <= self.ctg_end):
+                continue
+
+            # as VcfReader.read_vcf, a spanning deletion needs a 1/2 genotype and two alternatives
+            alternate = columns[4]
+            if '*' in alternate:
+                genotype = columns[-1].split(":")[0].replace("/", "|").replace(".", "0").split("|")
+                try:
+                    genotype_1, genotype_2 = genotype
+                    if int(genotype_1) + int(genotype_2) != 3 or len(alternate.split(',')) != 2:
+                        print('error with variant representation')
+                        continue
+                except ValueError:
+                    pass
+
+            af = np.nan
+            if self.keep_af and len(columns) > 9:
+                tag_list = columns[8].split(':')
+                if 'AF' in tag_list or 'VAF' in tag_list:
+                    taf_index = tag_list.index('AF') if 'AF' in tag_list else tag_list.index('VAF')
+                    af = float(columns[9].split(':')[taf_index])
+
+            store.append(ctg_name=chromosome,
+                         pos=position,
+                         filter=columns[6] if len(columns) >= 7 else None,
+                         af=af,
+                         row=row)
+
+        close_vcf_stream(vcf_fp)
+        self.record_store = store.finalize()
 
     def get_alt_info(self, pos, extra_info=""):
         pos = int(pos)
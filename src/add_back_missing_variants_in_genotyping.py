@@ -184,6 +184,80 @@ def decode_hybrid_info(candidates_folder):
                                                 tumor_alt_info=tumor_alt_info)
     return hybrid_info_dict
 
+def genotyping_row_from(k, row_str, hybrid_info_dict, switch_genotype):
+    if not switch_genotype:
+        return row_str
+    ref_base = None
+    normal_alt_info = None
+    tumor_alt_info = None
+    if k in hybrid_info_dict:
+        ref_base = hybrid_info_dict[k].ref_base
+        normal_alt_info = hybrid_info_dict[k].normal_alt_info
+        tumor_alt_info = hybrid_info_dict[k].tumor_alt_info
+
+    return switch_genotype_row(row_str,
+                               ref_base=ref_base,
+                               normal_alt_info=normal_alt_info,
+                               tumor_alt_info=tumor_alt_info)
+
+
+def stream_genotyping_vcf(genotyping_mode_vcf_fn, somatic_variant_dict, hybrid_info_dict, switch_genotype, output):
+    """
+    Write one row per known site in the order of the genotyping VCF, without loading and sorting the whole VCF.
+    The last row of a repeated site is kept as in the legacy path. Return (total sites, added sites), or None if the
+    genotyping VCF is not sorted by position and in the major_contigs_order of the sorted output, and the legacy path
+    is needed.
+    """
+    vcf_fp = subprocess_popen(shlex.split("gzip -fdc %s" % (genotyping_mode_vcf_fn)))
+    finished_contig_set = set()
+    last_ctg, last_pos, last_contig_rank = None, 0, 0
+    # rows of a site are adjacent in a sorted VCF, the site is written once the next site is reached
+    pending_site = None
+    total_count = 0
+    count = 0
+    is_sorted = True
+
+    def write_site(k, row):
+        if k not in somatic_variant_dict:
+            output.write(genotyping_row_from(k, row, hybrid_info_dict, switch_genotype))
+            return 1
+        output.write(somatic_variant_dict[k].row_str)
+        return 0
+
+    for row in vcf_fp.stdout:
+        columns = row.strip().split()
+        if not len(columns) or columns[0][0] == "#":
+            continue
+        k = (columns[0], int(columns[1]))
+        ctg, pos = k
+        if ctg != last_ctg:
+            # other contigs follow the major contigs in any order as in the sorted output
+            contig_rank = major_contigs_order.index(ctg) if ctg in major_contigs_order else len(major_contigs_order)
+            if ctg in finished_contig_set or contig_rank < last_contig_rank:
+                is_sorted = False
+                break
+            if last_ctg is not None:
+                finished_contig_set.add(last_ctg)
+            last_ctg, last_pos, last_contig_rank = ctg, 0, contig_rank
+        if pos < last_pos:
+            is_sorted = False
+            break
+        last_pos = pos
+        if pending_site is not None and pending_site[0] != k:
+            total_count += 1
+            count += write_site(*pending_site)
+        pending_site = (k, row)
+
+    vcf_fp.stdout.close()
+    vcf_fp.wait()
+    if not is_sorted:
+        return None
+    if pending_site is not None:
+        total_count += 1
+        count += write_site(*pending_site)
+    return total_count, count
+
+
 def genotype_vcf(args):
     genotyping_mode_vcf_fn = args.genotyping_mode_vcf_fn
     hybrid_mode_vcf_fn = args.hybrid_mode_vcf_fn
@@ -211,7 +285,23 @@ def genotype_vcf(args):
     if candidates_folder is not None and os.path.exists(candidates_folder):
         hybrid_info_dict = decode_hybrid_info(candidates_folder)
 
-    if genotyping_mode_vcf_fn is not None:
+    streamed_count = None
+    if genotyping_mode_vcf_fn is not None and args.genotyping_fast_path:
+        header_end = output.tell()
+        streamed_count = stream_genotyping_vcf(genotyping_mode_vcf_fn=genotyping_mode_vcf_fn,
+                                               somatic_variant_dict=somatic_variant_dict,
+                                               hybrid_info_dict=hybrid_info_dict,
+                                               switch_genotype=switch_genotype,
+                                               output=output)
+        if streamed_count is None:
+            print("[WARNING] Genotyping VCF {} is not sorted in the output order, load and sort all sites instead".format(genotyping_mode_vcf_fn))
+            output.seek(header_end)
+            output.truncate()
+
+    if streamed_count is not None:
+        total_count, count = streamed_count
+
+    elif genotyping_mode_vcf_fn is not None:
         vcf_reader = VcfReader(vcf_fn=genotyping_mode_vcf_fn,
                                ctg_name=None,
                                keep_row_str=True,
@@ -231,25 +321,13 @@ def genotype_vcf(args):
         for k, v in variant_dict.items():
             ctg, pos = k
             if k not in somatic_variant_dict:
-                row_str = variant_dict[k].row_str
                 count += 1
-                if switch_genotype:
-                    ref_base = None
-                    normal_alt_info = None
-                    tumor_alt_info = None
-                    if k in hybrid_info_dict:
-                        ref_base = hybrid_info_dict[k].ref_base
-                        normal_alt_info = hybrid_info_dict[k].normal_alt_info
-                        tumor_alt_info = hybrid_info_dict[k].tumor_alt_info
-
-                    row_str = switch_genotype_row(row_str,
-                                                  ref_base=ref_base,
-                                                  normal_alt_info=normal_alt_info,
-                                                  tumor_alt_info=tumor_alt_info,)
+                row_str = genotyping_row_from(k, variant_dict[k].row_str, hybrid_info_dict, switch_genotype)
             else:
                 row_str = somatic_variant_dict[k].row_str
 
             contig_dict[ctg].append((int(pos), row_str))
+        total_count = len(variant_dict)
 
         for contig in contigs_order_list:
             row_list = [item[1] for item in sorted(contig_dict[contig], key=lambda x: x[0])]
@@ -310,7 +388,7 @@ def genotype_vcf(args):
 
     if genotyping_mode_vcf_fn is not None:
         print("[INFO] Total variants for genotyping: {}, total somatic variant calls: {}, added {} variants into output VCF"\
-              .format(len(variant_dict), len(somatic_variant_dict), count))
+              .format(total_count, len(somatic_variant_dict), count))
     elif hybrid_mode_vcf_fn is not None:
         print("[INFO] Total additional variants for genotyping: {}, total somatic variant calls: {}, added {} variants into output VCF"\
               .format(len(variant_dict), len(somatic_variant_dict), count))
@@ -339,6 +417,9 @@ def main():
     parser.add_argument('--switch_genotype', type=str2bool, default=True,
                         help="Switch missed variant genotype to ./.")
 
+    parser.add_argument('--genotyping_fast_path', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Stream the sorted genotyping VCF in order instead of loading and sorting all sites")
+
     args = parser.parse_args()
 
     genotype_vcf(args)
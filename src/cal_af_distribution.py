@@ -31,6 +31,7 @@
 import sys
 import os
 import subprocess
+import tempfile
 import concurrent.futures
 
 from collections import Counter
@@ -40,62 +41,33 @@ from collections import defaultdict
 from shared.vcf import VcfReader
 import shared.param as param
 from shared.utils import str2bool
+from shared.pileup import base_list_from, allele_counter_from, hap_counts_from
+
+# truth variants closer than the gap are piled up by one samtools call, a window spans at most the max span
+AF_WINDOW_MAX_GAP = 100000
+AF_WINDOW_MAX_SPAN = 1000000
 
 def get_base_list(columns, args=None):
     if len(columns) < 5:
         return Counter(), []
     min_bq_cut = args.min_bq_cut if args is not None else 0
-    pileup_bases = columns[4]
-    base_idx = 0
-    base_list = []
+    base_list = base_list_from(columns[4])
     bq_list = [ord(qual) - 33 for qual in columns[5]]
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
-    upper_base_counter = Counter([''.join(item).upper() for item, bq in zip(base_list, bq_list) if bq >= min_bq_cut])
+    upper_base_counter = allele_counter_from(base_list, bq_list, min_bq_cut)
     return upper_base_counter, base_list
 
 
-def extract_base(POS):
-
+def af_result_from(POS, normal_columns, tumor_columns):
+    """
+    Normal and tumor depth, alt depth and tumor haplotype counts of a variant from its mpileup columns.
+    """
     pos = POS.pos
     ref_base = POS.reference_bases
     alt_base = POS.alternate_bases[0].upper()
     ctg_name = POS.ctg_name
 
-    normal_samtools_command_with_region = normal_samtools_command + ' -r {}:{}-{}'.format(ctg_name, pos, pos)
-    tumor_samtools_command_with_region = tumor_samtools_command + ' -r {}:{}-{}'.format(ctg_name, pos, pos)
-    #normal
-    output = subprocess.run(normal_samtools_command_with_region, shell=True, stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE, universal_newlines=True)
-    output = output.stdout.rstrip()
-    columns = output.split('\t')
-    base_counter, base_list = get_base_list(columns)
-
-    #tumor
-    tumor_output = subprocess.run(tumor_samtools_command_with_region, shell=True, stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE, universal_newlines=True)
-    tumor_output = tumor_output.stdout.rstrip()
-    columns = tumor_output.split('\t')
-    tumor_base_counter, tumor_base_list = get_base_list(columns)
+    base_counter, base_list = get_base_list(normal_columns)
+    tumor_base_counter, tumor_base_list = get_base_list(tumor_columns)
 
     match_alt_base = alt_base
     if len(ref_base) == 1 and len(alt_base) > 1:
@@ -107,14 +79,9 @@ def extract_base(POS):
 
     HAP_LIST = [0, 0, 0]
     ALL_HAP_LIST = [0, 0, 0]
-    if len(columns) >= 7:
-        phasing_info = columns[6].split(',')
-        for hap_idx, (b, hap) in enumerate(zip(tumor_base_list, phasing_info)):
-            if hap not in '12':
-                hap = 0
-            ALL_HAP_LIST[int(hap)] += 1
-            if ''.join(b).upper() == match_alt_base:
-                HAP_LIST[int(hap)] += 1
+    if len(tumor_columns) >= 7:
+        phasing_info = tumor_columns[6].split(',')
+        HAP_LIST, ALL_HAP_LIST = hap_counts_from(tumor_base_list, phasing_info, match_alt_base)
 
     HAP_LIST = " ".join([str(i) for i in HAP_LIST])
     ALL_HAP_LIST = " ".join([str(i) for i in ALL_HAP_LIST])
@@ -123,6 +90,51 @@ def extract_base(POS):
             HAP_LIST, ALL_HAP_LIST]
 
 
+def af_windows_from(variant_list, max_gap=AF_WINDOW_MAX_GAP, max_span=AF_WINDOW_MAX_SPAN):
+    """
+    Group the variants into [ctg_name, start, end, variant list] windows sorted by position.
+    """
+    windows = []
+    for POS in sorted(variant_list, key=lambda x: (x.ctg_name, x.pos)):
+        if len(windows) and windows[-1][0] == POS.ctg_name and POS.pos - windows[-1][2] <= max_gap \
+                and POS.pos - windows[-1][1] <= max_span:
+            windows[-1][2] = POS.pos
+            windows[-1][3].append(POS)
+        else:
+            windows.append([POS.ctg_name, POS.pos, POS.pos, [POS]])
+    return windows
+
+
+def pileup_columns_from(samtools_command, ctg_name, start, end):
+    """
+    mpileup columns of the variant positions in a window, keyed by position.
+    """
+    samtools_command_with_region = samtools_command + ' -r {}:{}-{} -l {}'.format(ctg_name, start, end,
+                                                                                  variant_positions_fn)
+    output = subprocess.run(samtools_command_with_region, shell=True, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    columns_dict = {}
+    for row in output.stdout.split('\n'):
+        columns = row.rstrip().split('\t')
+        if len(columns) < 2:
+            continue
+        columns_dict[int(columns[1])] = columns
+    return columns_dict
+
+
+def extract_window_bases(window):
+    """
+    Run one normal and one tumor pileup for all the variants in a window, only the variant positions are output.
+    """
+    ctg_name, start, end, variant_list = window
+    normal_columns_dict = pileup_columns_from(normal_samtools_command, ctg_name, start, end)
+    tumor_columns_dict = pileup_columns_from(tumor_samtools_command, ctg_name, start, end)
+    # same as the output of a position without coverage
+    no_coverage_columns = ['']
+    return [af_result_from(POS, normal_columns_dict.get(POS.pos, no_coverage_columns),
+                           tumor_columns_dict.get(POS.pos, no_coverage_columns)) for POS in variant_list]
+
+
 class INFO():
     def __init__(self):
         self.normal_base_counter = None
@@ -200,24 +212,34 @@ def cal_af(args, truth_variant_dict=None, input_variant_dict=None):
                                                                                           min_bq,
                                                                                           phasing_option)
 
-    global normal_samtools_command, tumor_samtools_command
+    global normal_samtools_command, tumor_samtools_command, variant_positions_fn
     normal_samtools_command = samtools_command + args.normal_bam_fn
     tumor_samtools_command = samtools_command + args.tumor_bam_fn
 
+    # positions list for mpileup -l, the pileup of a window only outputs the variant positions
+    windows = af_windows_from(list(variant_dict.values()))
+    with tempfile.NamedTemporaryFile('w', suffix='.positions', delete=False) as f:
+        variant_positions_fn = f.name
+        for ctg_name, start, end, variant_list in windows:
+            f.write(''.join(['{}\t{}\n'.format(ctg_name, POS.pos) for POS in variant_list]))
+
     total_num = 0
-    print("[INFO] Total truth need to calculate AF: {}".format(len(variant_dict)))
-
-    with concurrent.futures.ProcessPoolExecutor(max_workers=args.threads) as exec:
-        for result in exec.map(extract_base, list(variant_dict.values())):
-            total_num += 1
-            if total_num % 1000 == 0 and total_num > 0:
-                print("[INFO] Total processed positions: {}".format(total_num))
-            if result is not None:
-                ctg_name, pos, normal_depth, tumor_depth, normal_alt_depth, tumor_alt_depth, HAP_LIST, ALL_HAP_LIST = result
-                k = (ctg_name, int(pos))
-                results_dict[k] = ctg_name, pos, normal_depth, tumor_depth, normal_alt_depth, tumor_alt_depth, HAP_LIST, ALL_HAP_LIST
-                if output_path is not None:
-                    output_file.write(' '.join(str(item) for item in result) + '\n')
+    print("[INFO] Total truth need to calculate AF: {}, pileup windows: {}".format(len(variant_dict), len(windows)))
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.threads) as exec:
+            for window_results in exec.map(extract_window_bases, windows):
+                for result in window_results:
+                    total_num += 1
+                    if total_num % 1000 == 0 and total_num > 0:
+                        print("[INFO] Total processed positions: {}".format(total_num))
+                    ctg_name, pos, normal_depth, tumor_depth, normal_alt_depth, tumor_alt_depth, HAP_LIST, ALL_HAP_LIST = result
+                    k = (ctg_name, int(pos))
+                    results_dict[k] = ctg_name, pos, normal_depth, tumor_depth, normal_alt_depth, tumor_alt_depth, HAP_LIST, ALL_HAP_LIST
+                    if output_path is not None:
+                        output_file.write(' '.join(str(item) for item in result) + '\n')
+    finally:
+        os.remove(variant_positions_fn)
 
     if output_path is not None:
         output_file.close()
@@ -35,6 +35,8 @@ from argparse import ArgumentParser
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__))))
 from numpy import *
 
+from shared.utils import str2bool
+
 file_directory = os.path.dirname(os.path.realpath(__file__))
 entry_path = os.path.join(file_directory, 'verdict')
 
@@ -99,8 +101,15 @@ def get_logr_baf_command(args):
     command += f'--tumor_baf_output_file {args.output_dir}/{args.tumor_sample_name}_Tumor_BAF.txt '
     command += f'--normal_baf_output_file {args.output_dir}/{args.normal_sample_name}_Normal_BAF.txt '
     command += f'--sample_name {args.tumor_sample_name} '
-    command += f'--normal_sample_name {args.normal_sample_name}'
+    command += f'--normal_sample_name {args.normal_sample_name} '
     command += f'--contig_fn {args.contig_fn}'
+    if args.builtin_allele_counter:
+        command += f' --tumor_bam_fn {args.tumor_bam_fn} '
+        command += f'--normal_bam_fn {args.normal_bam_fn} '
+        command += f'--samtools {args.samtools} '
+        command += f'--ref_fn {args.ref_fn} ' if args.ref_fn is not None else ''
+        command += f'--decode_threads {args.decode_threads} ' if args.decode_threads else ''
+        command += f'--threads {args.threads if args.threads else 1}'
 
     return command
 
@@ -135,6 +144,7 @@ def create_aspcf_command(args):
     command += f'--tumor_logr_pcfed_output_file {args.output_dir}/{args.tumor_sample_name}_Tumor_LogR_PCFed.txt '
     command += f'--tumor_baf_pcfed_output_file {args.output_dir}/{args.tumor_sample_name}_Tumor_BAF_PCFed.txt '
     command += f'--penalty 1000 '
+    command += f'--threads {args.threads if args.threads else 1} '
     command += f'--sample_name {args.tumor_sample_name}'
 
     return command
@@ -164,6 +174,33 @@ def tag_germline_variant(args):
     return command
 
 
+def run_verdict_command(args):
+    command = f'time {args.python} {args.verdict}/run_verdict.py '
+    if args.builtin_allele_counter:
+        command += f'--tumor_bam_fn {args.tumor_bam_fn} '
+        command += f'--normal_bam_fn {args.normal_bam_fn} '
+        command += f'--samtools {args.samtools} '
+        command += f'--ref_fn {args.ref_fn} ' if args.ref_fn is not None else ''
+        command += f'--decode_threads {args.decode_threads} ' if args.decode_threads else ''
+    else:
+        command += f'--tumor_allele_counts_file_prefix {args.output_dir}/{args.tumor_sample_name}_AlleleCount_ '
+        command += f'--normal_allele_counts_file_prefix {args.output_dir}/{args.normal_sample_name}_AlleleCount_ '
+    command += f'--alleles_file_prefix {args.cnv_resource_dir}/allele_files/G1000_alleles_hg38_ '
+    command += f'--gc_content_file {args.cnv_resource_dir}/GC_G1000_hg38.txt '
+    command += f'--replication_timing_file {args.cnv_resource_dir}/RT_G1000_hg38.txt '
+    command += f'--contig_fn {args.contig_fn} '
+    command += f'--input_vcf_fn {args.input_vcf_fn} '
+    command += f'--output_fn {args.output_fn} '
+    command += f'--tumor_purity_ploidy_output_file {args.output_dir}/{args.tumor_sample_name}_Tumor_Purity_Ploidy.txt '
+    command += f'--tumor_cna_output_file {args.output_dir}/{args.tumor_sample_name}_Tumor_CNA.txt '
+    command += f'--probe_table_fn {args.output_dir}/{args.tumor_sample_name}_Probe_Table.npz '
+    command += f'--penalty 1000 '
+    command += f'--threads {args.threads if args.threads else 1} '
+    command += f'--sample_name {args.tumor_sample_name}'
+
+    return command
+
+
 def get_cnv_purity(args):
 
     args.verdict = args.verdict if args.verdict else entry_path
@@ -182,6 +219,12 @@ def get_cnv_purity(args):
     tg_command = tag_germline_variant(args)
 
     commands_list = (tac_command, nac_command, glb_command, cl_command, pgg_command, ca_command, cvra_command, tg_command)
+    if args.in_memory:
+        # all steps after the allele counting run in one process on a shared probe table
+        commands_list = (tac_command, nac_command, run_verdict_command(args))
+    if args.builtin_allele_counter:
+        # the alleles are counted in the LogR and BAF step
+        commands_list = commands_list[2:]
     for i, command in enumerate(zip(commands_list)):
 
         print(f"[INFO] STEP {i} RUN THE FOLLOWING COMMAND FOR CNV GERMLINE TAGGING:")
@@ -242,12 +285,27 @@ def main():
     parser.add_argument('--allele_counter', type=str, default=None,
                         help="Directory of allele counter")
 
+    parser.add_argument('--builtin_allele_counter', type=str2bool, default=False,
+                        help="Count the alleles of both BAMs with samtools in the LogR and BAF step instead of alleleCounter")
+
+    parser.add_argument('--in_memory', type=str2bool, default=False,
+                        help="Run the steps after the allele counting in one process on a shared probe table instead of a step per script")
+
+    parser.add_argument('--samtools', type=str, default='samtools',
+                        help="Absolute path of samtools, samtools version >= 1.10 is required")
+
+    parser.add_argument('--ref_fn', type=str, default=None,
+                        help="Reference fasta file input, required for CRAM inputs of the built-in allele counter")
+
     parser.add_argument('--cnv_resource_dir', type=str, default=None,
                         help="Reference resource of CNV directory")
 
     parser.add_argument('--threads', type=int, default=None,
                         help="Threads to use")
 
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="htslib threads of each samtools to decode a BAM/CRAM in the built-in allele counter")
+
     parser.add_argument('--verdict', type=str, default=None,
                         help="Path of entry path")
 
@@ -30,12 +30,17 @@
 
 import os
 import sys
+import copy
+import shlex
 import subprocess
+import concurrent.futures
+from bisect import bisect_left
+from shutil import which
 from argparse import ArgumentParser, SUPPRESS
 
 from collections import defaultdict
 from shared.utils import str2bool, str_none
-from shared.vcf import VcfReader, VcfWriter
+from shared.vcf import VcfReader, VcfWriter, vcf_index_path_from
 from shared.interval_tree import bed_tree_from, is_region_in
 from shared.utils import file_path_from
 from src.cal_af_distribution import cal_af
@@ -54,6 +59,17 @@ def cal_metrics(tp, fp, fn):
     return round(precision, 4), round(recall, 4), round(f1_score, 4)
 
 
+def qual_sweep_from(fp_qual_list, tp_qual_list, cut_off_list):
+    """
+    Count the FP and TP with QUAL >= cut-off for every cut-off in a single sort, return a list of (cut-off, TP, FP)
+    in the order of cut_off_list.
+    """
+    fp_qual_list = sorted(fp_qual_list)
+    tp_qual_list = sorted(tp_qual_list)
+    return [(cut_off, len(tp_qual_list) - bisect_left(tp_qual_list, cut_off),
+             len(fp_qual_list) - bisect_left(fp_qual_list, cut_off)) for cut_off in cut_off_list]
+
+
 def output_best_cut_off(fp_qual_dict, tp_qual_dict, fn_count, use_int_cut_off=True, add_tp_fn=False):
     results = []
     if use_int_cut_off:
@@ -61,9 +77,7 @@ def output_best_cut_off(fp_qual_dict, tp_qual_dict, fn_count, use_int_cut_off=Tr
     else:
         qual_list = [item / 100.0 for item in range(0, 101)]
 
-    for qual in qual_list:
-        fp_snv = sum([1 for k, v in fp_qual_dict.items() if v >= qual])
-        tp_snv = sum([1 for k, v in tp_qual_dict.items() if v >= qual])
+    for qual, tp_snv, fp_snv in qual_sweep_from(fp_qual_dict.values(), tp_qual_dict.values(), qual_list):
         fn_snv = fn_count + len(tp_qual_dict) - tp_snv
         snv_pre, snv_rec, snv_f1 = cal_metrics(tp=tp_snv, fp=fp_snv, fn=fn_snv)
         tp_fn = tp_snv + fn_snv
@@ -72,12 +86,74 @@ def output_best_cut_off(fp_qual_dict, tp_qual_dict, fn_count, use_int_cut_off=Tr
     results = sorted(results, key=lambda x: x[3], reverse=True)
     return results
 
-def compare_vcf(args):
+
+def caller_qual_dict_from(args, variant_set, input_variant_dict):
+    """
+    Score of each variant used for the ROC curve, the QUAL or the caller specific score.
+    """
+    caller = args.caller.lower() if args.caller is not None else None
+    qual_dict = {}
+    for key in variant_set:
+        if caller == 'strelka2':
+            somaticEVC = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
+            qual = float(somaticEVC.split('=')[1])
+        elif caller == 'mutect2':
+            TLOD = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
+            qual = float(TLOD.split('=')[1])
+        elif caller == 'somaticsniper':
+            SSC = input_variant_dict[key].row_str.split('\t')[10].split(':')[-1]
+            qual = float(SSC)
+        elif caller == 'varnet':
+            SCORE = input_variant_dict[key].row_str.split('\t')[7].split(';')[1]
+            qual = float(SCORE.split('=')[1])
+        else:
+            qual = float(input_variant_dict[key].qual)
+        qual_dict[key] = qual
+    return qual_dict
+
+
+class BenchmarkResult(object):
+    """
+    Counts and variant sets of a benchmark, results of per-contig shards are merged with merge().
+    """
+
+    count_names = ['tp_snv', 'tp_ins', 'tp_del', 'fp_snv', 'fp_ins', 'fp_del', 'fn_snv', 'fn_ins', 'fn_del',
+                   'input_count', 'truth_count', 'pos_out_of_bed']
+    set_names = ['fp_set', 'fn_set', 'fp_fn_set', 'tp_set']
+    dict_names = ['fp_qual_dict', 'tp_qual_dict', 'fp_roc_qual_dict', 'tp_roc_qual_dict', 'row_str_dict']
+
+    def __init__(self):
+        for name in self.count_names:
+            setattr(self, name, 0)
+        for name in self.set_names:
+            setattr(self, name, set())
+        for name in self.dict_names:
+            setattr(self, name, {})
+
+    def with_contig_key(self, contig):
+        """
+        Convert the position keys of a single contig benchmark into (contig, position) keys.
+        """
+        for name in self.set_names:
+            setattr(self, name, set([(contig, key) for key in getattr(self, name)]))
+        for name in self.dict_names:
+            setattr(self, name, dict([((contig, key), value) for key, value in getattr(self, name).items()]))
+        return self
+
+    def merge(self, other):
+        for name in self.count_names:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name in self.set_names:
+            getattr(self, name).update(getattr(other, name))
+        for name in self.dict_names:
+            getattr(self, name).update(getattr(other, name))
+
+
+def benchmark_from(args):
     """
     Follow how som.py works
     ## https://github.com/Illumina/hap.py/blob/master/doc/sompy.md
     """
-    output_fn = args.output_fn
     output_dir = args.output_dir
     truth_vcf_fn = args.truth_vcf_fn
     input_vcf_fn = args.input_vcf_fn
@@ -87,17 +163,16 @@ def compare_vcf(args):
     skip_genotyping = args.skip_genotyping
     input_filter_tag = args.input_filter_tag
     truth_filter_tag = args.truth_filter_tag
-    discard_fn_out_of_fp_bed = args.discard_fn_out_of_fp_bed
     benchmark_indel = args.benchmark_indel
 
-    fp_bed_tree = bed_tree_from(bed_file_path=bed_fn, contig_name=ctg_name)
+    fp_bed_tree = bed_tree_from(bed_file_path=bed_fn, contig_name=ctg_name, cache_dir=args.bed_cache_dir)
     strat_bed_tree_list = []
 
     if args.strat_bed_fn is not None and ',' in args.strat_bed_fn:
         for strat_bed_fn in args.strat_bed_fn.split(','):
-            strat_bed_tree_list.append(bed_tree_from(bed_file_path=strat_bed_fn, contig_name=ctg_name))
+            strat_bed_tree_list.append(bed_tree_from(bed_file_path=strat_bed_fn, contig_name=ctg_name, cache_dir=args.bed_cache_dir))
     elif args.strat_bed_fn is not None:
-        strat_bed_tree_list = [bed_tree_from(bed_file_path=args.strat_bed_fn, contig_name=ctg_name)]
+        strat_bed_tree_list = [bed_tree_from(bed_file_path=args.strat_bed_fn, contig_name=ctg_name, cache_dir=args.bed_cache_dir)]
 
     truth_vcf_fn = file_path_from(file_name=truth_vcf_fn, exit_on_not_found=True, allow_none=False)
     input_vcf_fn = file_path_from(file_name=input_vcf_fn, exit_on_not_found=True, allow_none=False)
@@ -149,6 +224,8 @@ def compare_vcf(args):
             fp = [item.rstrip().split(' ') for item in fp]
             for row in fp:
                 ctg, pos, normal_cov, tumor_cov, normal_alt, tumor_alt, *hap_info = row
+                if args.ctg_name is not None and ctg != args.ctg_name:
+                    continue
                 result_dict[ctg, int(pos)] = ctg, pos, normal_cov, tumor_cov, normal_alt, tumor_alt, hap_info
 
         for k, v in result_dict.items():
@@ -221,11 +298,6 @@ def compare_vcf(args):
             if "PASS;HighConf" not in row:
                 low_qual_truth.add(key)
 
-    if output_fn:
-        output_file = open(output_fn, 'w')
-    else:
-        output_file = None
-
     for key in list(input_variant_dict.keys()):
         pos = key if args.ctg_name is not None else key[1]
         contig = args.ctg_name if args.ctg_name is not None else key[0]
@@ -290,7 +362,6 @@ def compare_vcf(args):
 
 
     tp_snv, tp_ins, tp_del, fp_snv, fp_ins, fp_del, fn_snv, fn_ins, fn_del, fp_snv_truth, fp_ins_truth, fp_del_truth = 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
-    truth_set = set()
     truth_snv, truth_ins, truth_del = 0, 0, 0
     query_snv, query_ins, query_del = 0, 0, 0
     pos_out_of_bed = 0
@@ -301,7 +372,15 @@ def compare_vcf(args):
     tp_set = set()
     fp_qual_dict = defaultdict(float)
     tp_qual_dict = defaultdict(float)
-    for key, vcf_infos in input_variant_dict.items():
+    # merge-join of the input and truth variants sorted by key, a truth variant is marked once matched
+    truth_item_list = sorted(truth_variant_dict.items(), key=lambda x: x[0])
+    is_truth_matched_list = [False] * len(truth_item_list)
+    truth_idx = 0
+    for key, vcf_infos in sorted(input_variant_dict.items(), key=lambda x: x[0]):
+        while truth_idx < len(truth_item_list) and truth_item_list[truth_idx][0] < key:
+            truth_idx += 1
+        is_in_truth = truth_idx < len(truth_item_list) and truth_item_list[truth_idx][0] == key
+
         pos = key if args.ctg_name is not None else key[1]
         contig = args.ctg_name if args.ctg_name is not None else key[0]
         pass_bed_region = len(fp_bed_tree) == 0 or is_region_in(tree=fp_bed_tree,
@@ -330,7 +409,7 @@ def compare_vcf(args):
         is_ins = len(ref_base) < len(alt_base)
         is_del = len(ref_base) > len(alt_base)
 
-        if key not in truth_variant_dict and genotype != (0, 0):
+        if not is_in_truth and genotype != (0, 0):
             fp_snv = fp_snv + 1 if is_snv else fp_snv
             fp_ins = fp_ins + 1 if is_ins else fp_ins
             fp_del = fp_del + 1 if is_del else fp_del
@@ -341,8 +420,8 @@ def compare_vcf(args):
                 fp_set.add(key)
                 fp_qual_dict[key] = qual
 
-        if key in truth_variant_dict:
-            vcf_infos = truth_variant_dict[key]
+        if is_in_truth:
+            vcf_infos = truth_item_list[truth_idx][1]
             truth_ref_base = vcf_infos.reference_bases
             truth_alt_base = vcf_infos.alternate_bases[0]
             truth_genotype = vcf_infos.genotype
@@ -382,9 +461,9 @@ def compare_vcf(args):
                 if benchmark_indel and (is_ins_truth or is_del_truth):
                     fp_fn_set.add(key)
 
-            truth_set.add(key)
+            is_truth_matched_list[truth_idx] = True
 
-    for key, vcf_infos in truth_variant_dict.items():
+    for (key, vcf_infos), is_truth_matched in zip(truth_item_list, is_truth_matched_list):
         pos = key if args.ctg_name is not None else key[1]
         contig = args.ctg_name if args.ctg_name is not None else key[0]
         pass_bed_region = len(fp_bed_tree) == 0 or is_region_in(tree=fp_bed_tree,
@@ -392,7 +471,7 @@ def compare_vcf(args):
                                                                 region_start=pos - 1,
                                                                 region_end=pos)
 
-        if key in truth_set:
+        if is_truth_matched:
             continue
         if not pass_bed_region:
             continue
@@ -422,8 +501,91 @@ def compare_vcf(args):
         if benchmark_indel and (is_ins_truth or is_del_truth):
             fn_set.add(key)
 
-    truth_indel = truth_ins + truth_del
-    query_indel = query_ins + query_del
+    result = BenchmarkResult()
+    result.tp_snv, result.tp_ins, result.tp_del = tp_snv, tp_ins, tp_del
+    result.fp_snv, result.fp_ins, result.fp_del = fp_snv, fp_ins, fp_del
+    result.fn_snv, result.fn_ins, result.fn_del = fn_snv, fn_ins, fn_del
+    result.input_count, result.truth_count = len(input_variant_dict), len(truth_variant_dict)
+    result.pos_out_of_bed = pos_out_of_bed
+    result.fp_set, result.fn_set, result.fp_fn_set, result.tp_set = fp_set, fn_set, fp_fn_set, tp_set
+    result.fp_qual_dict, result.tp_qual_dict = dict(fp_qual_dict), dict(tp_qual_dict)
+    if args.roc_fn:
+        result.fp_roc_qual_dict = caller_qual_dict_from(args, fp_set, input_variant_dict)
+        result.tp_roc_qual_dict = caller_qual_dict_from(args, tp_set, input_variant_dict)
+    if output_dir is not None:
+        for key in fp_set | fn_set | fp_fn_set | tp_set:
+            if key in input_variant_dict:
+                result.row_str_dict[key] = input_variant_dict[key].row_str
+            elif key in truth_variant_dict:
+                result.row_str_dict[key] = truth_variant_dict[key].row_str
+    return result
+
+
+def benchmark_contig(args, contig):
+    contig_args = copy.copy(args)
+    contig_args.ctg_name = contig
+    return benchmark_from(contig_args).with_contig_key(contig)
+
+
+def vcf_contigs_from(vcf_fn):
+    """
+    Contigs of a tabix indexed VCF, None if the VCF is not indexed.
+    """
+    if vcf_fn is None or which('tabix') is None or vcf_index_path_from(vcf_fn) is None:
+        return None
+    tabix_option = "-C " if vcf_index_path_from(vcf_fn).endswith('.csi') else ""
+    try:
+        output = subprocess.check_output(shlex.split("tabix {}-l {}".format(tabix_option, vcf_fn)),
+                                         universal_newlines=True)
+    except subprocess.CalledProcessError:
+        return None
+    return [contig for contig in output.split('\n') if contig != ""]
+
+
+def benchmark_contigs_from(args):
+    """
+    Contigs to benchmark in parallel, None if the benchmark needs to run in a single process: a contig is given,
+    one thread, the VCFs are not indexed, or options with whole genome inputs are used.
+    """
+    if args.ctg_name is not None or args.threads <= 1:
+        return None
+    if args.min_af is not None or args.validate_phase_only is not None:
+        return None
+    truth_contigs = vcf_contigs_from(args.truth_vcf_fn)
+    input_contigs = vcf_contigs_from(args.input_vcf_fn)
+    if truth_contigs is None or input_contigs is None:
+        return None
+    return sorted(set(truth_contigs + input_contigs), key=lambda x: (x not in major_contigs_order,
+                  major_contigs_order.index(x) if x in major_contigs_order else x))
+
+
+def compare_vcf(args):
+    contigs = benchmark_contigs_from(args)
+    if contigs is None:
+        result = benchmark_from(args)
+    else:
+        # each shard only decompresses its own contig with a tabix query
+        result = BenchmarkResult()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.threads) as executor:
+            for contig_result in executor.map(benchmark_contig, [args] * len(contigs), contigs):
+                result.merge(contig_result)
+
+    output_benchmark(args, result)
+
+
+def output_benchmark(args, result):
+    output_fn = args.output_fn
+    output_dir = args.output_dir
+    tp_snv, tp_ins, tp_del = result.tp_snv, result.tp_ins, result.tp_del
+    fp_snv, fp_ins, fp_del = result.fp_snv, result.fp_ins, result.fp_del
+    fn_snv, fn_ins, fn_del = result.fn_snv, result.fn_ins, result.fn_del
+    fp_set, fn_set, fp_fn_set, tp_set = result.fp_set, result.fn_set, result.fp_fn_set, result.tp_set
+
+    if output_fn:
+        output_file = open(output_fn, 'w')
+    else:
+        output_file = None
+
     tp_indel = tp_ins + tp_del
     fp_indel = fp_ins + fp_del
     fn_indel = fn_ins + fn_del
@@ -431,9 +593,9 @@ def compare_vcf(args):
     snv_pre, snv_rec, snv_f1 = cal_metrics(tp=tp_snv, fp=fp_snv, fn=fn_snv)
 
     print("\n")
-    print("[INFO] Total input records: {}, truth records: {}, records out of BED:{}".format(len(input_variant_dict),
-                                                                                            len(truth_variant_dict),
-                                                                                            pos_out_of_bed))
+    print("[INFO] Total input records: {}, truth records: {}, records out of BED:{}".format(result.input_count,
+                                                                                            result.truth_count,
+                                                                                            result.pos_out_of_bed))
     add_tp_fn = False
     tp_fn = 'TP+FN' if add_tp_fn else ""
     tp_fn_count = tp_snv + fn_snv if add_tp_fn else ""
@@ -456,7 +618,7 @@ def compare_vcf(args):
               file=output_file)
 
     if args.output_best_f1_score:
-        results = output_best_cut_off(fp_qual_dict, tp_qual_dict, len(fn_set), use_int_cut_off=args.use_int_cut_off,
+        results = output_best_cut_off(result.fp_qual_dict, result.tp_qual_dict, len(fn_set), use_int_cut_off=args.use_int_cut_off,
                                       add_tp_fn=add_tp_fn)
         best_match = results[0].copy()
         best_match[0] = 'SNV(Best F1)'
@@ -468,76 +630,21 @@ def compare_vcf(args):
 
         if args.debug:
             print("")
-            for result in results:
+            for cut_off_result in results:
                 print(''.join(
                     [str(item).ljust(13) if idx >= 4 or idx == 0 else ('%.4f' % item).ljust(13) for idx, item in
-                     enumerate(result)]),
+                     enumerate(cut_off_result)]),
                     file=output_file)
 
     if args.roc_fn:
-        if args.caller is None:
-            fp_dict = dict([(key, float(input_variant_dict[key].qual)) for key in fp_set])
-            tp_dict = dict([(key, float(input_variant_dict[key].qual)) for key in tp_set])
-        elif args.caller.lower() == 'strelka2':
-            fp_dict = {}
-            for key in fp_set:
-                somaticEVC = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
-                qual = float(somaticEVC.split('=')[1])
-                fp_dict[key] = qual
-            tp_dict = {}
-            for key in tp_set:
-                somaticEVC = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
-                qual = float(somaticEVC.split('=')[1])
-                tp_dict[key] = qual
-
-        elif args.caller.lower() == 'mutect2':
-            fp_dict = {}
-            for key in fp_set:
-                TLOD = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
-                qual = float(TLOD.split('=')[1])
-                fp_dict[key] = qual
-            tp_dict = {}
-            for key in tp_set:
-                TLOD = input_variant_dict[key].row_str.split('\t')[7].split(';')[-1]
-                qual = float(TLOD.split('=')[1])
-                tp_dict[key] = qual
-
-        elif args.caller.lower() == 'somaticsniper':
-            fp_dict = {}
-            for key in fp_set:
-                SSC = input_variant_dict[key].row_str.split('\t')[10].split(':')[-1]
-                qual = float(SSC)
-                fp_dict[key] = qual
-            tp_dict = {}
-            for key in tp_set:
-                SSC = input_variant_dict[key].row_str.split('\t')[10].split(':')[-1]
-                qual = float(SSC)
-                tp_dict[key] = qual
-
-        elif args.caller.lower() == 'varnet':
-            fp_dict = {}
-            for key in fp_set:
-                SCORE = input_variant_dict[key].row_str.split('\t')[7].split(';')[1]
-                qual = float(SCORE.split('=')[1])
-                fp_dict[key] = qual
-            tp_dict = {}
-            for key in tp_set:
-                SCORE = input_variant_dict[key].row_str.split('\t')[7].split(';')[1]
-                qual = float(SCORE.split('=')[1])
-                tp_dict[key] = qual
-
-        else:
-            fp_dict = dict([(key, float(input_variant_dict[key].qual)) for key in fp_set])
-            tp_dict = dict([(key, float(input_variant_dict[key].qual)) for key in tp_set])
-
+        fp_dict, tp_dict = result.fp_roc_qual_dict, result.tp_roc_qual_dict
         qual_list = sorted([float(qual) for qual in fp_dict.values()] + [qual for qual in tp_dict.values()],
                            reverse=True)
 
         tp_count = len(tp_set)
         roc_fn = open(args.roc_fn, 'w')
-        for qual_cut_off in set(qual_list):
-            pass_fp_count = sum([1 if float(qual) >= qual_cut_off else 0 for key, qual in fp_dict.items()])
-            pass_tp_count = sum([1 if float(qual) >= qual_cut_off else 0 for key, qual in tp_dict.items()])
+        for qual_cut_off, pass_tp_count, pass_fp_count in qual_sweep_from(fp_dict.values(), tp_dict.values(),
+                                                                          set(qual_list)):
             fn_count = tp_count - pass_tp_count + fn_snv
             tmp_pre, tmp_rec, tmp_f1 = cal_metrics(tp=pass_tp_count, fp=pass_fp_count, fn=fn_count)
             roc_fn.write('\t'.join([str(round(item, 4)) for item in [qual_cut_off, tmp_pre, tmp_rec, tmp_f1]]) + '\n')
@@ -569,14 +676,10 @@ def compare_vcf(args):
             vcf_fn = os.path.join(output_dir, '{}.vcf'.format(vcf_type))
             vcf_writer = VcfWriter(vcf_fn=vcf_fn, ctg_name=args.ctg_name, write_header=False)
             for key in variant_set:
-                if key in input_variant_dict:
-                    vcf_infos = input_variant_dict[key]
-                elif key in truth_variant_dict:
-                    vcf_infos = truth_variant_dict[key]
-                else:
+                if key not in result.row_str_dict:
                     continue
 
-                vcf_writer.write_row(row_str=vcf_infos.row_str)
+                vcf_writer.write_row(row_str=result.row_str_dict[key])
             vcf_writer.close()
     if output_fn:
         output_file.close()
@@ -591,6 +694,9 @@ def main():
     parser.add_argument('--bed_fn', type=str, default=None,
                         help="High confident BED region for benchmarking")
 
+    parser.add_argument('--bed_cache_dir', type=str, default=None,
+                        help="EXPERIMENTAL: Folder to cache the parsed BED index across runs of the same BED, default: disabled")
+
     parser.add_argument('--input_vcf_fn', type=str, default=None,
                         help="Input VCF filename")
 
@@ -45,7 +45,13 @@ def Run(args):
         import clairs.utils as utils
     utils.setup_environment()
     logging.info("Loading the dataset ...")
-    
+
+    # parallel sharding and bin layout options are only supported by the full-alignment bin writer
+    bin_kwargs = dict(threads=args.threads,
+                      complib=args.complib,
+                      complevel=args.complevel,
+                      chunk_rows=args.chunk_rows,
+                      store_read_rows=args.store_read_rows) if args.normal_tensor_fn is not None and not args.pileup else {}
     utils.get_training_array(
         args=args,
         normal_tensor_fn=args.normal_tensor_fn,
@@ -59,7 +65,8 @@ def Run(args):
         chunk_num=args.chunk_num,
         pileup=args.pileup,
         platform=args.platform,
-        merge_bins=args.merge_bins)
+        merge_bins=args.merge_bins,
+        **bin_kwargs)
     logging.info("Finish!")
 
 
@@ -90,6 +97,21 @@ def main():
     parser.add_argument('--allow_duplicate_chr_pos', action='store_true',
                         help="Allow duplicated chromosome:position in the tensor input")
 
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Number of processes to shard the tensor files across, the shard bins are merged into --bin_fn, default: %(default)s")
+
+    parser.add_argument('--complib', type=str, default='blosc:lz4hc',
+                        help="PyTables compressor of the output bin, default: %(default)s")
+
+    parser.add_argument('--complevel', type=int, default=5,
+                        help="Compression level of the output bin, default: %(default)s")
+
+    parser.add_argument('--chunk_rows', type=int, default=None,
+                        help="Number of tensors per HDF5 chunk of the output bin, default: chosen by PyTables")
+
+    parser.add_argument('--store_read_rows', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Store the unpadded normal and tumor read rows of each candidate, the tumor purity and depth are sampled at training time with train.py --purity_mixing, default: %(default)s")
+
     # options for internal process control
     ## In pileup mode or not (full alignment mode), default: False
     parser.add_argument('--pileup', action='store_true',
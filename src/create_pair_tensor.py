@@ -41,8 +41,9 @@ from collections import Counter, defaultdict, OrderedDict
 
 import shared.param as param
 from shared.utils import subprocess_popen, file_path_from, IUPAC_base_to_num_dict as BASE2NUM, region_from, \
-    reference_sequence_from, str2bool, vcf_candidates_from
+    reference_sequence_from, str2bool, samtools_input_option_from, vcf_candidates_from, ReadDownsampler
 from shared.interval_tree import bed_tree_from, is_region_in
+from shared.pileup import base_list_from
 
 from src.create_tensor import NORMAL_HAP_TYPE, TUMOR_HAP_TYPE, normalize_bq, normalize_mq, ACGT_NUM, \
     STRAND_0, STRAND_1, get_chunk_id
@@ -59,12 +60,14 @@ HAP_TYPE = dict(zip((1, 0, 2), (30, 60, 90)))  # hap1 UNKNOWN H2
 
 class Position(object):
     def __init__(self, pos, ref_base=None, alt_base=None, read_name_list=None, base_list=None, raw_base_quality=None,
-                 raw_mapping_quality=None, af=None, depth=None, genotype=None, phase_set=None):
+                 raw_mapping_quality=None, af=None, depth=None, genotype=None, phase_set=None, all_base_list=None):
         self.pos = pos
         self.ref_base = ref_base
         self.alt_base = alt_base
         self.read_name_list = read_name_list
         self.base_list = base_list
+        # base list of all reads if the reads are downsampled, for the alt info
+        self.all_base_list = all_base_list
         self.raw_base_quality = raw_base_quality
         self.raw_mapping_quality = raw_mapping_quality
         self.af = af
@@ -192,7 +195,8 @@ def decode_pileup_bases(pos,
                         has_pileup_candidates,
                         candidates_type_dict,
                         is_tumor,
-                        platform="ont"):
+                        platform="ont",
+                        read_idx_list=None):
     """
     Decode mpileup input string.
     pileup_bases: pileup base string for each position, include all mapping information.
@@ -202,36 +206,23 @@ def decode_pileup_bases(pos,
     reference_sequence: reference sequence index by contig:start-end. 0-based.
     minimum_af_for_candidate: default minimum alleic frequency for candidate filtering, filter if below specific thredshold.
     has_pileup_candidates: if the candidate is directly obtained from pileup output, then no need to check the af filtering.
+    read_idx_list: indices of the reads kept by the read downsampling, None to keep all reads. All reads are only
+    decoded at the candidates, the depth, af and alt info are calculated from all reads.
+    Return the base list of the kept reads, the base list of all reads if the reads are downsampled and all reads are
+    decoded (None otherwise), depth, pass_af and af.
     """
 
-    base_idx = 0
-    base_list = []
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
-    if has_pileup_candidates:
-        if pos not in candidates_type_dict or not is_tumor:
-            return base_list, None, True, 1.0
+    is_candidate = pos in candidates_type_dict
+    if has_pileup_candidates and not is_candidate:
+        return base_list_from(pileup_bases, read_idx_list=read_idx_list), None, None, True, 1.0
+    all_base_list = base_list_from(pileup_bases)
+    base_list = all_base_list if read_idx_list is None else [all_base_list[idx] for idx in read_idx_list if
+                                                             idx < len(all_base_list)]
+    all_base_list = all_base_list if read_idx_list is not None else None
+    if has_pileup_candidates and not is_tumor:
+        return base_list, all_base_list, None, True, 1.0
     pileup_dict = defaultdict(int)
-    base_counter = Counter([''.join(item) for item in base_list])
+    base_counter = Counter([''.join(item) for item in (base_list if all_base_list is None else all_base_list)])
     depth = 0
     for key, count in base_counter.items():
         if key[0].upper() in 'ACGT':
@@ -270,7 +261,7 @@ def decode_pileup_bases(pos,
 
     pass_af = pass_snv_af or pass_indel_af
 
-    return base_list, depth, pass_af, af
+    return base_list, all_base_list, depth, pass_af, af
 
 
 def get_alt_info(center_pos, pileup_dict, ref_seq, reference_sequence, reference_start, hap_dict):
@@ -416,7 +407,8 @@ def generate_tensor(args,
     reverse_ref_count = 0
     forward_depth = 0
     reverse_depth = 0
-    for base, indel in pileup_dict[center_pos].base_list:
+    all_base_list = pileup_dict[center_pos].all_base_list
+    for base, indel in pileup_dict[center_pos].base_list if all_base_list is None else all_base_list:
         if base == "*":
             forward_depth += 1
             continue
@@ -570,6 +562,7 @@ def create_pair_tensor(args):
     phase_tumor = args.phase_tumor if args.phase_tumor is not None else param.phase_tumor[platform]
     is_known_vcf_file_provided = vcf_fn is not None
     tensor_sample_mode = args.tensor_sample_mode
+    downsample_reads = args.downsample_reads and not tensor_sample_mode
     candidates_pos_set = set()
     candidates_type_dict = defaultdict(str)
     add_read_regions = True
@@ -676,10 +669,12 @@ def create_pair_tensor(args):
     samtools_command = "{} mpileup --reverse-del".format(samtools_execute_command) + \
                        output_read_name_option + output_mq_option + reads_regions_option + mq_option + bq_option + bed_option + flags_option + max_depth_option
     samtools_mpileup_normal_process = subprocess_popen(
-        shlex.split(samtools_command + ' ' + nomral_phasing_option + ' ' + normal_bam_file_path), stderr=PIPE)
+        shlex.split(samtools_command + ' ' + nomral_phasing_option + samtools_input_option_from(
+            normal_bam_file_path, fasta_file_path, args.decode_threads) + ' ' + normal_bam_file_path), stderr=PIPE)
 
     samtools_mpileup_tumor_process = subprocess_popen(
-        shlex.split(samtools_command + ' ' + tumor_phasing_option + ' ' + tumor_bam_file_path), stderr=PIPE)
+        shlex.split(samtools_command + ' ' + tumor_phasing_option + samtools_input_option_from(
+            tumor_bam_file_path, fasta_file_path, args.decode_threads) + ' ' + tumor_bam_file_path), stderr=PIPE)
 
     if tensor_can_output_path != "PIPE":
         tensor_can_fpo = open(tensor_can_output_path, "wb")
@@ -704,12 +699,20 @@ def create_pair_tensor(args):
                                     bed_ctg_start=extend_start,
                                     bed_ctg_end=extend_end)
 
+    normal_read_downsampler, tumor_read_downsampler = None, None
+    if downsample_reads:
+        normal_read_downsampler = ReadDownsampler(
+            max_depth=param.normal_matrix_depth_dict[platform] * param.downsample_depth_headroom)
+        tumor_read_downsampler = ReadDownsampler(
+            max_depth=param.tumor_matrix_depth_dict[platform] * param.downsample_depth_headroom)
+
     def samtools_pileup_generator_from(samtools_mpileup_process, is_tumor=True, phasing_info_in_bam=False):
         candidate_pos_list = sorted(list(candidates_pos_set))
         current_pos_index = 0
         has_pileup_candidates = len(candidates_pos_set)
         pileup_dict = tumor_pileup_dict if is_tumor else normal_pileup_dict
         hap_dict = tumor_hap_dict if is_tumor else normal_hap_dict
+        read_downsampler = tumor_read_downsampler if is_tumor else normal_read_downsampler
 
         for row in samtools_mpileup_process.stdout:  # chr position N depth seq BQ read_name mapping_quality phasing_info
             columns = row.strip().split('\t')
@@ -728,14 +731,24 @@ def create_pair_tensor(args):
             reference_base = reference_sequence[pos - reference_start].upper()
             if reference_base not in 'ACGT':
                 continue
-            base_list, depth, pass_af, af = decode_pileup_bases(pos=pos,
-                                                                pileup_bases=pileup_bases,
-                                                                reference_base=reference_base,
-                                                                minimum_snv_af_for_candidate=minimum_snv_af_for_candidate,
-                                                                minimum_indel_af_for_candidate=minimum_indel_af_for_candidate,
-                                                                has_pileup_candidates=has_pileup_candidates,
-                                                                candidates_type_dict=candidates_type_dict,
-                                                                is_tumor=is_tumor)
+            # the reads are downsampled before the decoding, the depth, af and alt info are kept from all reads
+            read_num = len(read_name_list)
+            kept_idx_list = read_downsampler.kept_indices_from(read_name_list) if read_downsampler is not None else None
+            base_list, all_base_list, depth, pass_af, af = decode_pileup_bases(pos=pos,
+                                                                               pileup_bases=pileup_bases,
+                                                                               reference_base=reference_base,
+                                                                               minimum_snv_af_for_candidate=minimum_snv_af_for_candidate,
+                                                                               minimum_indel_af_for_candidate=minimum_indel_af_for_candidate,
+                                                                               has_pileup_candidates=has_pileup_candidates,
+                                                                               candidates_type_dict=candidates_type_dict,
+                                                                               is_tumor=is_tumor,
+                                                                               read_idx_list=kept_idx_list)
+            if all_base_list is not None and len(all_base_list) != read_num:
+                continue
+            if kept_idx_list is not None:
+                read_name_list = [read_name_list[idx] for idx in kept_idx_list]
+                raw_base_quality = ''.join([raw_base_quality[idx] for idx in kept_idx_list])
+                raw_mapping_quality = ''.join([raw_mapping_quality[idx] for idx in kept_idx_list])
 
             if platform == 'ilmn':
                 for b_idx, base in enumerate(base_list):
@@ -746,9 +759,11 @@ def create_pair_tensor(args):
 
             if phasing_info_in_bam:
                 phasing_info = columns[8].split(',')
-                if len(read_name_list) != len(phasing_info):
+                if read_num != len(phasing_info):
                     continue
                 else:
+                    if kept_idx_list is not None:
+                        phasing_info = [phasing_info[idx] for idx in kept_idx_list]
                     for hap_idx, hap in enumerate(phasing_info):
                         if hap in '12' and read_name_list[hap_idx] not in hap_dict:
                             hap_dict[read_name_list[hap_idx]] = int(hap)
@@ -770,7 +785,8 @@ def create_pair_tensor(args):
                                         raw_base_quality=raw_base_quality,
                                         raw_mapping_quality=raw_mapping_quality,
                                         af=af,
-                                        depth=depth)
+                                        depth=depth,
+                                        all_base_list=all_base_list)
 
             if current_pos_index < len(candidate_pos_list) and pos - candidate_pos_list[
                 current_pos_index] > extend_bp_distance:
@@ -862,6 +878,9 @@ def create_pair_tensor(args):
 
     chunk_info = get_chunk_id(candidates_bed_regions)
     print("[INFO] {} {} Tensors generated: {}".format(ctg_name, chunk_info, tensor_count))
+    if downsample_reads:
+        print("[INFO] {} {} Normal read downsampling: {}".format(ctg_name, chunk_info, normal_read_downsampler.summary()))
+        print("[INFO] {} {} Tumor read downsampling: {}".format(ctg_name, chunk_info, tumor_read_downsampler.summary()))
 
 
 def main():
@@ -916,6 +935,12 @@ def main():
     parser.add_argument('--max_depth', type=int, default=None,
                         help="EXPERIMENTAL: Maximum full alignment depth to be processed. default: %(default)s")
 
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
+    parser.add_argument('--downsample_reads', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Downsample the reads while the pileup is read, keep up to %d times the tensor depth at each position. default: %%(default)s" % param.downsample_depth_headroom)
+
     # options for debug purpose
     parser.add_argument('--extend_bed', nargs='?', action="store", type=str, default=None,
                         help="DEBUG: Extend the regions in the --bed_fn by a few bp for tensor creation, default extend 16bp")
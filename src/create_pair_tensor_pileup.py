@@ -39,8 +39,9 @@ from collections import Counter, defaultdict
 
 import shared.param as param
 from shared.utils import subprocess_popen, file_path_from, IUPAC_base_to_num_dict as BASE2NUM, region_from, \
-    reference_sequence_from, str2bool, vcf_candidates_from
+    reference_sequence_from, str2bool, samtools_input_option_from, vcf_candidates_from, ReadDownsampler
 from shared.interval_tree import bed_tree_from, is_region_in
+from shared.pileup import base_list_from
 from src.create_tensor import get_chunk_id
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
@@ -92,7 +93,8 @@ def decode_pileup_bases(args,
                         base_quality,
                         phasing_info=None,
                         chunk_ref_seq=None,
-                        platform="ont"):
+                        platform="ont",
+                        read_idx_list=None):
     """
     Decode mpileup input string.
     pileup_bases: pileup base string for each position, include all mapping information.
@@ -102,34 +104,17 @@ def decode_pileup_bases(args,
     reference_sequence: reference sequence index by contig:start-end. 0-based.
     minimum_af_for_candidate: default minimum alleic frequency for candidate filtering, filter if below specific thredshold.
     has_pileup_candidates: if the candidate is directly obtained from pileup output, then no need to check the af filtering.
+    read_idx_list: indices of the reads kept by the read downsampling, only these reads are decoded, None to keep all
+    reads.
     """
 
-    base_idx = 0
-    base_list = []
+    base_list = base_list_from(pileup_bases, read_idx_list=read_idx_list)
+    if read_idx_list is not None:
+        mapping_quality = [mapping_quality[idx] for idx in read_idx_list]
+        base_quality = [base_quality[idx] for idx in read_idx_list]
+        phasing_info = [phasing_info[idx] for idx in read_idx_list] if phasing_info is not None else None
     pileup_tensor = [0] * (channel_size if phasing_info is None else (channel_size + len(phase_channel)))
     is_candidate = pos in candidates_type_dict
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
-
     pileup_dict = defaultdict(int)
     base_counter = Counter([''.join(item) for item, mq in zip(base_list, mapping_quality) if mq >= 20])
     low_mq_base_counter = Counter([''.join(item) for item, mq in zip(base_list, mapping_quality) if mq < 20])
@@ -322,6 +307,56 @@ def get_normal_set(alt_fn):
     file_path_process.wait()
     return normal_pos_set
 
+def fetch_windows_from(pos_list, flanking_size, max_gap):
+    """
+    Group the sorted 1-based sites into 1-based [start, end] fetch windows, a site covers [pos - flanking_size,
+    pos + flanking_size] and windows closer than max_gap are merged.
+    """
+    window_list = []
+    for pos in pos_list:
+        start, end = max(pos - flanking_size, 1), pos + flanking_size
+        if len(window_list) and start - window_list[-1][1] <= max_gap:
+            window_list[-1][1] = max(window_list[-1][1], end)
+            continue
+        window_list.append([start, end])
+    return window_list
+
+
+def samtools_mpileup_rows_from(samtools_command, bam_fn, ctg_name, window_list):
+    """
+    Yield the mpileup rows of each fetch window in turn, only the windows are read from the indexed BAM.
+    """
+    for start, end in window_list:
+        samtools_mpileup_process = subprocess_popen(
+            shlex.split(samtools_command + ' -r {} {}'.format(region_from(ctg_name=ctg_name, ctg_start=start, ctg_end=end),
+                                                              bam_fn)), stderr=PIPE)
+        for row in samtools_mpileup_process.stdout:
+            yield row
+        samtools_mpileup_process.stdout.close()
+        samtools_mpileup_process.wait()
+
+
+def hybrid_alt_info_from(base_list, mapping_quality, min_mapping_quality):
+    """
+    Return the genotyping alt info of a known site, "depth-allele count ..." with the read counts of the reads passing
+    min_mapping_quality, as written by extract_pair_candidates.
+    """
+    pileup_dict = defaultdict(int)
+    depth = 0
+    for key, count in Counter([''.join(item) for item, mq in zip(base_list, mapping_quality) if mq >= min_mapping_quality]).items():
+        if key[0].upper() in 'ACGT':
+            pileup_dict[key[0].upper()] += count
+            depth += count
+        elif key[0] in "#*":
+            depth += count
+        if len(key) > 1 and key[1] == '+':
+            pileup_dict['I'] += count
+        elif len(key) > 1 and key[1] == '-':
+            pileup_dict['D'] += count
+    pileup_list = sorted(list(pileup_dict.items()), key=lambda x: x[1], reverse=True)
+    return str(depth) + '-' + ' '.join([' '.join([item[0], str(item[1])]) for item in pileup_list])
+
+
 def heapq_merge_generator_from(normal_bam_pileup_generator, tumor_bam_pileup_generator, skip_if_normal_empty=True):
     normal_candidates_set = set()
     tumor_candidates_set = set()
@@ -371,9 +406,12 @@ def create_tensor(args):
     is_extend_bed_file_given = extend_bed is not None
     min_mapping_quality = args.min_mq
     min_base_quality = args.min_bq if args.min_bq is not None else param.min_bq_dict[platform]
+    downsample_reads = args.downsample_reads
     vcf_fn = args.vcf_fn
     is_known_vcf_file_provided = vcf_fn is not None
     phasing_info_in_bam = args.phase_tumor and args.platform == 'ont'
+    # the candidates are the known genotyping sites, read the BAMs around them only and keep their hybrid information
+    genotyping_fast_path = args.genotyping_fast_path and candidates_bed_regions is not None
     args.max_indel_length = param.max_indel_length if args.max_indel_length is None else args.max_indel_length
 
     candidates_pos_set = set()
@@ -472,7 +510,8 @@ def create_tensor(args):
     samtools_view_min_mq = 0
     # mq_option = ' --min-MQ {}'.format(min_mapping_quality)
     mq_option = ' --min-MQ {}'.format(samtools_view_min_mq)
-    output_mq, output_read_name = True, False
+    # the read names are only required by the read downsampling
+    output_mq, output_read_name = True, downsample_reads
     output_mq_option = ' --output-MQ ' if output_mq else ""
     output_read_name_option = ' --output-QNAME ' if output_read_name else ""
     bq_option = ' --min-BQ {}'.format(min_base_quality)
@@ -488,11 +527,26 @@ def create_tensor(args):
 
     samtools_command = "{} mpileup --reverse-del".format(samtools_execute_command) + \
                        output_read_name_option + output_mq_option + reads_regions_option + mq_option + bq_option + bed_option + flags_option + max_depth_option
-    samtools_mpileup_normal_process = subprocess_popen(
-        shlex.split(samtools_command + normal_phasing_option + ' ' + normal_bam_file_path), stderr=PIPE)
+    normal_input_option = normal_phasing_option + samtools_input_option_from(normal_bam_file_path, fasta_file_path,
+                                                                              args.decode_threads)
+    tumor_input_option = tumor_phasing_option + samtools_input_option_from(tumor_bam_file_path, fasta_file_path,
+                                                                           args.decode_threads)
+    if genotyping_fast_path:
+        fetch_window_list = fetch_windows_from(sorted(candidates_pos_set), no_of_positions, param.genotyping_max_fetch_gap)
+        window_samtools_command = samtools_command.replace(reads_regions_option, '', 1) if add_read_regions else samtools_command
+        samtools_mpileup_normal_process, samtools_mpileup_tumor_process = None, None
+        normal_mpileup_rows = samtools_mpileup_rows_from(window_samtools_command + normal_input_option,
+                                                         normal_bam_file_path, ctg_name, fetch_window_list)
+        tumor_mpileup_rows = samtools_mpileup_rows_from(window_samtools_command + tumor_input_option,
+                                                        tumor_bam_file_path, ctg_name, fetch_window_list)
+    else:
+        samtools_mpileup_normal_process = subprocess_popen(
+            shlex.split(samtools_command + normal_input_option + ' ' + normal_bam_file_path), stderr=PIPE)
 
-    samtools_mpileup_tumor_process = subprocess_popen(
-        shlex.split(samtools_command + tumor_phasing_option + ' ' + tumor_bam_file_path), stderr=PIPE)
+        samtools_mpileup_tumor_process = subprocess_popen(
+            shlex.split(samtools_command + tumor_input_option + ' ' + tumor_bam_file_path), stderr=PIPE)
+        normal_mpileup_rows = samtools_mpileup_normal_process.stdout
+        tumor_mpileup_rows = samtools_mpileup_tumor_process.stdout
 
 
     if tensor_can_output_path != "PIPE":
@@ -513,15 +567,27 @@ def create_tensor(args):
 
     normal_alt_info_dict = defaultdict()
     tumor_alt_info_dict = defaultdict()
-
-    def samtools_pileup_generator_from(samtools_mpileup_process, is_tumor=True):
+    normal_hybrid_info_dict = defaultdict(str)
+    tumor_hybrid_info_dict = defaultdict(str)
+    hybrid_ref_base_dict = {}
+
+    normal_read_downsampler, tumor_read_downsampler = None, None
+    if downsample_reads:
+        normal_read_downsampler = ReadDownsampler(
+            max_depth=param.normal_matrix_depth_dict[platform] * param.downsample_depth_headroom)
+        tumor_read_downsampler = ReadDownsampler(
+            max_depth=param.tumor_matrix_depth_dict[platform] * param.downsample_depth_headroom)
+
+    def samtools_pileup_generator_from(mpileup_rows, is_tumor=True):
         candidate_pos_list = sorted(list(candidates_pos_set))
         current_pos_index = 0
         has_pileup_candidates = len(candidates_pos_set)
+        read_downsampler = tumor_read_downsampler if is_tumor else normal_read_downsampler
         alt_info_dict = tumor_alt_info_dict if is_tumor else normal_alt_info_dict
         pileup_tensors = tumor_pileup_tensors if is_tumor else normal_pileup_tensors
+        hybrid_info_dict = tumor_hybrid_info_dict if is_tumor else normal_hybrid_info_dict
 
-        for row in samtools_mpileup_process.stdout:  # chr position N depth seq BQ read_name mapping_quality phasing_info
+        for row in mpileup_rows:  # chr position N depth seq BQ read_name mapping_quality phasing_info
             columns = row.strip().split('\t')
             pos = int(columns[1])
             # pos that near bed region should include some indel cover in bed
@@ -542,30 +608,42 @@ def create_tensor(args):
             base_quality = [ord(mq) - 33 for mq in raw_base_quality]
 
             if phasing_info_in_bam and is_tumor:
-                phasing_info = columns[7].split(',')
+                phasing_info = columns[8 if output_read_name else 7].split(',')
             else:
                 phasing_info = None
 
             chunk_ref_seq = reference_sequence[pos - reference_start: pos - reference_start + args.max_indel_length].upper()
 
-            pileup_tensor, base_list, depth, pass_af, af, alt_info = decode_pileup_bases(args=args,
-                                                                                         pos=pos,
-                                                                                         pileup_bases=pileup_bases,
-                                                                                         reference_base=reference_base,
-                                                                                         minimum_snp_af_for_candidate=minimum_snp_af_for_candidate,
-                                                                                         minimum_indel_af_for_candidate=minimum_indel_af_for_candidate,
-                                                                                         has_pileup_candidates=has_pileup_candidates,
-                                                                                         candidates_type_dict=candidates_type_dict,
-                                                                                         mapping_quality=mapping_quality,
-                                                                                         base_quality=base_quality,
-                                                                                         phasing_info=phasing_info,
-                                                                                         chunk_ref_seq=chunk_ref_seq,
-                                                                                         is_tumor=is_tumor)
+            decode_kwargs = dict(args=args,
+                                 pos=pos,
+                                 pileup_bases=pileup_bases,
+                                 reference_base=reference_base,
+                                 minimum_snp_af_for_candidate=minimum_snp_af_for_candidate,
+                                 minimum_indel_af_for_candidate=minimum_indel_af_for_candidate,
+                                 has_pileup_candidates=has_pileup_candidates,
+                                 candidates_type_dict=candidates_type_dict,
+                                 mapping_quality=mapping_quality,
+                                 base_quality=base_quality,
+                                 phasing_info=phasing_info,
+                                 chunk_ref_seq=chunk_ref_seq,
+                                 is_tumor=is_tumor)
+            # the tensor is built from the reads kept by the downsampling, which are the only reads decoded except at
+            # the candidates, the af and alt info are calculated from all reads
+            kept_idx_list = read_downsampler.kept_indices_from(columns[7].split(',')) if read_downsampler is not None \
+                else None
+            pileup_tensor, base_list, depth, pass_af, af, alt_info = decode_pileup_bases(read_idx_list=kept_idx_list,
+                                                                                         **decode_kwargs)
+            if kept_idx_list is not None and (not has_pileup_candidates or pos in candidates_type_dict or
+                                              pos in candidates_pos_set):
+                _, base_list, depth, pass_af, af, alt_info = decode_pileup_bases(**decode_kwargs)
 
             offset = pos - extend_start
             pileup_tensors[offset] = pileup_tensor
             if pos in candidates_type_dict:
                 alt_info_dict[pos] = alt_info
+            if genotyping_fast_path and pos in candidates_pos_set:
+                hybrid_info_dict[pos] = hybrid_alt_info_from(base_list, mapping_quality, min_mapping_quality)
+                hybrid_ref_base_dict[pos] = reference_base
 
             if not is_known_vcf_file_provided and not has_pileup_candidates and reference_base in 'ACGT' and (
                     pass_af and depth >= min_coverage):
@@ -583,8 +661,8 @@ def create_tensor(args):
             yield (candidate_pos_list[current_pos_index], is_tumor)
             current_pos_index += 1
 
-    normal_bam_pileup_generator = samtools_pileup_generator_from(samtools_mpileup_process=samtools_mpileup_normal_process,is_tumor=False)
-    tumor_bam_pileup_generator = samtools_pileup_generator_from(samtools_mpileup_process=samtools_mpileup_tumor_process)
+    normal_bam_pileup_generator = samtools_pileup_generator_from(mpileup_rows=normal_mpileup_rows, is_tumor=False)
+    tumor_bam_pileup_generator = samtools_pileup_generator_from(mpileup_rows=tumor_mpileup_rows)
 
     tensor_count = 0
     for pos in heapq_merge_generator_from(normal_bam_pileup_generator=normal_bam_pileup_generator, tumor_bam_pileup_generator=tumor_bam_pileup_generator):
@@ -624,10 +702,17 @@ def create_tensor(args):
                 variant_type)
             tensor_can_fp.stdin.write(tensor)
             tensor_count += 1
-    samtools_mpileup_normal_process.stdout.close()
-    samtools_mpileup_normal_process.wait()
-    samtools_mpileup_tumor_process.stdout.close()
-    samtools_mpileup_tumor_process.wait()
+    if not genotyping_fast_path:
+        samtools_mpileup_normal_process.stdout.close()
+        samtools_mpileup_normal_process.wait()
+        samtools_mpileup_tumor_process.stdout.close()
+        samtools_mpileup_tumor_process.wait()
+    else:
+        # read by add_back_missing_variants_in_genotyping for the known sites without calls
+        with open(candidates_bed_regions + '_hybrid_info', 'w') as output_file:
+            for pos in sorted(hybrid_ref_base_dict.keys()):
+                output_file.write('\t'.join([ctg_name, str(pos), hybrid_ref_base_dict[pos], normal_hybrid_info_dict[pos],
+                                             tumor_hybrid_info_dict[pos]]) + '\n')
     if tensor_can_output_path != "PIPE":
         tensor_can_fp.stdin.close()
         tensor_can_fp.wait()
@@ -635,6 +720,9 @@ def create_tensor(args):
 
     chunk_info = get_chunk_id(candidates_bed_regions)
     print("[INFO] {} {} Tensors generated: {}".format(ctg_name, chunk_info, tensor_count))
+    if downsample_reads:
+        print("[INFO] {} {} Normal read downsampling: {}".format(ctg_name, chunk_info, normal_read_downsampler.summary()))
+        print("[INFO] {} {} Tumor read downsampling: {}".format(ctg_name, chunk_info, tumor_read_downsampler.summary()))
 
 
 def main():
@@ -689,7 +777,13 @@ def main():
     parser.add_argument('--max_depth', type=int, default=None,
                         help="EXPERIMENTAL: Maximum full alignment depth to be processed. default: %(default)s")
 
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
     # options for debug purpose
+    parser.add_argument('--downsample_reads', type=str2bool, default=False,
+                        help="EXPERIMENTAL: Downsample the reads while the pileup is read, keep up to %d times the tensor depth at each position. default: %%(default)s" % param.downsample_depth_headroom)
+
     parser.add_argument('--extend_bed', nargs='?', action="store", type=str, default=None,
                         help="DEBUG: Extend the regions in the --bed_fn by a few bp for tensor creation, default extend 16bp")
 
@@ -733,6 +827,9 @@ def main():
     parser.add_argument('--truth_vcf_fn', type=str, default=None,
                         help=SUPPRESS)
 
+    parser.add_argument('--genotyping_fast_path', type=str2bool, default=False,
+                        help="EXPERIMENTAL: The candidates are known genotyping sites, only read the BAMs around them and write their hybrid information, default: disabled")
+
     args = parser.parse_args()
 
     create_tensor(args)
@@ -41,6 +41,7 @@ import shared.param as param
 from shared.utils import subprocess_popen, file_path_from, IUPAC_base_to_num_dict as BASE2NUM, region_from, \
     reference_sequence_from, str2bool, vcf_candidates_from
 from shared.interval_tree import bed_tree_from, is_region_in
+from shared.pileup import base_list_from
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 BASES = set(list(BASE2NUM.keys()) + ["-"])
@@ -94,29 +95,7 @@ def decode_pileup_bases(pos, pileup_bases, reference_base,  minimum_snp_af_for_c
     pileup_tensor = [0] * (channel_size if phasing_info is None else (channel_size + len(phase_channel)))
     is_candidate = pos in candidates_type_dict
     if base_list is None:
-        base_idx = 0
-        base_list = []
-        while base_idx < len(pileup_bases):
-            base = pileup_bases[base_idx]
-            if base == '+' or base == '-':
-                base_idx += 1
-                advance = 0
-                while True:
-                    num = pileup_bases[base_idx]
-                    if num.isdigit():
-                        advance = advance * 10 + int(num)
-                        base_idx += 1
-                    else:
-                        break
-                base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-                base_idx += advance - 1
-
-            elif base in "ACGTNacgtn#*":
-                base_list.append([base, ""])
-            elif base == '^':  # start of read, next base is mq, update mq info
-                base_idx += 1
-            # skip $, the end of read
-            base_idx += 1
+        base_list = base_list_from(pileup_bases)
 
     pileup_dict = defaultdict(int)
     base_counter = Counter([''.join(item) for item, mq in zip(base_list, mapping_quality) if mq >= 20])
@@ -40,6 +40,7 @@ import shared.param as param
 from shared.vcf import VcfReader
 from shared.utils import subprocess_popen, file_path_from, region_from, reference_sequence_from, str2bool
 from shared.interval_tree import bed_tree_from
+from shared.pileup import base_list_from
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
@@ -70,29 +71,7 @@ def decode_pileup_bases(pileup_bases,
     has_pileup_candidates: if the candidate is directly obtained from pileup output, then no need to check the af filtering.
     """
 
-    base_idx = 0
-    base_list = []
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
+    base_list = base_list_from(pileup_bases)
 
     pileup_dict = defaultdict(int)
     base_counter = Counter([''.join(item) for item in base_list])
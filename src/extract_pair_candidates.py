@@ -39,9 +39,10 @@ from collections import Counter, defaultdict
 
 import shared.param as param
 from shared.vcf import VcfReader, VcfWriter
-from shared.utils import subprocess_popen, file_path_from, region_from, \
+from shared.utils import subprocess_popen, file_path_from, region_from, samtools_input_option_from, \
     reference_sequence_from, str2bool, str_none
 from shared.interval_tree import bed_tree_from, is_region_in
+from shared.pileup import base_list_from
 
 logging.basicConfig(format='%(message)s', level=logging.INFO)
 
@@ -74,29 +75,7 @@ def decode_pileup_bases(pileup_bases,
     has_pileup_candidates: if the candidate is directly obtained from pileup output, then no need to check the af filtering.
     """
 
-    base_idx = 0
-    base_list = []
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
+    base_list = base_list_from(pileup_bases)
 
     pileup_dict = defaultdict(int)
     base_counter = Counter([''.join(item) for item in base_list])
@@ -151,8 +130,11 @@ def decode_pileup_bases(pileup_bases,
     alt_list = [[item[0], str(round(item[1] / denominator, 3))] for item in alt_list if
                 item[0].upper() != reference_base]
 
+    # read numbers from the raw counts, the AFs below are rounded
+    alt_read_nums = alt_read_num_from(pileup_list, reference_base)
+
     if not pass_af:
-        return base_list, depth, pass_af, af, "", "", "", alt_list, pass_snv_af, pass_indel_af, pileup_list
+        return base_list, depth, pass_af, af, "", "", "", alt_list, pass_snv_af, pass_indel_af, pileup_list, alt_read_nums
 
     pileup_list = [[item[0], str(round(item[1] / denominator, 3))] for item in pileup_list]
     af_infos = ','.join([item[1] for item in pileup_list if item[0] != reference_base])
@@ -166,7 +148,119 @@ def decode_pileup_bases(pileup_bases,
     else:
         tumor_pileup_infos = ""
 
-    return base_list, depth, pass_af, af, af_infos, pileup_infos, tumor_pileup_infos, alt_list, pass_snv_af, pass_indel_af, pileup_list
+    return base_list, depth, pass_af, af, af_infos, pileup_infos, tumor_pileup_infos, alt_list, pass_snv_af, pass_indel_af, pileup_list, alt_read_nums
+
+
+def alt_read_num_from(pileup_list, reference_base):
+    """
+    Return the read number of the most supported SNV alternative and indel alternative from the (allele, read count)
+    pileup list.
+    """
+    snv_alt_read_num, indel_alt_read_num = 0, 0
+    for item, read_num in pileup_list:
+        if item[0] in 'ID':
+            indel_alt_read_num = max(indel_alt_read_num, read_num)
+        elif item != reference_base and item in 'ACGT':
+            snv_alt_read_num = max(snv_alt_read_num, read_num)
+    return snv_alt_read_num, indel_alt_read_num
+
+
+def prefilter_candidates(candidate_list,
+                         tumor_info_list,
+                         normal_pileup_dict,
+                         min_coverage,
+                         normal_snv_max_af,
+                         min_tumor_support_read_num=None,
+                         max_normal_alt_read_num=None,
+                         min_normal_coverage=None,
+                         enable_params_for_liquid_tumor_sample=False):
+    """
+    Reject candidates that could not be called as somatic variants from the tumor and normal alternative counts alone,
+    before any tensor is created for them.
+    candidate_list: candidate positions.
+    tumor_info_list: (tumor depth, tumor alt list of the variant type, tumor alt read number) of each candidate.
+    normal_pileup_dict: dictionary (pos: (normal depth, normal alt list, normal alt read number dict)) of the candidates
+    covered in the normal BAM.
+
+    The per-candidate columns are built once and each rule is evaluated over the whole columns, a candidate is
+    counted under the first rule it fails. Return the rejected positions and a Counter of the reject reasons.
+    """
+    candidate_num = len(candidate_list)
+    tumor_alt_base = [alt_list[0][0] if len(alt_list) else None for _, alt_list, _ in tumor_info_list]
+    tumor_af = [float(alt_list[0][1]) if len(alt_list) else 0.0 for _, alt_list, _ in tumor_info_list]
+    tumor_support = [read_num for _, _, read_num in tumor_info_list]
+    normal_depth = [normal_pileup_dict[pos][0] if pos in normal_pileup_dict else 0 for pos in candidate_list]
+    normal_af = []
+    normal_alt_read_num = []
+    for pos, alt_base in zip(candidate_list, tumor_alt_base):
+        normal_alt_list, normal_alt_read_num_dict = normal_pileup_dict[pos][1:] if pos in normal_pileup_dict else ([], {})
+        normal_info = [item for item in normal_alt_list if item[0] == alt_base]
+        normal_af.append(float(normal_info[0][1]) if len(normal_info) else 0.0)
+        normal_alt_read_num.append(normal_alt_read_num_dict.get(alt_base, 0))
+
+    # the normal AF rules only apply if the alternative is observed in both samples with enough normal coverage
+    is_af_comparable = [n_dp > min_coverage and n_af > 0 and t_af > 0
+                        for n_dp, n_af, t_af in zip(normal_depth, normal_af, tumor_af)]
+    rule_list = [('no_tumor_alt', [alt_base is None for alt_base in tumor_alt_base])]
+    if min_tumor_support_read_num is not None:
+        rule_list.append(('low_tumor_support', [read_num < min_tumor_support_read_num for read_num in tumor_support]))
+    if min_normal_coverage is not None:
+        rule_list.append(('low_normal_coverage', [n_dp < min_normal_coverage for n_dp in normal_depth]))
+    if max_normal_alt_read_num is not None:
+        rule_list.append(('high_normal_alt_support', [read_num > max_normal_alt_read_num
+                                                      for read_num in normal_alt_read_num]))
+    rule_list.append(('high_normal_af', [
+        is_comparable and n_af >= normal_snv_max_af and not t_af >= n_af * param.upper_beta and not (
+                round(n_af * n_dp, 1) < 2 and enable_params_for_liquid_tumor_sample and
+                t_af >= n_af * param.upper_beta_liqud)
+        for is_comparable, n_af, n_dp, t_af in zip(is_af_comparable, normal_af, normal_depth, tumor_af)]))
+    rule_list.append(('high_af_gap', [
+        is_comparable and n_af < normal_snv_max_af and t_af <= n_af * param.lower_beta
+        for is_comparable, n_af, t_af in zip(is_af_comparable, normal_af, tumor_af)]))
+
+    reject_reason_list = [None] * candidate_num
+    for reason, is_rejected_list in rule_list:
+        reject_reason_list = [reject_reason if reject_reason is not None or not is_rejected else reason
+                              for reject_reason, is_rejected in zip(reject_reason_list, is_rejected_list)]
+
+    reject_list = [pos for pos, reject_reason in zip(candidate_list, reject_reason_list) if reject_reason is not None]
+    reason_counter = Counter([reject_reason for reject_reason in reject_reason_list if reject_reason is not None])
+    return reject_list, reason_counter
+
+
+def print_prefilter_summary(ctg_name, chunk_id, chunk_num, variant_type, candidate_num, reason_counter):
+    reject_num = sum(reason_counter.values())
+    reason_infos = ', '.join(['{}: {}'.format(reason, count) for reason, count in sorted(reason_counter.items())])
+    print("[INFO] {} chunk {}/{}: Prefilter removed {}/{} {} candidates before tensor creation{}".format(
+        ctg_name, chunk_id, chunk_num, reject_num, candidate_num, variant_type,
+        ' ({})'.format(reason_infos) if reject_num else ''))
+
+
+def write_candidate_regions(candidates_folder, ctg_name, chunk_id, candidates_list, flanking_base_num, split_bed_size,
+                            is_indel=False):
+    """
+    Split the sorted candidates into bed region files of at most split_bed_size sites for tensor creation, and list the
+    region files in (INDEL_)CANDIDATES_FILE_{ctg_name}_{chunk_id}.
+    """
+    all_candidates_regions = []
+    region_num = len(candidates_list) // split_bed_size + 1 if len(
+        candidates_list) % split_bed_size else len(candidates_list) // split_bed_size
+
+    for idx in range(region_num):
+        # a windows region for create tensor # samtools mpileup not include last position
+        split_output = candidates_list[idx * split_bed_size: (idx + 1) * split_bed_size]
+        output_path = os.path.join(candidates_folder, '{}.{}_{}_{}{}'.format(ctg_name, chunk_id, idx, region_num,
+                                                                            '_indel' if is_indel else ''))
+        all_candidates_regions.append(output_path)
+        with open(output_path, 'w') as output_file:
+            output_file.write('\n'.join(
+                ['\t'.join([ctg_name, str(x - flanking_base_num - 1), str(x + flanking_base_num + 1)]) for x in
+                 split_output]) + '\n')  # bed format
+
+    all_candidates_regions_path = os.path.join(candidates_folder, '{}CANDIDATES_FILE_{}_{}'.format(
+        'INDEL_' if is_indel else '', ctg_name, chunk_id))
+    with open(all_candidates_regions_path, 'w') as output_file:
+        output_file.write('\n'.join(all_candidates_regions) + '\n')
 
 
 def extract_pair_candidates(args):
@@ -204,6 +298,9 @@ def extract_pair_candidates(args):
     select_indel_candidates = args.select_indel_candidates
 
     hybrid_mode_vcf_fn = args.hybrid_mode_vcf_fn
+    # only build tensors at the known sites, genotyping output is restricted to the known sites
+    genotyping_fast_path = args.genotyping_fast_path and genotyping_mode_vcf_fn is not None and hybrid_mode_vcf_fn is None \
+                           and tumor_bam_file_path != "PIPE"
     enable_params_for_liquid_tumor_sample = args.enable_params_for_liquid_tumor_sample
 
     candidates_set = set()
@@ -249,7 +346,8 @@ def extract_pair_candidates(args):
             # consistent with pileup generation, faster to extract tensor using bed region
             tree, bed_start, bed_end = bed_tree_from(bed_file_path=confident_bed_fn,
                                                      contig_name=ctg_name,
-                                                     return_bed_region=True)
+                                                     return_bed_region=True,
+                                                     cache_dir=args.bed_cache_dir)
 
             chunk_size = (bed_end - bed_start) // chunk_num + 1 if (bed_end - bed_start) % chunk_num else (
                                                                                                                       bed_end - bed_start) // chunk_num
@@ -296,6 +394,21 @@ def extract_pair_candidates(args):
     if reference_sequence is None or len(reference_sequence) == 0:
         sys.exit("[ERROR] Failed to load reference sequence from file ({}).".format(fasta_file_path))
 
+    if genotyping_fast_path:
+        # no pileup here, the tensors are built directly at the known sites and create_pair_tensor_pileup writes
+        # their hybrid information
+        known_site_list = sorted([pos for pos in hybrid_candidate_set if (not is_ctg_range_given or ctg_start <= pos <= ctg_end)
+                                  and reference_sequence[pos - reference_start].upper() in "ACGT"])
+        print("[INFO] {} chunk {}/{}: Genotyping fast path, total known sites: {}".format(ctg_name, chunk_id, chunk_num,
+                                                                                         len(known_site_list)))
+        if candidates_folder is not None and len(known_site_list):
+            write_candidate_regions(candidates_folder, ctg_name, chunk_id, known_site_list, flankingBaseNum,
+                                    split_bed_size)
+            if select_indel_candidates:
+                write_candidate_regions(candidates_folder, ctg_name, chunk_id, known_site_list, flankingBaseNum,
+                                        split_bed_size, is_indel=True)
+        return
+
     mq_option = ' --min-MQ {}'.format(min_mapping_quality)
     bq_option = ' --min-BQ {}'.format(min_base_quality)
     read_name_option = ' --output-QNAME' if store_tumor_infos else ' '
@@ -309,9 +422,11 @@ def extract_pair_candidates(args):
     tumor_bam_file_path = tumor_bam_file_path if tumor_bam_file_path != "PIPE" else "-"
     samtools_command = samtools_execute_command + " mpileup --reverse-del" + read_name_option + reads_regions_option + \
                        mq_option + bq_option + bed_option + flags_option + max_depth_option
+    tumor_input_option = samtools_input_option_from(tumor_bam_file_path, fasta_file_path, args.decode_threads)
+    normal_input_option = samtools_input_option_from(args.normal_bam_fn, fasta_file_path, args.decode_threads)
 
     samtools_mpileup_process = subprocess_popen(
-        shlex.split(samtools_command + ' ' + tumor_bam_file_path), stdin=stdin, stderr=subprocess.PIPE)
+        shlex.split(samtools_command + tumor_input_option + ' ' + tumor_bam_file_path), stdin=stdin, stderr=subprocess.PIPE)
 
     if alt_fn:
         output_alt_fn = alt_fn
@@ -321,6 +436,7 @@ def extract_pair_candidates(args):
     has_pileup_candidates = len(candidates_pos_set)
 
     candidates_dict = defaultdict(str)
+    tumor_support_dict = {}
     for row in samtools_mpileup_process.stdout:  # chr position N depth seq BQ read_name mapping_quality phasing_info
         columns = row.strip().split('\t')
         pos = int(columns[1])
@@ -333,7 +449,7 @@ def extract_pair_candidates(args):
         is_truth_candidate = pos in truths_variant_dict
         minimum_snv_af_for_candidate = minimum_snv_af_for_truth if is_truth_candidate and minimum_snv_af_for_truth else minimum_snv_af_for_candidate
         minimum_indel_af_for_candidate = minimum_indel_af_for_truth if is_truth_candidate and minimum_indel_af_for_truth else minimum_indel_af_for_candidate
-        base_list, depth, pass_af, af, af_infos, pileup_infos, tumor_pileup_infos, alt_list, pass_snv_af, pass_indel_af, pileup_list = decode_pileup_bases(
+        base_list, depth, pass_af, af, af_infos, pileup_infos, tumor_pileup_infos, alt_list, pass_snv_af, pass_indel_af, pileup_list, alt_read_nums = decode_pileup_bases(
             pileup_bases=pileup_bases,
             reference_base=reference_base,
             min_coverage=min_coverage,
@@ -359,6 +475,7 @@ def extract_pair_candidates(args):
         if pass_af:
             candidates_set.add(pos)
             candidates_dict[pos] = (alt_list, depth)
+            tumor_support_dict[pos] = alt_read_nums
             if pass_snv_af:
                 snv_candidates_set.add(pos)
             if select_indel_candidates and pass_indel_af:
@@ -380,10 +497,9 @@ def extract_pair_candidates(args):
     output_bed.close()
 
     normal_samtools_mpileup_process = subprocess_popen(
-        shlex.split(samtools_command + ' ' + args.normal_bam_fn + ' -l ' + bed_path), stdin=stdin, stderr=subprocess.PIPE)
+        shlex.split(samtools_command + normal_input_option + ' ' + args.normal_bam_fn + ' -l ' + bed_path), stdin=stdin, stderr=subprocess.PIPE)
 
-    high_normal_af_set = set()
-    high_af_gap_set = set()
+    normal_pileup_dict = {}
     for row in normal_samtools_mpileup_process.stdout:  # chr position N depth seq BQ read_name mapping_quality phasing_info
         columns = row.strip().split('\t')
         pos = int(columns[1])
@@ -398,7 +514,7 @@ def extract_pair_candidates(args):
         is_truth_candidate = pos in truths_variant_dict
         minimum_snv_af_for_candidate = minimum_snv_af_for_truth if is_truth_candidate and minimum_snv_af_for_truth else minimum_snv_af_for_candidate
         minimum_indel_af_for_candidate = minimum_indel_af_for_truth if is_truth_candidate and minimum_indel_af_for_truth else minimum_indel_af_for_candidate
-        base_list, depth, pass_af, af, af_infos, pileup_infos, normal_pileup_infos, normal_alt_list, pass_snv_af, pass_indel_af, pileup_list = decode_pileup_bases(
+        base_list, depth, pass_af, af, af_infos, pileup_infos, normal_pileup_infos, normal_alt_list, pass_snv_af, pass_indel_af, pileup_list, _ = decode_pileup_bases(
             pileup_bases=pileup_bases,
             reference_base=reference_base,
             min_coverage=min_coverage,
@@ -427,51 +543,35 @@ def extract_pair_candidates(args):
                     hybrid_info_dict[pos] = AltInfo(ref_base=ref_base, normal_alt_info=normal_alt_info)
             continue
 
-        tumor_alt_list, tumor_depth = candidates_dict[pos]
-        if pos in snv_candidates_set:
-            tumor_info = [item for item in tumor_alt_list if item[0] in "ACGT"]
-            if len(tumor_info) == 0:
-                snv_candidates_set.remove(pos)
-            elif len(tumor_info) > 0:
-                alt_base, tumor_af = tumor_info[0]
-                normal_info = [item for item in normal_alt_list if item[0] == alt_base]
-                tumor_af = float(tumor_af)
-                if len(normal_info) > 0 and depth > min_coverage:
-                    normal_af = float(normal_info[0][1])
-                    normal_alt_depth = round(normal_af * depth, 1)
-                    if normal_af > 0 and tumor_af > 0:
-                        if normal_af >= normal_snv_max_af:
-                            if not (tumor_af >= normal_af * param.upper_beta):
-                                pass_liquid = enable_params_for_liquid_tumor_sample and tumor_af >= normal_af * param.upper_beta_liqud
-                                if not (normal_alt_depth < 2 and pass_liquid):
-                                    snv_candidates_set.remove(pos)
-                                    high_normal_af_set.add(pos)
-                        elif tumor_af <= normal_af * param.lower_beta and tumor_af != 0:
-                            snv_candidates_set.remove(pos)
-                            high_af_gap_set.add(pos)
-
-        #indel candidate check
-        if select_indel_candidates and pos in indel_candidates_set:
-            tumor_info = [item for item in tumor_alt_list if '+' in item[0] or '-' in item[0]]
-            if len(tumor_info) == 0:
-                indel_candidates_set.remove(pos)
-            elif len(tumor_info) > 0:
-                alt_base, tumor_af = tumor_info[0]
-                normal_info = [item for item in normal_alt_list if item[0] == alt_base]
-                tumor_af = float(tumor_af)
-                if len(normal_info) > 0 and depth > min_coverage:
-                    normal_af = float(normal_info[0][1])
-                    normal_alt_depth = round(normal_af * depth, 1)
-                    if normal_af > 0 and tumor_af > 0:
-                        if normal_af >= normal_snv_max_af:
-                            if not (tumor_af >= normal_af * param.upper_beta):
-                                pass_liquid = enable_params_for_liquid_tumor_sample and tumor_af >= normal_af * param.upper_beta_liqud
-                                if not (normal_alt_depth < 2 and pass_liquid):
-                                    indel_candidates_set.remove(pos)
-                                    high_normal_af_set.add(pos)
-                        elif tumor_af <= normal_af * param.lower_beta and tumor_af != 0:
-                            indel_candidates_set.remove(pos)
-                            high_af_gap_set.add(pos)
+        # raw read numbers of each alternative, the AFs of the alt list are rounded
+        normal_pileup_dict[pos] = (depth, normal_alt_list, Counter([''.join(item).upper() for item in base_list]))
+
+    prefilter_kwargs = dict(normal_pileup_dict=normal_pileup_dict,
+                            min_coverage=min_coverage,
+                            normal_snv_max_af=normal_snv_max_af,
+                            min_tumor_support_read_num=args.min_tumor_support_read_num,
+                            max_normal_alt_read_num=args.max_normal_alt_read_num,
+                            min_normal_coverage=args.min_normal_coverage,
+                            enable_params_for_liquid_tumor_sample=enable_params_for_liquid_tumor_sample)
+    snv_prefilter_list = [pos for pos in snv_candidates_set if pos not in hybrid_candidate_set]
+    snv_reject_list, snv_reason_counter = prefilter_candidates(
+        candidate_list=snv_prefilter_list,
+        tumor_info_list=[(candidates_dict[pos][1], [item for item in candidates_dict[pos][0] if item[0] in "ACGT"],
+                          tumor_support_dict[pos][0]) for pos in snv_prefilter_list],
+        **prefilter_kwargs)
+    snv_candidates_set.difference_update(snv_reject_list)
+    print_prefilter_summary(ctg_name, chunk_id, chunk_num, 'snv', len(snv_prefilter_list), snv_reason_counter)
+
+    if select_indel_candidates:
+        indel_prefilter_list = [pos for pos in indel_candidates_set if pos not in hybrid_candidate_set]
+        indel_reject_list, indel_reason_counter = prefilter_candidates(
+            candidate_list=indel_prefilter_list,
+            tumor_info_list=[(candidates_dict[pos][1],
+                              [item for item in candidates_dict[pos][0] if '+' in item[0] or '-' in item[0]],
+                              tumor_support_dict[pos][1]) for pos in indel_prefilter_list],
+            **prefilter_kwargs)
+        indel_candidates_set.difference_update(indel_reject_list)
+        print_prefilter_summary(ctg_name, chunk_id, chunk_num, 'indel', len(indel_prefilter_list), indel_reason_counter)
 
     snv_candidates_list = sorted([pos for pos in candidates_set if pos in snv_candidates_set])
     if select_indel_candidates:
@@ -523,44 +623,12 @@ def extract_pair_candidates(args):
                                                                          chunk_num,
                                                                          len(snv_candidates_list)))
     if candidates_folder is not None and len(snv_candidates_list):
-        all_candidates_regions = []
-        region_num = len(snv_candidates_list) // split_bed_size + 1 if len(
-            snv_candidates_list) % split_bed_size else len(snv_candidates_list) // split_bed_size
-
-        for idx in range(region_num):
-            # a windows region for create tensor # samtools mpileup not include last position
-            split_output = snv_candidates_list[idx * split_bed_size: (idx + 1) * split_bed_size]
-            output_path = os.path.join(candidates_folder, '{}.{}_{}_{}'.format(ctg_name, chunk_id, idx, region_num))
-            all_candidates_regions.append(output_path)
-            with open(output_path, 'w') as output_file:
-                output_file.write('\n'.join(
-                    ['\t'.join([ctg_name, str(x - flankingBaseNum - 1), str(x + flankingBaseNum + 1)]) for x in
-                     split_output]) + '\n')  # bed format
-
-        all_candidates_regions_path = os.path.join(candidates_folder,
-                                                   'CANDIDATES_FILE_{}_{}'.format(ctg_name, chunk_id))
-        with open(all_candidates_regions_path, 'w') as output_file:
-            output_file.write('\n'.join(all_candidates_regions) + '\n')
+        write_candidate_regions(candidates_folder, ctg_name, chunk_id, snv_candidates_list, flankingBaseNum,
+                                split_bed_size)
 
     if select_indel_candidates and candidates_folder is not None and len(indel_candidates_list):
-        all_candidates_regions = []
-        region_num = len(indel_candidates_list) // split_bed_size + 1 if len(
-            indel_candidates_list) % split_bed_size else len(indel_candidates_list) // split_bed_size
-
-        for idx in range(region_num):
-            # a windows region for create tensor # samtools mpileup not include last position
-            split_output = indel_candidates_list[idx * split_bed_size: (idx + 1) * split_bed_size]
-            output_path = os.path.join(candidates_folder, '{}.{}_{}_{}_indel'.format(ctg_name, chunk_id, idx, region_num))
-            all_candidates_regions.append(output_path)
-            with open(output_path, 'w') as output_file:
-                output_file.write('\n'.join(
-                    ['\t'.join([ctg_name, str(x - flankingBaseNum - 1), str(x + flankingBaseNum + 1)]) for x in
-                     split_output]) + '\n')  # bed format
-
-        all_candidates_regions_path = os.path.join(candidates_folder,
-                                                   'INDEL_CANDIDATES_FILE_{}_{}'.format(ctg_name, chunk_id))
-        with open(all_candidates_regions_path, 'w') as output_file:
-            output_file.write('\n'.join(all_candidates_regions) + '\n')
+        write_candidate_regions(candidates_folder, ctg_name, chunk_id, indel_candidates_list, flankingBaseNum,
+                                split_bed_size, is_indel=True)
 
     if hybrid_mode_vcf_fn is not None or genotyping_mode_vcf_fn is not None:
         hybrid_output_path = os.path.join(candidates_folder,
@@ -615,6 +683,9 @@ def main():
     parser.add_argument('--bed_fn', type=str, default=None,
                         help="Call variant only in the provided regions. Will take an intersection if --ctg_name and/or (--ctg_start, --ctg_end) are set")
 
+    parser.add_argument('--bed_cache_dir', type=str, default=None,
+                        help="EXPERIMENTAL: Folder to cache the parsed BED index across runs of the same BED, default: disabled")
+
     parser.add_argument('--samtools', type=str, default="samtools",
                         help="Path to the 'samtools', samtools version >= 1.10 is required. default: %(default)s")
 
@@ -634,6 +705,15 @@ def main():
     parser.add_argument('--alternative_base_num', type=int, default=param.alternative_base_num,
                         help="EXPERIMENTAL: Minimum alternative base number to process a candidate. default: %(default)s")
 
+    parser.add_argument('--min_tumor_support_read_num', type=int, default=None,
+                        help="Prefilter: minimum tumor reads supporting the alternative of a candidate, only stricter than --alternative_base_num has an effect, default: disabled")
+
+    parser.add_argument('--max_normal_alt_read_num', type=int, default=None,
+                        help="Prefilter: maximum normal reads supporting the tumor alternative of a candidate, default: disabled")
+
+    parser.add_argument('--min_normal_coverage', type=int, default=None,
+                        help="Prefilter: minimum normal coverage of a candidate, default: disabled")
+
     parser.add_argument('--select_indel_candidates', type=str2bool, default=0,
                         help="EXPERIMENTAL: Get Indel candidates instead of SNV candidates")
 
@@ -643,6 +723,12 @@ def main():
     parser.add_argument('--genotyping_mode_vcf_fn', type=str_none, default=None,
                         help="Candidate sites VCF file input, if provided, variants will only be called at the sites in the VCF file, default: %(default)s")
 
+    parser.add_argument('--genotyping_fast_path', type=str2bool, default=False,
+                        help="EXPERIMENTAL: With --genotyping_mode_vcf_fn, write the known sites as candidates without reading the BAMs, default: disabled")
+
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
     parser.add_argument('--enable_params_for_liquid_tumor_sample', type=str2bool, default=None,
                         help="Candidate sites VCF file input, if provided, variants will only be called at the sites in the VCF file, default: %(default)s")
 
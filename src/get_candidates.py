@@ -392,7 +392,7 @@ def filter_somatic_candidates(args, truths, variant_info, alt_dict, paired_alt_d
 def get_candidates(args):
     contig_name = args.ctg_name
     bed_fn = args.bed_fn
-    bed_tree = bed_tree_from(bed_fn, contig_name)
+    bed_tree = bed_tree_from(bed_fn, contig_name, cache_dir=args.bed_cache_dir)
     normal_vcf_fn = args.normal_vcf_fn
     tumor_vcf_fn = args.tumor_vcf_fn
     maximum_non_variant_ratio = args.maximum_non_variant_ratio
@@ -698,6 +698,9 @@ def main():
     parser.add_argument('--bed_fn', type=str, default=None,
                         help="Call variant only in the provided regions")
 
+    parser.add_argument('--bed_cache_dir', type=str, default=None,
+                        help="EXPERIMENTAL: Folder to cache the parsed BED index across runs of the same BED, default: disabled")
+
     parser.add_argument('--samtools', type=str, default="samtools",
                         help="Path to the 'samtools', samtools version >= 1.10 is required. default: %(default)s")
 
@@ -10,7 +10,8 @@ from collections import defaultdict
 
 import shared.param as param
 from shared.vcf import VcfReader, VcfWriter
-from shared.utils import str2bool, str_none, reference_sequence_from, subprocess_popen
+from shared.utils import str2bool, str_none, reference_sequence_from, subprocess_popen, samtools_input_option_from
+from shared.pileup import base_list_with_read_ends_from, allele_counter_from
 
 HIGH_QUAL = 0.9
 LOW_AF = 0.1
@@ -20,36 +21,9 @@ eps = 0.2
 def get_base_list(columns):
     pileup_bases = columns[4]
 
-    base_idx = 0
-    base_list = []
-    read_end_set = set()
-    read_start_set = set()
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx].upper()
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance].upper()  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-            read_start_set.add(len(base_list) - 1)
-        # skip $, the end of read
-        if base == "$":
-            read_end_set.add(len(base_list) - 1)
-        base_idx += 1
+    base_list, read_start_set, read_end_set = base_list_with_read_ends_from(pileup_bases, upper=True)
     read_start_end_set = read_start_set if len(read_start_set) > len(read_end_set) else read_end_set
-    upper_base_counter = Counter([''.join(item).upper() for item in base_list])
+    upper_base_counter = allele_counter_from(base_list)
     return upper_base_counter, base_list, read_start_end_set
 
 
@@ -97,7 +71,8 @@ def haplotype_filter_per_pos(args):
     samtools_command = "{} mpileup  --min-MQ {} --min-BQ {} --excl-flags 2316 -r {} --output-QNAME --output-extra HP ".format(
         samtools, min_mq, min_bq, ctg_range)
 
-    tumor_samtools_command = samtools_command + tumor_bam_fn
+    tumor_samtools_command = samtools_command + samtools_input_option_from(tumor_bam_fn, ref_fn, args.decode_threads) + \
+                             ' ' + tumor_bam_fn
 
 
     reference_sequence = reference_sequence_from(
@@ -499,6 +474,7 @@ def haplotype_filter(args):
     parallel_command += " --samtools " + str(args.samtools)
     parallel_command += " --tumor_bam_fn " + str(args.tumor_bam_fn)
     parallel_command += " --ref_fn " + str(args.ref_fn)
+    parallel_command += " --decode_threads " + str(args.decode_threads) if args.decode_threads else ""
     parallel_command += " --debug " if args.debug else ""
     parallel_command += " --flanking " + str(args.flanking) if args.flanking is not None else ""
     parallel_command += " :::: " + str(hap_info_output_path)
@@ -596,6 +572,9 @@ def main():
     parser.add_argument('--samtools', type=str, default="samtools",
                         help="Absolute path to the 'samtools', samtools version >= 1.10 is required. Default: %(default)s")
     # options for advanced users
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
     parser.add_argument('--apply_post_processing', type=str2bool, default=True,
                         help="EXPERIMENTAL: Apply post processing to the variant calls")
 
@@ -51,13 +51,6 @@ def quality_score_from(probability, int_format=False, use_phred_qual=True):
 
     return str(int(round(tmp, 3))) if int_format else "%.3f" % float(round(tmp, 3))
 
-def compress_index_vcf(input_vcf):
-    # use bgzip to compress vcf -> vcf.gz
-    # use tabix to index vcf.gz
-    proc = subprocess.run('bgzip -f {}'.format(input_vcf), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    proc = subprocess.run('tabix -f -p vcf {}.gz'.format(input_vcf), shell=True, stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-
 def mark_low_qual(row, quality_score_for_pass):
     if row == '' or "Germline" in row or "RefCall" in row:
         return row
@@ -97,11 +90,14 @@ def merge_vcf(args):
                                  keep_row_str=True,
                                  skip_genotype=True,
                                  filter_tag=None,
-                                 keep_af=True)
+                                 keep_af=True,
+                                 split_by_contig=True)
     input_vcf_reader.read_vcf()
-    fa_input_variant_dict = input_vcf_reader.variant_dict
+    # full-alignment variants of all contigs are read in one pass into one position keyed dict per contig
+    fa_contig_variant_dict = input_vcf_reader.contig_variant_dict
 
-    pass_fa_set = set([k for k, v in fa_input_variant_dict.items() if v.filter == "PASS"])
+    pass_fa_set = set([(ctg_name, pos) for ctg_name, fa_input_variant_dict in fa_contig_variant_dict.items()
+                       for pos, v in fa_input_variant_dict.items() if v.filter == "PASS"])
 
     pileup_input_variant_dict = defaultdict(str)
     row_count = 0
@@ -153,7 +149,7 @@ def merge_vcf(args):
                 continue
 
         if (ctg_name, int(pos)) in pass_fa_set:
-            QUAL = (qual + float(fa_input_variant_dict[(ctg_name, int(pos))].qual)) / 2
+            QUAL = (qual + float(input_vcf_reader.contig_variants(ctg_name)[int(pos)].qual)) / 2
             columns[5] = quality_score_from(QUAL, use_phred_qual=use_phred_qual)
             #update GQ to phred
             columns = update_GQ(columns)
@@ -163,28 +159,29 @@ def merge_vcf(args):
             no_vcf_output = False
 
     # append all non_pass fa variant if need to print ref calls
-    for k, v in fa_input_variant_dict.items():
-        if k[0] not in contig_dict or k[1] not in contig_dict[k[0]]:
-            row = v.row_str
-            columns = row.strip().split()
-            if columns[6] != "Germline" and columns[6] != "RefCall":
-                if prefer_recall:
-                    columns[5] = quality_score_from(columns[5], use_phred_qual=use_phred_qual)
-                    columns = update_GQ(columns)
-                    row = '\t'.join(columns) + '\n'
-                    contig_dict[k[0]][k[1]] = row
-                    no_vcf_output = False
-                    recall_count += 1
-                    continue
+    for ctg_name, fa_input_variant_dict in fa_contig_variant_dict.items():
+        for pos, v in fa_input_variant_dict.items():
+            if ctg_name not in contig_dict or pos not in contig_dict[ctg_name]:
+                row = v.row_str
+                columns = row.strip().split()
+                if columns[6] != "Germline" and columns[6] != "RefCall":
+                    if prefer_recall:
+                        columns[5] = quality_score_from(columns[5], use_phred_qual=use_phred_qual)
+                        columns = update_GQ(columns)
+                        row = '\t'.join(columns) + '\n'
+                        contig_dict[ctg_name][pos] = row
+                        no_vcf_output = False
+                        recall_count += 1
+                        continue
+                    else:
+                        columns[5] = "0.000"
                 else:
-                    columns[5] = "0.000"
-            else:
-                columns[5] = quality_score_from(columns[5], use_phred_qual=use_phred_qual)
-            #update GQ to phred
-            columns = update_GQ(columns)
-            row = '\t'.join(columns) + '\n'
-            contig_dict[k[0]][k[1]] = row
-            no_vcf_output = False
+                    columns[5] = quality_score_from(columns[5], use_phred_qual=use_phred_qual)
+                #update GQ to phred
+                columns = update_GQ(columns)
+                row = '\t'.join(columns) + '\n'
+                contig_dict[ctg_name][pos] = row
+                no_vcf_output = False
 
     # append all non_pass pileup variant if need to print ref calls
     for k, row in pileup_input_variant_dict.items():
@@ -213,12 +210,15 @@ def merge_vcf(args):
     contigs_order = major_contigs_order + list(contig_dict.keys())
     contigs_order_list = sorted(contig_dict.keys(), key=lambda x: contigs_order.index(x))
 
-    output_vcf_writer = VcfWriter(vcf_fn=args.output_fn,
+    # write the BGZF compressed VCF and its tabix index directly
+    output_vcf_writer = VcfWriter(vcf_fn=args.output_fn + '.gz' if compress_vcf else args.output_fn,
                                  ctg_name=','.join(list(contig_dict.keys())),
                                  ref_fn=args.ref_fn,
                                  sample_name=args.sample_name,
                                  cmdline=cmdline,
-                                 show_ref_calls=True)
+                                 show_ref_calls=True,
+                                 compress_vcf=compress_vcf,
+                                 threads=args.threads)
 
     for contig in contigs_order_list:
         all_pos = sorted(contig_dict[contig].keys())
@@ -228,9 +228,6 @@ def merge_vcf(args):
             output_vcf_writer.vcf_writer.write(row)
     output_vcf_writer.close()
 
-    if compress_vcf:
-        compress_index_vcf(args.output_fn)
-
     if args.enable_indel_calling and not args.indel_calling:
         output_fn = args.output_fn + '.gz' if compress_vcf else args.output_fn
         output_dir = os.path.dirname(output_fn)
@@ -268,6 +265,9 @@ def main():
     parser.add_argument('--cmdline', type=str_none, default=None,
                         help="If defined, added command line into VCF header")
 
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Number of threads to compress the output VCF, default: %(default)s")
+
     # options for advanced users
     parser.add_argument('--qual', type=float, default=None,
                         help="EXPERIMENTAL: If set, variants Phread quality with >=$qual will be marked 'PASS', or 'LowQual' otherwise")
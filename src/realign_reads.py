@@ -40,7 +40,8 @@ from argparse import ArgumentParser, SUPPRESS
 from collections import defaultdict
 
 import shared.param as param
-from shared.utils import subprocess_popen, reference_sequence_from, IUPAC_base_to_ACGT_base_dict as BASE2ACGT, log_error
+from shared.utils import subprocess_popen, reference_sequence_from, IUPAC_base_to_ACGT_base_dict as BASE2ACGT, log_error, \
+    samtools_input_option_from
 from shared.interval_tree import bed_tree_from
 from shared.intervaltree.intervaltree import IntervalTree
 
@@ -409,8 +410,9 @@ def reads_realignment(args):
     bed_option = ' -L {}'.format(extend_bed) if extend_bed else ""
     bed_option = ' -L {}'.format(bed_file_path) if is_bed_file_given else bed_option
     mq_option = ' -q {}'.format(min_mq) if min_mq > 0 else ""
-    samtools_view_command = "{} view -h {} {}".format(samtools_execute_command, bam_file_path,
-                                                      " ".join(reads_regions)) + mq_option + bed_option
+    input_option = samtools_input_option_from(bam_file_path, fasta_file_path, args.decode_threads)
+    samtools_view_command = "{} view -h{} {} {}".format(samtools_execute_command, input_option, bam_file_path,
+                                                        " ".join(reads_regions)) + mq_option + bed_option
     samtools_view_process = subprocess_popen(
         shlex.split(samtools_view_command)
     )
@@ -687,6 +689,9 @@ def main():
                         help="Path to the 'samtools', samtools version >= 1.10 is required, default: %(default)s")
 
     # options for advanced users
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
     parser.add_argument('--min_coverage', type=float, default=2,
                         help="EXPERIMENTAL: Minimum coverage required to call a variant, default: %(default)f")
 
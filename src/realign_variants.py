@@ -3,13 +3,13 @@ import os
 import subprocess
 import concurrent.futures
 
-from collections import Counter
 from argparse import ArgumentParser, SUPPRESS
 from collections import defaultdict
 
 import shared.param as param
 from shared.vcf import VcfReader, VcfWriter
-from shared.utils import str2bool
+from shared.utils import str2bool, samtools_input_option_from
+from shared.pileup import base_list_from, allele_counter_from
 
 file_directory = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 main_entry = os.path.join(file_directory, "{}.py".format(param.caller_name))
@@ -18,30 +18,8 @@ main_entry = os.path.join(file_directory, "{}.py".format(param.caller_name))
 def get_base_list(columns):
     pileup_bases = columns[4]
 
-    base_idx = 0
-    base_list = []
-    while base_idx < len(pileup_bases):
-        base = pileup_bases[base_idx]
-        if base == '+' or base == '-':
-            base_idx += 1
-            advance = 0
-            while True:
-                num = pileup_bases[base_idx]
-                if num.isdigit():
-                    advance = advance * 10 + int(num)
-                    base_idx += 1
-                else:
-                    break
-            base_list[-1][1] = base + pileup_bases[base_idx: base_idx + advance]  # add indel seq
-            base_idx += advance - 1
-
-        elif base in "ACGTNacgtn#*":
-            base_list.append([base, ""])
-        elif base == '^':  # start of read, next base is mq, update mq info
-            base_idx += 1
-        # skip $, the end of read
-        base_idx += 1
-    upper_base_counter = Counter([''.join(item).upper() for item in base_list])
+    base_list = base_list_from(pileup_bases)
+    upper_base_counter = allele_counter_from(base_list)
     return upper_base_counter, base_list
 
 
@@ -62,7 +40,8 @@ def extract_base(POS):
         return ctg_name, pos, True, (-1, -1, -1, -1)
 
     ctg_range = "{}:{}-{}".format(ctg_name, pos, pos)
-    samtools_command = "{} mpileup {} --min-MQ {} --min-BQ {} --excl-flags 2316 -r {}".format(samtools,
+    samtools_command = "{} mpileup{} {} --min-MQ {} --min-BQ {} --excl-flags 2316 -r {}".format(samtools,
+                                                                                              samtools_input_option_from(bam_fn, ref_fn, args.decode_threads),
                                                                                               bam_fn,
                                                                                               min_mq,
                                                                                               min_bq,
@@ -83,6 +62,7 @@ def extract_base(POS):
                                                                                                                 bam_fn,
                                                                                                                 ref_fn,
                                                                                                                 samtools)
+    realign_command += " --decode_threads {}".format(args.decode_threads) if args.decode_threads else ""
 
     samtools_mpileup_command = "{} mpileup - --reverse-del --min-MQ {} --min-BQ {} --excl-flags 2316 | grep -w {}".format(
                                                                                                                 samtools,
@@ -233,6 +213,9 @@ def main():
                         help="Path to the 'python3', default: %(default)s")
 
     # options for advanced users
+    parser.add_argument('--decode_threads', type=int, default=0,
+                        help="EXPERIMENTAL: Number of htslib threads to decode each BAM/CRAM input, CRAM inputs are decoded with --ref_fn, default: %(default)s")
+
     parser.add_argument('--min_mq', type=int, default=param.min_mq,
                         help="EXPERIMENTAL: If set, reads with mapping quality with <$min_mq are filtered, default: %(default)d")
 
@@ -0,0 +1,254 @@
+# BSD 3-Clause License
+#
+# Copyright 2023 The University of Hong Kong, Department of Computer Science
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+
+from argparse import ArgumentParser, SUPPRESS
+from collections import Counter, defaultdict
+
+import shared.param as param
+from shared.utils import str2bool, str_none
+
+CASCADE_REFERENCE = 'reference'
+CASCADE_SOMATIC = 'somatic'
+CASCADE_FULL_ALIGNMENT = 'full_alignment'
+
+# thresholds (reference, somatic) evaluated in validation mode
+validation_reference_threshold_list = [0.01, 0.02, 0.05, 0.1, 0.2]
+validation_somatic_threshold_list = [0.9, 0.95, 0.98, 0.99, 0.995, 0.999]
+
+
+def probabilities_from(probabilities_dir):
+    """
+    Read the pileup probabilities written by predict --probabilities_fn, return a dictionary
+    ((contig, pos): somatic probability).
+    """
+    somatic_prob_dict = {}
+    if not os.path.exists(probabilities_dir):
+        return somatic_prob_dict
+    for file_name in os.listdir(probabilities_dir):
+        with open(os.path.join(probabilities_dir, file_name)) as f:
+            for row in f:
+                columns = row.rstrip().split('\t')
+                if len(columns) < 3:
+                    continue
+                probabilities = columns[2].split()
+                somatic_prob_dict[(columns[0], int(columns[1]))] = float(probabilities[param.somatic_arg_index])
+    return somatic_prob_dict
+
+
+def cascade_path_from(somatic_prob, reference_threshold, somatic_threshold):
+    if somatic_prob is None:
+        return CASCADE_FULL_ALIGNMENT
+    if somatic_prob < reference_threshold:
+        return CASCADE_REFERENCE
+    if somatic_prob >= somatic_threshold:
+        return CASCADE_SOMATIC
+    return CASCADE_FULL_ALIGNMENT
+
+
+def candidate_regions_from(candidates_files):
+    """
+    Yield (region file, [(contig, start, end, pos)]) of every candidate region file listed in candidates_files.
+    """
+    with open(candidates_files) as f:
+        region_fn_list = [row.rstrip() for row in f if row.rstrip() != '']
+    for region_fn in region_fn_list:
+        region_list = []
+        with open(region_fn) as f:
+            for row in f:
+                columns = row.rstrip().split('\t')
+                if len(columns) < 3:
+                    continue
+                start, end = int(columns[1]), int(columns[2])
+                # candidate windows are [pos - flankingBaseNum - 1, pos + flankingBaseNum + 1]
+                region_list.append((columns[0], start, end, (start + end) // 2))
+        yield region_fn, region_list
+
+
+def vcf_rows_from(vcf_fn):
+    header_list = []
+    row_dict = {}
+    if not os.path.exists(vcf_fn):
+        return header_list, row_dict
+    with open(vcf_fn) as f:
+        for row in f:
+            if row[0] == '#':
+                header_list.append(row)
+                continue
+            columns = row.split('\t', 7)
+            row_dict[(columns[0], int(columns[1]))] = (columns[6].rstrip(), row)
+    return header_list, row_dict
+
+
+def validate_cascade(somatic_prob_dict, position_list, full_alignment_vcf_fn, reference_threshold, somatic_threshold):
+    """
+    Compare the cascade decisions with the full-alignment calls of a full run, a skipped confident somatic candidate is
+    discordant if full-alignment does not call it PASS, a skipped confident reference candidate is discordant if
+    full-alignment calls it PASS.
+    """
+    _, fa_row_dict = vcf_rows_from(full_alignment_vcf_fn)
+    pass_fa_set = set([k for k, (filter, _) in fa_row_dict.items() if filter == 'PASS'])
+
+    def print_concordance(ref_threshold, som_threshold, is_selected=False):
+        path_counter = Counter()
+        discordant_counter = Counter()
+        for key in position_list:
+            path = cascade_path_from(somatic_prob_dict.get(key), ref_threshold, som_threshold)
+            path_counter[path] += 1
+            if (path == CASCADE_SOMATIC and key not in pass_fa_set) or (path == CASCADE_REFERENCE and key in pass_fa_set):
+                discordant_counter[path] += 1
+        total = len(position_list)
+        print("[INFO] Cascade thresholds reference<{} somatic>={}{}: full-alignment {}/{} ({:.2f}%), discordant with "
+              "full run {} (somatic skipped: {}, reference skipped: {})".format(
+            ref_threshold, som_threshold, ' (selected)' if is_selected else '',
+            path_counter[CASCADE_FULL_ALIGNMENT], total,
+            100.0 * path_counter[CASCADE_FULL_ALIGNMENT] / total if total else 0.0,
+            sum(discordant_counter.values()), discordant_counter[CASCADE_SOMATIC], discordant_counter[CASCADE_REFERENCE]))
+
+    print("[INFO] Full-alignment PASS calls of the full run: {}".format(len(pass_fa_set)))
+    print_concordance(reference_threshold, somatic_threshold, is_selected=True)
+    for ref_threshold in validation_reference_threshold_list:
+        for som_threshold in validation_somatic_threshold_list:
+            print_concordance(ref_threshold, som_threshold)
+
+
+def select_cascade_candidates(args):
+    """
+    Two-tier cascade calling, split the pileup candidates by their pileup somatic probability:
+    reference: somatic probability < reference_threshold, skip full-alignment, the pileup call is final.
+    somatic: somatic probability >= somatic_threshold, skip full-alignment, the pileup call is written into a fa_ prefixed
+    VCF so that it is taken as the full-alignment call of the candidate.
+    full_alignment: all other candidates, written into new candidate region files for full-alignment calling.
+    """
+    reference_threshold = args.reference_threshold
+    somatic_threshold = args.somatic_threshold
+    if not 0 <= reference_threshold <= somatic_threshold <= 1:
+        sys.exit("[ERROR] Cascade thresholds require 0 <= --reference_threshold <= --somatic_threshold <= 1")
+
+    somatic_prob_dict = probabilities_from(args.probabilities_dir)
+    candidates_folder = args.candidates_folder
+    candidates_files = os.path.join(candidates_folder, args.candidates_files)
+
+    if args.full_alignment_vcf_fn is not None:
+        position_list = []
+        for _, region_list in candidate_regions_from(candidates_files):
+            position_list += [(ctg_name, pos) for ctg_name, _, _, pos in region_list]
+        validate_cascade(somatic_prob_dict, position_list, args.full_alignment_vcf_fn, reference_threshold,
+                         somatic_threshold)
+        return
+
+    cascade_folder = os.path.join(candidates_folder, 'cascade')
+    if not os.path.exists(cascade_folder):
+        os.makedirs(cascade_folder)
+
+    path_counter = Counter()
+    somatic_position_list = []
+    cascade_region_fn_list = []
+    for region_fn, region_list in candidate_regions_from(candidates_files):
+        full_alignment_region_list = []
+        for ctg_name, start, end, pos in region_list:
+            path = cascade_path_from(somatic_prob_dict.get((ctg_name, pos)), reference_threshold, somatic_threshold)
+            path_counter[path] += 1
+            if path == CASCADE_FULL_ALIGNMENT:
+                full_alignment_region_list.append((ctg_name, start, end))
+            elif path == CASCADE_SOMATIC:
+                somatic_position_list.append((ctg_name, pos))
+        if len(full_alignment_region_list) == 0:
+            continue
+        # keep the region file name, the tensor and VCF file names of each chunk are derived from it
+        cascade_region_fn = os.path.join(cascade_folder, os.path.basename(region_fn))
+        with open(cascade_region_fn, 'w') as output_file:
+            output_file.write('\n'.join(['\t'.join([ctg_name, str(start), str(end)]) for ctg_name, start, end in
+                                         full_alignment_region_list]) + '\n')
+        cascade_region_fn_list.append(cascade_region_fn)
+
+    with open(os.path.join(candidates_folder, args.output_candidates_files), 'w') as output_file:
+        output_file.write(''.join([fn + '\n' for fn in cascade_region_fn_list]))
+
+    # sort_vcf merges the fa_ prefixed VCFs of a contig by file name, so one VCF per contig
+    header_list, pileup_row_dict = vcf_rows_from(args.pileup_vcf_fn)
+    contig_row_dict = defaultdict(list)
+    for key in sorted(somatic_position_list):
+        if key in pileup_row_dict:
+            contig_row_dict[key[0]].append(pileup_row_dict[key][1])
+    for ctg_name, row_list in contig_row_dict.items():
+        with open(os.path.join(args.vcf_output_dir, 'fa_cascade_{}.vcf'.format(ctg_name)), 'w') as output_file:
+            output_file.write(''.join(header_list + row_list))
+
+    total = sum(path_counter.values())
+    print("[INFO] Cascade calling: total {} candidates, confident reference {}, confident somatic {}, "
+          "full-alignment {} ({:.2f}%)".format(total, path_counter[CASCADE_REFERENCE], path_counter[CASCADE_SOMATIC],
+                                              path_counter[CASCADE_FULL_ALIGNMENT],
+                                              100.0 * path_counter[CASCADE_FULL_ALIGNMENT] / total if total else 0.0))
+
+
+def main():
+    parser = ArgumentParser(description="Select the candidates requiring full-alignment calling in cascade calling")
+
+    parser.add_argument('--candidates_folder', type=str, default=None, required=True,
+                        help="Candidates folder of the pileup calling")
+
+    parser.add_argument('--probabilities_dir', type=str, default=None, required=True,
+                        help="Directory of the pileup probabilities written by predict --probabilities_fn")
+
+    parser.add_argument('--pileup_vcf_fn', type=str, default=None,
+                        help="Pileup VCF input, the calls of the confident somatic candidates are taken from it")
+
+    parser.add_argument('--vcf_output_dir', type=str, default=None,
+                        help="Output directory of the full-alignment VCFs")
+
+    parser.add_argument('--reference_threshold', type=float, default=0.05,
+                        help="Skip full-alignment calling if the pileup somatic probability is below the threshold, default: %(default)s")
+
+    parser.add_argument('--somatic_threshold', type=float, default=0.99,
+                        help="Skip full-alignment calling if the pileup somatic probability is not below the threshold, default: %(default)s")
+
+    parser.add_argument('--full_alignment_vcf_fn', type=str_none, default=None,
+                        help="Full-alignment VCF of a full run, if set, only report the concordance of the cascade decisions with it")
+
+    parser.add_argument('--candidates_files', type=str, default="CANDIDATES_FILES",
+                        help=SUPPRESS)
+
+    parser.add_argument('--output_candidates_files', type=str, default="CASCADE_CANDIDATES_FILES",
+                        help=SUPPRESS)
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    select_cascade_candidates(args)
+
+
+if __name__ == "__main__":
+    main()
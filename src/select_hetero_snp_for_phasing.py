@@ -35,7 +35,8 @@ from argparse import ArgumentParser, SUPPRESS
 from collections import defaultdict
 from subprocess import run
 
-from shared.utils import subprocess_popen, str2bool
+from shared.utils import str2bool
+from shared.vcf import open_vcf_stream, close_vcf_stream
 
 def select_hetero_snp_for_phasing(args):
 
@@ -53,8 +54,9 @@ def select_hetero_snp_for_phasing(args):
     indel_normal_variant_dict = defaultdict(str)
     indel_tumor_variant_dict = defaultdict(str)
     normal_variant_dict = defaultdict(str)
-    normal_unzip_process = subprocess_popen(shlex.split("gzip -fdc %s" % (normal_vcf_fn)))
-    for row in normal_unzip_process.stdout:
+    # seek to the contig directly if the VCF is indexed
+    normal_unzip_process, normal_vcf_stream = open_vcf_stream(normal_vcf_fn, ctg_name=contig_name)
+    for row in normal_vcf_stream:
         row = row.rstrip()
         if row[0] == '#':
             header.append(row + '\n')
@@ -86,12 +88,13 @@ def select_hetero_snp_for_phasing(args):
             genotype_sum = int(genotype_1) + int(genotype_2)
             DP = int(columns[-1].split(":")[2])
             indel_normal_variant_dict[pos] = [ref_base, alt_base, row, DP, AF, genotype_sum]
+    close_vcf_stream(normal_unzip_process)
 
     intersect_pos_set = set()
     hetero_snp_not_found_in_tumor = 0
     hetero_snp_not_match_in_tumor = 0
-    tumor_unzip_process = subprocess_popen(shlex.split("gzip -fdc %s" % (tumor_vcf_fn)))
-    for row in tumor_unzip_process.stdout:
+    tumor_unzip_process, tumor_vcf_stream = open_vcf_stream(tumor_vcf_fn, ctg_name=contig_name, include_header=False)
+    for row in tumor_vcf_stream:
         row = row.rstrip()
         if row[0] == '#':
             continue
@@ -131,6 +134,7 @@ def select_hetero_snp_for_phasing(args):
             DP = int(columns[-1].split(":")[2])
             genotype_sum = int(genotype_1) + int(genotype_2)
             indel_tumor_variant_dict[pos] = [ref_base, alt_base, row, DP, AF, genotype_sum]
+    close_vcf_stream(tumor_unzip_process)
 
     normal_low_qual_set = set([item[0] for item in sorted(normal_qual_dict.items(), key=lambda x: x[1])[:int(var_pct_full * len(normal_qual_dict))]])
     tumor_low_qual_set = set([item[0] for item in sorted(tumor_qual_dict.items(), key=lambda x: x[1])[:int(var_pct_full * len(tumor_qual_dict))]])
@@ -29,6 +29,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import heapq
 import subprocess
 import shlex
 from sys import stdin, exit
@@ -37,19 +38,12 @@ from collections import defaultdict
 
 from shared.utils import log_error, log_warning, file_path_from, subprocess_popen, str2bool
 from shared.vcf import vcf_header
+from shared.bgzf import BgzfVcfWriter, compress_index_vcf
 
 major_contigs_order = ["chr" + str(a) for a in list(range(1, 23)) + ["X", "Y"]] + [str(a) for a in
                                                                                    list(range(1, 23)) + ["X", "Y"]]
 
 
-def compress_index_vcf(input_vcf):
-    # use bgzip to compress vcf -> vcf.gz
-    # use tabix to index vcf.gz
-    proc = subprocess.run('bgzip -f {}'.format(input_vcf), shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    proc = subprocess.run('tabix -f -p vcf {}.gz'.format(input_vcf), shell=True, stdout=subprocess.PIPE,
-                          stderr=subprocess.PIPE)
-
-
 def output_header(output_fn, reference_file_path, sample_name='SAMPLE'):
     output_file = open(output_fn, "w")
     output_file.write(vcf_header)
@@ -106,6 +100,133 @@ def sort_vcf_from_stdin(args):
                 output.write(contig_dict[contig][pos])
 
 
+class UnsortedVcfError(Exception):
+    pass
+
+
+def vcf_header_from(vcf_fn):
+    """
+    Return (header rows, first variant row) of a VCF, the first variant row is None if the VCF has no variant.
+    """
+    header = []
+    with open(vcf_fn, 'r') as fn:
+        for row in fn:
+            if row[0] == '#':
+                header.append(row)
+                continue
+            return header, row
+    return header, None
+
+
+def contig_rows_from(vcf_fn, contig, in_memory=False):
+    """
+    Yield (pos, row) of a per-chunk VCF until the first row of another contig. Rows are streamed if the VCF is
+    position sorted, an UnsortedVcfError is raised otherwise, the rows are loaded and sorted if in_memory is set.
+    """
+    pos_row_list = [] if in_memory else None
+    last_pos = None
+    fn = open(vcf_fn, 'r')
+    try:
+        for row in fn:
+            if row[0] == '#':
+                continue
+            columns = row.strip().split(maxsplit=3)
+            ctg_name, pos = columns[0], int(columns[1])
+            # skip vcf file sharing same contig prefix, ie, chr1 and chr11
+            if ctg_name != contig:
+                break
+            if in_memory:
+                pos_row_list.append((pos, row))
+                continue
+            if last_pos is not None and pos < last_pos:
+                raise UnsortedVcfError("{}:{} in {}".format(contig, pos, vcf_fn))
+            last_pos = pos
+            yield pos, row
+    finally:
+        fn.close()
+    if in_memory:
+        pos_row_list.sort(key=lambda x: x[0])
+        for pos, row in pos_row_list:
+            yield pos, row
+
+
+def merge_contig_rows(row_iter_list):
+    """
+    k-way merge the position sorted rows of all VCFs of a contig, if a position is found more than once, the row of
+    the last VCF is kept.
+    """
+    heap = []
+    for idx, row_iter in enumerate(row_iter_list):
+        for pos, row in row_iter:
+            heap.append((pos, idx, row))
+            break
+    heapq.heapify(heap)
+
+    current_pos, current_row = None, None
+    while len(heap):
+        pos, idx, row = heapq.heappop(heap)
+        if current_pos is not None and pos != current_pos:
+            yield current_row
+        current_pos, current_row = pos, row
+        for next_pos, next_row in row_iter_list[idx]:
+            heapq.heappush(heap, (next_pos, idx, next_row))
+            break
+    if current_row is not None:
+        yield current_row
+
+
+def write_sorted_vcf(output_fn, input_dir, all_files, contigs_order_list, compress_vcf=False, in_memory=False):
+    """
+    Merge the per-chunk VCFs into output_fn in contig order. The VCFs are grouped by the contig of their first row in
+    one pass, rows of a contig are merged from all its VCFs with a k-way merge, only one row of each VCF is kept in
+    memory. Return (row_count, no_vcf_output).
+    """
+    row_count = 0
+    contig_set = set(contigs_order_list)
+    contig_vcf_dict = defaultdict(list)
+    empty_vcf_list = []
+    vcf_header_dict = {}
+    for vcf_fn in all_files:
+        vcf_header, first_row = vcf_header_from(os.path.join(input_dir, vcf_fn))
+        row_count += len(vcf_header) + (first_row is not None)
+        vcf_header_dict[vcf_fn] = vcf_header
+        if first_row is None:
+            empty_vcf_list.append(vcf_fn)
+            continue
+        # group by the exact contig of the first row, file names may share a contig prefix, ie, chr1 and chr10
+        contig = first_row.split(maxsplit=1)[0]
+        if contig in contig_set:
+            contig_vcf_dict[contig].append(vcf_fn)
+
+    # use the vcf headers of the first contig with vcf header
+    output_header_rows = []
+    for vcf_fn_list in [contig_vcf_dict[contig] for contig in contigs_order_list] + [empty_vcf_list]:
+        for vcf_fn in vcf_fn_list:
+            for row in vcf_header_dict[vcf_fn]:
+                if row not in output_header_rows:
+                    output_header_rows.append(row)
+        if len(output_header_rows):
+            break
+
+    no_vcf_output = True
+    output = BgzfVcfWriter(output_fn + '.gz') if compress_vcf else open(output_fn, 'w')
+    if len(output_header_rows):
+        output.write(''.join(output_header_rows))
+    try:
+        for contig in contigs_order_list:
+            # only the VCFs of the current contig are opened
+            row_iter_list = [iter(contig_rows_from(os.path.join(input_dir, vcf_fn), contig, in_memory=in_memory))
+                             for vcf_fn in contig_vcf_dict[contig]]
+            for row in merge_contig_rows(row_iter_list):
+                output.write(row)
+                no_vcf_output = False
+            for row_iter in row_iter_list:
+                row_iter.close()
+    finally:
+        output.close()
+    return row_count, no_vcf_output
+
+
 def sort_vcf_from(args):
     """
     Sort vcf file from providing vcf filename prefix.
@@ -158,43 +279,13 @@ def sort_vcf_from(args):
     contigs_order = major_contigs_order + all_contigs_list
     contigs_order_list = sorted(all_contigs_list, key=lambda x: contigs_order.index(x))
 
-    row_count = 0
-    header = []
-    no_vcf_output = True
-    need_write_header = True
-
-    output = open(output_fn, 'w')
-    for contig in contigs_order_list:
-        contig_dict = defaultdict(str)
-        contig_vcf_fns = [fn for fn in all_files if contig in fn]
-        for vcf_fn in contig_vcf_fns:
-            file = os.path.join(input_dir, vcf_fn)
-
-            fn = open(file, 'r')
-            for row in fn:
-                row_count += 1
-                if row[0] == '#':
-                    if row not in header:
-                        header.append(row)
-                    continue
-                # use the first vcf header
-                columns = row.strip().split(maxsplit=3)
-                ctg_name, pos = columns[0], columns[1]
-                # skip vcf file sharing same contig prefix, ie, chr1 and chr11
-                if ctg_name != contig:
-                    break
-                contig_dict[int(pos)] = row
-                no_vcf_output = False
-            fn.close()
-
-        if need_write_header and len(header):
-            output.write(''.join(header))
-            need_write_header = False
-        all_pos = sorted(contig_dict.keys())
-        for pos in all_pos:
-            output.write(contig_dict[pos])
-
-    output.close()
+    try:
+        row_count, no_vcf_output = write_sorted_vcf(output_fn, input_dir, all_files, contigs_order_list,
+                                                    compress_vcf=compress_vcf)
+    except UnsortedVcfError as e:
+        print(log_warning("[WARNING] Unsorted VCF row found at {}, sort the VCFs in memory".format(e)))
+        row_count, no_vcf_output = write_sorted_vcf(output_fn, input_dir, all_files, contigs_order_list,
+                                                    compress_vcf=compress_vcf, in_memory=True)
 
     if row_count == 0:
         print(log_warning("[WARNING] No vcf file found, output empty vcf file"))
@@ -210,9 +301,6 @@ def sort_vcf_from(args):
             compress_index_vcf(output_fn)
         return
 
-    if compress_vcf:
-        compress_index_vcf(output_fn)
-
     print("[INFO] Finished VCF sorting!")
 
 
@@ -1,9 +1,13 @@
 from argparse import ArgumentParser
+import concurrent.futures
+from itertools import repeat
 
 import numpy as np
 import math
 from scipy.ndimage import median_filter
 
+from probe_table import chromosome_indices_from, read_probe_values, write_probe_values
+
 import random
 from time import time
 
@@ -13,7 +17,7 @@ random.seed(seed)
 
 def predictGermlineHomozygousStretches(chr, hom):
     homsam = hom
-    num_hom = np.sum(homsam == 'True')
+    num_hom = np.sum(homsam)
     total_num = len(homsam)
     perchom = num_hom / total_num
     if perchom == 0.0:
@@ -27,14 +31,14 @@ def predictGermlineHomozygousStretches(chr, hom):
         hschr = homsam[chrom]
         hprobes = []
         for probe, value in enumerate(hschr):
-            if value == 'True':
+            if value:
                 hprobes.append(probe)
             else:
                 if len(hprobes) >= homthres:
                     allhprobes.append([chrke, chrom[min(hprobes)], chrom[max(hprobes)]])
                 hprobes = []
         # if the last probe is homozygous, this is not yet accounted for
-        if hschr[-1] == 'True':
+        if hschr[-1]:
             if len(hprobes) >= homthres:
                 allhprobes.append([chrke, chrom[min(hprobes)], chrom[max(hprobes)]])
 
@@ -137,102 +141,82 @@ def aspcfpart(logRpart, allBflip, a, b, d, sd1, sd2, N, kmin, gamma):
         breakpts = [0]
         return {'breakpts': breakpts}
 
-    initSum1 = np.sum(y1[:kmin])
-    initKvad1 = np.sum(y1[:kmin] ** 2)
-    initAve1 = initSum1 / kmin
-    initSum2 = np.sum(y2[:kmin])
-    initKvad2 = np.sum(y2[:kmin] ** 2)
-    initAve2 = initSum2 / kmin
-
-    # Define vector of best costs
-    bestCost = np.zeros(N)
-    cost1 = (initKvad1 - initSum1 * initAve1) / sd1 ** 2
-    cost2 = (initKvad2 - initSum2 * initAve2) / sd2 ** 2
-    bestCost[kmin - 1] = cost1 + cost2
-
-    # Define vector of best splits
-    bestSplit = np.zeros(N, dtype=int)
-
-    # Define vector of best averages
-    bestAver1 = np.zeros(N)
-    bestAver2 = np.zeros(N)
-    bestAver1[kmin - 1] = initAve1
-    bestAver2[kmin - 1] = initAve2
-
-    # Initialize
-    Sum1 = np.zeros(N)
-    Sum2 = np.zeros(N)
-    Kvad1 = np.zeros(N)
-    Kvad2 = np.zeros(N)
-    Aver1 = np.zeros(N)
-    Aver2 = np.zeros(N)
-    Cost = np.zeros(N)
-
-    kminP1 = kmin + 1
-    for k in range(kminP1, 2 * kmin):
-        Sum1[kminP1 - 1:k] += y1[k - 1]
-        Aver1[kminP1 - 1:k] = Sum1[kminP1 - 1:k] / np.arange(k - kmin, 0, -1)
-        Kvad1[kminP1 - 1:k] += y1[k - 1] ** 2
-        Sum2[kminP1 - 1:k] += y2[k - 1]
-        Aver2[kminP1 - 1:k] = Sum2[kminP1 - 1:k] / np.arange(k - kmin, 0, -1)
-        Kvad2[kminP1 - 1:k] += y2[k - 1] ** 2
-
-        bestAver1[k - 1] = (initSum1 + Sum1[kminP1 - 1]) / k
-        bestAver2[k - 1] = (initSum2 + Sum2[kminP1 - 1]) / k
-        cost1 = ((initKvad1 + Kvad1[kminP1 - 1]) - k * bestAver1[k - 1] ** 2) / sd1 ** 2
-        cost2 = ((initKvad2 + Kvad2[kminP1 - 1]) - k * bestAver2[k - 1] ** 2) / sd2 ** 2
-
-        bestCost[k - 1] = cost1 + cost2
-
-    for n in range(2 * kmin, N + 1):
-        nMkminP1 = n - kmin + 1
+    bestSplit = pcfBreakpoints([y1, y2], [sd1, sd2], kmin, gamma)
 
-        Sum1[kminP1 - 1:n] += y1[n - 1]
-        Aver1[kminP1 - 1:n] = Sum1[kminP1 - 1:n] / np.arange(n - kmin, 0, -1)
-        Kvad1[kminP1 - 1:n] += y1[n - 1] ** 2
+    # Trace back
+    n = N
+    breakpts = [n]
+    while n > 0:
+        n = bestSplit[n]
+        breakpts.append(n)
 
-        cost1 = (Kvad1[kminP1 - 1:nMkminP1] - Sum1[kminP1 - 1:nMkminP1] * Aver1[kminP1 - 1:nMkminP1]) / sd1 ** 2
+    breakpts = np.array(breakpts) + from_idx
+    breakpts = breakpts[(breakpts >= usefrom) & (breakpts <= useto)].tolist()
 
-        Sum2[kminP1 - 1:n] += y2[n - 1]
-        Aver2[kminP1 - 1:n] = Sum2[kminP1 - 1:n] / np.arange(n - kmin, 0, -1)
-        Kvad2[kminP1 - 1:n] += y2[n - 1] ** 2
-        cost2 = (Kvad2[kminP1 - 1:nMkminP1] - Sum2[kminP1 - 1:nMkminP1] * Aver2[kminP1 - 1:nMkminP1]) / sd2 ** 2
+    return {'breakpts': breakpts}
 
-        Cost[kminP1 - 1:nMkminP1] = bestCost[kmin - 1:n - kmin] + cost1 + cost2
 
-        Pos = np.argmin(Cost[kminP1 - 1:nMkminP1]) + kmin
-        cost = Cost[Pos - 1] + gamma
+def pcfBreakpoints(y_list, sd_list, kmin, gamma):
+    """
+    Pruned optimal partitioning behind fastAspcf and exactPcf.
 
-        aver1 = Aver1[Pos - 1]
-        aver2 = Aver2[Pos - 1]
-        totAver1 = (Sum1[kminP1 - 1] + initSum1) / n
-        totCost1 = ((Kvad1[kminP1 - 1] + initKvad1) - n * totAver1 ** 2) / sd1 ** 2
-        totAver2 = (Sum2[kminP1 - 1] + initSum2) / n
-        totCost2 = ((Kvad2[kminP1 - 1] + initKvad2) - n * totAver2 ** 2) / sd2 ** 2
-        totCost = totCost1 + totCost2
+    Segment costs come from prefix sums in O(1), and a split position is dropped for good once it can no longer beat
+    a later one (PELT pruning, delayed by kmin so the minimal plateau length is respected), so each arm costs close to
+    O(N) instead of O(N^2).
 
-        if totCost < cost:
-            Pos = 1
-            cost = totCost
-            aver1 = totAver1
-            aver2 = totAver2
+    Parameters:
+    y_list (list of np.ndarray): Input tracks of equal length, their costs are summed.
+    sd_list (list of float): Standard deviation used to scale the squared error of each track.
+    kmin (int): Minimal length of plateaus.
+    gamma (float): Penalty for each discontinuity.
 
-        bestCost[n - 1] = cost
-        bestAver1[n - 1] = aver1
-        bestAver2[n - 1] = aver2
-        bestSplit[n - 1] = Pos - 1
+    Returns:
+    np.ndarray: bestSplit, where bestSplit[n] is the start of the last plateau of the optimal segmentation of y[:n].
+    """
+    N = len(y_list[0])
+    cum_list = []
+    for y, sd in zip(y_list, sd_list):
+        y = np.asarray(y, dtype=float)
+        cum_list.append((np.concatenate(([0.0], np.cumsum(y))), np.concatenate(([0.0], np.cumsum(y ** 2))), sd ** 2))
+
+    def segment_cost(start, end):
+        length = end - start
+        cost = 0.0
+        for cum_sum, cum_kvad, var in cum_list:
+            seg_sum = cum_sum[end] - cum_sum[start]
+            cost = cost + (cum_kvad[end] - cum_kvad[start] - seg_sum * seg_sum / length) / var
+        return cost
+
+    bestCost = np.zeros(N + 1)
+    bestSplit = np.zeros(N + 1, dtype=int)
+    for n in range(kmin, min(2 * kmin, N + 1)):
+        bestCost[n] = segment_cost(0, n)
+
+    # split candidates are kept sorted so ties resolve to the leftmost split, a single plateau must be strictly better
+    splits = np.empty(0, dtype=int)
+    keep_total = True
+    for n in range(2 * kmin, N + 1):
+        new_split = n - kmin
+        if len(splits):
+            splits = splits[bestCost[splits] + segment_cost(splits, new_split) <= bestCost[new_split]]
+        if keep_total and segment_cost(0, new_split) - gamma > bestCost[new_split]:
+            keep_total = False
+        splits = np.append(splits, new_split)
 
-    # Trace back
-    n = N
-    breakpts = [n]
-    while n > 0:
-        breakpts.append(bestSplit[n - 1])
-        n = bestSplit[n - 1]
+        Cost = bestCost[splits] + segment_cost(splits, n)
+        idx = np.argmin(Cost)
+        cost = Cost[idx] + gamma
+        split = splits[idx]
+        if keep_total:
+            totCost = segment_cost(0, n)
+            if totCost < cost:
+                cost = totCost
+                split = 0
 
-    breakpts = np.array(breakpts) + from_idx - 1
-    breakpts = breakpts[(breakpts >= usefrom) & (breakpts <= useto)].tolist()
+        bestCost[n] = cost
+        bestSplit[n] = split
 
-    return {'breakpts': breakpts}
+    return bestSplit
 
 
 def getMad(x, k=25):
@@ -260,7 +244,7 @@ def exactPcf(y, kmin, gamma):
     gamma (float): Penalty for each discontinuity.
 
     Returns:
-    np.ndarray: Output array of filtered values.
+    dict: 'yhat', output array of filtered values.
     """
     N = len(y)
     y = np.array(y)
@@ -268,63 +252,15 @@ def exactPcf(y, kmin, gamma):
 
     if N < 2 * kmin:
         yhat[:] = np.mean(y)
-        return yhat
+        return {'yhat': yhat}
 
-    init_sum = np.sum(y[:kmin])
-    init_kvad = np.sum(y[:kmin] ** 2)
-    init_ave = init_sum / kmin
-
-    best_cost = np.zeros(N)
-    best_cost[kmin - 1] = init_kvad - init_sum * init_ave
-
-    best_split = np.zeros(N, dtype=int)
-    best_aver = np.zeros(N)
-    best_aver[kmin - 1] = init_ave
-
-    Sum = np.zeros(N)
-    Kvad = np.zeros(N)
-    Aver = np.zeros(N)
-    Cost = np.zeros(N)
-
-    kminP1 = kmin + 1
-
-    for k in range(kminP1, 2 * kmin):
-        Sum[kminP1 - 1:k] += y[k - 1]
-        Aver[kminP1 - 1:k] = Sum[kminP1 - 1:k] / np.arange(k - kmin, 0, -1)
-        Kvad[kminP1 - 1:k] += y[k - 1] ** 2
-        best_aver[k - 1] = (init_sum + Sum[kminP1 - 1]) / k
-        best_cost[k - 1] = (init_kvad + Kvad[kminP1 - 1]) - k * best_aver[k - 1] ** 2
-
-    for n in range(2 * kmin, N + 1):
-        yn = y[n - 1]
-        yn2 = yn ** 2
-        Sum[kminP1 - 1:n] += yn
-        Aver[kminP1 - 1:n] = Sum[kminP1 - 1:n] / np.arange(n - kmin, 0, -1)
-        Kvad[kminP1 - 1:n] += yn2
-
-        nMkminP1 = n - kmin + 1
-        Cost[kminP1 - 1:nMkminP1] = best_cost[kmin - 1:n - kmin] + Kvad[kminP1 - 1:nMkminP1] - Sum[kminP1 - 1:nMkminP1] * Aver[kminP1 - 1:nMkminP1] + gamma
-
-        Pos = np.argmin(Cost[kminP1 - 1:nMkminP1]) + kmin
-        cost = Cost[Pos - 1]
-        aver = Aver[Pos - 1]
-
-        tot_aver = (Sum[kminP1 - 1] + init_sum) / n
-        tot_cost = (Kvad[kminP1 - 1] + init_kvad) - n * tot_aver ** 2
-
-        if tot_cost < cost:
-            Pos = 1
-            cost = tot_cost
-            aver = tot_aver
-
-        best_cost[n - 1] = cost
-        best_aver[n - 1] = aver
-        best_split[n - 1] = Pos - 1
+    bestSplit = pcfBreakpoints([y], [1.0], kmin, gamma)
 
     n = N
     while n > 0:
-        yhat[best_split[n - 1]:n] = best_aver[n - 1]
-        n = best_split[n - 1]
+        start = bestSplit[n]
+        yhat[start:n] = np.mean(y[start:n])
+        n = start
 
     return {'yhat': yhat}
 
@@ -422,61 +358,17 @@ def rle_lengths(arr):
         return np.diff(np.append(-1, i))
 
 
-def aspcf(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_pcfed_output_file, tumor_baf_pcfed_output_file, penalty, sample_name):
-    tumor_logr = open(tumor_logr_file, 'r')
-    tumor_baf = open(tumor_baf_file, 'r')
-    germline_genotypes = open(germline_genotypes_file, 'r')
-    tumor_logr_dict = dict()
-    tumor_baf_dict = dict()
-    germline_genotypes_dict = dict()
-    for idx, tumor_logr_line in enumerate(tumor_logr.readlines()):
-        if idx == 0:
-            continue
-        tumor_logr_info = tumor_logr_line.strip().split('\t')
-        chr = tumor_logr_info[0]
-        pos = tumor_logr_info[1]
-        logr = tumor_logr_info[2]
-        key = (str(chr), str(pos))
-        tumor_logr_dict[key] = logr
-    for idx, tumor_baf_line in enumerate(tumor_baf.readlines()):
-        if idx == 0:
-            continue
-        tumor_baf_info = tumor_baf_line.strip().split('\t')
-        chr = tumor_baf_info[0]
-        pos = tumor_baf_info[1]
-        baf = tumor_baf_info[2]
-        key = (str(chr), str(pos))
-        tumor_baf_dict[key] = baf
-    for idx, germline_genotypes_line in enumerate(germline_genotypes.readlines()):
-        if idx == 0:
-            continue
-        germline_genotypes_info = germline_genotypes_line.strip().split('\t')
-        chr = germline_genotypes_info[0]
-        pos = germline_genotypes_info[1]
-        gg = germline_genotypes_info[2]
-        key = (str(chr), str(pos))
-        germline_genotypes_dict[key] = gg
-
-    germline_genotypes_values = np.array(list(germline_genotypes_dict.values()))
-
-    result = []
-    current_chr = None
-    temp_list = []
-    for index, (key, value) in enumerate(tumor_baf_dict.items()):
-        chr_key = key[0]
-
-        if chr_key != current_chr:
-            if temp_list:
-                result.append(temp_list)
-            temp_list = []
-            current_chr = chr_key
-
-        temp_list.append(index)
-
-    if temp_list:
-        result.append(temp_list)
-
-    ghs = predictGermlineHomozygousStretches(result, germline_genotypes_values)
+def aspcfFrom(chr_array, logr, tbsam, homosam, penalty, threads=1):
+    """
+    Allele-specific piecewise constant fitting of the probes. homosam is True for the homozygous probes. Return the
+    segmented LogR of all probes and the segmented BAF of the heterozygous probes.
+    """
+    logr = np.asarray(logr, dtype=float)
+    tbsam = np.asarray(tbsam, dtype=float)
+    homosam = np.asarray(homosam, dtype=bool)
+    result = chromosome_indices_from(chr_array)
+
+    ghs = predictGermlineHomozygousStretches(result, homosam)
 
     segmentlengths = sorted(list({penalty, 70, 100, 140}))
     segmentlengths = [l for l in segmentlengths if l >= penalty]
@@ -484,46 +376,63 @@ def aspcf(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_p
     logRPCFed = np.array([])
     bafPCFed = np.array([])
 
+    # winsorization and het-probe averaging do not depend on the segment length, prepare every arm once
+    chrom_info_list = []
+    for chrke, chrom in enumerate(result):
+        lr = logr[chrom]
+        lrwins = madWins(lr, 2.5, 25)['ywin']
+        baf = tbsam[chrom]
+        homo = homosam[chrom]
+        Select_het = ~homo
+        bafsel = baf[Select_het]
+        bafselwinsmirrored = madWins(np.where(bafsel > 0.5, bafsel, 1 - bafsel), 2.5, 25)['ywin']
+        bafselwins = np.where(bafsel > 0.5, bafselwinsmirrored, 1 - bafselwinsmirrored)
+        select_het_indices = np.where(Select_het)[0]
+        logRaveraged = None
+
+        if len(select_het_indices) != 0:
+            averageIndices = np.concatenate(([0], (select_het_indices[:-1] + select_het_indices[1:]) / 2, [len(lr)]))
+            startindices = np.ceil(averageIndices[:-1]).astype(int)
+            endindices = np.floor(averageIndices[1:]).astype(int)
+
+            if len(select_het_indices) == 1:
+                startindices = [0]
+                endindices = [len(lr) - 1]
+
+            logRaveraged = np.full(len(select_het_indices), np.nan)
+
+            for i in range(len(select_het_indices)):
+                if np.isnan(endindices[i]):
+                    endindices[i] = startindices[i]
+                logRaveraged[i] = np.nanmean(lrwins[startindices[i]:endindices[i] + 1])
+
+        chrom_info_list.append((lr, bafselwinsmirrored, bafselwins, select_het_indices, logRaveraged))
+
+    # arms are independent, segment them across one process pool shared by all segment lengths if threads > 1
+    pcf_chrke_list = [chrke for chrke, chrom_info in enumerate(chrom_info_list)
+                      if chrom_info[4] is not None and len(chrom_info[4]) >= 6]
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=threads) if threads > 1 else None
+    pcf_map = executor.map if executor is not None else map
+
     for segmentlength in segmentlengths:
         logRPCFed = np.array([])
         bafPCFed = np.array([])
-        tbsam = np.array(list(tumor_baf_dict.values())).astype(float)
-        logr = np.array(list(tumor_logr_dict.values())).astype(float)
-        homosam = np.array(list(germline_genotypes_dict.values()))
+
+        pcf_result_dict = dict(zip(pcf_chrke_list, pcf_map(fastAspcf,
+                                                           [chrom_info_list[chrke][4] for chrke in pcf_chrke_list],
+                                                           [chrom_info_list[chrke][2] for chrke in pcf_chrke_list],
+                                                           repeat(6),
+                                                           repeat(segmentlength))))
+
         for chrke, chrom in enumerate(result):
-            lr = logr[chrom]
-            lrwins = madWins(lr, 2.5, 25)['ywin']
-            baf = tbsam[chrom]
-            homo = homosam[chrom]
-            Select_het = homo == 'False'
-            bafsel = baf[Select_het]
-            bafselwinsmirrored = madWins(np.where(bafsel > 0.5, bafsel, 1 - bafsel), 2.5, 25)['ywin']
-            bafselwins = np.where(bafsel > 0.5, bafselwinsmirrored, 1 - bafselwinsmirrored)
-            select_het_indices = np.where(Select_het)[0]
-            logRaveraged = None
-
-            if len(select_het_indices) != 0:
-                averageIndices = np.concatenate(([0], (select_het_indices[:-1] + select_het_indices[1:]) / 2, [len(lr)]))
-                startindices = np.ceil(averageIndices[:-1]).astype(int)
-                endindices = np.floor(averageIndices[1:]).astype(int)
-
-                if len(select_het_indices) == 1:
-                    startindices = [0]
-                    endindices = [len(lr) - 1]
-
-                logRaveraged = np.full(len(select_het_indices), np.nan)
-
-                for i in range(len(select_het_indices)):
-                    if np.isnan(endindices[i]):
-                        endindices[i] = startindices[i]
-                    logRaveraged[i] = np.nanmean(lrwins[startindices[i]:endindices[i] + 1])
+            lr, bafselwinsmirrored, bafselwins, select_het_indices, logRaveraged = chrom_info_list[chrke]
 
             if len(logRaveraged) > 0:
                 if len(logRaveraged) < 6:
                     logRASPCF = np.full(len(logRaveraged), np.mean(logRaveraged))
                     bafASPCF = np.full(len(logRaveraged), np.mean(bafselwinsmirrored))
                 else:
-                    PCFed = fastAspcf(logRaveraged, bafselwins, 6, segmentlength)
+                    PCFed = pcf_result_dict[chrke]
                     logRASPCF = PCFed['yhat1']
                     bafASPCF = PCFed['yhat2']
 
@@ -629,28 +538,27 @@ def aspcf(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_p
         if len(np.unique(logRPCFed)) < 800:
             break
 
+    if executor is not None:
+        executor.shutdown()
+
     bafPCFed = np.array(bafPCFed)
     Tumor_LogR_segmented = logRPCFed
     Tumor_BAF_segmented = 1 - bafPCFed
+    return Tumor_LogR_segmented, Tumor_BAF_segmented
 
-    tumor_logr_pcfed_output_dict = {key: Tumor_LogR_segmented[idx] for idx, key in enumerate(tumor_logr_dict.keys())}
 
-    het = germline_genotypes_values == 'False'
-    het_indices = np.where(het)[0]
-    het_indices_keys = np.array(list(tumor_baf_dict.keys()))[het_indices]
-    tumor_baf_pcfed_output_dict = {tuple(key): Tumor_BAF_segmented[idx] for idx, key in enumerate(het_indices_keys)}
+def aspcf(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_pcfed_output_file, tumor_baf_pcfed_output_file, penalty, sample_name, threads=1):
+    chr_array, pos_array, logr = read_probe_values(tumor_logr_file)
+    tumor_baf = read_probe_values(tumor_baf_file)[2]
+    germline_genotypes = read_probe_values(germline_genotypes_file, dtype=bool)[2]
 
-    output_header = 'Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n'
-    tumor_logr_pcfed_output = open(tumor_logr_pcfed_output_file, 'w')
-    tumor_logr_pcfed_output.write(output_header)
-    for key, value in tumor_logr_pcfed_output_dict.items():
-        tumor_logr_pcfed_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-        tumor_logr_pcfed_output.write(tumor_logr_pcfed_string)
-    tumor_baf_pcfed_output = open(tumor_baf_pcfed_output_file, 'w')
-    tumor_baf_pcfed_output.write(output_header)
-    for key, value in tumor_baf_pcfed_output_dict.items():
-        tumor_baf_pcfed_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-        tumor_baf_pcfed_output.write(tumor_baf_pcfed_string)
+    Tumor_LogR_segmented, Tumor_BAF_segmented = aspcfFrom(chr_array, logr, tumor_baf, germline_genotypes, penalty,
+                                                          threads)
+
+    het_indices = np.where(~germline_genotypes)[0]
+    write_probe_values(tumor_logr_pcfed_output_file, sample_name, chr_array, pos_array, Tumor_LogR_segmented)
+    write_probe_values(tumor_baf_pcfed_output_file, sample_name, chr_array[het_indices], pos_array[het_indices],
+                       Tumor_BAF_segmented)
 
 
 def main():
@@ -684,10 +592,14 @@ def main():
                         default="SAMPLE",
                         help="Tumor sample name")
 
+    parser.add_argument('--threads', type=int,
+                        default=1,
+                        help="Number of processes to segment chromosome arms in parallel")
+
     global args
     args = parser.parse_args()
 
-    aspcf(args.tumor_logr_file, args.tumor_baf_file, args.germline_genotypes_file, args.tumor_logr_pcfed_output_file, args.tumor_baf_pcfed_output_file, args.penalty, args.sample_name)
+    aspcf(args.tumor_logr_file, args.tumor_baf_file, args.germline_genotypes_file, args.tumor_logr_pcfed_output_file, args.tumor_baf_pcfed_output_file, args.penalty, args.sample_name, args.threads)
 
 
 if __name__ == "__main__":
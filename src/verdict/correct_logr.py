@@ -4,6 +4,8 @@ import numpy as np
 from scipy.interpolate import BSpline
 from sklearn.linear_model import LinearRegression
 
+from probe_table import read_probe_values, write_probe_values
+
 
 def create_bspline_basis(x, df, degree=3):
     """Create B-spline basis for given data"""
@@ -11,51 +13,34 @@ def create_bspline_basis(x, df, degree=3):
     knots = np.linspace(np.min(x), np.max(x), n_knots)
     knots = np.concatenate(([knots[0]] * degree, knots, [knots[-1]] * degree))
     spline = BSpline(knots, np.eye(len(knots) - degree - 1), degree)
-    return np.row_stack([spline(xi) for xi in x])
-
-
-def correctLogR(tumor_logr_file, gc_content_file, replication_timing_file, tumor_logr_correction_output_file, sample_name):
-    tumor_logr = open(tumor_logr_file, 'r')
-    gc_content = open(gc_content_file, 'r')
-    replication_timing = open(replication_timing_file, 'r')
-    tumor_logr_dict = dict()
-    gc_content_dict = dict()
-    replication_timing_dict = dict()
-    for idx, tumor_logr_line in enumerate(tumor_logr.readlines()):
-        if idx == 0:
-            continue
-        tumor_logr_info = tumor_logr_line.strip().split('\t')
-        chr = tumor_logr_info[0]
-        pos = tumor_logr_info[1]
-        logr = tumor_logr_info[2]
-        key = (str(chr), str(pos))
-        tumor_logr_dict[key] = logr
-    for idx, gc_content_line in enumerate(gc_content.readlines()):
-        if idx == 0:
-            continue
-        gc_content_info = gc_content_line.strip().split('\t')
-        chr = 'chr' + str(gc_content_info[1])
-        pos = gc_content_info[2]
-        gccontent = ('\t').join(gc_content_info[3:])
-        key = (str(chr), str(pos))
-        gc_content_dict[key] = gccontent
-    for idx, replication_timing_line in enumerate(replication_timing.readlines()):
-        if idx == 0:
-            continue
-        replication_timing_info = replication_timing_line.strip().split('\t')
-        chr = 'chr' + str(replication_timing_info[1])
-        pos = replication_timing_info[2]
-        replicationtiming = ('\t').join(replication_timing_info[3:])
-        key = (str(chr), str(pos))
-        replication_timing_dict[key] = replicationtiming
-
-    overlap_keys = tumor_logr_dict.keys()
-    tumor_logr_dict_overlap = {key: tumor_logr_dict[key] for key in overlap_keys}
-    gc_content_dict_overlap = {key: gc_content_dict[key] for key in overlap_keys}
-
-    tumor_logr_dict_values = np.array(list(tumor_logr_dict_overlap.values())).astype(float)
-    gc_content_dict_values = [gc_content_value.split('\t') for gc_content_value in list(gc_content_dict_overlap.values())]
-    gc_content_dict_values = np.array(gc_content_dict_values).astype(float)
+    return np.vstack([spline(xi) for xi in x])
+
+
+def probe_resource_values_from(resource_file, chr_array, pos_array):
+    """
+    Values of a G1000 GC content or replication timing file at each probe, a float array of shape (probes, columns).
+    Only the rows of the probes are kept while reading.
+    """
+    probe_key_set = set(zip(chr_array.tolist(), [str(pos) for pos in pos_array.tolist()]))
+    resource_dict = dict()
+    with open(resource_file, 'r') as f:
+        f.readline()
+        for row in f:
+            columns = row.strip().split('\t', 3)
+            key = ('chr' + str(columns[1]), columns[2])
+            if key in probe_key_set:
+                resource_dict[key] = columns[3]
+    return np.array([resource_dict[(chr, str(pos))].split('\t') for chr, pos in
+                     zip(chr_array.tolist(), pos_array.tolist())]).astype(float)
+
+
+def correctedLogRFrom(chr_array, pos_array, tumor_logr, gc_content_file, replication_timing_file):
+    """
+    GC content and replication timing corrected LogR of the probes, the residuals of a linear fit of the LogR on the
+    B-spline bases of the best correlated GC content and replication timing columns.
+    """
+    tumor_logr_dict_values = np.asarray(tumor_logr, dtype=float)
+    gc_content_dict_values = probe_resource_values_from(gc_content_file, chr_array, pos_array)
 
     corr_gc = np.abs(np.corrcoef(gc_content_dict_values, tumor_logr_dict_values, rowvar=False))[0, 1:]
 
@@ -64,10 +49,7 @@ def correctLogR(tumor_logr_file, gc_content_file, replication_timing_file, tumor
     maxGCcol_insert = np.argmax(corr_gc[:(index_1kb + 1)])
     maxGCcol_amplic = np.argmax(corr_gc[(index_1kb + 2):(index_max + 1)]) + (index_1kb + 2)
 
-    replication_timing_dict_overlap = {key: replication_timing_dict[key] for key in overlap_keys}
-    replication_timing_dict_values = [replication_timing_value.split('\t') for replication_timing_value in
-                              list(replication_timing_dict_overlap.values())]
-    replication_timing_dict_values = np.array(replication_timing_dict_values).astype(float)
+    replication_timing_dict_values = probe_resource_values_from(replication_timing_file, chr_array, pos_array)
 
     corr_rep = np.abs(np.corrcoef(replication_timing_dict_values, tumor_logr_dict_values, rowvar=False))[0, 1:]
 
@@ -81,16 +63,13 @@ def correctLogR(tumor_logr_file, gc_content_file, replication_timing_file, tumor
     y = tumor_logr_dict_values.reshape(-1, 1)
     model = LinearRegression(fit_intercept=True).fit(X, y)
     residuals = y - model.predict(X)
-    tumor_logr_dict_values_after = residuals.flatten()
+    return residuals.flatten()
 
-    tumor_logr_dict_overlap_after = {key: tumor_logr_dict_values_after[idx] for idx, key in enumerate(overlap_keys)}
 
-    output_header = 'Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n'
-    tumor_logr_correction_output = open(tumor_logr_correction_output_file, 'w')
-    tumor_logr_correction_output.write(output_header)
-    for key, value in tumor_logr_dict_overlap_after.items():
-        tumor_logr_correction_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-        tumor_logr_correction_output.write(tumor_logr_correction_string)
+def correctLogR(tumor_logr_file, gc_content_file, replication_timing_file, tumor_logr_correction_output_file, sample_name):
+    chr_array, pos_array, tumor_logr = read_probe_values(tumor_logr_file)
+    tumor_logr_corrected = correctedLogRFrom(chr_array, pos_array, tumor_logr, gc_content_file, replication_timing_file)
+    write_probe_values(tumor_logr_correction_output_file, sample_name, chr_array, pos_array, tumor_logr_corrected)
 
 
 def main():
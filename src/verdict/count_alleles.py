@@ -0,0 +1,176 @@
+import os
+import sys
+import shlex
+import tempfile
+import concurrent.futures
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+from shared.utils import subprocess_popen, samtools_input_option_from
+from shared.pileup import READ_MARKER_PATTERN, INDEL_PATTERN
+
+# same read filters as alleleCounter -m 20 -q 20 -f 0 -F 2316
+MIN_BASE_QUALITY = 20
+MIN_MAPPING_QUALITY = 20
+EXCLUDE_FLAGS = 2316
+ALLELE_INDEX = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
+
+
+def load_alleles(alleles_file_path):
+    """
+    Sorted 1-based positions and the 0-3 (ACGT) index of the ref and alt allele of a G1000 alleles file, each as a NumPy
+    array.
+    """
+    alleles = np.loadtxt(alleles_file_path, dtype=np.int64, skiprows=1, usecols=(0, 1, 2), ndmin=2)
+    alleles = alleles[np.argsort(alleles[:, 0], kind='stable')]
+    positions, unique_idx = np.unique(alleles[:, 0], return_index=True)
+    return positions, alleles[unique_idx, 1] - 1, alleles[unique_idx, 2] - 1
+
+
+def read_bases_from(pileup_bases):
+    """
+    One base per read of a mpileup base column, read markers and indel sequences removed.
+    """
+    if '^' in pileup_bases or '$' in pileup_bases:
+        pileup_bases = READ_MARKER_PATTERN.sub('', pileup_bases)
+    if '+' not in pileup_bases and '-' not in pileup_bases:
+        return pileup_bases
+    base_list = []
+    start = 0
+    indel_match = INDEL_PATTERN.search(pileup_bases, start)
+    while indel_match is not None:
+        base_list.append(pileup_bases[start:indel_match.start()])
+        start = indel_match.end() + int(indel_match.group(1))
+        indel_match = INDEL_PATTERN.search(pileup_bases, start)
+    base_list.append(pileup_bases[start:])
+    return ''.join(base_list)
+
+
+def base_counts_from(bases, qualities, read_names, min_base_quality=MIN_BASE_QUALITY):
+    """
+    A, C, G, T counts of a mpileup position as alleleCounter counts them. The first read of a name stores its base, and
+    a later read of the same name (the overlapping mate) is only counted if its base differs from the stored one. Each
+    counted base needs a base quality of at least min_base_quality.
+    """
+    min_quality_char = chr(min_base_quality + 33)
+    bases = bases.upper()
+    if min(qualities) >= min_quality_char and len(set(read_names)) == len(read_names):
+        return [bases.count('A'), bases.count('C'), bases.count('G'), bases.count('T')]
+
+    counts = [0, 0, 0, 0]
+    read_base_dict = {}
+    for base, quality, read_name in zip(bases, qualities, read_names):
+        if read_name in read_base_dict:
+            if read_base_dict[read_name] == base:
+                continue
+        else:
+            read_base_dict[read_name] = base
+        if quality >= min_quality_char and base in ALLELE_INDEX:
+            counts[ALLELE_INDEX[base]] += 1
+    return counts
+
+
+def allele_counts_from(samtools, bam_fn, ctg_name, positions, ref_fn=None, decode_threads=0):
+    """
+    A, C, G, T counts of a BAM at the sorted positions of a contig, an int32 array of shape (len(positions), 4), from
+    a single samtools mpileup pass over the contig.
+    """
+    counts = np.zeros((len(positions), 4), dtype=np.int32)
+    if len(positions) == 0:
+        return counts
+    with tempfile.NamedTemporaryFile('w', suffix='.pos', delete=False) as f:
+        positions_fn = f.name
+        f.write(''.join(['{}\t{}\n'.format(ctg_name, pos) for pos in positions]))
+
+    # no BAQ, orphan reads kept, no depth cap and no overlap detection, as alleleCounter (bam_plp_init without
+    # bam_plp_init_overlaps), the base quality and overlapping mates are handled in base_counts_from()
+    samtools_command = "{} mpileup -B -A -x -d 0 --min-MQ {} --min-BQ 0 --excl-flags {} --output-QNAME -r {} -l {}{} {}".format(
+        samtools, MIN_MAPPING_QUALITY, EXCLUDE_FLAGS, ctg_name, positions_fn,
+        samtools_input_option_from(bam_fn, ref_fn, decode_threads), bam_fn)
+    row_positions = []
+    row_counts = []
+    try:
+        samtools_mpileup_process = subprocess_popen(shlex.split(samtools_command))
+        for row in samtools_mpileup_process.stdout:
+            columns = row.rstrip('\n').split('\t')
+            if len(columns) < 7 or columns[3] == '0':
+                continue
+            row_positions.append(int(columns[1]))
+            row_counts.append(base_counts_from(read_bases_from(columns[4]), columns[5], columns[6].split(',')))
+        samtools_mpileup_process.stdout.close()
+        samtools_mpileup_process.wait()
+    finally:
+        os.remove(positions_fn)
+    if samtools_mpileup_process.returncode != 0:
+        sys.exit("[ERROR] Failed to count the alleles of {} in {}".format(ctg_name, bam_fn))
+
+    if len(row_positions):
+        row_idx = np.searchsorted(positions, np.array(row_positions, dtype=np.int64))
+        is_locus = (row_idx < len(positions)) & (positions[np.minimum(row_idx, len(positions) - 1)] == row_positions)
+        counts[row_idx[is_locus]] = np.array(row_counts, dtype=np.int32)[is_locus]
+    return counts
+
+
+def allele_counts_from_file(allele_counts_file_path, positions):
+    """
+    A, C, G, T counts of an alleleCounter output file at the sorted positions, an int32 array of shape
+    (len(positions), 4), the rows of other positions are ignored.
+    """
+    counts = np.zeros((len(positions), 4), dtype=np.int32)
+    rows = np.loadtxt(allele_counts_file_path, dtype=np.int64, skiprows=1, usecols=(1, 2, 3, 4, 5), ndmin=2)
+    if len(rows) == 0 or len(positions) == 0:
+        return counts
+    row_idx = np.searchsorted(positions, rows[:, 0])
+    is_locus = (row_idx < len(positions)) & (positions[np.minimum(row_idx, len(positions) - 1)] == rows[:, 0])
+    counts[row_idx[is_locus]] = rows[is_locus, 1:]
+    return counts
+
+
+def load_allele_counts(contig_list, alleles_file_prefix, tumor_allele_counts_file_prefix,
+                       normal_allele_counts_file_prefix=None):
+    """
+    Same dict as count_alleles() from the per contig alleleCounter output files.
+    """
+    allele_count_dict = {}
+    for ctg_name in contig_list:
+        positions, ref_idx, alt_idx = load_alleles(alleles_file_prefix + str(ctg_name) + '.txt')
+        tumor_counts = allele_counts_from_file(tumor_allele_counts_file_prefix + str(ctg_name) + '.txt', positions)
+        normal_counts = allele_counts_from_file(normal_allele_counts_file_prefix + str(ctg_name) + '.txt', positions) \
+            if normal_allele_counts_file_prefix is not None else None
+        allele_count_dict[ctg_name] = (positions, ref_idx, alt_idx, tumor_counts, normal_counts)
+    return allele_count_dict
+
+
+def count_alleles(samtools, contig_list, alleles_file_prefix, tumor_bam_fn, normal_bam_fn=None, threads=1,
+                  ref_fn=None, decode_threads=0):
+    """
+    Read the alleles of each contig once and count them in the tumor and normal BAM, the contig and BAM pairs are
+    counted in a thread pool, each samtools decodes its BAM with decode_threads htslib threads. Return a dict contig:
+    (positions, ref index, alt index, tumor counts, normal counts), normal counts is None without a normal BAM.
+    """
+    alleles_dict = {}
+    for ctg_name in contig_list:
+        alleles_dict[ctg_name] = load_alleles(alleles_file_prefix + str(ctg_name) + '.txt')
+
+    # keyed on the role, the tumor and normal BAM may be the same file
+    bam_fn_dict = {'tumor': tumor_bam_fn}
+    if normal_bam_fn is not None:
+        bam_fn_dict['normal'] = normal_bam_fn
+    count_dict = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as executor:
+        future_dict = {}
+        for ctg_name in contig_list:
+            for role, bam_fn in bam_fn_dict.items():
+                future = executor.submit(allele_counts_from, samtools, bam_fn, ctg_name, alleles_dict[ctg_name][0], ref_fn,
+                                         decode_threads)
+                future_dict[future] = (ctg_name, role)
+        for future in concurrent.futures.as_completed(future_dict):
+            count_dict[future_dict[future]] = future.result()
+
+    allele_count_dict = {}
+    for ctg_name in contig_list:
+        positions, ref_idx, alt_idx = alleles_dict[ctg_name]
+        normal_counts = count_dict[(ctg_name, 'normal')] if normal_bam_fn is not None else None
+        allele_count_dict[ctg_name] = (positions, ref_idx, alt_idx, count_dict[(ctg_name, 'tumor')], normal_counts)
+    return allele_count_dict
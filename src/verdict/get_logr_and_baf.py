@@ -1,170 +1,103 @@
 from argparse import ArgumentParser
 
-import math
+import numpy as np
 
-import random
 from time import time
 
+from count_alleles import count_alleles, load_allele_counts
+from probe_table import write_probe_values
+
 seed = int(time())
-random.seed(seed)
 
 major_contigs_order = ["chr" + str(a) for a in list(range(1, 23)) + ["X"]]
 
 
 def getBAFsAndLogRs(tumor_allele_counts_file_prefix, normal_allele_counts_file_prefix, alleles_file_prefix, tumor_logr_output_file, tumor_baf_output_file, normal_baf_output_file, sample_name, normal_sample_name, contig_fn):
-    allele_map_dict = {'1': 'A', '2': 'C', '3': 'G', '4': 'T'}
-    allele_dict = dict()
-    totalTumor_dict = dict()
-    tumorBAF_dict = dict()
-    totalNormal_dict = dict()
-    normalBAF_dict = dict()
-    contig_fn = open(contig_fn, 'r')
+    """
+    Tumor LogR, tumor BAF and normal BAF files from the per contig alleleCounter output files, the BAFs are mirrored
+    with the same random generator as the built-in allele counter and run_verdict.
+    """
+    contig_list = contigs_from(contig_fn)
+    allele_count_dict = load_allele_counts(contig_list, alleles_file_prefix, tumor_allele_counts_file_prefix,
+                                           normal_allele_counts_file_prefix)
+    write_logr_and_baf(allele_count_dict, contig_list, normal_allele_counts_file_prefix is not None,
+                       tumor_logr_output_file, tumor_baf_output_file, normal_baf_output_file, sample_name,
+                       normal_sample_name)
+
+
+def contigs_from(contig_fn):
     contig_list = []
-    for contig in contig_fn:
-        chr = contig.strip()
-        if chr not in major_contigs_order:
-            continue
-        contig_list.append(chr)
-    for chr in contig_list:
-        alleles_file_path = alleles_file_prefix + str(chr) + '.txt'
-        alleles = open(alleles_file_path, 'r')
-        for idx, allele in enumerate(alleles.readlines()):
-            if idx == 0:
-                continue
-            allele_info = allele.strip().split('\t')
-            allele_pos = allele_info[0]
-            allele_ref = allele_map_dict[allele_info[1]]
-            allele_alt = allele_map_dict[allele_info[2]]
-            allele_dict[(chr, allele_pos)] = allele_ref + '\t' + allele_alt
-
-        tumor_allele_counts_file_path = tumor_allele_counts_file_prefix + str(chr) + '.txt'
-        tumor_allele_counts = open(tumor_allele_counts_file_path, 'r')
-        for idx, allele_count in enumerate(tumor_allele_counts.readlines()):
-            if idx == 0:
+    with open(contig_fn, 'r') as f:
+        for contig in f:
+            chr = contig.strip()
+            if chr not in major_contigs_order:
                 continue
-            allele_count_info = allele_count.strip().split('\t')
-            allele_chr = allele_count_info[0]
-            allele_pos = allele_count_info[1]
-            if (chr, allele_pos) not in allele_dict.keys():
-                continue
-            allele_a_count = allele_count_info[2]
-            allele_c_count = allele_count_info[3]
-            allele_g_count = allele_count_info[4]
-            allele_t_count = allele_count_info[5]
-            tumor_allele_ref = allele_dict[(chr, allele_pos)].split('\t')[0]
-            tumor_allele_alt = allele_dict[(chr, allele_pos)].split('\t')[1]
-            tumor_allele_ref_count = 0
-            tumor_allele_alt_count = 0
-            if tumor_allele_ref == 'A':
-                tumor_allele_ref_count = allele_a_count
-            elif tumor_allele_ref == 'C':
-                tumor_allele_ref_count = allele_c_count
-            elif tumor_allele_ref == 'G':
-                tumor_allele_ref_count = allele_g_count
-            elif tumor_allele_ref == 'T':
-                tumor_allele_ref_count = allele_t_count
-            if tumor_allele_alt == 'A':
-                tumor_allele_alt_count = allele_a_count
-            elif tumor_allele_alt == 'C':
-                tumor_allele_alt_count = allele_c_count
-            elif tumor_allele_alt == 'G':
-                tumor_allele_alt_count = allele_g_count
-            elif tumor_allele_alt == 'T':
-                tumor_allele_alt_count = allele_t_count
-            mutCount1 = int(tumor_allele_ref_count)
-            mutCount2 = int(tumor_allele_alt_count)
-            totalTumor = mutCount1 + mutCount2
-            if totalTumor == 0:
-                continue
-            key = (allele_chr, allele_pos)
-            totalTumor_dict[key] = totalTumor
-            tumorBAF = random.choice([(mutCount1 / totalTumor), (mutCount2 / totalTumor)])
-            tumorBAF_dict[key] = tumorBAF
-
-        if normal_allele_counts_file_prefix is not None:
-            normal_allele_counts_file_path = normal_allele_counts_file_prefix + str(chr) + '.txt'
-            normal_allele_counts = open(normal_allele_counts_file_path, 'r')
-            for idx, allele_count in enumerate(normal_allele_counts.readlines()):
-                if idx == 0:
-                    continue
-                allele_count_info = allele_count.strip().split('\t')
-                allele_chr = allele_count_info[0]
-                allele_pos = allele_count_info[1]
-                if (chr, allele_pos) not in allele_dict.keys():
-                    continue
-                allele_a_count = allele_count_info[2]
-                allele_c_count = allele_count_info[3]
-                allele_g_count = allele_count_info[4]
-                allele_t_count = allele_count_info[5]
-                normal_allele_ref = allele_dict[(chr, allele_pos)].split('\t')[0]
-                normal_allele_alt = allele_dict[(chr, allele_pos)].split('\t')[1]
-                normal_allele_ref_count = 0
-                normal_allele_alt_count = 0
-                if normal_allele_ref == 'A':
-                    normal_allele_ref_count = allele_a_count
-                elif normal_allele_ref == 'C':
-                    normal_allele_ref_count = allele_c_count
-                elif normal_allele_ref == 'G':
-                    normal_allele_ref_count = allele_g_count
-                elif normal_allele_ref == 'T':
-                    normal_allele_ref_count = allele_t_count
-                if normal_allele_alt == 'A':
-                    normal_allele_alt_count = allele_a_count
-                elif normal_allele_alt == 'C':
-                    normal_allele_alt_count = allele_c_count
-                elif normal_allele_alt == 'G':
-                    normal_allele_alt_count = allele_g_count
-                elif normal_allele_alt == 'T':
-                    normal_allele_alt_count = allele_t_count
-                mutCount1 = int(normal_allele_ref_count)
-                mutCount2 = int(normal_allele_alt_count)
-                totalNormal = mutCount1 + mutCount2
-                if totalNormal < 10:
-                    continue
-                key = (allele_chr, allele_pos)
-                totalNormal_dict[key] = totalNormal
-                normalBAF = random.choice([(mutCount1 / totalNormal), (mutCount2 / totalNormal)])
-                normalBAF_dict[key] = normalBAF
-
-    if normal_allele_counts_file_prefix is not None:
-        common_keys = [k for k in totalTumor_dict if k in totalNormal_dict]
-
-        tumorBAF_dict = {k: tumorBAF_dict[k] for k in common_keys}
-        normalBAF_dict = {k: normalBAF_dict[k] for k in common_keys}
-
-        totalTumor_dict_overlap = {k: totalTumor_dict[k] for k in common_keys}
-        totalNormal_dict_overlap = {k: totalNormal_dict[k] for k in common_keys}
-
-        totalTumor_values_overlap = totalTumor_dict_overlap.values()
-        mean_totalTumor_overlap = sum(totalTumor_values_overlap) / len(totalTumor_values_overlap)
-
-        totalNormal_values_overlap = totalNormal_dict_overlap.values()
-        mean_totalNormal_overlap = sum(totalNormal_values_overlap) / len(totalNormal_values_overlap)
-
-        tumorLogR_dict = {key: math.log2((value / mean_totalTumor_overlap) / (totalNormal_dict_overlap[key] / mean_totalNormal_overlap)) for key, value in totalTumor_dict_overlap.items()}
-    else:
-        totalTumor_values = totalTumor_dict.values()
-        mean_totalTumor = sum(totalTumor_values) / len(totalTumor_values)
-        tumorLogR_dict = {key: math.log2(value / mean_totalTumor) for key, value in totalTumor_dict.items()}
-
-    output_header = 'Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n'
-    tumor_logr_output = open(tumor_logr_output_file, 'w')
-    tumor_logr_output.write(output_header)
-    for key, value in tumorLogR_dict.items():
-        tumor_logr_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-        tumor_logr_output.write(tumor_logr_string)
-    tumor_baf_output = open(tumor_baf_output_file, 'w')
-    tumor_baf_output.write(output_header)
-    for key, value in tumorBAF_dict.items():
-        tumor_baf_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-        tumor_baf_output.write(tumor_baf_string)
-    if normal_allele_counts_file_prefix is not None:
-        output_header_normal = 'Chromosome' + '\t' + 'Position' + '\t' + normal_sample_name + '\n'
-        normal_baf_output = open(normal_baf_output_file, 'w')
-        normal_baf_output.write(output_header_normal)
-        for key, value in normalBAF_dict.items():
-            normal_baf_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-            normal_baf_output.write(normal_baf_string)
+            contig_list.append(chr)
+    return contig_list
+
+
+def bafs_from(ref_counts, alt_counts, total, rng):
+    # BAF of the ref or the alt allele at random
+    return np.where(rng.randint(2, size=len(total)) == 0, ref_counts / total, alt_counts / total)
+
+
+def getBAFsAndLogRsFromCounts(allele_count_dict, contig_list, has_normal=True):
+    """
+    Array version of getBAFsAndLogRs() on the allele counts of count_alleles(). Return the chromosome, position,
+    tumor LogR, tumor BAF and normal BAF (None without normal) NumPy arrays of the probes kept.
+    """
+    rng = np.random.RandomState(seed)
+    chr_list, pos_list, total_tumor_list, tumor_baf_list, total_normal_list, normal_baf_list = [], [], [], [], [], []
+    for chr in contig_list:
+        positions, ref_idx, alt_idx, tumor_counts, normal_counts = allele_count_dict[chr]
+        probe_idx = np.arange(len(positions))
+        tumor_ref_counts, tumor_alt_counts = tumor_counts[probe_idx, ref_idx], tumor_counts[probe_idx, alt_idx]
+        total_tumor = tumor_ref_counts + tumor_alt_counts
+        keep = total_tumor > 0
+        if has_normal:
+            normal_ref_counts, normal_alt_counts = normal_counts[probe_idx, ref_idx], normal_counts[probe_idx, alt_idx]
+            total_normal = normal_ref_counts + normal_alt_counts
+            keep &= total_normal >= 10
+            total_normal_list.append(total_normal[keep])
+            normal_baf_list.append(bafs_from(normal_ref_counts[keep], normal_alt_counts[keep], total_normal[keep], rng))
+        chr_list.append(np.full(keep.sum(), chr, dtype=object))
+        pos_list.append(positions[keep])
+        total_tumor_list.append(total_tumor[keep])
+        tumor_baf_list.append(bafs_from(tumor_ref_counts[keep], tumor_alt_counts[keep], total_tumor[keep], rng))
+
+    total_tumor = np.concatenate(total_tumor_list)
+    tumor_logr = total_tumor / np.mean(total_tumor)
+    normal_baf = None
+    if has_normal:
+        total_normal = np.concatenate(total_normal_list)
+        tumor_logr /= total_normal / np.mean(total_normal)
+        normal_baf = np.concatenate(normal_baf_list)
+    tumor_logr = np.log2(tumor_logr)
+    return np.concatenate(chr_list), np.concatenate(pos_list), tumor_logr, np.concatenate(tumor_baf_list), normal_baf
+
+
+def getBAFsAndLogRsFromBams(samtools, tumor_bam_fn, normal_bam_fn, alleles_file_prefix, tumor_logr_output_file,
+                            tumor_baf_output_file, normal_baf_output_file, sample_name, normal_sample_name, contig_fn,
+                            threads=1, ref_fn=None, decode_threads=0):
+    """
+    Count the alleles of the G1000 loci in the BAMs with the built-in allele counter instead of alleleCounter, and
+    output the same tumor LogR, tumor BAF and normal BAF files as getBAFsAndLogRs().
+    """
+    contig_list = contigs_from(contig_fn)
+    allele_count_dict = count_alleles(samtools, contig_list, alleles_file_prefix, tumor_bam_fn, normal_bam_fn,
+                                      threads=threads, ref_fn=ref_fn, decode_threads=decode_threads)
+    write_logr_and_baf(allele_count_dict, contig_list, normal_bam_fn is not None, tumor_logr_output_file,
+                       tumor_baf_output_file, normal_baf_output_file, sample_name, normal_sample_name)
+
+
+def write_logr_and_baf(allele_count_dict, contig_list, has_normal, tumor_logr_output_file, tumor_baf_output_file,
+                       normal_baf_output_file, sample_name, normal_sample_name):
+    chr_array, pos_array, tumor_logr, tumor_baf, normal_baf = getBAFsAndLogRsFromCounts(
+        allele_count_dict, contig_list, has_normal=has_normal)
+    write_probe_values(tumor_logr_output_file, sample_name, chr_array, pos_array, tumor_logr)
+    write_probe_values(tumor_baf_output_file, sample_name, chr_array, pos_array, tumor_baf)
+    if normal_baf is not None:
+        write_probe_values(normal_baf_output_file, normal_sample_name, chr_array, pos_array, normal_baf)
 
 
 def main():
@@ -205,10 +138,41 @@ def main():
     parser.add_argument('--contig_fn', type=str,
                         default=None,
                         help="Contig file")
-    
+
+    parser.add_argument('--tumor_bam_fn', type=str,
+                        default=None,
+                        help="Tumor BAM file, count the alleles with the built-in allele counter instead of reading the allele count files if provided")
+
+    parser.add_argument('--normal_bam_fn', type=str,
+                        default=None,
+                        help="Normal BAM file of the built-in allele counter")
+
+    parser.add_argument('--ref_fn', type=str,
+                        default=None,
+                        help="Reference fasta file, required to count the alleles of a CRAM input")
+
+    parser.add_argument('--samtools', type=str,
+                        default="samtools",
+                        help="Path to the 'samtools' of the built-in allele counter")
+
+    parser.add_argument('--threads', type=int,
+                        default=1,
+                        help="Threads of the built-in allele counter")
+
+    parser.add_argument('--decode_threads', type=int,
+                        default=0,
+                        help="htslib threads of each samtools to decode a BAM/CRAM in the built-in allele counter")
+
     global args
     args = parser.parse_args()
 
+    if args.tumor_bam_fn is not None:
+        getBAFsAndLogRsFromBams(args.samtools, args.tumor_bam_fn, args.normal_bam_fn, args.alleles_file_prefix,
+                                args.tumor_logr_output_file, args.tumor_baf_output_file, args.normal_baf_output_file,
+                                args.sample_name, args.normal_sample_name, args.contig_fn, threads=args.threads,
+                                ref_fn=args.ref_fn, decode_threads=args.decode_threads)
+        return
+
     getBAFsAndLogRs(args.tumor_allele_counts_file_prefix, args.normal_allele_counts_file_prefix, args.alleles_file_prefix, args.tumor_logr_output_file, args.tumor_baf_output_file, args.normal_baf_output_file, args.sample_name, args.normal_sample_name, args.contig_fn)
 
 
@@ -3,200 +3,151 @@ from argparse import ArgumentParser
 import numpy as np
 import math
 
+from probe_table import chromosome_indices_from, read_probe_values, write_probe_values
 
-def predictGermlineGenotypes(tumor_logr_file, tumor_baf_file, normal_baf_file, germline_genotypes_output_file, maxHomozygous, proportionHetero, proportionHomo, proportionOpen, segmentLength, sample_name):
-    if normal_baf_file is None:
-        tumor_logr = open(tumor_logr_file, 'r')
-        tumor_baf = open(tumor_baf_file, 'r')
-        tumor_logr_dict = dict()
-        tumor_baf_dict = dict()
-        for idx, tumor_logr_line in enumerate(tumor_logr.readlines()):
-            if idx == 0:
-                continue
-            tumor_logr_info = tumor_logr_line.strip().split('\t')
-            chr = tumor_logr_info[0]
-            pos = tumor_logr_info[1]
-            logr = tumor_logr_info[2]
-            key = (str(chr), str(pos))
-            tumor_logr_dict[key] = logr
-        for idx, tumor_baf_line in enumerate(tumor_baf.readlines()):
-            if idx == 0:
-                continue
-            tumor_baf_info = tumor_baf_line.strip().split('\t')
-            chr = tumor_baf_info[0]
-            pos = tumor_baf_info[1]
-            baf = tumor_baf_info[2]
-            key = (str(chr), str(pos))
-            tumor_baf_dict[key] = baf
-
-        result = []
-        current_chr = None
-        temp_list = []
-        for index, (key, value) in enumerate(tumor_baf_dict.items()):
-            chr_key = key[0]
-
-            if chr_key != current_chr:
-                if temp_list:
-                    result.append(temp_list)
-                temp_list = []
-                current_chr = chr_key
-
-            temp_list.append(index)
-
-        if temp_list:
-            result.append(temp_list)
-
-        tbsam = np.array(list(tumor_baf_dict.values())).astype(float)
-        bsm = np.where(tbsam < 0.5, tbsam, 1 - tbsam)
-
-        sorted_bsm = np.sort(bsm)
-        index = round(len(bsm) * proportionHomo)
-        value = sorted_bsm[index]
-        homoLimit = max(value, maxHomozygous)
-
-        Hom = np.where(bsm < homoLimit, True, np.nan)
-        Undecided = np.sum(np.isnan(Hom))
-        extraHetero = round(min(proportionHetero * len(tbsam), Undecided - proportionOpen * len(tbsam)))
-
-        if extraHetero > 0:
-            allProbes = np.arange(len(tbsam))
-            nonHomoProbes = allProbes[np.isnan(Hom) | (Hom == False)]
-
-            lowestDist = []
-
-            bsmHNA = bsm.copy()
-            bsmHNA[~np.isnan(Hom) & (Hom == True)] = np.nan
-
-            for chr_result in result:
-                chrNonHomoProbes = sorted(list(set(nonHomoProbes).intersection(set(chr_result))))
-
-                if len(chrNonHomoProbes) > 5:
-                    segmentLength2 = min(len(chrNonHomoProbes) - 1, segmentLength)
-
-                    # Window on the left
-                    chrNonHomoProbesStartWindowLeft = np.concatenate((np.repeat(np.nan, segmentLength2), chrNonHomoProbes[:len(chrNonHomoProbes) - segmentLength2]))
-                    chrNonHomoProbesEndWindowLeft = np.concatenate(([np.nan], chrNonHomoProbes[:len(chrNonHomoProbes) - 1]))
-
-                    # Window on the right
-                    chrNonHomoProbesStartWindowRight = np.concatenate((chrNonHomoProbes[1:], [np.nan]))
-                    chrNonHomoProbesEndWindowRight = np.concatenate((chrNonHomoProbes[segmentLength2:], np.repeat(np.nan, segmentLength2)))
-
-                    # Window in the middle
-                    middle_segment_length = segmentLength2 // 2
-                    chrNonHomoProbesStartWindowMiddle = np.concatenate((np.repeat(np.nan, middle_segment_length), chrNonHomoProbes[:len(chrNonHomoProbes) - middle_segment_length]))
-                    chrNonHomoProbesEndWindowMiddle = np.concatenate((chrNonHomoProbes[middle_segment_length:], np.repeat(np.nan, middle_segment_length)))
 
-                    chrLowestDist = []
+def germlineGenotypesFrom(chr_array, tumor_baf, normal_baf, maxHomozygous, proportionHetero, proportionHomo, proportionOpen, segmentLength):
+    """
+    Germline genotype of each probe, True if homozygous. Called from the normal BAF if provided, otherwise predicted
+    from the tumor BAF.
+    """
+    if normal_baf is not None:
+        normal_baf_values = np.asarray(normal_baf, dtype=float)
+        return (normal_baf_values < 0.3) | (normal_baf_values > 0.7)
+
+    result = chromosome_indices_from(chr_array)
+
+    tbsam = np.asarray(tumor_baf, dtype=float)
+    bsm = np.where(tbsam < 0.5, tbsam, 1 - tbsam)
+
+    sorted_bsm = np.sort(bsm)
+    index = round(len(bsm) * proportionHomo)
+    value = sorted_bsm[index]
+    homoLimit = max(value, maxHomozygous)
+
+    Hom = np.where(bsm < homoLimit, True, np.nan)
+    Undecided = np.sum(np.isnan(Hom))
+    extraHetero = round(min(proportionHetero * len(tbsam), Undecided - proportionOpen * len(tbsam)))
+
+    if extraHetero > 0:
+        allProbes = np.arange(len(tbsam))
+        nonHomoProbes = allProbes[np.isnan(Hom) | (Hom == False)]
+
+        lowestDist = []
+
+        bsmHNA = bsm.copy()
+        bsmHNA[~np.isnan(Hom) & (Hom == True)] = np.nan
+
+        for chr_result in result:
+            chrNonHomoProbes = sorted(list(set(nonHomoProbes).intersection(set(chr_result))))
+
+            if len(chrNonHomoProbes) > 5:
+                segmentLength2 = min(len(chrNonHomoProbes) - 1, segmentLength)
+
+                # Window on the left
+                chrNonHomoProbesStartWindowLeft = np.concatenate((np.repeat(np.nan, segmentLength2), chrNonHomoProbes[:len(chrNonHomoProbes) - segmentLength2]))
+                chrNonHomoProbesEndWindowLeft = np.concatenate(([np.nan], chrNonHomoProbes[:len(chrNonHomoProbes) - 1]))
 
-                    for probeNr in range(len(chrNonHomoProbes)):
-                        probe = chrNonHomoProbes[probeNr]
+                # Window on the right
+                chrNonHomoProbesStartWindowRight = np.concatenate((chrNonHomoProbes[1:], [np.nan]))
+                chrNonHomoProbesEndWindowRight = np.concatenate((chrNonHomoProbes[segmentLength2:], np.repeat(np.nan, segmentLength2)))
 
-                        start_left = chrNonHomoProbesStartWindowLeft[probeNr]
-                        end_left = chrNonHomoProbesEndWindowLeft[probeNr]
+                # Window in the middle
+                middle_segment_length = segmentLength2 // 2
+                chrNonHomoProbesStartWindowMiddle = np.concatenate((np.repeat(np.nan, middle_segment_length), chrNonHomoProbes[:len(chrNonHomoProbes) - middle_segment_length]))
+                chrNonHomoProbesEndWindowMiddle = np.concatenate((chrNonHomoProbes[middle_segment_length:], np.repeat(np.nan, middle_segment_length)))
 
-                        if not math.isnan(start_left) and not math.isnan(end_left):
-                            window_values_left = bsmHNA[int(start_left):int(end_left) + 1]
-                            window_values_left = [value for value in window_values_left if not math.isnan(value)]
-                            if window_values_left:
-                                medianLeft = np.median(window_values_left)
-                            else:
-                                medianLeft = np.nan
+                chrLowestDist = []
+
+                for probeNr in range(len(chrNonHomoProbes)):
+                    probe = chrNonHomoProbes[probeNr]
+
+                    start_left = chrNonHomoProbesStartWindowLeft[probeNr]
+                    end_left = chrNonHomoProbesEndWindowLeft[probeNr]
+
+                    if not math.isnan(start_left) and not math.isnan(end_left):
+                        window_values_left = bsmHNA[int(start_left):int(end_left) + 1]
+                        window_values_left = [value for value in window_values_left if not math.isnan(value)]
+                        if window_values_left:
+                            medianLeft = np.median(window_values_left)
                         else:
                             medianLeft = np.nan
+                    else:
+                        medianLeft = np.nan
 
-                        start_right = chrNonHomoProbesStartWindowRight[probeNr]
-                        end_right = chrNonHomoProbesEndWindowRight[probeNr]
+                    start_right = chrNonHomoProbesStartWindowRight[probeNr]
+                    end_right = chrNonHomoProbesEndWindowRight[probeNr]
 
-                        if not math.isnan(start_right) and not math.isnan(end_right):
-                            window_values_right = bsmHNA[int(start_right):int(end_right) + 1]
-                            window_values_right = [value for value in window_values_right if not math.isnan(value)]
+                    if not math.isnan(start_right) and not math.isnan(end_right):
+                        window_values_right = bsmHNA[int(start_right):int(end_right) + 1]
+                        window_values_right = [value for value in window_values_right if not math.isnan(value)]
 
-                            if window_values_right:
-                                medianRight = np.median(window_values_right)
-                            else:
-                                medianRight = np.nan
+                        if window_values_right:
+                            medianRight = np.median(window_values_right)
                         else:
                             medianRight = np.nan
+                    else:
+                        medianRight = np.nan
 
-                        start_middle = chrNonHomoProbesStartWindowMiddle[probeNr]
-                        end_middle = chrNonHomoProbesEndWindowMiddle[probeNr]
+                    start_middle = chrNonHomoProbesStartWindowMiddle[probeNr]
+                    end_middle = chrNonHomoProbesEndWindowMiddle[probeNr]
 
-                        if not math.isnan(start_middle) and not math.isnan(end_middle):
-                            window_values_middle_left = bsmHNA[int(start_middle):int(end_left) + 1]
-                            window_values_middle_right = bsmHNA[int(start_right):int(end_middle) + 1]
+                    if not math.isnan(start_middle) and not math.isnan(end_middle):
+                        window_values_middle_left = bsmHNA[int(start_middle):int(end_left) + 1]
+                        window_values_middle_right = bsmHNA[int(start_right):int(end_middle) + 1]
 
-                            window_values_middle_left = [value for value in window_values_middle_left if
-                                                         not math.isnan(value)]
-                            window_values_middle_right = [value for value in window_values_middle_right if
-                                                          not math.isnan(value)]
+                        window_values_middle_left = [value for value in window_values_middle_left if
+                                                     not math.isnan(value)]
+                        window_values_middle_right = [value for value in window_values_middle_right if
+                                                      not math.isnan(value)]
 
-                            concatenated_values = np.concatenate(
-                                (window_values_middle_left, window_values_middle_right))
+                        concatenated_values = np.concatenate(
+                            (window_values_middle_left, window_values_middle_right))
 
-                            if concatenated_values.size > 0:
-                                medianMiddle = np.median(concatenated_values)
-                            else:
-                                medianMiddle = np.nan
+                        if concatenated_values.size > 0:
+                            medianMiddle = np.median(concatenated_values)
                         else:
                             medianMiddle = np.nan
-
-                        diffs = [np.abs(medianLeft - bsm[probe]),
-                                 np.abs(medianRight - bsm[probe]),
-                                 np.abs(medianMiddle - bsm[probe])]
-                        diffs = [d for d in diffs if not np.isnan(d)]
-                        chrLowestDist.insert(probeNr, np.min(diffs) if len(diffs) > 0 else np.inf)
-                else:
-                    if len(chrNonHomoProbes) > 0:
-                        chrLowestDist = [1] * len(chrNonHomoProbes)
                     else:
-                        chrLowestDist = []
+                        medianMiddle = np.nan
+
+                    diffs = [np.abs(medianLeft - bsm[probe]),
+                             np.abs(medianRight - bsm[probe]),
+                             np.abs(medianMiddle - bsm[probe])]
+                    diffs = [d for d in diffs if not np.isnan(d)]
+                    chrLowestDist.insert(probeNr, np.min(diffs) if len(diffs) > 0 else np.inf)
+            else:
+                if len(chrNonHomoProbes) > 0:
+                    chrLowestDist = [1] * len(chrNonHomoProbes)
+                else:
+                    chrLowestDist = []
 
-                lowestDist.extend(chrLowestDist)
+            lowestDist.extend(chrLowestDist)
 
-            lowestDistUndecided = [lowestDist[i] for i, h in enumerate(Hom[nonHomoProbes]) if np.isnan(h)]
-            sorted_indices = np.argsort(lowestDistUndecided)
-            sorted_lowestDistUndecided = np.sort(lowestDistUndecided)
+        lowestDistUndecided = [lowestDist[i] for i, h in enumerate(Hom[nonHomoProbes]) if np.isnan(h)]
+        sorted_indices = np.argsort(lowestDistUndecided)
+        sorted_lowestDistUndecided = np.sort(lowestDistUndecided)
 
-            min_length = min(len(sorted_lowestDistUndecided), extraHetero)
-            selected_indices = sorted_indices[:min_length]
-            selected_indices_ori = [nonHomoProbes[i] for i in selected_indices]
+        min_length = min(len(sorted_lowestDistUndecided), extraHetero)
+        selected_indices = sorted_indices[:min_length]
+        selected_indices_ori = [nonHomoProbes[i] for i in selected_indices]
 
-            Hom[selected_indices_ori] = False
+        Hom[selected_indices_ori] = False
 
-        Hom[np.isnan(Hom)] = True
-        germline_genotypes_output_dict = {key: Hom[idx] for idx, key in enumerate(tumor_baf_dict.keys())}
+    Hom[np.isnan(Hom)] = True
+    return Hom.astype(bool)
 
-        output_header = 'Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n'
-        germline_genotypes_output = open(germline_genotypes_output_file, 'w')
-        germline_genotypes_output.write(output_header)
-        for key, value in germline_genotypes_output_dict.items():
-            if value == 1.0:
-                value = "True"
-            elif value == 0.0:
-                value = "False"
-            germline_genotypes_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-            germline_genotypes_output.write(germline_genotypes_string)
+
+def predictGermlineGenotypes(tumor_logr_file, tumor_baf_file, normal_baf_file, germline_genotypes_output_file, maxHomozygous, proportionHetero, proportionHomo, proportionOpen, segmentLength, sample_name):
+    if normal_baf_file is None:
+        chr_array, pos_array, tumor_baf = read_probe_values(tumor_baf_file)
+        normal_baf = None
     else:
-        normal_baf = open(normal_baf_file, 'r')
-        normal_baf_dict = dict()
-        for idx, normal_baf_line in enumerate(normal_baf.readlines()):
-            if idx == 0:
-                continue
-            normal_baf_info = normal_baf_line.strip().split('\t')
-            chr = normal_baf_info[0]
-            pos = normal_baf_info[1]
-            baf = normal_baf_info[2]
-            key = (str(chr), str(pos))
-            normal_baf_dict[key] = baf
-        normal_baf_values = np.array(list(normal_baf_dict.values()), dtype=float)
-        Hom = np.where((normal_baf_values < 0.3) | (normal_baf_values > 0.7), 'True', 'False')
-        germline_genotypes_output_dict = {key: Hom[idx] for idx, key in enumerate(normal_baf_dict.keys())}
-        output_header = 'Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n'
-        germline_genotypes_output = open(germline_genotypes_output_file, 'w')
-        germline_genotypes_output.write(output_header)
-        for key, value in germline_genotypes_output_dict.items():
-            germline_genotypes_string = '\t'.join(map(str, key)) + '\t' + str(value) + '\n'
-            germline_genotypes_output.write(germline_genotypes_string)
+        chr_array, pos_array, normal_baf = read_probe_values(normal_baf_file)
+        tumor_baf = None
+    germline_genotypes = germlineGenotypesFrom(chr_array, tumor_baf, normal_baf, maxHomozygous, proportionHetero,
+                                               proportionHomo, proportionOpen, segmentLength)
+    write_probe_values(germline_genotypes_output_file, sample_name, chr_array, pos_array, germline_genotypes)
 
 
 def main():
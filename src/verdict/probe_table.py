@@ -0,0 +1,75 @@
+import numpy as np
+
+# columns of the probe table in the order the Verdict steps fill them, None until filled
+PROBE_TABLE_COLUMNS = ('chr', 'pos', 'logr', 'baf', 'normal_baf', 'logr_corrected', 'genotype', 'logr_segmented',
+                       'baf_segmented', 'segment_id')
+
+
+class ProbeTable(object):
+    """
+    Columnar table of the G1000 probes shared by the Verdict steps, one NumPy array per column, all aligned to the
+    probe order of get_logr_and_baf. genotype is True for the homozygous probes, baf_segmented is NaN for them and
+    segment_id is the index of the ASCAT segment of each probe, -1 if not segmented.
+    """
+
+    def __init__(self, chr, pos, logr, baf, normal_baf=None):
+        self.chr = np.asarray(chr, dtype=str)
+        self.pos = np.asarray(pos, dtype=np.int64)
+        self.logr = np.asarray(logr, dtype=float)
+        self.baf = np.asarray(baf, dtype=float)
+        self.normal_baf = np.asarray(normal_baf, dtype=float) if normal_baf is not None else None
+        self.logr_corrected = None
+        self.genotype = None
+        self.logr_segmented = None
+        self.baf_segmented = None
+        self.segment_id = None
+
+    def __len__(self):
+        return len(self.pos)
+
+    def save(self, probe_table_fn):
+        """
+        Persist the filled columns as a single uncompressed .npz file.
+        """
+        columns = dict([(column, getattr(self, column)) for column in PROBE_TABLE_COLUMNS if
+                        getattr(self, column) is not None])
+        with open(probe_table_fn, 'wb') as f:
+            np.savez(f, **columns)
+
+
+def chromosome_indices_from(chr_array):
+    """
+    Probe indices of each run of the same chromosome, a list of index lists in probe order.
+    """
+    if len(chr_array) == 0:
+        return []
+    chr_array = np.asarray(chr_array)
+    run_starts = np.concatenate(([0], np.flatnonzero(chr_array[1:] != chr_array[:-1]) + 1, [len(chr_array)]))
+    return [list(range(start, end)) for start, end in zip(run_starts[:-1], run_starts[1:])]
+
+
+def read_probe_values(probe_values_fn, dtype=float):
+    """
+    Chromosome, position and value arrays of a Verdict probe file (header, then chromosome, position and value
+    columns), a later row of the same probe replaces the earlier one.
+    """
+    probe_dict = {}
+    with open(probe_values_fn, 'r') as f:
+        f.readline()
+        for row in f:
+            chr, pos, value = row.strip().split('\t')[:3]
+            probe_dict[(chr, pos)] = value
+    chr_array = np.array([key[0] for key in probe_dict], dtype=str)
+    pos_array = np.array([key[1] for key in probe_dict], dtype=np.int64)
+    if dtype is bool:
+        values = np.array([value == 'True' for value in probe_dict.values()], dtype=bool)
+    else:
+        values = np.array(list(probe_dict.values())).astype(dtype)
+    return chr_array, pos_array, values
+
+
+def write_probe_values(output_file, sample_name, chr_array, pos_array, values):
+    with open(output_file, 'w') as f:
+        f.write('Chromosome' + '\t' + 'Position' + '\t' + sample_name + '\n')
+        f.write(''.join(['{}\t{}\t{}\n'.format(chr, pos, value) for chr, pos, value in
+                         zip(chr_array.tolist(), pos_array.tolist(), values.tolist())]))
@@ -1,6 +1,9 @@
 from argparse import ArgumentParser
 
 import numpy as np
+from scipy.ndimage import minimum_filter
+
+from probe_table import read_probe_values
 
 
 def make_segments(r, b):
@@ -28,7 +31,8 @@ def make_segments(r, b):
     return np.array(pcf_segments, dtype=float)
 
 
-def create_distance_matrix(segments, gamma, min_ploidy=None, max_ploidy=None, min_purity=None, max_purity=None):
+def create_distance_matrix(segments, gamma, min_ploidy=None, max_ploidy=None, min_purity=None, max_purity=None,
+                           max_chunk_elements=2 ** 24):
     s = segments
 
     if min_ploidy is None or max_ploidy is None:
@@ -42,24 +46,69 @@ def create_distance_matrix(segments, gamma, min_ploidy=None, max_ploidy=None, mi
         rho_pos = np.arange(round(min_purity, 2), round(max_purity, 2), 0.01)
 
     d = np.zeros((len(psi_pos), len(rho_pos)))
-    dmin = 1E20
 
-    for i, psi in enumerate(psi_pos):
-        for j, rho in enumerate(rho_pos):
-            nA = (rho - 1 - (s[:, 1] - 1) * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-            nB = (rho - 1 + s[:, 1] * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
+    # evaluate the psi x rho x segment tensor in blocks of psi rows to bound memory
+    chunk_rows = max(1, int(max_chunk_elements // max(1, len(rho_pos) * len(s))))
+    for chunk_start in range(0, len(psi_pos), chunk_rows):
+        psi = psi_pos[chunk_start:chunk_start + chunk_rows, None]
+        rho = rho_pos[None, :]
+        nA, nB = allele_copy_numbers(s, gamma, psi, rho)
 
-            if np.nansum(nA) < np.nansum(nB):
-                nMinor = nA
-            else:
-                nMinor = nB
+        nMinor = np.where((np.nansum(nA, axis=-1) < np.nansum(nB, axis=-1))[..., None], nA, nB)
 
-            d[i, j] = np.nansum(
-                np.abs(nMinor - np.maximum(np.round(nMinor), 0)) ** 2 * s[:, 2] * np.where(s[:, 1] == 0.5, 0.05, 1))
+        d[chunk_start:chunk_start + chunk_rows] = np.nansum(
+            np.abs(nMinor - np.maximum(np.round(nMinor), 0)) ** 2 * s[:, 2] * np.where(s[:, 1] == 0.5, 0.05, 1), axis=-1)
 
     return d
 
 
+def allele_copy_numbers(s, gamma, psi, rho):
+    """
+    Raw nA/nB of every segment, broadcast over arrays of psi and rho, segments are placed on the last axis.
+    """
+    psi = np.asarray(psi, dtype=float)[..., None]
+    rho = np.asarray(rho, dtype=float)[..., None]
+    scale = 2 ** (s[:, 0] / gamma)
+    ploidy_scale = (1 - rho) * 2 + rho * psi
+    nA = (rho - 1 - (s[:, 1] - 1) * scale * ploidy_scale) / rho
+    nB = (rho - 1 + s[:, 1] * scale * ploidy_scale) / rho
+    return nA, nB
+
+
+def find_local_minima(d, psi_values, rho_values, s, gamma, TheoretMaxdist):
+    """
+    Cells strictly smaller than every other cell of their 7x7 neighbourhood, with the fit statistics of each.
+    """
+    footprint = np.ones((7, 7), dtype=bool)
+    footprint[3, 3] = False
+    neighbour_min = minimum_filter(d, footprint=footprint, mode='constant', cval=np.inf)
+    is_local_min = np.zeros(d.shape, dtype=bool)
+    is_local_min[3:d.shape[0] - 3, 3:d.shape[1] - 3] = (neighbour_min > d)[3:d.shape[0] - 3, 3:d.shape[1] - 3]
+    i, j = np.nonzero(is_local_min)
+
+    m = d[i, j]
+    psi = psi_values[i]
+    rho = rho_values[j]
+    nA, nB = allele_copy_numbers(s, gamma, psi, rho)
+    nA_round, nB_round = np.round(nA), np.round(nB)
+    length = s[:, 2]
+    aberrant = s[:, 1] != 0.5
+
+    ploidy = np.sum((nA + nB) * length, axis=-1) / np.sum(length)
+    percentzero = (np.sum((nA_round == 0) * length, axis=-1) + np.sum((nB_round == 0) * length, axis=-1)) / np.sum(length)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        perczeroAbb = (np.sum((nA_round == 0) * length * aberrant, axis=-1) +
+                       np.sum((nB_round == 0) * length * aberrant, axis=-1)) / np.sum(length * aberrant)
+    # Handle the case where BAF is a flat line at 0.5
+    perczeroAbb = np.where(np.isnan(perczeroAbb), 0, perczeroAbb)
+    percOddEven = np.sum(((nA_round % 2 == 0) & (nB_round % 2 == 1) | (nA_round % 2 == 1) & (nB_round % 2 == 0)) * length,
+                         axis=-1) / np.sum(length)
+    goodnessOfFit = (1 - m / TheoretMaxdist) * 100
+
+    return {'m': m, 'i': i, 'j': j, 'rho': rho, 'ploidy': ploidy, 'percentzero': percentzero,
+            'perczeroAbb': perczeroAbb, 'percOddEven': percOddEven, 'goodnessOfFit': goodnessOfFit}
+
+
 def rle(x):
     n = len(x)
     y = np.array(x[1:] != x[:-1])
@@ -69,91 +118,21 @@ def rle(x):
     return {'lengths': lengths, 'values': values}
 
 
-def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_segmented_file, tumor_baf_segmented_file, tumor_purity_ploidy_output_file, tumor_cna_output_file, gamma, min_ploidy, max_ploidy, min_purity,
-                    max_purity, sample_name):
-    tumor_logr = open(tumor_logr_file, 'r')
-    tumor_baf = open(tumor_baf_file, 'r')
-    germline_genotypes = open(germline_genotypes_file, 'r')
-    tumor_logr_segmented = open(tumor_logr_segmented_file, 'r')
-    tumor_baf_segmented = open(tumor_baf_segmented_file, 'r')
-    tumor_logr_dict = dict()
-    tumor_baf_dict = dict()
-    germline_genotypes_dict = dict()
-    tumor_logr_segmented_dict = dict()
-    tumor_baf_segmented_dict = dict()
-    for idx, tumor_logr_line in enumerate(tumor_logr.readlines()):
-        if idx == 0:
-            continue
-        tumor_logr_info = tumor_logr_line.strip().split('\t')
-        chr = tumor_logr_info[0]
-        pos = tumor_logr_info[1]
-        logr = tumor_logr_info[2]
-        key = (str(chr), str(pos))
-        tumor_logr_dict[key] = logr
-    for idx, tumor_baf_line in enumerate(tumor_baf.readlines()):
-        if idx == 0:
-            continue
-        tumor_baf_info = tumor_baf_line.strip().split('\t')
-        chr = tumor_baf_info[0]
-        pos = tumor_baf_info[1]
-        baf = tumor_baf_info[2]
-        key = (str(chr), str(pos))
-        tumor_baf_dict[key] = baf
-    for idx, germline_genotypes_line in enumerate(germline_genotypes.readlines()):
-        if idx == 0:
-            continue
-        germline_genotypes_info = germline_genotypes_line.strip().split('\t')
-        chr = germline_genotypes_info[0]
-        pos = germline_genotypes_info[1]
-        gg = germline_genotypes_info[2]
-        key = (str(chr), str(pos))
-        germline_genotypes_dict[key] = gg
-    for idx, tumor_logr_segmented_line in enumerate(tumor_logr_segmented.readlines()):
-        if idx == 0:
-            continue
-        tumor_logr_segmented_info = tumor_logr_segmented_line.strip().split('\t')
-        chr = tumor_logr_segmented_info[0]
-        pos = tumor_logr_segmented_info[1]
-        logr = tumor_logr_segmented_info[2]
-        key = (str(chr), str(pos))
-        tumor_logr_segmented_dict[key] = logr
-    for idx, tumor_baf_segmented_line in enumerate(tumor_baf_segmented.readlines()):
-        if idx == 0:
-            continue
-        tumor_baf_segmented_info = tumor_baf_segmented_line.strip().split('\t')
-        chr = tumor_baf_segmented_info[0]
-        pos = tumor_baf_segmented_info[1]
-        baf = tumor_baf_segmented_info[2]
-        key = (str(chr), str(pos))
-        tumor_baf_segmented_dict[key] = baf
-
-    result = []
-    current_chr = None
-    temp_list = []
-    for index, (key, value) in enumerate(tumor_baf_dict.items()):
-        chr_key = key[0]
-
-        if chr_key != current_chr:
-            if temp_list:
-                result.append(temp_list)
-            temp_list = []
-            current_chr = chr_key
-
-        temp_list.append(index)
-
-    if temp_list:
-        result.append(temp_list)
-
-    tumor_baf_ori = np.array(list(tumor_baf_dict.values()))
-
-    germline_genotypes_values = np.array(list(germline_genotypes_dict.values()))
-    het = germline_genotypes_values == 'False'
+def runAscatFrom(chr_array, pos_array, tumor_baf_ori, germline_genotypes_values, tumor_logr_segmented, tumor_baf_segmented, gamma, min_ploidy, max_ploidy, min_purity,
+                 max_purity, sample_name):
+    """
+    Fit the tumor purity and ploidy on the segmented LogR of all probes and the segmented BAF of the heterozygous
+    probes, germline_genotypes_values is True for the homozygous probes. Return a dict of the purity (rho), ploidy,
+    goodness of fit, the CNA segments as [chromosome, start position, end position, nMajor, nMinor] strings and the
+    segment index of each probe, None if no optimal fit is found.
+    """
+    germline_genotypes_values = np.asarray(germline_genotypes_values, dtype=bool)
+    het = ~germline_genotypes_values
     het_indices = np.where(het)[0]
 
-    b = np.array([float(v) for v in tumor_baf_segmented_dict.values()])
-    r = np.array([float(v) for v in tumor_logr_segmented_dict.values()])[het_indices]
-
-    r_ori = np.array([float(v) for v in tumor_logr_segmented_dict.values()])
+    b = np.asarray(tumor_baf_segmented, dtype=float)
+    r_ori = np.asarray(tumor_logr_segmented, dtype=float)
+    r = r_ori[het_indices]
 
     s = make_segments(r, b)
     d = create_distance_matrix(s, gamma, min_ploidy=min_ploidy, max_ploidy=max_ploidy, min_purity=min_purity,
@@ -180,150 +159,49 @@ def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_lo
     MINPLOIDYSTRICT = 1.7
     MAXPLOIDYSTRICT = 2.3
 
-    localmin = []
-    optima = []
-
     psi_values = np.arange(1.05, 6.05, 0.05)
 
     rho_values = np.arange(0.11, 1.06, 0.01)
     rho_values = np.round(rho_values, 2)
 
-    for i in range(3, d.shape[0] - 3):
-        for j in range(3, d.shape[1] - 3):
-            m = d[i, j]
-            seld = d[i - 3:i + 4, j - 3:j + 4]
-            seld[3, 3] = np.max(seld)
-            if np.min(seld) > m:
-                psi = psi_values[i]
-                rho = rho_values[j]
-
-                nA = (rho - 1 - (s[:, 1] - 1) * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-                nB = (rho - 1 + s[:, 1] * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-
-                ploidy = np.sum((nA + nB) * s[:, 2]) / np.sum(s[:, 2])
-
-                percentzero = (np.sum((np.round(nA) == 0) * s[:, 2]) + np.sum((np.round(nB) == 0) * s[:, 2])) / np.sum(
-                    s[:, 2])
+    minima = find_local_minima(d, psi_values, rho_values, s, gamma, TheoretMaxdist)
+    fit = (minima['rho'] >= MINRHO) & (minima['goodnessOfFit'] > MINGOODNESSOFFIT)
+    loose_ploidy = (MINPLOIDY < minima['ploidy']) & (minima['ploidy'] < MAXPLOIDY)
+    strict_ploidy = (MINPLOIDYSTRICT < minima['ploidy']) & (minima['ploidy'] < MAXPLOIDYSTRICT)
+    allow_strict = MINPLOIDY < MAXPLOIDYSTRICT and MAXPLOIDY > MINPLOIDYSTRICT
 
-                goodnessOfFit = (1 - m / TheoretMaxdist) * 100
-
-                if (not nonaberrant and MINPLOIDY < ploidy < MAXPLOIDY and
-                        rho >= MINRHO and goodnessOfFit > MINGOODNESSOFFIT and
-                        percentzero > MINPERCZERO):
-                    optima.append([m, i, j, ploidy, goodnessOfFit])
-                    localmin.append(m)
+    selected = (not nonaberrant) & loose_ploidy & fit & (minima['percentzero'] > MINPERCZERO)
 
     # if no solution, drop the percentzero > MINPERCZERO filter (allow non-aberrant solutions - but limit the ploidy options)
-    if len(optima) == 0 and MINPLOIDY < MAXPLOIDYSTRICT and MAXPLOIDY > MINPLOIDYSTRICT:
-        for i in range(3, d.shape[0] - 3):
-            for j in range(3, d.shape[1] - 3):
-                m = d[i, j]
-                seld = d[i - 3:i + 4, j - 3:j + 4]
-                seld[3, 3] = np.max(seld)
-                if np.min(seld) > m:
-                    psi = psi_values[i]
-                    rho = rho_values[j]
-                    nA = (rho - 1 - (s[:, 1] - 1) * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-                    nB = (rho - 1 + s[:, 1] * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-
-                    ploidy = np.sum((nA + nB) * s[:, 2]) / np.sum(s[:, 2])
-
-                    perczeroAbb = (np.sum((np.round(nA) == 0) * s[:, 2] * (s[:, 1] != 0.5)) +
-                                   np.sum((np.round(nB) == 0) * s[:, 2] * (s[:, 1] != 0.5))) / \
-                                  np.sum(s[:, 2] * (s[:, 1] != 0.5))
-
-                    # Handle the case where BAF is a flat line at 0.5
-                    if np.isnan(perczeroAbb):
-                        perczeroAbb = 0
-
-                    goodnessOfFit = (1 - m / TheoretMaxdist) * 100
-
-                    if (MINPLOIDYSTRICT < ploidy < MAXPLOIDYSTRICT and
-                            rho >= MINRHO and goodnessOfFit > MINGOODNESSOFFIT and
-                            perczeroAbb > MINPERCZEROABB):
-                        optima.append([m, i, j, ploidy, goodnessOfFit])
-                        localmin.append(m)
+    if not np.any(selected) and allow_strict:
+        selected = strict_ploidy & fit & (minima['perczeroAbb'] > MINPERCZEROABB)
 
     # if still no solution, allow solutions with 100% aberrant cells (include the borders with rho = 1), but in first instance, keep the percentzero > 0.01 filter
-    if len(optima) == 0:
+    if not np.any(selected):
         # Include borders
         cold = np.where(rho_values > 1)[0]
         d[:, cold] = 1E20
 
-        for i in range(3, d.shape[0] - 3):
-            for j in range(3, d.shape[1] - 3):
-                m = d[i, j]
-                seld = d[i - 3:i + 4, j - 3:j + 4]
-                seld[3, 3] = np.max(seld)
-                if np.min(seld) > m:
-                    psi = psi_values[i]
-                    rho = rho_values[j]
-                    nA = (rho - 1 - (s[:, 1] - 1) * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-                    nB = (rho - 1 + s[:, 1] * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-
-                    ploidy = np.sum((nA + nB) * s[:, 2]) / np.sum(s[:, 2])
-
-                    percentzero = (np.sum((np.round(nA) == 0) * s[:, 2]) + np.sum(
-                        (np.round(nB) == 0) * s[:, 2])) / np.sum(s[:, 2])
-                    percOddEven = np.sum(((np.round(nA) % 2 == 0) & (np.round(nB) % 2 == 1) | (
-                                np.round(nA) % 2 == 1) & (np.round(nB) % 2 == 0)) * s[:, 2]) / np.sum(s[:, 2])
-                    perczeroAbb = (np.sum((np.round(nA) == 0) * s[:, 2] * (s[:, 1] != 0.5)) +
-                                   np.sum((np.round(nB) == 0) * s[:, 2] * (s[:, 1] != 0.5))) / \
-                                  np.sum(s[:, 2] * (s[:, 1] != 0.5))
-
-                    if np.isnan(perczeroAbb):
-                        perczeroAbb = 0
-
-                    goodnessOfFit = (1 - m / TheoretMaxdist) * 100
-
-                    if (not nonaberrant and MINPLOIDY < ploidy < MAXPLOIDY and
-                            rho >= MINRHO and goodnessOfFit > MINGOODNESSOFFIT and
-                            (
-                                    perczeroAbb > MINPERCZEROABB or percentzero > MINPERCZERO or percOddEven > MINPERCODDEVEN)):
-                        optima.append([m, i, j, ploidy, goodnessOfFit])
-                        localmin.append(m)
-
-    # if still no solution, drop the percentzero > MINPERCENTZERO filter, but strict ploidy borders
-    if len(optima) == 0 and MINPLOIDY < MAXPLOIDYSTRICT and MAXPLOIDY > MINPLOIDYSTRICT:
-        for i in range(3, d.shape[0] - 3):
-            for j in range(3, d.shape[1] - 3):
-                m = d[i, j]
-                seld = d[i - 3:i + 4, j - 3:j + 4]
-                seld[3, 3] = np.max(seld)
-                if np.min(seld) > m:
-                    psi = psi_values[i]
-                    rho = rho_values[j]
-                    nA = (rho - 1 - (s[:, 1] - 1) * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-                    nB = (rho - 1 + s[:, 1] * 2 ** (s[:, 0] / gamma) * ((1 - rho) * 2 + rho * psi)) / rho
-
-                    ploidy = np.sum((nA + nB) * s[:, 2]) / np.sum(s[:, 2])
-
-                    perczeroAbb = (np.sum((np.round(nA) == 0) * s[:, 2] * (s[:, 1] != 0.5)) +
-                                   np.sum((np.round(nB) == 0) * s[:, 2] * (s[:, 1] != 0.5))) / \
-                                  np.sum(s[:, 2] * (s[:, 1] != 0.5))
-
-                    # Handle the case where BAF is a flat line at 0.5
-                    if np.isnan(perczeroAbb):
-                        perczeroAbb = 0
-
-                    goodnessOfFit = (1 - m / TheoretMaxdist) * 100
-
-                    if (MINPLOIDYSTRICT < ploidy < MAXPLOIDYSTRICT and
-                            rho >= MINRHO and goodnessOfFit > MINGOODNESSOFFIT):
-                        optima.append([m, i, j, ploidy, goodnessOfFit])
-                        localmin.append(m)
+        minima = find_local_minima(d, psi_values, rho_values, s, gamma, TheoretMaxdist)
+        fit = (minima['rho'] >= MINRHO) & (minima['goodnessOfFit'] > MINGOODNESSOFFIT)
+        loose_ploidy = (MINPLOIDY < minima['ploidy']) & (minima['ploidy'] < MAXPLOIDY)
+        strict_ploidy = (MINPLOIDYSTRICT < minima['ploidy']) & (minima['ploidy'] < MAXPLOIDYSTRICT)
+        selected = (not nonaberrant) & loose_ploidy & fit & ((minima['perczeroAbb'] > MINPERCZEROABB) |
+                                                             (minima['percentzero'] > MINPERCZERO) |
+                                                             (minima['percOddEven'] > MINPERCODDEVEN))
+
+        # if still no solution, drop the percentzero > MINPERCENTZERO filter, but strict ploidy borders
+        if not np.any(selected) and allow_strict:
+            selected = strict_ploidy & fit
 
+    optima = np.any(selected)
     if optima:
-        optlim = np.min(localmin)
-        for opt in optima:
-            if opt[0] == optlim:
-                psi_opt1 = psi_values[int(opt[1])]
-                rho_opt1 = rho_values[int(opt[2])]
-                if rho_opt1 > 1:
-                    rho_opt1 = 1
-                ploidy_opt1 = opt[3]
-                goodnessOfFit_opt1 = opt[4]
-                break
+        # minima are in row-major order, the first cell reaching the lowest distance wins
+        best = np.flatnonzero(selected)[np.argmin(minima['m'][selected])]
+        psi_opt1 = psi_values[minima['i'][best]]
+        rho_opt1 = min(rho_values[minima['j'][best]], 1)
+        ploidy_opt1 = minima['ploidy'][best]
+        goodnessOfFit_opt1 = minima['goodnessOfFit'][best]
 
     if optima:
         rho = rho_opt1
@@ -424,15 +302,17 @@ def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_lo
         nMajor = np.zeros(len(r_ori))
         nMinor = np.zeros(len(r_ori))
 
-        for row in seg:
+        segment_id = np.full(len(r_ori), -1, dtype=np.int64)
+        for seg_idx, row in enumerate(seg):
             start, end, nA, nB = row
             nMajor[int(start):int(end)+1] = nA
             nMinor[int(start):int(end)+1] = nB
+            segment_id[int(start):int(end)+1] = seg_idx
 
         n1all = np.zeros(len(r_ori))
         n2all = np.zeros(len(r_ori))
 
-        homo = germline_genotypes_values == 'True'
+        homo = germline_genotypes_values
         homo_indices = np.where(homo)[0]
 
         heteroprobes_indices = het_indices
@@ -456,13 +336,10 @@ def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_lo
         for idx, seg_line in enumerate(seg):
             start_idx = int(seg_line[0]) if idx == 0 else int(seg_line[0]) + 1
             end_idx = int(seg_line[1])
-            tumor_baf_dict_keys = list(tumor_baf_dict.keys())
-            start_key = tumor_baf_dict_keys[start_idx]
-            end_key = tumor_baf_dict_keys[end_idx]
-            start_chr = start_key[0]
-            end_chr = end_key[0]
-            start_pos = start_key[1]
-            end_pos = end_key[1]
+            start_chr = str(chr_array[start_idx])
+            end_chr = str(chr_array[end_idx])
+            start_pos = str(pos_array[start_idx])
+            end_pos = str(pos_array[end_idx])
             seg_line_new = [start_chr, start_pos, end_pos, str(seg_line[2]), str(seg_line[3])]
             seg_new.append(seg_line_new)
         seg_raw = seg_raw
@@ -470,46 +347,51 @@ def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_lo
         for idx, seg_raw_line in enumerate(seg_raw):
             start_idx = int(seg_raw_line[0]) if idx == 0 else int(seg_raw_line[0]) + 1
             end_idx = int(seg_raw_line[1])
-            tumor_baf_dict_keys = list(tumor_baf_dict.keys())
-            start_key = tumor_baf_dict_keys[start_idx]
-            end_key = tumor_baf_dict_keys[end_idx]
-            start_chr = start_key[0]
-            end_chr = end_key[0]
-            start_pos = start_key[1]
-            end_pos = end_key[1]
+            start_chr = str(chr_array[start_idx])
+            end_chr = str(chr_array[end_idx])
+            start_pos = str(pos_array[start_idx])
+            end_pos = str(pos_array[end_idx])
             seg_raw_line_new = [start_chr, start_pos, end_pos, str(seg_raw_line[2]), str(seg_raw_line[3])]
             seg_raw_new.append(seg_raw_line_new)
         distance_matrix = d
         ploidy = np.mean(n1all + n2all)
 
-    else:
-        print("Could not find an optimal purity and ploidy value for {}!".format(sample_name))
-        rho = None
-        psi = None
-        goodnessOfFit = None
-        nonaberrant = None
-        nA = None
-        nB = None
-        seg = None
-        seg_new = None
-        seg_raw = None
-        seg_raw_new = None
-        distance_matrix = None
-        ploidy = None
-
-    if rho != None:
-        output_header_purity = 'Sample' + '\t' + 'Purity' + '\t' + 'Ploidy' + '\t' + 'GoodnessOfFit' + '\n'
-        tumor_purity_ploidy_output = open(tumor_purity_ploidy_output_file, 'w')
-        tumor_purity_ploidy_output.write(output_header_purity)
-        tumor_purity_ploidy_string = sample_name + '\t' + str(rho) + '\t' + str(ploidy) + '\t' + str(goodnessOfFit) + '\n'
-        tumor_purity_ploidy_output.write(tumor_purity_ploidy_string)
-
-        output_header_cna = 'Sample' + '\t' + 'Chromosome' + '\t' + 'StartPosition' + '\t' + 'EndPosition' + '\t' + 'nMajor' + '\t' + 'nMinor' + '\n'
-        tumor_cna_output = open(tumor_cna_output_file, 'w')
-        tumor_cna_output.write(output_header_cna)
-        for seg_line in seg_new:
-            tumor_cna_string = sample_name + '\t' + '\t'.join(list(seg_line)) + '\n'
-            tumor_cna_output.write(tumor_cna_string)
+        return {'rho': rho, 'ploidy': ploidy, 'goodnessOfFit': goodnessOfFit, 'segments': seg_new,
+                'segment_id': segment_id}
+
+    print("Could not find an optimal purity and ploidy value for {}!".format(sample_name))
+    return None
+
+
+def write_ascat_output(ascat_result, tumor_purity_ploidy_output_file, tumor_cna_output_file, sample_name):
+    output_header_purity = 'Sample' + '\t' + 'Purity' + '\t' + 'Ploidy' + '\t' + 'GoodnessOfFit' + '\n'
+    tumor_purity_ploidy_output = open(tumor_purity_ploidy_output_file, 'w')
+    tumor_purity_ploidy_output.write(output_header_purity)
+    tumor_purity_ploidy_string = sample_name + '\t' + str(ascat_result['rho']) + '\t' + str(ascat_result['ploidy']) + '\t' + str(ascat_result['goodnessOfFit']) + '\n'
+    tumor_purity_ploidy_output.write(tumor_purity_ploidy_string)
+    tumor_purity_ploidy_output.close()
+
+    output_header_cna = 'Sample' + '\t' + 'Chromosome' + '\t' + 'StartPosition' + '\t' + 'EndPosition' + '\t' + 'nMajor' + '\t' + 'nMinor' + '\n'
+    tumor_cna_output = open(tumor_cna_output_file, 'w')
+    tumor_cna_output.write(output_header_cna)
+    for seg_line in ascat_result['segments']:
+        tumor_cna_string = sample_name + '\t' + '\t'.join(list(seg_line)) + '\n'
+        tumor_cna_output.write(tumor_cna_string)
+    tumor_cna_output.close()
+
+
+def run_ascat(tumor_logr_file, tumor_baf_file, germline_genotypes_file, tumor_logr_segmented_file, tumor_baf_segmented_file, tumor_purity_ploidy_output_file, tumor_cna_output_file, gamma, min_ploidy, max_ploidy, min_purity,
+                    max_purity, sample_name):
+    chr_array, pos_array, tumor_baf_ori = read_probe_values(tumor_baf_file)
+    germline_genotypes_values = read_probe_values(germline_genotypes_file, dtype=bool)[2]
+    tumor_logr_segmented = read_probe_values(tumor_logr_segmented_file)[2]
+    tumor_baf_segmented = read_probe_values(tumor_baf_segmented_file)[2]
+
+    ascat_result = runAscatFrom(chr_array, pos_array, tumor_baf_ori, germline_genotypes_values, tumor_logr_segmented,
+                                tumor_baf_segmented, gamma, min_ploidy, max_ploidy, min_purity, max_purity,
+                                sample_name)
+    if ascat_result is not None:
+        write_ascat_output(ascat_result, tumor_purity_ploidy_output_file, tumor_cna_output_file, sample_name)
 
 
 def main():
@@ -0,0 +1,199 @@
+from argparse import ArgumentParser
+
+import numpy as np
+
+from count_alleles import count_alleles, load_allele_counts
+from get_logr_and_baf import contigs_from, getBAFsAndLogRsFromCounts
+from correct_logr import correctedLogRFrom
+from predict_germline_genotypes import germlineGenotypesFrom
+from aspcf import aspcfFrom
+from run_ascat import runAscatFrom, write_ascat_output
+from tag_germline_variant import tag_variants
+from probe_table import ProbeTable
+
+
+def run_verdict(args):
+    """
+    Run the Verdict steps from the allele counts to the variant tagging in one process. The steps share a single
+    ProbeTable instead of writing and parsing a probe file each, only the purity, ploidy and CNA outputs are written,
+    and the probe table if --probe_table_fn is provided.
+    """
+    contig_list = contigs_from(args.contig_fn)
+    if args.tumor_bam_fn is not None:
+        allele_count_dict = count_alleles(args.samtools, contig_list, args.alleles_file_prefix, args.tumor_bam_fn,
+                                          args.normal_bam_fn, threads=args.threads, ref_fn=args.ref_fn,
+                                          decode_threads=args.decode_threads)
+        has_normal = args.normal_bam_fn is not None
+    else:
+        allele_count_dict = load_allele_counts(contig_list, args.alleles_file_prefix,
+                                               args.tumor_allele_counts_file_prefix,
+                                               args.normal_allele_counts_file_prefix)
+        has_normal = args.normal_allele_counts_file_prefix is not None
+
+    probe_table = ProbeTable(*getBAFsAndLogRsFromCounts(allele_count_dict, contig_list, has_normal=has_normal))
+    print("[INFO] Total Verdict probes: {}".format(len(probe_table)))
+
+    probe_table.logr_corrected = correctedLogRFrom(probe_table.chr, probe_table.pos, probe_table.logr,
+                                                   args.gc_content_file, args.replication_timing_file)
+
+    probe_table.genotype = germlineGenotypesFrom(probe_table.chr, probe_table.baf, probe_table.normal_baf,
+                                                 args.maxHomozygous, args.proportionHetero, args.proportionHomo,
+                                                 args.proportionOpen, args.segmentLength)
+
+    logr_segmented, het_baf_segmented = aspcfFrom(probe_table.chr, probe_table.logr_corrected, probe_table.baf,
+                                                  probe_table.genotype, args.penalty, args.threads)
+    probe_table.logr_segmented = logr_segmented
+    probe_table.baf_segmented = np.full(len(probe_table), np.nan)
+    probe_table.baf_segmented[~probe_table.genotype] = het_baf_segmented
+
+    ascat_result = runAscatFrom(probe_table.chr, probe_table.pos, probe_table.baf, probe_table.genotype,
+                                probe_table.logr_segmented, het_baf_segmented, args.gamma, args.min_ploidy,
+                                args.max_ploidy, args.min_purity, args.max_purity, args.sample_name)
+    if ascat_result is not None:
+        probe_table.segment_id = ascat_result['segment_id']
+        write_ascat_output(ascat_result, args.tumor_purity_ploidy_output_file, args.tumor_cna_output_file,
+                           args.sample_name)
+
+    if args.probe_table_fn is not None:
+        probe_table.save(args.probe_table_fn)
+
+    if ascat_result is None:
+        print("[INFO] Verdict can not obtain final results, not applying verdict tagging!")
+        return
+
+    segments = ascat_result['segments']
+    tag_variants(args.input_vcf_fn, args.output_fn, float(ascat_result['rho']),
+                 [seg_line[0] for seg_line in segments],
+                 [int(seg_line[1]) for seg_line in segments],
+                 [int(seg_line[2]) for seg_line in segments],
+                 [int(seg_line[3]) for seg_line in segments],
+                 [int(seg_line[4]) for seg_line in segments])
+
+
+def main():
+    parser = ArgumentParser(description="Run all Verdict steps in one process on a shared probe table")
+
+    parser.add_argument('--tumor_allele_counts_file_prefix', type=str,
+                        default=None,
+                        help="Prefix of tumor allele count file")
+
+    parser.add_argument('--normal_allele_counts_file_prefix', type=str,
+                        default=None,
+                        help="Prefix of normal allele count file")
+
+    parser.add_argument('--tumor_bam_fn', type=str,
+                        default=None,
+                        help="Tumor BAM file, count the alleles with the built-in allele counter instead of reading the allele count files if provided")
+
+    parser.add_argument('--normal_bam_fn', type=str,
+                        default=None,
+                        help="Normal BAM file of the built-in allele counter")
+
+    parser.add_argument('--ref_fn', type=str,
+                        default=None,
+                        help="Reference fasta file, required to count the alleles of a CRAM input")
+
+    parser.add_argument('--samtools', type=str,
+                        default="samtools",
+                        help="Path to the 'samtools' of the built-in allele counter")
+
+    parser.add_argument('--alleles_file_prefix', type=str,
+                        default=None,
+                        help="Prefix of 1kG alleles file")
+
+    parser.add_argument('--gc_content_file', type=str,
+                        default=None,
+                        help="Path of 1kG GC content file")
+
+    parser.add_argument('--replication_timing_file', type=str,
+                        default=None,
+                        help="Path of 1kG replication timing file")
+
+    parser.add_argument('--contig_fn', type=str,
+                        default=None,
+                        help="Contig file")
+
+    parser.add_argument('--input_vcf_fn', type=str,
+                        default=None,
+                        help="Input VCF to tag")
+
+    parser.add_argument('--output_fn', type=str,
+                        default=None,
+                        help="Output file path")
+
+    parser.add_argument('--tumor_purity_ploidy_output_file', type=str,
+                        default=None,
+                        help="Output path of estimated tumor sample purity and ploidy")
+
+    parser.add_argument('--tumor_cna_output_file', type=str,
+                        default=None,
+                        help="Output path of tumor sample CNA file")
+
+    parser.add_argument('--probe_table_fn', type=str,
+                        default=None,
+                        help="Output path of the probe table (.npz) with the LogR, BAF, genotype and segment of each probe")
+
+    parser.add_argument('--sample_name', type=str,
+                        default="SAMPLE",
+                        help="Tumor sample name")
+
+    parser.add_argument('--maxHomozygous', type=float,
+                        default=0.02,
+                        help="Value of max homozygous")
+
+    parser.add_argument('--proportionHetero', type=float,
+                        default=0.30,
+                        help="Proportion of hetero")
+
+    parser.add_argument('--proportionHomo', type=float,
+                        default=0.65,
+                        help="Proportion of homo")
+
+    parser.add_argument('--proportionOpen', type=float,
+                        default=0.03,
+                        help="Proportion of open")
+
+    parser.add_argument('--segmentLength', type=int,
+                        default=100,
+                        help="Segment length")
+
+    parser.add_argument('--penalty', type=int,
+                        default=1000,
+                        help="Penalty term")
+
+    parser.add_argument('--gamma', type=float,
+                        default=1.0,
+                        help="Value of gamma parameter")
+
+    parser.add_argument('--min_ploidy', type=float,
+                        default=1.5,
+                        help="Value of min ploidy")
+
+    parser.add_argument('--max_ploidy', type=float,
+                        default=5.5,
+                        help="Value of max ploidy")
+
+    parser.add_argument('--min_purity', type=float,
+                        default=0.1,
+                        help="Value of min purity")
+
+    parser.add_argument('--max_purity', type=float,
+                        default=1.05,
+                        help="Value of max purity")
+
+    parser.add_argument('--threads', type=int,
+                        default=1,
+                        help="Threads of the built-in allele counter and processes to segment chromosome arms in parallel")
+
+    parser.add_argument('--decode_threads', type=int,
+                        default=0,
+                        help="htslib threads of each samtools to decode a BAM/CRAM in the built-in allele counter")
+
+    global args
+    args = parser.parse_args()
+
+    run_verdict(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,12 +7,14 @@ from argparse import ArgumentParser
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
 from shared.vcf import VcfReader
 import subprocess
-from src.sort_vcf import compress_index_vcf
-from numpy import *
-from scipy.stats import binom_test
+from shared.bgzf import BgzfVcfWriter
+from numpy import nan, inf, isnan, log10, nanargmax, array, asarray, full, ones, arange, argsort, \
+    searchsorted, unique, append, minimum, maximum, int64, float64
+from scipy.stats import binom
 
 import random
 from time import time
+from collections import defaultdict
 
 seed = int(time())
 random.seed(seed)
@@ -27,6 +29,76 @@ def insert_after_line(original_str, target_line, insert_str):
     return '\n'.join(lines)
 
 
+def binom_test_pvalues(k, n, prob, max_chunk_elements=2**22):
+    """
+    Two-sided exact binomial test for a batch of variants sharing the same expected allele frequency, the p-value is
+    the total probability of all outcomes no more likely than the observed one (same definition as scipy binomtest).
+    """
+    k = asarray(k, dtype=int64)
+    n = asarray(n, dtype=int64)
+    pvalues = ones(len(n), dtype=float64)
+    if len(n) == 0:
+        return pvalues
+    rerr = 1 + 1e-7
+    # sort by depth so that each chunk only expands up to its own maximum depth
+    order = argsort(n, kind='stable')
+    chunk_size = max(1, max_chunk_elements // (int(n.max()) + 1))
+    for chunk_start in range(0, len(order), chunk_size):
+        chunk_idx = order[chunk_start:chunk_start + chunk_size]
+        chunk_k = k[chunk_idx][:, None]
+        chunk_n = n[chunk_idx][:, None]
+        x = arange(int(chunk_n.max()) + 1)[None, :]
+        observed_pmf = binom.pmf(chunk_k, chunk_n, prob)
+        pmf = binom.pmf(x, chunk_n, prob)
+        pmf[(x > chunk_n) | (pmf > observed_pmf * rerr)] = 0
+        pvalues[chunk_idx] = minimum(1.0, pmf.sum(axis=1))
+    pvalues[k == prob * n] = 1.0
+    return pvalues
+
+
+def build_segment_index(seg_chr_list, seg_start_list, seg_end_list):
+    """
+    Index the CNA segments per contig with start-sorted arrays, return a dict of contig: (starts, ends, segment
+    indexes, is_overlapped).
+    """
+    contig_seg_idx = defaultdict(list)
+    for idx, seg_chr in enumerate(seg_chr_list):
+        contig_seg_idx[seg_chr].append(idx)
+
+    segment_index = {}
+    for seg_chr, seg_idx_list in contig_seg_idx.items():
+        seg_idx = array(seg_idx_list, dtype=int64)
+        starts = array(seg_start_list, dtype=int64)[seg_idx]
+        ends = array(seg_end_list, dtype=int64)[seg_idx]
+        order = argsort(starts, kind='stable')
+        starts, ends, seg_idx = starts[order], ends[order], seg_idx[order]
+        is_overlapped = len(starts) > 1 and bool((starts[1:] <= maximum.accumulate(ends)[:-1]).any())
+        segment_index[seg_chr] = (starts, ends, seg_idx, is_overlapped)
+    return segment_index
+
+
+def assign_segments(segment_index, ctg_name, pos):
+    """
+    Return the index of the first segment (in CNA file order) covering each position of a contig, -1 if not found.
+    """
+    pos = asarray(pos, dtype=int64)
+    assigned = full(len(pos), -1, dtype=int64)
+    if ctg_name not in segment_index or len(pos) == 0:
+        return assigned
+    starts, ends, seg_idx, is_overlapped = segment_index[ctg_name]
+    if not is_overlapped:
+        candidate = searchsorted(starts, pos, side='right') - 1
+        valid = candidate >= 0
+        valid[valid] = pos[valid] <= ends[candidate[valid]]
+        assigned[valid] = seg_idx[candidate[valid]]
+        return assigned
+
+    # overlapped segments, keep the first covering segment in file order
+    for i in argsort(seg_idx, kind='stable')[::-1]:
+        assigned[(starts[i] <= pos) & (pos <= ends[i])] = seg_idx[i]
+    return assigned
+
+
 def tag_germline_variant(args):
 
     input_vcf_fn = args.input_vcf_fn
@@ -44,17 +116,6 @@ def tag_germline_variant(args):
     if tumor_purity > 0.8:
         print("[INFO] Tumor purity estimation {} is higher than 0.8, not applying verdict tagging!".format(tumor_purity))
         return
-    
-    input_vcf_reader = VcfReader(
-            vcf_fn=input_vcf_fn,
-            show_ref=True,
-            keep_row_str=True,
-            keep_af=True,
-            skip_genotype=True,
-            save_header=True
-    )
-    input_vcf_reader.read_vcf()
-    input_variant_dict = input_vcf_reader.variant_dict
 
     cna_file = open(segment_path, 'r')
 
@@ -79,143 +140,193 @@ def tag_germline_variant(args):
         cn_minor_list.append(cn_minor)
 
     cna_file.close()
+    tag_variants(input_vcf_fn, args.output_fn, tumor_purity, seg_chr_list, seg_start_list, seg_end_list, cn_major_list,
+                 cn_minor_list)
+
+
+def tag_variants(input_vcf_fn, output_fn, tumor_purity, seg_chr_list, seg_start_list, seg_end_list, cn_major_list,
+                 cn_minor_list):
+    """
+    Tag the PASS variants of the input VCF as germline or somatic from the tumor purity and the CNA segments, and
+    write the BGZF compressed output VCF.
+    """
+    if tumor_purity > 0.8:
+        print("[INFO] Tumor purity estimation {} is higher than 0.8, not applying verdict tagging!".format(tumor_purity))
+        return
+
+    input_vcf_reader = VcfReader(
+            vcf_fn=input_vcf_fn,
+            show_ref=True,
+            keep_row_str=True,
+            keep_af=True,
+            skip_genotype=True,
+            save_header=True,
+            columnar=True
+    )
+    input_vcf_reader.read_vcf()
+    # read the rows, filters and AFs from the columnar record store, no Position is built per variant
+    record_store = input_vcf_reader.record_store
+    record_idx_list = list(record_store.key_index().values()) if record_store is not None else []
+    row_list = [record_store.row_str(idx) for idx in record_idx_list]
+
     high_purity_tresh = 0.95
     ALPHA = 0.01
 
     not_pass_count = 0
-    for k, v in input_variant_dict.items():
-        if v.filter != 'PASS':
+    pass_variant_list = []
+    contig_variant_idx = defaultdict(list)
+    for row_idx, record_idx in enumerate(record_idx_list):
+        if record_store.filter_list[record_store.filter_code[record_idx]] != 'PASS':
             continue
-        frequency = v.af
-        columns = v.row_str.strip().split('\t')
+        columns = row_list[row_idx].strip().split('\t')
         depth = int(columns[9].strip().split(':')[2])
-        ctg_name = str(columns[0])
-        pos = int(columns[1])
-        p = M = C = nan
-        segFound = 0
+        contig_variant_idx[str(columns[0])].append(len(pass_variant_list))
+        pass_variant_list.append((row_idx, columns, depth, float(record_store.af[record_idx]), int(columns[1])))
+
+    # assign all PASS variants to the CNA segments with one binary search pass per contig
+    segment_index = build_segment_index(seg_chr_list, seg_start_list, seg_end_list)
+    variant_seg_idx = full(len(pass_variant_list), -1, dtype=int64)
+    for ctg_name, variant_idx in contig_variant_idx.items():
+        pos_list = [pass_variant_list[i][4] for i in variant_idx]
+        variant_seg_idx[variant_idx] = assign_segments(segment_index, ctg_name, pos_list)
+
+    # binomial tests are computed in batch for all variants in the same segment
+    p = tumor_purity
+    variant_count = len(pass_variant_list)
+    depth_array = array([item[2] for item in pass_variant_list], dtype=int64)
+    alt_count_array = array([round(item[2] * item[3]) for item in pass_variant_list], dtype=int64)
+    P_G1_array, P_S1_array, P_G2_array, P_S2_array = [full(variant_count, nan) for _ in range(4)]
+    seg_af_dict = {}
+    order = argsort(variant_seg_idx, kind='stable')
+    group_seg_idx, group_start = unique(variant_seg_idx[order], return_index=True)
+    group_end = append(group_start[1:], variant_count)
+    for seg_idx, start, end in zip(group_seg_idx, group_start, group_end):
+        if seg_idx < 0:
+            continue
+        variant_idx = order[start:end]
+        M = cn_minor_list[seg_idx]
+        C = cn_major_list[seg_idx] + cn_minor_list[seg_idx]
+        if M == 0:
+            M = C - M
+        AF_G1 = (p * M + 1 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
+        AF_S1 = (p * M + 0 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
+        P_G1_array[variant_idx] = binom_test_pvalues(alt_count_array[variant_idx], depth_array[variant_idx], AF_G1)
+        P_S1_array[variant_idx] = binom_test_pvalues(alt_count_array[variant_idx], depth_array[variant_idx], AF_S1)
+        if M != C - M:
+            AF_G2 = (p * (C - M) + 1 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
+            P_G2_array[variant_idx] = binom_test_pvalues(alt_count_array[variant_idx], depth_array[variant_idx], AF_G2)
+            if C - M != 0:
+                AF_S2 = (p * (C - M) + 0 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
+                P_S2_array[variant_idx] = binom_test_pvalues(alt_count_array[variant_idx], depth_array[variant_idx], AF_S2)
+            else:
+                AF_S2 = nan
+        else:
+            AF_G2 = AF_S2 = nan
+        seg_af_dict[seg_idx] = (M, C, AF_G1, AF_S1, AF_G2, AF_S2)
+
+    for variant_idx, (row_idx, columns, depth, frequency, pos) in enumerate(pass_variant_list):
+        seg_idx = variant_seg_idx[variant_idx]
         clonality = 'NA'
         in_tumor = 'NA'
         SG_status = 'somatic'
-        for i in range(len(seg_chr_list)):
-            seg_chr = seg_chr_list[i]
-            seg_start = seg_start_list[i]
-            seg_end = seg_end_list[i]
-            cn_major = cn_major_list[i]
-            cn_minor = cn_minor_list[i]
-            if seg_chr == ctg_name and seg_start <= pos <= seg_end:
-                segFound = 1
-                p = tumor_purity
-                M = cn_minor
-                C = cn_major + cn_minor
-                if M == 0:
-                    M = C - M
-                P_G1 = P_G2 = P_S1 = P_S2 = 0
-                AF_G1 = (p * M + 1 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
-                AF_S1 = (p * M + 0 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
-                P_G1 = binom_test(round(depth * frequency), depth, AF_G1).pvalue
-                P_S1 = binom_test(round(depth * frequency), depth, AF_S1).pvalue
-                if M != C - M:
-                    AF_G2 = (p * (C - M) + 1 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
-                    P_G2 = binom_test(round(depth * frequency), depth, AF_G2).pvalue
-                    if C - M != 0:
-                        AF_S2 = (p * (C - M) + 0 * (1 - p)) / (p * C + 2 * (1 - p) + sys.float_info.epsilon)
-                        P_S2 = binom_test(round(depth * frequency), depth, AF_S2).pvalue
+        if seg_idx >= 0:
+            M, C, AF_G1, AF_S1, AF_G2, AF_S2 = seg_af_dict[seg_idx]
+            P_G1 = float(P_G1_array[variant_idx])
+            P_S1 = float(P_S1_array[variant_idx])
+            P_G2 = float(P_G2_array[variant_idx])
+            P_S2 = float(P_S2_array[variant_idx])
+
+            max_prob_germline = max(P_G1, P_G2)
+            max_prob_somatic = max(P_S1, P_S2)
+
+            if max_prob_somatic == 0:
+                logodds = inf
+            elif max_prob_germline == 0:
+                logodds = -inf
+            else:
+                logodds = log10(max_prob_germline) - log10(max_prob_somatic)
+
+            if frequency < 0.05 and 0.2 < p < 0.9:
+                SG_status = 'subclonal somatic'
+                columns[7] += ';Verdict_SubclonalSomatic'
+                # columns[6] += ';SubclonalSomatic'
+
+            elif isnan(C) or isnan(M):
+                SG_status = 'ambiguous_CNA_model'
+                # columns[6] += ';AmbiguousCNA'
+
+            elif frequency > 0.95:
+                SG_status = 'germline'
+                columns[7] += ';Verdict_Germline'
+                # columns[6] += ';Germline'
+
+            elif max_prob_germline > ALPHA and max_prob_somatic < ALPHA:
+                if logodds < 2:
+                    SG_status = 'probable germline'
+                    # columns[6] += ';ProbableGermline'
+                else:
+                    if frequency > 0.25:
+                        SG_status = 'germline'
+                        columns[7] += ';Verdict_Germline'
+                        # columns[6] += ';Germline'
                     else:
-                        AF_S2 = P_S2 = nan
+                        SG_status = 'probable germline'
+                        # columns[6] += ';ProbableGermline'
+
+            elif max_prob_germline < ALPHA and max_prob_somatic > ALPHA:
+                if logodds > -2:
+                    SG_status = 'probable somatic'
+                    # columns[6] += ';ProbableSomatic'
                 else:
-                    AF_G2 = AF_S2 = P_G2 = P_S2 = nan
+                    SG_status = 'somatic'
+                    columns[7] += ';Verdict_Somatic'
+                    # columns[6] += ';Somatic'
 
-                max_prob_germline = max(P_G1, P_G2)
-                max_prob_somatic = max(P_S1, P_S2)
+                if nanargmax([P_S1, P_S2]) == 1:
+                    M = C - M
 
-                if max_prob_somatic == 0:
-                    logodds = inf
-                elif max_prob_germline == 0:
-                    logodds = -inf
-                else:
-                    logodds = log10(max_prob_germline) - log10(max_prob_somatic)
+            elif max_prob_germline > ALPHA and max_prob_somatic > ALPHA:
+                SG_status = 'ambiguous_both_G_and_S'
+
+            elif max_prob_germline < ALPHA and max_prob_somatic < ALPHA:
 
-                if frequency < 0.05 and 0.2 < p < 0.9:
+                min_soma_EAF = min(AF_S1, AF_S2)
+                min_germ_EAF = min(AF_G1, AF_G2)
+
+                if p >= 0.3 and frequency < 0.25 and frequency < min_soma_EAF / 1.5 and min_soma_EAF <= min_germ_EAF:
                     SG_status = 'subclonal somatic'
                     columns[7] += ';Verdict_SubclonalSomatic'
                     # columns[6] += ';SubclonalSomatic'
 
-                elif isnan(C) or isnan(M):
-                    SG_status = 'ambiguous_CNA_model'
-                    # columns[6] += ';AmbiguousCNA'
-
-                elif frequency > 0.95:
-                    SG_status = 'germline'
-                    columns[7] += ';Verdict_Germline'
-                    # columns[6] += ';Germline'
+                elif p >= 0.3 and frequency < 0.25 and frequency < min_germ_EAF / 2.0 and min_germ_EAF < min_soma_EAF:
+                    SG_status = 'subclonal somatic'
+                    columns[7] += ';Verdict_SubclonalSomatic'
+                    # columns[6] += ';SubclonalSomatic'
 
-                elif max_prob_germline > ALPHA and max_prob_somatic < ALPHA:
-                    if logodds < 2:
-                        SG_status = 'probable germline'
-                        # columns[6] += ';ProbableGermline'
-                    else:
-                        if frequency > 0.25:
-                            SG_status = 'germline'
-                            columns[7] += ';Verdict_Germline'
-                            # columns[6] += ';Germline'
-                        else:
-                            SG_status = 'probable germline'
-                            # columns[6] += ';ProbableGermline'
-
-                elif max_prob_germline < ALPHA and max_prob_somatic > ALPHA:
-                    if logodds > -2:
-                        SG_status = 'probable somatic'
-                        # columns[6] += ';ProbableSomatic'
-                    else:
-                        SG_status = 'somatic'
-                        columns[7] += ';Verdict_Somatic'
-                        # columns[6] += ';Somatic'
+                elif logodds < -5 and max_prob_somatic > 1e-10:
+                    SG_status = 'somatic'
+                    columns[7] += ';Verdict_Somatic'
+                    # columns[6] += ';Somatic'
 
                     if nanargmax([P_S1, P_S2]) == 1:
                         M = C - M
 
-                elif max_prob_germline > ALPHA and max_prob_somatic > ALPHA:
-                    SG_status = 'ambiguous_both_G_and_S'
-
-                elif max_prob_germline < ALPHA and max_prob_somatic < ALPHA:
-
-                    min_soma_EAF = min(AF_S1, AF_S2)
-                    min_germ_EAF = min(AF_G1, AF_G2)
-
-                    if p >= 0.3 and frequency < 0.25 and frequency < min_soma_EAF / 1.5 and min_soma_EAF <= min_germ_EAF:
-                        SG_status = 'subclonal somatic'
-                        columns[7] += ';Verdict_SubclonalSomatic'
-                        # columns[6] += ';SubclonalSomatic'
-
-                    elif p >= 0.3 and frequency < 0.25 and frequency < min_germ_EAF / 2.0 and min_germ_EAF < min_soma_EAF:
-                        SG_status = 'subclonal somatic'
-                        columns[7] += ';Verdict_SubclonalSomatic'
-                        # columns[6] += ';SubclonalSomatic'
-
-                    elif logodds < -5 and max_prob_somatic > 1e-10:
-                        SG_status = 'somatic'
-                        columns[7] += ';Verdict_Somatic'
-                        # columns[6] += ';Somatic'
-
-                        if nanargmax([P_S1, P_S2]) == 1:
-                            M = C - M
-
-                    elif logodds > 5 and max_prob_germline > 1e-4:
-                        SG_status = 'germline'
-                        columns[7] += ';Verdict_Germline'
-                        # columns[6] += ';Germline'
-
-                    else:
-                        SG_status = 'ambiguous_neither_G_nor_S'
+                elif logodds > 5 and max_prob_germline > 1e-4:
+                    SG_status = 'germline'
+                    columns[7] += ';Verdict_Germline'
+                    # columns[6] += ';Germline'
 
                 else:
-                    SG_status = 'unknown'
+                    SG_status = 'ambiguous_neither_G_nor_S'
 
-                break
+            else:
+                SG_status = 'unknown'
 
-        v.row_str = '\t'.join(columns) + '\n'
+        row_list[row_idx] = '\t'.join(columns) + '\n'
 
-    with open(args.output_fn, 'w') as f:
+    # write the BGZF compressed VCF and its tabix index directly
+    output_fn = output_fn if output_fn.endswith('.gz') else output_fn + '.gz'
+    with BgzfVcfWriter(output_fn) as f:
         #write header
         ori_header = input_vcf_reader.header
         last_filter_line = '##FILTER=<ID=Germline,Description="Germline variant">'
@@ -225,11 +336,8 @@ def tag_germline_variant(args):
         vcf_header_verdict_info += '##INFO=<ID=Verdict_SubclonalSomatic,Number=0,Type=Flag,Description="Variant tagged by verdict as Subclonal Somatic">' + '\n'
         updated_header = insert_after_line(ori_header, last_filter_line, vcf_header_verdict_info)
         f.write(updated_header)
-        for k, v in input_variant_dict.items():
-            f.write(v.row_str)
-
-    if os.path.exists(args.output_fn):
-        compress_index_vcf(args.output_fn)
+        for row in row_list:
+            f.write(row)
 
 
 def main():
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the Verdict scripts import their siblings as top level modules
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, 'src', 'verdict')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
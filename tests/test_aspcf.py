@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+
+from aspcf import aspcfFrom, aspcfpart, exactPcf, pcfBreakpoints
+
+# (mean LogR, mean flipped BAF, probe number) of each plateau
+PLATEAU_LIST = [(0.0, 0.5, 60), (0.8, 0.3, 40), (-0.5, 0.2, 80), (0.3, 0.45, 50)]
+
+
+def synthetic_tracks(rng, logr_sd=0.2, baf_sd=0.05):
+    logr = np.concatenate([rng.normal(mean, logr_sd, num) for mean, _, num in PLATEAU_LIST])
+    baf = np.concatenate([np.abs(rng.normal(mean, baf_sd, num)) for _, mean, num in PLATEAU_LIST])
+    return logr, baf
+
+
+def exhaustive_best_split(y_list, sd_list, kmin, gamma):
+    # the unpruned O(N^2) recurrence of the ASCAT segmentation, every split is tried and the leftmost best is kept
+    N = len(y_list[0])
+
+    def segment_cost(start, end):
+        return sum(np.sum((y[start:end] - np.mean(y[start:end])) ** 2) / sd ** 2 for y, sd in zip(y_list, sd_list))
+
+    bestCost = np.zeros(N + 1)
+    bestSplit = np.zeros(N + 1, dtype=int)
+    for n in range(kmin, min(2 * kmin, N + 1)):
+        bestCost[n] = segment_cost(0, n)
+    for n in range(2 * kmin, N + 1):
+        cost_list = [bestCost[split] + segment_cost(split, n) for split in range(kmin, n - kmin + 1)]
+        split = kmin + int(np.argmin(cost_list))
+        bestCost[n], bestSplit[n] = cost_list[split - kmin] + gamma, split
+        totCost = segment_cost(0, n)
+        if totCost < bestCost[n]:
+            bestCost[n], bestSplit[n] = totCost, 0
+    return bestSplit
+
+
+@pytest.mark.parametrize('kmin,gamma', [(6, 25), (3, 5), (6, 1000)])
+def test_pcf_breakpoints_match_exhaustive_segmentation(kmin, gamma):
+    rng = np.random.RandomState(kmin + gamma)
+    logr, baf = synthetic_tracks(rng)
+    noise = rng.normal(0, 1, 120)
+
+    assert np.array_equal(pcfBreakpoints([logr, baf], [0.2, 0.05], kmin, gamma),
+                          exhaustive_best_split([logr, baf], [0.2, 0.05], kmin, gamma))
+    assert np.array_equal(pcfBreakpoints([noise], [1.0], kmin, gamma),
+                          exhaustive_best_split([noise], [1.0], kmin, gamma))
+
+
+def test_segmentation_recovers_synthetic_change_points():
+    rng = np.random.RandomState(0)
+    logr, baf = synthetic_tracks(rng)
+    N = len(logr)
+    change_point_list = np.cumsum([0] + [num for _, _, num in PLATEAU_LIST]).tolist()
+
+    assert sorted(aspcfpart(logr, baf, 0, N, 0, 0.2, 0.05, N, 6, 25)['breakpts']) == change_point_list
+    yhat = exactPcf(logr / 0.2, 6, 25)['yhat']
+    assert (np.flatnonzero(np.diff(yhat)) + 1).tolist() == change_point_list[1:-1]
+
+
+def test_aspcf_from_single_thread_matches_process_pool():
+    rng = np.random.RandomState(1)
+    chr_list, logr_list, baf_list, homo_list = [], [], [], []
+    for chr_name in ('1', '2', '3'):
+        logr, baf = synthetic_tracks(rng)
+        homo = rng.random_sample(len(logr)) < 0.3
+        chr_list += [chr_name] * len(logr)
+        logr_list.append(logr)
+        baf_list.append(np.where(rng.random_sample(len(baf)) < 0.5, baf, 1 - baf))
+        homo_list.append(homo)
+    input_tuple = (np.array(chr_list), np.concatenate(logr_list), np.concatenate(baf_list), np.concatenate(homo_list))
+
+    single_logr, single_baf = aspcfFrom(*input_tuple, penalty=70, threads=1)
+    pool_logr, pool_baf = aspcfFrom(*input_tuple, penalty=70, threads=2)
+    assert np.array_equal(single_logr, pool_logr) and np.array_equal(single_baf, pool_baf)
+    assert len(single_logr) == len(chr_list) and len(single_baf) == np.sum(~input_tuple[3])
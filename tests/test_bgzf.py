@@ -0,0 +1,110 @@
+import gzip
+import random
+
+import pytest
+
+pysam = pytest.importorskip('pysam')
+
+from shared.bgzf import BgzfVcfWriter, compress_index_vcf, vcf_interval_from
+
+VCF_HEADER = '##fileformat=VCFv4.2\n##contig=<ID=chr1>\n##contig=<ID=chr2>\n' \
+             '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n'
+
+
+def vcf_rows_from(seed=0, row_num=3000):
+    random.seed(seed)
+    row_list = []
+    for ctg_name, ctg_length in (('chr1', 2000000), ('chr2', 300000)):
+        for pos in sorted(random.sample(range(1, ctg_length), row_num)):
+            ref = ''.join(random.choice('ACGT') for _ in range(random.choice((1, 1, 1, 5, 40))))
+            info = 'END={}'.format(pos + 20000) if random.random() < 0.01 else '.'
+            row_list.append('{}\t{}\t.\t{}\tA\t30\tPASS\t{}\tGT\t0/1\n'.format(ctg_name, pos, ref, info))
+    return row_list
+
+
+def overlapping_rows_from(row_list, ctg_name, start, end):
+    overlapping_row_list = []
+    for row in row_list:
+        columns = row.split('\t')
+        row_start, row_end = vcf_interval_from(columns)
+        if columns[0] == ctg_name and row_start < end and row_end > start:
+            overlapping_row_list.append(row.rstrip('\n'))
+    return overlapping_row_list
+
+
+def test_bgzf_vcf_matches_plain_vcf(tmp_path):
+    row_list = vcf_rows_from()
+    vcf_fn = str(tmp_path / 'out.vcf.gz')
+    with BgzfVcfWriter(vcf_fn) as vcf_writer:
+        vcf_writer.write(VCF_HEADER)
+        for row in row_list:
+            vcf_writer.write_row(row)
+
+    with gzip.open(vcf_fn, 'rt') as f:
+        assert f.read() == VCF_HEADER + ''.join(row_list)
+    with pysam.BGZFile(vcf_fn, 'rb') as f:
+        assert f.read().decode() == VCF_HEADER + ''.join(row_list)
+
+
+def test_tabix_index_matches_pysam_queries(tmp_path):
+    row_list = vcf_rows_from(seed=1)
+    vcf_fn = str(tmp_path / 'out.vcf.gz')
+    with BgzfVcfWriter(vcf_fn) as vcf_writer:
+        vcf_writer.write(VCF_HEADER + ''.join(row_list))
+
+    # same file indexed by htslib
+    pysam_vcf_fn = str(tmp_path / 'pysam.vcf.gz')
+    with open(vcf_fn, 'rb') as f, open(pysam_vcf_fn, 'wb') as pysam_f:
+        pysam_f.write(f.read())
+    pysam.tabix_index(pysam_vcf_fn, preset='vcf', force=True)
+
+    random.seed(2)
+    with pysam.TabixFile(vcf_fn) as tabix_file, pysam.TabixFile(pysam_vcf_fn) as pysam_tabix_file:
+        assert list(tabix_file.contigs) == ['chr1', 'chr2']
+        for _ in range(200):
+            ctg_name = random.choice(('chr1', 'chr2'))
+            start = random.randint(0, 2000000)
+            end = start + random.choice((1, 100, 10000, 500000))
+            row_list_in_region = list(tabix_file.fetch(ctg_name, start, end))
+            assert row_list_in_region == list(pysam_tabix_file.fetch(ctg_name, start, end))
+            assert row_list_in_region == overlapping_rows_from(row_list, ctg_name, start, end)
+
+
+def test_unsorted_vcf_is_not_indexed(tmp_path):
+    row_list = vcf_rows_from(seed=3, row_num=100)
+    row_list[10], row_list[20] = row_list[20], row_list[10]
+    vcf_fn = str(tmp_path / 'out.vcf.gz')
+    vcf_writer = BgzfVcfWriter(vcf_fn)
+    vcf_writer.write(VCF_HEADER + ''.join(row_list))
+    assert not vcf_writer.close()
+    assert not (tmp_path / 'out.vcf.gz.tbi').exists()
+    with gzip.open(vcf_fn, 'rt') as f:
+        assert f.read() == VCF_HEADER + ''.join(row_list)
+
+
+def test_compress_index_vcf(tmp_path):
+    row_list = vcf_rows_from(seed=4, row_num=500)
+    vcf_fn = tmp_path / 'out.vcf'
+    vcf_fn.write_text(VCF_HEADER + ''.join(row_list))
+    compress_index_vcf(str(vcf_fn))
+
+    assert not vcf_fn.exists()
+    with pysam.TabixFile(str(vcf_fn) + '.gz') as tabix_file:
+        assert list(tabix_file.fetch('chr2')) == [row.rstrip('\n') for row in row_list if row.startswith('chr2\t')]
+
+
+def test_threaded_bgzf_vcf_is_identical(tmp_path):
+    vcf_text = VCF_HEADER + ''.join(vcf_rows_from(seed=5))
+    output_list = []
+    for threads in (1, 4):
+        vcf_fn = tmp_path / 'out_{}.vcf.gz'.format(threads)
+        with BgzfVcfWriter(str(vcf_fn), threads=threads) as vcf_writer:
+            # rows split across writes
+            for start in range(0, len(vcf_text), 1000):
+                vcf_writer.write(vcf_text[start:start + 1000])
+        output_list.append((vcf_fn.read_bytes(), (tmp_path / (vcf_fn.name + '.tbi')).read_bytes()))
+    assert output_list[0] == output_list[1]
+
+    with pysam.TabixFile(str(tmp_path / 'out_4.vcf.gz')) as tabix_file:
+        assert list(tabix_file.fetch('chr1', 1000, 50000)) == \
+               overlapping_rows_from(vcf_rows_from(seed=5), 'chr1', 1000, 50000)
@@ -0,0 +1,61 @@
+import os
+import shutil
+import stat
+import sys
+
+import numpy as np
+import pytest
+
+from count_alleles import allele_counts_from, allele_counts_from_file, base_counts_from, count_alleles, \
+    load_allele_counts, load_alleles
+
+# sample.bam has proper, improper and unpaired reads of random mapping and base qualities. AlleleCount_chr1.txt is
+# the output of the bundled alleleCounter with the options of cnv_germline_tagging:
+# alleleCounter -b sample.bam -l G1000_loci_chr1.txt -o AlleleCount_chr1.txt -m 20 -q 20 -f 0 -F 2316 --dense-snps
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'verdict')
+BAM_FN = os.path.join(DATA_DIR, 'sample.bam')
+
+
+@pytest.fixture
+def samtools(tmp_path):
+    samtools_path = shutil.which('samtools')
+    if samtools_path is not None:
+        return samtools_path
+    pytest.importorskip('pysam')
+    # the samtools bundled in pysam
+    samtools_path = str(tmp_path / 'samtools')
+    with open(samtools_path, 'w') as f:
+        f.write('#!{}\nimport sys\nimport pysam\nsys.stdout.write(pysam.samtools.mpileup(*sys.argv[2:]))\n'.format(
+            sys.executable))
+    os.chmod(samtools_path, os.stat(samtools_path).st_mode | stat.S_IEXEC)
+    return samtools_path
+
+
+def test_base_counts_from_overlapping_mates():
+    # mates with different bases are both counted
+    assert base_counts_from('AC', 'II', ['r1', 'r1']) == [1, 1, 0, 0]
+    # an agreeing mate is counted once
+    assert base_counts_from('AA', 'II', ['r1', 'r1']) == [1, 0, 0, 0]
+    # the first mate stores its base even below the base quality threshold
+    assert base_counts_from('AA', '+I', ['r1', 'r1']) == [0, 0, 0, 0]
+    assert base_counts_from('acgtN*', 'IIIIII', ['r1', 'r2', 'r3', 'r4', 'r5', 'r6']) == [1, 1, 1, 1]
+
+
+def test_allele_counts_match_allele_counter(samtools):
+    positions, _, _ = load_alleles(os.path.join(DATA_DIR, 'G1000_alleles_chr1.txt'))
+    expected_counts = allele_counts_from_file(os.path.join(DATA_DIR, 'AlleleCount_chr1.txt'), positions)
+    counts = allele_counts_from(samtools, BAM_FN, 'chr1', positions)
+    assert expected_counts.sum() > 0
+    np.testing.assert_array_equal(counts, expected_counts)
+
+
+def test_count_alleles_matches_allele_counter_files(samtools):
+    alleles_file_prefix = os.path.join(DATA_DIR, 'G1000_alleles_')
+    allele_counts_file_prefix = os.path.join(DATA_DIR, 'AlleleCount_')
+    # the same BAM as tumor and normal, each decoded with two htslib threads
+    allele_count_dict = count_alleles(samtools, ['chr1'], alleles_file_prefix, BAM_FN, BAM_FN, threads=2,
+                                      decode_threads=2)
+    expected_allele_count_dict = load_allele_counts(['chr1'], alleles_file_prefix, allele_counts_file_prefix,
+                                                    allele_counts_file_prefix)
+    for array, expected_array in zip(allele_count_dict['chr1'], expected_allele_count_dict['chr1']):
+        np.testing.assert_array_equal(array, expected_array)
@@ -0,0 +1,63 @@
+import gzip
+import os
+from argparse import Namespace
+
+import pytest
+
+from src.add_back_missing_variants_in_genotyping import genotype_vcf
+
+VCF_HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n'
+
+
+def vcf_row(ctg_name, pos, variant_id, ref_base, alt_base, genotype='0/1'):
+    return '\t'.join([ctg_name, str(pos), variant_id, ref_base, alt_base, '20', 'PASS', '.', 'GT:AF',
+                      genotype + ':0.3']) + '\n'
+
+
+def read_rows(output_fn):
+    # the output is bgzipped when bgzip is installed
+    if os.path.exists(output_fn):
+        with open(output_fn) as f:
+            return [row for row in f if not row.startswith('#')]
+    with gzip.open(output_fn + '.gz', 'rt') as f:
+        return [row for row in f if not row.startswith('#')]
+
+
+@pytest.mark.parametrize('switch_genotype', [True, False])
+def test_streamed_genotyping_vcf_keeps_last_duplicate_row(tmp_path, switch_genotype):
+    genotyping_vcf_fn = str(tmp_path / 'genotyping.vcf')
+    with open(genotyping_vcf_fn, 'w') as f:
+        f.write(VCF_HEADER
+                + vcf_row('chr1', 100, 'site1', 'C', 'A')
+                + vcf_row('chr1', 300, 'first', 'A', 'T')
+                + vcf_row('chr1', 300, 'last', 'A', 'G')
+                + vcf_row('chr2', 50, 'site3', 'G', 'C')
+                + vcf_row('chr2', 50, 'site3_last', 'G', 'T')
+                + vcf_row('chr10', 70, 'site4', 'T', 'A'))
+    call_fn = str(tmp_path / 'call.vcf')
+    with open(call_fn, 'w') as f:
+        f.write(VCF_HEADER + vcf_row('chr1', 100, 'called', 'C', 'A', genotype='1/1'))
+    candidates_folder = tmp_path / 'candidates'
+    candidates_folder.mkdir()
+    with open(str(candidates_folder / 'chr1.0_0_1_hybrid_info'), 'w') as f:
+        f.write('chr1\t300\tA\t30-A 30\t40-A 30 G 10\n')
+
+    output_rows = {}
+    for genotyping_fast_path in (True, False):
+        output_fn = str(tmp_path / 'output_{}.vcf'.format(genotyping_fast_path))
+        genotype_vcf(Namespace(genotyping_mode_vcf_fn=genotyping_vcf_fn,
+                               hybrid_mode_vcf_fn=None,
+                               call_fn=call_fn,
+                               output_fn=output_fn,
+                               switch_genotype=switch_genotype,
+                               candidates_folder=str(candidates_folder),
+                               genotyping_fast_path=genotyping_fast_path))
+        output_rows[genotyping_fast_path] = read_rows(output_fn)
+
+    assert output_rows[True] == output_rows[False]
+    assert [row.split('\t')[2] for row in output_rows[True]] == ['called', 'last', 'site3_last', 'site4']
+    duplicated_row = output_rows[True][1].rstrip('\n').split('\t')
+    if switch_genotype:
+        assert duplicated_row[4] == '.' and duplicated_row[9] == './.:40:30:30:0:10:0:30:0:0:0'
+    else:
+        assert duplicated_row[4] == 'G'
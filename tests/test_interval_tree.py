@@ -0,0 +1,63 @@
+import random
+
+from shared.intervaltree.intervaltree import IntervalTree
+from shared.interval_tree import IntervalIndex, bed_tree_from, is_region_in
+
+
+def random_intervals_from(seed, interval_num=500, max_pos=100000):
+    random.seed(seed)
+    interval_list = []
+    for _ in range(interval_num):
+        begin = random.randint(0, max_pos)
+        interval_list.append((begin, begin + random.choice((1, 2, 10, 100, 1000, 5000))))
+    return interval_list
+
+
+def test_interval_index_matches_interval_tree():
+    for seed in range(5):
+        interval_tree, interval_index = IntervalTree(), IntervalIndex()
+        for begin, end in random_intervals_from(seed):
+            interval_tree.addi(begin, end)
+            interval_index.addi(begin, end)
+
+        positions = list(range(-5, 110000, 7))
+        expected_list = [len(interval_tree.at(pos)) > 0 for pos in positions]
+        assert [interval_index.at(pos) for pos in positions] == expected_list
+        assert list(interval_index.contains(positions)) == expected_list
+
+        random.seed(seed + 100)
+        for _ in range(2000):
+            begin = random.randint(-10, 110000)
+            end = begin + random.randint(-2, 300)
+            assert interval_index.overlaps(begin, end) == (len(interval_tree.overlap(begin, end)) > 0)
+
+
+def test_interval_index_rebuilds_after_addi():
+    interval_index = IntervalIndex()
+    interval_index.addi(10, 20)
+    assert interval_index.at(15) and not interval_index.at(20)
+    interval_index.addi(20, 30)
+    interval_index.addi(5, 5)
+    assert list(interval_index) == [(10, 30)]
+    assert interval_index.at(25) and not interval_index.at(5)
+
+
+def test_bed_tree_from_matches_interval_tree(tmp_path):
+    bed_fn = tmp_path / 'regions.bed'
+    interval_list = random_intervals_from(seed=7, interval_num=200)
+    bed_fn.write_text(''.join('chr{}\t{}\t{}\n'.format(idx % 2 + 1, begin, end) for idx, (begin, end)
+                              in enumerate(interval_list)))
+
+    interval_tree_dict = {'chr1': IntervalTree(), 'chr2': IntervalTree()}
+    for idx, (begin, end) in enumerate(interval_list):
+        interval_tree_dict['chr{}'.format(idx % 2 + 1)].addi(begin, end)
+
+    cache_dir = str(tmp_path / 'cache')
+    for _ in range(2):
+        # the second call loads the cache built by the first one
+        tree = bed_tree_from(str(bed_fn), cache_dir=cache_dir)
+        for ctg_name, interval_tree in interval_tree_dict.items():
+            for pos in range(0, 110000, 13):
+                assert is_region_in(tree, ctg_name, pos) == (len(interval_tree.at(pos)) > 0)
+                assert is_region_in(tree, ctg_name, pos, pos + 50) == (len(interval_tree.overlap(pos, pos + 50)) > 0)
+    assert not is_region_in(tree, 'chr3', 100)
@@ -0,0 +1,113 @@
+import random
+
+from collections import Counter
+
+from shared.pileup import base_list_from, base_list_with_read_ends_from, allele_counter_from, hap_counts_from
+
+
+def legacy_base_list_from(pileup_bases, upper=False):
+    # char by char decoding the shared decoder replaces, the upper case variant also tracks the read starts and ends
+    base_idx = 0
+    base_list = []
+    read_end_set = set()
+    read_start_set = set()
+    while base_idx < len(pileup_bases):
+        base = pileup_bases[base_idx].upper() if upper else pileup_bases[base_idx]
+        if base == '+' or base == '-':
+            base_idx += 1
+            advance = 0
+            while True:
+                num = pileup_bases[base_idx]
+                if num.isdigit():
+                    advance = advance * 10 + int(num)
+                    base_idx += 1
+                else:
+                    break
+            indel = pileup_bases[base_idx: base_idx + advance]
+            base_list[-1][1] = base + (indel.upper() if upper else indel)  # add indel seq
+            base_idx += advance - 1
+
+        elif base in "ACGTNacgtn#*":
+            base_list.append([base, ""])
+        elif base == '^':  # start of read, next base is mq, update mq info
+            base_idx += 1
+            read_start_set.add(len(base_list) - 1)
+        # skip $, the end of read
+        if base == "$":
+            read_end_set.add(len(base_list) - 1)
+        base_idx += 1
+    return base_list, read_start_set, read_end_set
+
+
+def random_pileup_bases_from(read_num):
+    pileup_bases = []
+    for _ in range(read_num):
+        if random.random() < 0.1:
+            # the mapping quality char can be any char, including the markers
+            pileup_bases.append('^' + chr(random.randint(33, 126)))
+        base = random.choice('ACGTNacgtn*#><')
+        pileup_bases.append(base)
+        if base not in '<>' and random.random() < 0.1:
+            indel_length = random.choice((1, 2, 3, 12))
+            pileup_bases.append(random.choice('+-') + str(indel_length) +
+                                ''.join(random.choice('ACGTNacgtn') for _ in range(indel_length)))
+        if random.random() < 0.1:
+            pileup_bases.append('$')
+    return ''.join(pileup_bases)
+
+
+def test_base_list_matches_legacy_decoding():
+    random.seed(0)
+    for _ in range(3000):
+        pileup_bases = random_pileup_bases_from(random.randint(0, 60))
+        legacy_base_list = legacy_base_list_from(pileup_bases)[0]
+        assert base_list_from(pileup_bases) == legacy_base_list
+        assert base_list_with_read_ends_from(pileup_bases)[0] == legacy_base_list
+        assert base_list_from(pileup_bases, upper=True) == legacy_base_list_from(pileup_bases, upper=True)[0]
+        read_idx_list = sorted(random.sample(range(len(legacy_base_list)), len(legacy_base_list) // 2))
+        assert base_list_from(pileup_bases, read_idx_list=read_idx_list) == [legacy_base_list[idx] for idx in
+                                                                              read_idx_list]
+        assert base_list_from(pileup_bases, read_idx_list=[len(legacy_base_list)]) == []
+
+
+def test_read_ends_match_legacy_decoding():
+    random.seed(1)
+    for _ in range(3000):
+        pileup_bases = random_pileup_bases_from(random.randint(0, 60))
+        assert base_list_with_read_ends_from(pileup_bases, upper=True) == legacy_base_list_from(pileup_bases,
+                                                                                                 upper=True)
+
+
+def test_allele_and_hap_counts():
+    random.seed(2)
+    for _ in range(500):
+        pileup_bases = random_pileup_bases_from(random.randint(1, 60))
+        base_list = base_list_from(pileup_bases)
+        if not len(base_list):
+            continue
+        bq_list = [random.randint(0, 40) for _ in base_list]
+        assert allele_counter_from(base_list) == Counter([''.join(item).upper() for item in base_list])
+        assert allele_counter_from(base_list, bq_list, 20) == Counter(
+            [''.join(item).upper() for item, bq in zip(base_list, bq_list) if bq >= 20])
+
+        legacy_forward_counter, legacy_reverse_counter = Counter(), Counter()
+        for (base, indel), bq in zip(base_list, bq_list):
+            if bq < 20:
+                continue
+            if base in 'ACGTN*':
+                legacy_forward_counter[(base + indel).upper()] += 1
+            else:
+                legacy_reverse_counter[(base + indel).upper()] += 1
+        assert allele_counter_from(base_list, bq_list, 20, strand=True) == (
+            legacy_forward_counter + legacy_reverse_counter, legacy_forward_counter, legacy_reverse_counter)
+
+        phasing_info = [random.choice(('0', '1', '2', '.')) for _ in base_list]
+        allele = ''.join(random.choice(base_list)).upper()
+        legacy_hap_list, legacy_all_hap_list = [0, 0, 0], [0, 0, 0]
+        for b, hap in zip(base_list, phasing_info):
+            if hap not in '12':
+                hap = 0
+            legacy_all_hap_list[int(hap)] += 1
+            if ''.join(b).upper() == allele:
+                legacy_hap_list[int(hap)] += 1
+        assert hap_counts_from(base_list, phasing_info, allele) == (legacy_hap_list, legacy_all_hap_list)
@@ -0,0 +1,96 @@
+import random
+
+import shared.param as param
+from src.extract_pair_candidates import prefilter_candidates, alt_read_num_from
+
+
+def legacy_rejected_from(tumor_alt_list, depth, normal_alt_list, min_coverage, normal_snv_max_af,
+                         enable_params_for_liquid_tumor_sample):
+    # inline normal AF checks of the normal pileup scan the prefilter replaces
+    if len(tumor_alt_list) == 0:
+        return 'no_tumor_alt'
+    alt_base, tumor_af = tumor_alt_list[0]
+    normal_info = [item for item in normal_alt_list if item[0] == alt_base]
+    tumor_af = float(tumor_af)
+    if len(normal_info) > 0 and depth > min_coverage:
+        normal_af = float(normal_info[0][1])
+        normal_alt_depth = round(normal_af * depth, 1)
+        if normal_af > 0 and tumor_af > 0:
+            if normal_af >= normal_snv_max_af:
+                if not (tumor_af >= normal_af * param.upper_beta):
+                    pass_liquid = enable_params_for_liquid_tumor_sample and tumor_af >= normal_af * param.upper_beta_liqud
+                    if not (normal_alt_depth < 2 and pass_liquid):
+                        return 'high_normal_af'
+            elif tumor_af <= normal_af * param.lower_beta and tumor_af != 0:
+                return 'high_af_gap'
+    return None
+
+
+def random_alt_list_from(alt_base_list):
+    return [[alt_base, str(round(random.choice((0.0, 0.01, 0.02, 0.05, 0.1, 0.3, 0.6, random.random())), 3))]
+            for alt_base in random.sample(alt_base_list, random.randint(0, 2))]
+
+
+def test_prefilter_matches_legacy_normal_af_checks():
+    random.seed(0)
+    min_coverage, normal_snv_max_af = 4, 0.1
+    for enable_params_for_liquid_tumor_sample in (False, True):
+        candidate_list = list(range(1, 5001))
+        tumor_info_list, normal_pileup_dict = [], {}
+        for pos in candidate_list:
+            tumor_info_list.append((random.randint(1, 100), random_alt_list_from(['A', 'C', 'G']),
+                                    random.randint(0, 20)))
+            normal_pileup_dict[pos] = (random.randint(0, 60), random_alt_list_from(['A', 'C', 'G', 'T']), {})
+
+        reject_list, reason_counter = prefilter_candidates(candidate_list, tumor_info_list, normal_pileup_dict,
+                                                           min_coverage, normal_snv_max_af,
+                                                           enable_params_for_liquid_tumor_sample=enable_params_for_liquid_tumor_sample)
+
+        legacy_reason_list = [legacy_rejected_from(tumor_alt_list, normal_pileup_dict[pos][0],
+                                                   normal_pileup_dict[pos][1], min_coverage, normal_snv_max_af,
+                                                   enable_params_for_liquid_tumor_sample)
+                              for pos, (_, tumor_alt_list, _) in zip(candidate_list, tumor_info_list)]
+        assert reject_list == [pos for pos, reason in zip(candidate_list, legacy_reason_list) if reason is not None]
+        assert sum(reason_counter.values()) == len(reject_list)
+        for reason in ('no_tumor_alt', 'high_normal_af', 'high_af_gap'):
+            assert reason_counter[reason] == legacy_reason_list.count(reason) > 0
+
+
+def test_prefilter_optional_rules():
+    candidate_list = [1, 2, 3, 4, 5]
+    tumor_info_list = [(30, [['A', '0.1']], 3),
+                       (30, [['A', '0.5']], 15),
+                       (30, [['C', '0.5']], 15),
+                       (30, [['G', '0.5']], 15),
+                       (30, [], 0)]
+    # the normal alt support rule uses the raw read numbers, not the rounded normal AF
+    normal_pileup_dict = {1: (40, [], {}),
+                          2: (5, [], {}),
+                          3: (40, [['C', '0.05']], {'A': 37, 'C': 3}),
+                          4: (40, [['T', '0.5']], {'A': 20, 'T': 20})}
+    reject_list, reason_counter = prefilter_candidates(candidate_list, tumor_info_list, normal_pileup_dict,
+                                                       min_coverage=4, normal_snv_max_af=0.2,
+                                                       min_tumor_support_read_num=5, max_normal_alt_read_num=2,
+                                                       min_normal_coverage=10)
+    assert reject_list == [1, 2, 3, 5]
+    # a candidate is counted under the first rule it fails
+    assert dict(reason_counter) == {'low_tumor_support': 1, 'low_normal_coverage': 1, 'high_normal_alt_support': 1,
+                                    'no_tumor_alt': 1}
+
+    # all optional rules disabled
+    reject_list, reason_counter = prefilter_candidates(candidate_list, tumor_info_list, normal_pileup_dict,
+                                                       min_coverage=4, normal_snv_max_af=0.2)
+    assert reject_list == [5] and dict(reason_counter) == {'no_tumor_alt': 1}
+
+    # the normal alt read number of 2 is within the limit even if the rounded AF gives 40 * 0.075 = 3 reads
+    normal_pileup_dict[3] = (40, [['C', '0.075']], {'A': 38, 'C': 2})
+    reject_list, reason_counter = prefilter_candidates(candidate_list, tumor_info_list, normal_pileup_dict,
+                                                       min_coverage=4, normal_snv_max_af=0.2,
+                                                       max_normal_alt_read_num=2)
+    assert reject_list == [5] and dict(reason_counter) == {'no_tumor_alt': 1}
+
+
+def test_alt_read_num_from_raw_counts():
+    pileup_list = [['A', 40], ['N', 20], ['DNN', 9], ['C', 7], ['IAT', 5], ['G', 3]]
+    assert alt_read_num_from(pileup_list, 'A') == (7, 9)
+    assert alt_read_num_from([['A', 40]], 'A') == (0, 0)
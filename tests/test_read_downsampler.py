@@ -0,0 +1,90 @@
+import random
+
+from shared.utils import ReadDownsampler
+
+
+def random_reads_from(seed, read_num=1500, ctg_length=3000):
+    random.seed(seed)
+    read_list = []
+    for read_idx in range(read_num):
+        start = random.randint(0, ctg_length)
+        read_list.append(('read_{}'.format(read_idx), start, start + random.randint(100, 1500)))
+    return read_list
+
+
+def pileup_kept_reads_from(read_downsampler, read_list, ctg_length=3000, missing_rate=0.0):
+    """
+    (read names, kept read names) of each position, a read is missing at a position with missing_rate (e.g. a filtered
+    base).
+    """
+    pileup_list = []
+    for pos in range(ctg_length):
+        read_name_list = [read_name for read_name, start, end in read_list if start <= pos < end and
+                          random.random() >= missing_rate]
+        kept_idx_list = read_downsampler.kept_indices_from(read_name_list)
+        pileup_list.append((read_name_list, set(read_name_list) if kept_idx_list is None else
+                            set([read_name_list[idx] for idx in kept_idx_list])))
+    return pileup_list
+
+
+def test_kept_depth_is_capped():
+    read_list = random_reads_from(seed=0)
+    read_downsampler = ReadDownsampler(max_depth=40, prune_interval=200)
+    pileup_list = pileup_kept_reads_from(read_downsampler, read_list)
+    assert max([len(kept_read_name_set) for _, kept_read_name_set in pileup_list]) == 40
+    assert read_downsampler.max_kept_depth == 40
+    assert read_downsampler.downsampled_position_count > 0
+
+
+def test_read_decision_is_stable_across_prunes():
+    read_list = random_reads_from(seed=1)
+    random.seed(1)
+    read_downsampler = ReadDownsampler(max_depth=40, prune_interval=100)
+    decision_dict = {}
+    for read_name_list, kept_read_name_set in pileup_kept_reads_from(read_downsampler, read_list, missing_rate=0.1):
+        for read_name in read_name_list:
+            decision_dict.setdefault(read_name, set()).add(read_name in kept_read_name_set)
+    for read_name, decision_set in decision_dict.items():
+        assert len(decision_set) == 1, read_name
+    # only the reads of the last prune intervals are kept in memory
+    assert len(read_downsampler.decision_dict) < len(read_list) / 2
+
+
+def test_downsampling_is_deterministic():
+    read_list = random_reads_from(seed=2)
+    kept_read_name_set_list = [kept_read_name_set for _, kept_read_name_set in
+                               pileup_kept_reads_from(ReadDownsampler(max_depth=30), read_list)]
+    # the order of the reads in the pileup does not change the decisions
+    shuffled_read_list = list(read_list)
+    random.shuffle(shuffled_read_list)
+    assert [kept_read_name_set for _, kept_read_name_set in
+            pileup_kept_reads_from(ReadDownsampler(max_depth=30), shuffled_read_list)] == kept_read_name_set_list
+
+
+def test_shallow_pileup_is_not_downsampled():
+    read_list = random_reads_from(seed=3, read_num=50)
+    read_downsampler = ReadDownsampler(max_depth=1000)
+    for read_name_list in (['read_1', 'read_2'], [], ['read_2']):
+        assert read_downsampler.kept_indices_from(read_name_list) is None
+    pileup_kept_reads_from(read_downsampler, read_list)
+    assert read_downsampler.downsampled_position_count == 0
+
+
+def test_decode_keeps_the_af_of_all_reads():
+    from src.create_pair_tensor import decode_pileup_bases
+
+    decode_kwargs = dict(pos=10, pileup_bases='AAAAaaC+2TTcc-1Ngg', reference_base='A', minimum_snv_af_for_candidate=0.1,
+                         minimum_indel_af_for_candidate=0.1, has_pileup_candidates=True,
+                         candidates_type_dict={10: 'homo_somatic'}, is_tumor=True)
+    base_list, all_base_list, depth, pass_af, af = decode_pileup_bases(**decode_kwargs)
+    kept_base_list, kept_all_base_list, kept_depth, kept_pass_af, kept_af = decode_pileup_bases(
+        read_idx_list=[0, 6, 8], **decode_kwargs)
+    assert all_base_list is None and kept_all_base_list == base_list
+    assert kept_base_list == [base_list[idx] for idx in (0, 6, 8)]
+    assert (kept_depth, kept_pass_af, kept_af) == (depth, pass_af, af) == (11, True, 3 / 11.0)
+
+    # only the kept reads are decoded outside the candidates
+    kept_base_list, kept_all_base_list, kept_depth, _, _ = decode_pileup_bases(
+        read_idx_list=[0, 6, 8], **dict(decode_kwargs, pos=11))
+    assert kept_base_list == [base_list[idx] for idx in (0, 6, 8)]
+    assert kept_all_base_list is None and kept_depth is None
@@ -0,0 +1,53 @@
+import gzip
+import hashlib
+import os
+import random
+import shutil
+
+from shared.utils import ref_cache_from
+
+
+def write_reference(ref_fn):
+    random.seed(0)
+    sequence_dict = {'chr1': ''.join(random.choice('ACGTacgtN') for _ in range(1234)),
+                     'chr2': ''.join(random.choice('ACGT') for _ in range(61)),
+                     'chr10': ''.join(random.choice('ACGT') for _ in range(700))}
+    with open(ref_fn, 'w') as f, open(ref_fn + '.fai', 'w') as fai_f:
+        for ctg_name, sequence in sequence_dict.items():
+            f.write('>' + ctg_name + ' description\n')
+            fai_f.write('\t'.join([ctg_name, str(len(sequence)), str(f.tell()), '60', '61']) + '\n')
+            f.write(''.join(sequence[i:i + 60] + '\n' for i in range(0, len(sequence), 60)))
+    return dict((hashlib.md5(sequence.upper().encode()).hexdigest(), sequence.upper()) for sequence in
+                sequence_dict.values())
+
+
+def cached_sequences_from(cache_dir):
+    sequence_dict = {}
+    for root, _, file_list in os.walk(cache_dir):
+        for file_name in file_list:
+            if file_name.endswith('.done'):
+                continue
+            with open(os.path.join(root, file_name)) as f:
+                sequence_dict[os.path.relpath(os.path.join(root, file_name), cache_dir).replace(os.sep, '')] = f.read()
+    return sequence_dict
+
+
+def test_ref_cache_only_populates_required_contigs(tmp_path):
+    ref_fn = str(tmp_path / 'ref.fa')
+    md5_sequence_dict = write_reference(ref_fn)
+    gz_ref_fn = ref_fn + '.gz'
+    with open(ref_fn, 'rb') as f, gzip.open(gz_ref_fn, 'wb') as gz_f:
+        shutil.copyfileobj(f, gz_f)
+
+    # the .fai offsets of a plain FASTA and a full scan of a compressed one
+    for fn in (ref_fn, gz_ref_fn):
+        cache_dir = str(tmp_path / (os.path.basename(fn) + '_cache'))
+        ref_cache = ref_cache_from(fn, cache_dir, contig_list={'chr2', 'chr10'})
+        assert ref_cache == os.path.join(cache_dir, '%2s', '%2s', '%s')
+        cached_sequence_dict = cached_sequences_from(cache_dir)
+        assert len(cached_sequence_dict) == 2
+        assert all(md5_sequence_dict[md5] == sequence for md5, sequence in cached_sequence_dict.items())
+
+        # the cached contigs are not read again, the rest are added
+        ref_cache_from(fn, cache_dir)
+        assert cached_sequences_from(cache_dir) == md5_sequence_dict
@@ -0,0 +1,225 @@
+import gzip
+import os
+
+from argparse import Namespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy')
+pytest.importorskip('sklearn')
+
+import get_logr_and_baf
+import run_verdict as run_verdict_module
+from aspcf import aspcf
+from correct_logr import correctLogR
+from predict_germline_genotypes import predictGermlineGenotypes
+from probe_table import ProbeTable, chromosome_indices_from, read_probe_values, write_probe_values
+from run_ascat import run_ascat
+from tag_germline_variant import tag_germline_variant
+
+CONTIG_LIST = ['chr1', 'chr2', 'chr3']
+PROBE_NUM = 600
+# tumor purity and the (major, minor) copy number of the first and second half of each contig
+PURITY = 0.6
+COPY_NUMBER_DICT = {'chr1': ((1, 1), (1, 1)), 'chr2': ((2, 1), (1, 0)), 'chr3': ((2, 2), (1, 1))}
+
+
+def synthetic_allele_count_dict():
+    """
+    count_alleles() output of a tumor and normal pair, 30% of the probes are heterozygous in the germline.
+    """
+    rng = np.random.RandomState(0)
+    allele_count_dict = {}
+    for ctg_name in CONTIG_LIST:
+        positions = np.sort(rng.choice(np.arange(1, 10000000), PROBE_NUM, replace=False)).astype(np.int64)
+        ref_idx = rng.randint(4, size=PROBE_NUM)
+        alt_idx = (ref_idx + rng.randint(1, 4, size=PROBE_NUM)) % 4
+        is_het = rng.rand(PROBE_NUM) < 0.3
+        major = np.array([COPY_NUMBER_DICT[ctg_name][i >= PROBE_NUM // 2][0] for i in range(PROBE_NUM)])
+        minor = np.array([COPY_NUMBER_DICT[ctg_name][i >= PROBE_NUM // 2][1] for i in range(PROBE_NUM)])
+        tumor_copy_number = PURITY * (major + minor) + 2 * (1 - PURITY)
+        tumor_depth = rng.poisson(30 * tumor_copy_number)
+        normal_depth = rng.poisson(60, size=PROBE_NUM)
+        tumor_alt_af = np.where(is_het, (PURITY * minor + 1 - PURITY) / tumor_copy_number, 0.0)
+        tumor_alt = rng.binomial(tumor_depth, tumor_alt_af)
+        normal_alt = rng.binomial(normal_depth, np.where(is_het, 0.5, 0.0))
+
+        probe_idx = np.arange(PROBE_NUM)
+        tumor_counts = np.zeros((PROBE_NUM, 4), dtype=np.int32)
+        normal_counts = np.zeros((PROBE_NUM, 4), dtype=np.int32)
+        tumor_counts[probe_idx, ref_idx] = tumor_depth - tumor_alt
+        tumor_counts[probe_idx, alt_idx] = tumor_alt
+        normal_counts[probe_idx, ref_idx] = normal_depth - normal_alt
+        normal_counts[probe_idx, alt_idx] = normal_alt
+        allele_count_dict[ctg_name] = (positions, ref_idx, alt_idx, tumor_counts, normal_counts)
+    return allele_count_dict
+
+
+def write_resource_file(resource_fn, allele_count_dict, column_num, rng):
+    # G1000 GC content and replication timing files: index, contig without the chr prefix, position, values
+    with open(resource_fn, 'w') as f:
+        f.write('\t'.join(['', 'Chr', 'Position'] + ['value_{}'.format(i) for i in range(column_num)]) + '\n')
+        for ctg_name in CONTIG_LIST:
+            for pos in allele_count_dict[ctg_name][0].tolist():
+                f.write('\t'.join(['{}_{}'.format(ctg_name, pos), ctg_name[3:], str(pos)] +
+                                  ['{:.4f}'.format(value) for value in rng.rand(column_num)]) + '\n')
+
+
+def write_input_vcf(vcf_fn, allele_count_dict):
+    rng = np.random.RandomState(1)
+    with open(vcf_fn, 'w') as f:
+        f.write('##fileformat=VCFv4.2\n##FILTER=<ID=Germline,Description="Germline variant">\n'
+                '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n')
+        for ctg_name in CONTIG_LIST:
+            for pos in sorted(rng.choice(allele_count_dict[ctg_name][0], 40, replace=False).tolist()):
+                depth = rng.randint(20, 80)
+                af = round(rng.choice([0.03, 0.1, 0.2, 0.3, 0.5, 0.98]), 4)
+                f.write('{}\t{}\t.\tA\tC\t30\t{}\t.\tGT:GQ:DP:AF\t0/1:30:{}:{}\n'.format(
+                    ctg_name, pos, 'PASS' if rng.rand() < 0.9 else 'LowQual', depth, af))
+
+
+def write_allele_counter_files(tmp_path, allele_count_dict):
+    # G1000 alleles files (position, 1-4 ref and alt allele) and the alleleCounter output files of each contig
+    for ctg_name in CONTIG_LIST:
+        positions, ref_idx, alt_idx, tumor_counts, normal_counts = allele_count_dict[ctg_name]
+        with open(str(tmp_path / 'G1000_alleles_{}.txt'.format(ctg_name)), 'w') as f:
+            f.write('position\ta0\ta1\n')
+            for pos, ref, alt in zip(positions.tolist(), ref_idx.tolist(), alt_idx.tolist()):
+                f.write('{}\t{}\t{}\n'.format(pos, ref + 1, alt + 1))
+        for prefix, counts in (('tumor', tumor_counts), ('normal', normal_counts)):
+            with open(str(tmp_path / '{}_alleleFrequencies_{}.txt'.format(prefix, ctg_name)), 'w') as f:
+                f.write('#CHR\tPOS\tCount_A\tCount_C\tCount_G\tCount_T\tGood_depth\n')
+                for pos, count in zip(positions.tolist(), counts.tolist()):
+                    f.write('\t'.join([ctg_name, str(pos)] + [str(c) for c in count] + [str(sum(count))]) + '\n')
+
+
+@pytest.fixture(params=['builtin', 'alleleCounter'])
+def verdict_args(request, tmp_path, monkeypatch):
+    allele_count_dict = synthetic_allele_count_dict()
+
+    def synthetic_count_alleles(samtools, contig_list, alleles_file_prefix, tumor_bam_fn, normal_bam_fn=None,
+                                threads=1, ref_fn=None, decode_threads=0):
+        return dict((ctg_name, tuple(np.copy(array) for array in allele_count_dict[ctg_name])) for ctg_name in
+                    contig_list)
+
+    monkeypatch.setattr(get_logr_and_baf, 'count_alleles', synthetic_count_alleles)
+    monkeypatch.setattr(run_verdict_module, 'count_alleles', synthetic_count_alleles)
+
+    rng = np.random.RandomState(2)
+    write_resource_file(str(tmp_path / 'gc_content.txt'), allele_count_dict, 12, rng)
+    write_resource_file(str(tmp_path / 'replication_timing.txt'), allele_count_dict, 3, rng)
+    (tmp_path / 'contigs').write_text(''.join([ctg_name + '\n' for ctg_name in CONTIG_LIST]))
+    write_input_vcf(str(tmp_path / 'input.vcf'), allele_count_dict)
+
+    # the built-in allele counter or the alleleCounter output files
+    if request.param == 'builtin':
+        input_kwargs = dict(tumor_allele_counts_file_prefix=None, normal_allele_counts_file_prefix=None,
+                            tumor_bam_fn='tumor.bam', normal_bam_fn='normal.bam', alleles_file_prefix='G1000_alleles_')
+    else:
+        write_allele_counter_files(tmp_path, allele_count_dict)
+        input_kwargs = dict(tumor_allele_counts_file_prefix=str(tmp_path / 'tumor_alleleFrequencies_'),
+                            normal_allele_counts_file_prefix=str(tmp_path / 'normal_alleleFrequencies_'),
+                            tumor_bam_fn=None, normal_bam_fn=None,
+                            alleles_file_prefix=str(tmp_path / 'G1000_alleles_'))
+
+    return Namespace(ref_fn=None, samtools='samtools', gc_content_file=str(tmp_path / 'gc_content.txt'),
+                     replication_timing_file=str(tmp_path / 'replication_timing.txt'),
+                     contig_fn=str(tmp_path / 'contigs'), input_vcf_fn=str(tmp_path / 'input.vcf'),
+                     output_fn=str(tmp_path / 'in_memory' / 'output.vcf.gz'),
+                     tumor_purity_ploidy_output_file=str(tmp_path / 'in_memory' / 'purity_ploidy.txt'),
+                     tumor_cna_output_file=str(tmp_path / 'in_memory' / 'cna.txt'),
+                     probe_table_fn=str(tmp_path / 'in_memory' / 'probe_table.npz'), sample_name='SAMPLE',
+                     maxHomozygous=0.02, proportionHetero=0.30, proportionHomo=0.65, proportionOpen=0.03,
+                     segmentLength=100, penalty=70, gamma=1.0, min_ploidy=1.5, max_ploidy=5.5, min_purity=0.1,
+                     max_purity=1.05, threads=1, decode_threads=0, **input_kwargs)
+
+
+def run_script_chain(args, output_dir):
+    """
+    The Verdict steps of cnv_germline_tagging, each step reads the probe files written by the previous one.
+    """
+    fn = lambda name: os.path.join(output_dir, name)
+    if args.tumor_bam_fn is not None:
+        get_logr_and_baf.getBAFsAndLogRsFromBams(args.samtools, args.tumor_bam_fn, args.normal_bam_fn,
+                                                 args.alleles_file_prefix, fn('logr.txt'), fn('baf.txt'),
+                                                 fn('normal_baf.txt'), args.sample_name, 'NORMAL', args.contig_fn)
+    else:
+        get_logr_and_baf.getBAFsAndLogRs(args.tumor_allele_counts_file_prefix, args.normal_allele_counts_file_prefix,
+                                         args.alleles_file_prefix, fn('logr.txt'), fn('baf.txt'),
+                                         fn('normal_baf.txt'), args.sample_name, 'NORMAL', args.contig_fn)
+    correctLogR(fn('logr.txt'), args.gc_content_file, args.replication_timing_file, fn('logr_corrected.txt'),
+                args.sample_name)
+    predictGermlineGenotypes(fn('logr_corrected.txt'), fn('baf.txt'), fn('normal_baf.txt'), fn('genotypes.txt'),
+                             args.maxHomozygous, args.proportionHetero, args.proportionHomo, args.proportionOpen,
+                             args.segmentLength, args.sample_name)
+    aspcf(fn('logr_corrected.txt'), fn('baf.txt'), fn('genotypes.txt'), fn('logr_segmented.txt'),
+          fn('baf_segmented.txt'), args.penalty, args.sample_name)
+    run_ascat(fn('logr_corrected.txt'), fn('baf.txt'), fn('genotypes.txt'), fn('logr_segmented.txt'),
+              fn('baf_segmented.txt'), fn('purity_ploidy.txt'), fn('cna.txt'), args.gamma, args.min_ploidy,
+              args.max_ploidy, args.min_purity, args.max_purity, args.sample_name)
+    tag_germline_variant(Namespace(input_vcf_fn=args.input_vcf_fn, output_fn=fn('output.vcf.gz'),
+                                   tumor_purity_ploidy_output_file=fn('purity_ploidy.txt'),
+                                   tumor_cna_output_file=fn('cna.txt')))
+
+
+def test_run_verdict_matches_script_chain(tmp_path, verdict_args):
+    os.makedirs(str(tmp_path / 'in_memory'))
+    os.makedirs(str(tmp_path / 'script_chain'))
+    run_verdict_module.run_verdict(verdict_args)
+    run_script_chain(verdict_args, str(tmp_path / 'script_chain'))
+
+    for name in ('purity_ploidy.txt', 'cna.txt'):
+        assert (tmp_path / 'in_memory' / name).read_text() == (tmp_path / 'script_chain' / name).read_text()
+    purity = float((tmp_path / 'in_memory' / 'purity_ploidy.txt').read_text().split('\n')[1].split('\t')[1])
+    assert abs(purity - PURITY) < 0.1
+    with gzip.open(str(tmp_path / 'in_memory' / 'output.vcf.gz'), 'rt') as f, \
+            gzip.open(str(tmp_path / 'script_chain' / 'output.vcf.gz'), 'rt') as script_chain_f:
+        tagged_vcf = f.read()
+        assert tagged_vcf == script_chain_f.read()
+    for tag in ('Verdict_Germline', 'Verdict_Somatic', 'Verdict_SubclonalSomatic'):
+        assert tag in tagged_vcf
+
+    # the probe table columns match the probe files of the steps
+    probe_table = np.load(verdict_args.probe_table_fn)
+    chr_array, pos_array, logr_corrected = read_probe_values(str(tmp_path / 'script_chain' / 'logr_corrected.txt'))
+    assert probe_table['chr'].tolist() == chr_array.tolist()
+    np.testing.assert_array_equal(probe_table['pos'], pos_array)
+    np.testing.assert_array_equal(probe_table['logr_corrected'], logr_corrected)
+    for column, name, dtype in (('genotype', 'genotypes.txt', bool), ('logr_segmented', 'logr_segmented.txt', float),
+                                ('baf', 'baf.txt', float), ('normal_baf', 'normal_baf.txt', float)):
+        np.testing.assert_array_equal(probe_table[column],
+                                      read_probe_values(str(tmp_path / 'script_chain' / name), dtype=dtype)[2])
+    genotype = probe_table['genotype']
+    np.testing.assert_array_equal(probe_table['baf_segmented'][~genotype],
+                                  read_probe_values(str(tmp_path / 'script_chain' / 'baf_segmented.txt'))[2])
+    assert np.isnan(probe_table['baf_segmented'][genotype]).all()
+    assert (probe_table['segment_id'] >= 0).all()
+
+
+def test_probe_values_round_trip(tmp_path):
+    rng = np.random.RandomState(3)
+    chr_array = np.array(['chr1'] * 50 + ['chr2'] * 50)
+    pos_array = np.arange(100, dtype=np.int64) * 7 + 1
+    probe_values_fn = str(tmp_path / 'probes.txt')
+    for values, dtype in ((rng.randn(100), float), (rng.rand(100) < 0.5, bool)):
+        write_probe_values(probe_values_fn, 'SAMPLE', chr_array, pos_array, values)
+        read_chr_array, read_pos_array, read_values = read_probe_values(probe_values_fn, dtype=dtype)
+        assert read_chr_array.tolist() == chr_array.tolist()
+        np.testing.assert_array_equal(read_pos_array, pos_array)
+        np.testing.assert_array_equal(read_values, values)
+
+
+def test_probe_table_save(tmp_path):
+    probe_table = ProbeTable(['chr1', 'chr1', 'chr2'], [1, 2, 3], [0.1, -0.2, 0.3], [0.5, 0.4, 1.0])
+    probe_table.genotype = np.array([False, False, True])
+    probe_table.save(str(tmp_path / 'probe_table.npz'))
+    columns = np.load(str(tmp_path / 'probe_table.npz'))
+    assert sorted(columns.files) == ['baf', 'chr', 'genotype', 'logr', 'pos']
+    assert len(probe_table) == 3
+    np.testing.assert_array_equal(columns['genotype'], probe_table.genotype)
+
+
+def test_chromosome_indices_from():
+    assert chromosome_indices_from([]) == []
+    assert chromosome_indices_from(['chr1', 'chr1', 'chr2', 'chr3', 'chr3', 'chr3']) == [[0, 1], [2], [3, 4, 5]]
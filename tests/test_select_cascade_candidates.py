@@ -0,0 +1,103 @@
+import os
+
+from argparse import Namespace
+
+import shared.param as param
+from src.select_cascade_candidates import select_cascade_candidates, cascade_path_from, CASCADE_REFERENCE, \
+    CASCADE_SOMATIC, CASCADE_FULL_ALIGNMENT
+
+VCF_HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n'
+
+# pileup somatic probability of each candidate, None if the candidate was not predicted
+SOMATIC_PROB_DICT = {('chr1', 100): 0.01,
+                     ('chr1', 200): 0.5,
+                     ('chr1', 300): 0.995,
+                     ('chr2', 100): 0.999,
+                     ('chr2', 200): 0.05,
+                     ('chr2', 300): None}
+
+
+def vcf_row_from(ctg_name, pos, filter='PASS'):
+    return '{}\t{}\t.\tA\tC\t30\t{}\t.\tGT\t0/1\n'.format(ctg_name, pos, filter)
+
+
+def cascade_args_from(tmp_path, full_alignment_vcf_fn=None):
+    candidates_folder = tmp_path / 'candidates'
+    probabilities_dir = tmp_path / 'probabilities'
+    vcf_output_dir = tmp_path / 'vcf_output'
+    for folder in (candidates_folder, probabilities_dir, vcf_output_dir):
+        folder.mkdir(exist_ok=True)
+
+    region_fn_list = []
+    for ctg_name in ('chr1', 'chr2'):
+        region_fn = candidates_folder / '{}.0_1_1'.format(ctg_name)
+        region_fn.write_text(''.join(['{}\t{}\t{}\n'.format(c, pos - param.flankingBaseNum - 1,
+                                                             pos + param.flankingBaseNum + 1)
+                                      for c, pos in sorted(SOMATIC_PROB_DICT) if c == ctg_name]))
+        region_fn_list.append(str(region_fn))
+    (candidates_folder / 'CANDIDATES_FILES').write_text(''.join([fn + '\n' for fn in region_fn_list]))
+
+    probability_row_list = []
+    for (ctg_name, pos), somatic_prob in SOMATIC_PROB_DICT.items():
+        if somatic_prob is None:
+            continue
+        probabilities = [0.0, 0.0, 0.0]
+        probabilities[param.somatic_arg_index] = somatic_prob
+        probability_row_list.append('{}\t{}\t{}\n'.format(ctg_name, pos, ' '.join(str(p) for p in probabilities)))
+    (probabilities_dir / 'chr1_chr2').write_text(''.join(probability_row_list))
+
+    pileup_vcf_fn = tmp_path / 'pileup.vcf'
+    pileup_vcf_fn.write_text(VCF_HEADER + ''.join([vcf_row_from(*key) for key in sorted(SOMATIC_PROB_DICT)]))
+
+    return Namespace(candidates_folder=str(candidates_folder),
+                     probabilities_dir=str(probabilities_dir),
+                     pileup_vcf_fn=str(pileup_vcf_fn),
+                     vcf_output_dir=str(vcf_output_dir),
+                     reference_threshold=0.05,
+                     somatic_threshold=0.99,
+                     full_alignment_vcf_fn=full_alignment_vcf_fn,
+                     candidates_files='CANDIDATES_FILES',
+                     output_candidates_files='CASCADE_CANDIDATES_FILES')
+
+
+def test_cascade_path_from():
+    assert cascade_path_from(None, 0.05, 0.99) == CASCADE_FULL_ALIGNMENT
+    assert cascade_path_from(0.049, 0.05, 0.99) == CASCADE_REFERENCE
+    assert cascade_path_from(0.05, 0.05, 0.99) == CASCADE_FULL_ALIGNMENT
+    assert cascade_path_from(0.99, 0.05, 0.99) == CASCADE_SOMATIC
+
+
+def test_select_cascade_candidates(tmp_path):
+    args = cascade_args_from(tmp_path)
+    select_cascade_candidates(args)
+
+    # only the uncertain and unpredicted candidates go to full-alignment calling
+    with open(os.path.join(args.candidates_folder, 'CASCADE_CANDIDATES_FILES')) as f:
+        cascade_region_fn_list = [row.rstrip() for row in f]
+    assert [os.path.basename(fn) for fn in cascade_region_fn_list] == ['chr1.0_1_1', 'chr2.0_1_1']
+    full_alignment_position_list = []
+    for region_fn in cascade_region_fn_list:
+        with open(region_fn) as f:
+            for row in f:
+                ctg_name, start, end = row.rstrip().split('\t')
+                full_alignment_position_list.append((ctg_name, (int(start) + int(end)) // 2))
+    assert full_alignment_position_list == [('chr1', 200), ('chr2', 200), ('chr2', 300)]
+
+    # the pileup calls of the confident somatic candidates are taken as full-alignment calls
+    for ctg_name, pos in (('chr1', 300), ('chr2', 100)):
+        with open(os.path.join(args.vcf_output_dir, 'fa_cascade_{}.vcf'.format(ctg_name))) as f:
+            assert f.read() == VCF_HEADER + vcf_row_from(ctg_name, pos)
+
+
+def test_cascade_validation(tmp_path, capsys):
+    full_alignment_vcf_fn = tmp_path / 'full_alignment.vcf'
+    full_alignment_vcf_fn.write_text(VCF_HEADER + vcf_row_from('chr1', 100) + vcf_row_from('chr1', 300) +
+                                     vcf_row_from('chr2', 100, filter='LowQual'))
+    args = cascade_args_from(tmp_path, full_alignment_vcf_fn=str(full_alignment_vcf_fn))
+    select_cascade_candidates(args)
+
+    selected_row = [row for row in capsys.readouterr().out.split('\n') if '(selected)' in row][0]
+    # chr1:100 is skipped as reference but called PASS, chr2:100 is skipped as somatic but not called PASS
+    assert 'full-alignment 3/6 (50.00%)' in selected_row
+    assert 'discordant with full run 2 (somatic skipped: 1, reference skipped: 1)' in selected_row
+    assert not os.path.exists(os.path.join(args.candidates_folder, 'CASCADE_CANDIDATES_FILES'))
@@ -0,0 +1,40 @@
+import random
+
+from src.sort_vcf import write_sorted_vcf
+
+VCF_HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n'
+
+
+def vcf_row(ctg_name, pos, alt_base='C'):
+    return '\t'.join([ctg_name, str(pos), '.', 'A', alt_base, '20', 'PASS', '.', 'GT', '0/1']) + '\n'
+
+
+def test_write_sorted_vcf_groups_chunks_by_exact_contig(tmp_path):
+    random.seed(0)
+    input_dir = tmp_path / 'vcf_output'
+    input_dir.mkdir()
+    expected_dict = {}
+    # chunk VCFs of chr1 and chr10 share the chr1 file name prefix
+    for ctg_name, chunk_num in (('chr1', 3), ('chr10', 2), ('chr2', 1)):
+        pos_list = sorted(random.sample(range(1, 100000), 60))
+        for chunk_id in range(chunk_num):
+            chunk_pos_list = pos_list[chunk_id::chunk_num]
+            with open(str(input_dir / '{}.{}_{}.vcf'.format(ctg_name, chunk_id, chunk_num)), 'w') as f:
+                f.write(VCF_HEADER + ''.join(vcf_row(ctg_name, pos) for pos in chunk_pos_list))
+        expected_dict[ctg_name] = [vcf_row(ctg_name, pos) for pos in pos_list]
+    # a chunk without variants and a repeated position, the row of the later VCF is kept
+    with open(str(input_dir / 'chr1.3_4.vcf'), 'w') as f:
+        f.write(VCF_HEADER)
+    duplicated_pos = int(expected_dict['chr10'][0].split('\t')[1])
+    with open(str(input_dir / 'chr10.2_3.vcf'), 'w') as f:
+        f.write(VCF_HEADER + vcf_row('chr10', duplicated_pos, alt_base='G'))
+    expected_dict['chr10'][0] = vcf_row('chr10', duplicated_pos, alt_base='G')
+
+    all_files = sorted(item.name for item in input_dir.iterdir())
+    output_fn = str(tmp_path / 'output.vcf')
+    row_count, no_vcf_output = write_sorted_vcf(output_fn, str(input_dir), all_files, ['chr1', 'chr2', 'chr10'])
+
+    assert row_count > 0 and not no_vcf_output
+    with open(output_fn) as f:
+        output = f.read()
+    assert output == VCF_HEADER + ''.join(expected_dict['chr1'] + expected_dict['chr2'] + expected_dict['chr10'])
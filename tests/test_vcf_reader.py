@@ -0,0 +1,69 @@
+import random
+
+from shared.vcf import VcfReader
+
+VCF_HEADER = '##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tSAMPLE\n'
+CONTIG_LIST = ['chr2', 'chr1', 'chr10']
+
+
+def write_vcf(vcf_fn):
+    random.seed(0)
+    row_list = []
+    for ctg_name in CONTIG_LIST:
+        for pos in sorted(random.sample(range(1, 100000), 200)):
+            row_list.append('{}\t{}\t.\tA\t{}\t{:.2f}\t{}\t.\tGT:GQ:DP:AF\t{}:30:40:{:.3f}\n'.format(
+                ctg_name, pos, random.choice(['C', 'CT']), random.uniform(0, 40),
+                random.choice(['PASS', 'LowQual', 'RefCall']), random.choice(['0/1', '1/1', '0/0']), random.random()))
+    with open(vcf_fn, 'w') as f:
+        f.write(VCF_HEADER + ''.join(row_list))
+
+
+def variant_tuple_from(variant):
+    return (variant.ctg_name, variant.pos, variant.reference_bases, variant.alternate_bases, variant.genotype,
+            variant.qual, variant.af, variant.filter, variant.row_str)
+
+
+def test_split_by_contig_matches_contig_readers(tmp_path):
+    vcf_fn = str(tmp_path / 'input.vcf')
+    write_vcf(vcf_fn)
+    reader_options = dict(show_ref=False, keep_row_str=True, keep_af=True, filter_tag='PASS,LowQual', min_qual=5)
+    split_reader = VcfReader(vcf_fn=vcf_fn, split_by_contig=True, **reader_options)
+    split_reader.read_vcf()
+
+    assert list(split_reader.contig_variant_dict.keys()) == CONTIG_LIST
+    for ctg_name in CONTIG_LIST:
+        contig_reader = VcfReader(vcf_fn=vcf_fn, ctg_name=ctg_name, **reader_options)
+        contig_reader.read_vcf()
+        contig_variant_dict = split_reader.contig_variants(ctg_name)
+        assert len(contig_variant_dict) > 0
+        assert list(contig_variant_dict.keys()) == list(contig_reader.variant_dict.keys())
+        for pos, variant in contig_reader.variant_dict.items():
+            assert variant_tuple_from(contig_variant_dict[pos]) == variant_tuple_from(variant)
+
+    # a contig without variants gives an empty dict and is not added
+    assert len(split_reader.contig_variants('chr3')) == 0
+    assert 'chr3' not in split_reader.contig_variant_dict
+
+
+def test_columnar_store_matches_variant_dict(tmp_path):
+    vcf_fn = str(tmp_path / 'input.vcf')
+    write_vcf(vcf_fn)
+    with open(vcf_fn) as f:
+        duplicated_pos = [row.split('\t')[1] for row in f if row.startswith('chr1\t')][0]
+    # a duplicated position keeps the last record as in the dict
+    with open(vcf_fn, 'a') as f:
+        f.write('chr1\t{}\t.\tA\tG\t10.00\tPASS\t.\tGT:GQ:DP:AF\t1/1:30:40:0.900\n'.format(duplicated_pos))
+    reader = VcfReader(vcf_fn=vcf_fn, show_ref=True, keep_row_str=True, keep_af=True, skip_genotype=True)
+    reader.read_vcf()
+    columnar_reader = VcfReader(vcf_fn=vcf_fn, show_ref=True, keep_row_str=True, keep_af=True, skip_genotype=True,
+                                columnar=True)
+    columnar_reader.read_vcf()
+    record_store = columnar_reader.record_store
+
+    key_index = record_store.key_index()
+    assert list(key_index.keys()) == list(reader.variant_dict.keys())
+    for key, idx in key_index.items():
+        variant = reader.variant_dict[key]
+        assert record_store.row_str(idx) == variant.row_str
+        assert record_store.filter_list[record_store.filter_code[idx]] == variant.filter
+        assert float(record_store.af[idx]) == variant.af